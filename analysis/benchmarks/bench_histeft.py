@@ -0,0 +1,312 @@
+'''
+    Benchmarks for the HistEFT operations and the eft_helper kernels used when accumulating the
+    outputs of the processors and when making the datacards
+
+    The benchmarks run on synthetic histograms with the same axes as the ones booked in
+    analysis/topEFT/topeft.py (sample, channel, systematic and appl sparse axes plus one dense axis),
+    filled with random events. The size of the histograms can be set from the command line.
+
+    For each benchmark the min/median/mean wall time over the repetitions is measured, along with the
+    peak memory allocated while running it once more (measured with tracemalloc, which sees the numpy
+    arrays, but not necessarily the temporaries allocated inside the numba kernels). The results are
+    printed as a table and saved to a json file, together with the versions of the relevant packages:
+
+        python bench_histeft.py -o before.json
+        (upgrade coffea, or change HistEFT)
+        python bench_histeft.py -o after.json --compare before.json
+'''
+
+import argparse
+import gc
+import json
+import pickle
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import awkward as ak
+import numba
+import coffea
+from coffea import hist
+
+from topcoffea.modules.HistEFT import HistEFT
+import topcoffea.modules.eft_helper as efth
+
+# The WCs of the private signal samples
+WC_NAMES = ["ctW","ctZ","ctp","cpQM","ctG","cbW","cpQ3","cptb","cpt","cQl3i","cQlMi","cQei","ctli","ctei","ctlSi","ctlTi","cQq13","cQq83","cQq11","ctq1","cQq81","ctq8","ctt1","cQQ1","cQt8","cQt1"]
+
+# The dense axes of the histograms booked by the topeft processor, as (name, nbins, min, max)
+DENSE_AXES = [
+    ("invmass", 20,    0, 1000),
+    ("ptbl",    40,    0, 1000),
+    ("ptz",     12,    0,  600),
+    ("njets",   10,    0,   10),
+    ("nbtagsl",  5,    0,    5),
+    ("l0pt",    10,    0,  500),
+    ("l1pt",    10,    0,  100),
+    ("l1eta",   20, -2.5,  2.5),
+    ("j0pt",    10,    0,  500),
+    ("b0pt",    10,    0,  500),
+    ("l0eta",   20, -2.5,  2.5),
+    ("j0eta",   30, -3.0,  3.0),
+    ("ht",      20,    0, 1000),
+    ("met",     20,    0,  400),
+    ("ljptsum", 11,    0, 1100),
+    ("o0pt",    10,    0,  500),
+    ("bl0pt",   10,    0,  500),
+    ("lj0pt",   12,    0,  600),
+]
+
+
+######### Synthetic inputs #########
+
+class Inputs:
+    ''' The random events and categories the histograms are filled with '''
+    def __init__(self,n_wc=len(WC_NAMES),n_eft_samples=2,n_samples=3,n_channels=6,n_systs=3,n_events=20000,seed=1234):
+        rng = np.random.default_rng(seed)
+        self.wc_names = WC_NAMES[:n_wc] if n_wc <= len(WC_NAMES) else [f"c{i}" for i in range(n_wc)]
+        self.n_quad = efth.n_quad_terms(len(self.wc_names))
+        self.samples = [f"eft_sample{i}" for i in range(n_eft_samples)] + [f"sample{i}" for i in range(n_samples-n_eft_samples)]
+        self.eft_samples = self.samples[:n_eft_samples]
+        self.channels = [f"channel{i}" for i in range(n_channels)]
+        self.systs = ["nominal"] + [f"syst{i}{d}" for i in range((n_systs-1+1)//2) for d in ["Up","Down"]][:n_systs-1]
+        self.n_events = n_events
+
+        # Same values for every dense axis, scaled to its range
+        self.unit_vals = rng.random(n_events)
+        self.weights = rng.normal(1.0,0.1,n_events)
+        self.eft_coeffs = rng.normal(0.0,1.0,(n_events,self.n_quad))
+        self.eft_coeffs[:,0] = self.weights
+        self.channel_idx = rng.integers(0,n_channels,n_events)
+        self.wc_point = rng.normal(0.0,1.0,len(self.wc_names))
+
+    def dense_vals(self,axis):
+        _,_,lo,hi = axis
+        return lo + (hi-lo)*self.unit_vals
+
+    # The arguments to HistEFT.fill_batch() for one sample: every event goes into its channel, once per syst
+    def fill_batch_args(self,sample):
+        sparse_keys = []
+        key_idx_lst = []
+        event_idx_lst = []
+        weight_lst = []
+        for syst in self.systs:
+            for i,ch in enumerate(self.channels):
+                events = np.nonzero(self.channel_idx == i)[0]
+                key_idx_lst.append(np.full(len(events),len(sparse_keys)))
+                event_idx_lst.append(events)
+                weight_lst.append(self.weights[events])
+                appl = "isSR_2lSS" if i % 2 == 0 else "isAR_2lSS"
+                sparse_keys.append({"sample": sample, "channel": ch, "systematic": syst, "appl": appl})
+        return dict(
+            sparse_keys = sparse_keys,
+            key_idx     = np.concatenate(key_idx_lst),
+            event_idx   = np.concatenate(event_idx_lst),
+            weight      = np.concatenate(weight_lst),
+            eft_coeff   = self.eft_coeffs if sample in self.eft_samples else None,
+        )
+
+def book_hist(inputs,axis,packed=True):
+    name,nbins,lo,hi = axis
+    h = HistEFT("Events", inputs.wc_names, hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Cat("systematic", "Systematic Uncertainty"),hist.Cat("appl", "AR/SR"), hist.Bin(name, name, nbins, lo, hi))
+    if packed:
+        h.pack()
+    return h
+
+def fill_hist(h,inputs,axis):
+    for sample in inputs.samples:
+        h.fill_batch(**inputs.fill_batch_args(sample),**{axis[0]: inputs.dense_vals(axis)})
+    return h
+
+# All of the histograms of the topeft processor, filled for every sample
+def make_hists(inputs,packed=True):
+    return {axis[0]: fill_hist(book_hist(inputs,axis,packed),inputs,axis) for axis in DENSE_AXES}
+
+
+######### Benchmarks #########
+
+# Each benchmark is a (setup, run) pair: setup() builds whatever run() needs (and is not timed), so that
+# benchmarks that modify their inputs (e.g. add, or setting the WCs) always start from the same state
+def get_benchmarks(inputs,packed=True):
+    hists = make_hists(inputs,packed)
+    h = hists["lj0pt"]
+    lj0pt_axis = DENSE_AXES[-1]
+    lj0pt_vals = inputs.dense_vals(lj0pt_axis)
+    eft_sample = inputs.eft_samples[0] if inputs.eft_samples else inputs.samples[0]
+    pkl = pickle.dumps(hists,protocol=pickle.HIGHEST_PROTOCOL)
+
+    def fill_loop(h_empty):
+        # One fill() per sparse bin, as the topeft processor used to do it
+        for sample in inputs.samples:
+            args = inputs.fill_batch_args(sample)
+            for i,key in enumerate(args["sparse_keys"]):
+                mask = args["key_idx"] == i
+                events = args["event_idx"][mask]
+                eft_coeff = None if args["eft_coeff"] is None else args["eft_coeff"][events]
+                h_empty.fill(weight=args["weight"][mask],eft_coeff=eft_coeff,**{lj0pt_axis[0]: lj0pt_vals[events]},**key)
+
+    def set_wcs(h_in):
+        h_out = h_in.copy()
+        h_out.set_wilson_coeff_from_array(inputs.wc_point)
+        return h_out
+
+    q_coeffs = inputs.eft_coeffs
+    q_coeffs_small = q_coeffs[:min(len(q_coeffs),200)]
+    w2_coeffs = efth.calc_w2_coeffs(q_coeffs_small)
+    wc_points = np.random.default_rng(1).normal(0.0,1.0,(100,len(inputs.wc_names)))
+    remap_src = list(reversed(inputs.wc_names))
+
+    benchmarks = {
+        "histeft.fill":             (lambda: book_hist(inputs,lj0pt_axis,packed), fill_loop),
+        "histeft.fill_batch":       (lambda: book_hist(inputs,lj0pt_axis,packed), lambda x: fill_hist(x,inputs,lj0pt_axis)),
+        "histeft.fill_batch_all":   (lambda: None,                                lambda x: make_hists(inputs,packed)),
+        "histeft.add":              (lambda: [hh.copy() for hh in hists.values()], lambda x: [hh.add(hh2) for hh,hh2 in zip(x,hists.values())]),
+        "histeft.copy":             (lambda: None,                                lambda x: h.copy()),
+        "histeft.group":            (lambda: None,                                lambda x: h.group("sample",hist.Cat("process","process"),{"signal": inputs.eft_samples, "bkgd": [s for s in inputs.samples if s not in inputs.eft_samples]})),
+        "histeft.rebin":            (lambda: None,                                lambda x: h.rebin(lj0pt_axis[0],2)),
+        "histeft.sum":              (lambda: None,                                lambda x: h.sum("sample")),
+        "histeft.integrate":        (lambda: None,                                lambda x: h.integrate("systematic","nominal")),
+        "histeft.values_sm":        (lambda: None,                                lambda x: h.values(sumw2=True)),
+        "histeft.values_wc":        (lambda: set_wcs(h),                          lambda x: x.values(sumw2=True)),
+        "histeft.set_wcs":          (lambda: h.copy(),                            lambda x: x.set_wilson_coeff_from_array(inputs.wc_point)),
+        "histeft.split_by_terms":   (lambda: None,                                lambda x: h.integrate("systematic","nominal").split_by_terms([eft_sample],"sample")),
+        "histeft.pickle_dumps":     (lambda: None,                                lambda x: pickle.dumps(hists,protocol=pickle.HIGHEST_PROTOCOL)),
+        "histeft.pickle_loads":     (lambda: None,                                lambda x: pickle.loads(pkl)),
+        "eft_helper.calc_eft_weights":       (lambda: None, lambda x: efth.calc_eft_weights(q_coeffs,inputs.wc_point)),
+        "eft_helper.calc_eft_weights_batch": (lambda: None, lambda x: efth.calc_eft_weights_batch(q_coeffs_small,wc_points)),
+        "eft_helper.calc_w2_coeffs":         (lambda: None, lambda x: efth.calc_w2_coeffs(q_coeffs_small)),
+        "eft_helper.calc_eft_w2":            (lambda: None, lambda x: efth.calc_eft_w2(w2_coeffs,inputs.wc_point)),
+        "eft_helper.calc_eft_w2_batch":      (lambda: None, lambda x: efth.calc_eft_w2_batch(w2_coeffs,wc_points[:10])),
+        "eft_helper.remap_coeffs":           (lambda: None, lambda x: efth.remap_coeffs(remap_src,inputs.wc_names,q_coeffs)),
+    }
+    return benchmarks
+
+# Time one benchmark, and measure the peak memory allocated while running it
+def run_benchmark(setup,run,repeat=5):
+    # Warm up (e.g. for the numba compilation)
+    run(setup())
+
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        gc.collect()
+        t0 = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - t0)
+        del state
+
+    state = setup()
+    gc.collect()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    run(state)
+    _,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "repeat": repeat,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.mean(times),
+        "peak_mem_mb": peak/1024**2,
+    }
+
+def get_env_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "awkward": ak.__version__,
+        "numba": numba.__version__,
+        "coffea": coffea.__version__,
+    }
+
+def run_benchmarks(inputs,packed=True,repeat=5,select=None):
+    results = {}
+    for name,(setup,run) in get_benchmarks(inputs,packed).items():
+        if select and not any(s in name for s in select):
+            continue
+        results[name] = run_benchmark(setup,run,repeat)
+    return results
+
+def print_results(results,ref=None):
+    header = f"{'benchmark':<36} {'min (ms)':>10} {'median (ms)':>12} {'peak mem (MB)':>14}"
+    if ref is not None:
+        header += f" {'ratio':>8}"
+    print(header)
+    print("-"*len(header))
+    for name,res in results.items():
+        line = f"{name:<36} {1e3*res['min_s']:>10.3f} {1e3*res['median_s']:>12.3f} {res['peak_mem_mb']:>14.2f}"
+        if ref is not None:
+            # Ratio of the median times wrt the reference, >1 means slower than the reference
+            if name in ref:
+                line += f" {res['median_s']/ref[name]['median_s']:>8.2f}"
+            else:
+                line += f" {'-':>8}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HistEFT operations and the eft_helper kernels")
+    parser.add_argument("-o", "--outname", default="histeft_benchmarks.json", help="Name of the json file to save the results to")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of timed repetitions of each benchmark")
+    parser.add_argument("-k", "--select", nargs="*", default=None, help="Only run the benchmarks with names containing any of these strings")
+    parser.add_argument("--compare", default=None, help="A json file from a previous run, to print the ratios of the times wrt")
+    parser.add_argument("--unpacked", action="store_true", help="Use the dict storage of HistEFT instead of the packed one (the topeft processor uses the packed one)")
+    parser.add_argument("--n-wc", type=int, default=len(WC_NAMES), help="Number of WCs")
+    parser.add_argument("--n-samples", type=int, default=3, help="Number of samples")
+    parser.add_argument("--n-eft-samples", type=int, default=2, help="Number of the samples that are EFT samples")
+    parser.add_argument("--n-channels", type=int, default=6, help="Number of channels")
+    parser.add_argument("--n-systs", type=int, default=3, help="Number of systematics (including nominal)")
+    parser.add_argument("--n-events", type=int, default=20000, help="Number of events filled per sample")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for the random inputs")
+    args = parser.parse_args()
+
+    if args.n_eft_samples > args.n_samples:
+        raise Exception(f"Error: Cannot have more EFT samples ({args.n_eft_samples}) than samples ({args.n_samples}).")
+
+    config = {
+        "n_wc": args.n_wc,
+        "n_samples": args.n_samples,
+        "n_eft_samples": args.n_eft_samples,
+        "n_channels": args.n_channels,
+        "n_systs": args.n_systs,
+        "n_events": args.n_events,
+        "seed": args.seed,
+        "packed": not args.unpacked,
+    }
+    inputs = Inputs(
+        n_wc          = args.n_wc,
+        n_eft_samples = args.n_eft_samples,
+        n_samples     = args.n_samples,
+        n_channels    = args.n_channels,
+        n_systs       = args.n_systs,
+        n_events      = args.n_events,
+        seed          = args.seed,
+    )
+    results = run_benchmarks(inputs,packed=config["packed"],repeat=args.repeat,select=args.select)
+
+    ref = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            ref = json.load(f)["results"]
+    print_results(results,ref)
+
+    out = {
+        "env": get_env_info(),
+        "config": config,
+        "argv": sys.argv,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,
+        "results": results,
+    }
+    with open(args.outname,"w") as f:
+        json.dump(out,f,indent=2)
+    print(f"\nSaved the results to {args.outname}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,7 @@ from optparse import OptionParser
 from coffea.analysis_tools import PackedSelection
 
 from topcoffea.modules.objects import *
-from topcoffea.modules.corrections import SFevaluator, GetLeptonSF
+from topcoffea.modules.corrections import SFevaluator
 from topcoffea.modules.selection import *
 from topcoffea.modules.HistEFT import HistEFT
 
@@ -22,6 +22,14 @@ from topcoffea.modules.HistEFT import HistEFT
 
 # In the future these names will be read from the nanoAOD files
 
+# The jet flavours (the index is the flavour code of a jet) and the hadronFlavour each one is filled with in jetptetaflav
+FLAV_LST = ['l', 'c', 'b']
+FLAV_HADRON = [0, 4, 5]
+
+# The WPs (DeepJet cuts), bit i of the WP bitmask of a jet is set if it passes the i-th one
+WP = {'all' : -999., 'loose': 0.0490, 'medium': 0.2783, 'tight': 0.7100}
+WP_LST = list(WP.keys())
+
 class AnalysisProcessor(processor.ProcessorABC):
     def __init__(self, samples):
         self._samples = samples
@@ -29,10 +37,11 @@ class AnalysisProcessor(processor.ProcessorABC):
         # Create the histograms
         # In general, histograms depend on 'sample', 'channel' (final state) and 'cut' (level of selection)
         self._accumulator = processor.dict_accumulator({
-        'jetpt'  : hist.Hist("Events", hist.Cat("WP", "WP"), hist.Cat("Flav", "Flav"), hist.Bin("pt",  "Jet p_{T} (GeV) ", 40, 0, 800)),
-        'jeteta' : hist.Hist("Events", hist.Cat("WP", "WP"), hist.Cat("Flav", "Flav"), hist.Bin("eta", "Jet eta", 25, -2.5, 2.5)),
-        'jetpteta' : hist.Hist("Events", hist.Cat("WP", "WP"), hist.Cat("Flav", "Flav"), hist.Bin("pt",  "Jet p_{T} (GeV) ", [20, 30, 60, 120]), hist.Bin("abseta", "Jet eta", [0, 1, 1.8, 2.4])),
-        'jetptetaflav' : hist.Hist("Events", hist.Cat("WP", "WP"), hist.Bin("pt",  "Jet p_{T} (GeV) ", [20, 30, 60, 120]), hist.Bin("abseta", "Jet eta", [0, 1, 1.8, 2.4]), hist.Bin("flav", "Flavor", [0, 4, 5]) ),
+        # Note: HistEFTs without WCs are just regular histograms, but they can fill all of the flavours and WPs at once
+        'jetpt'  : HistEFT("Events", [], hist.Cat("WP", "WP"), hist.Cat("Flav", "Flav"), hist.Bin("pt",  "Jet p_{T} (GeV) ", 40, 0, 800)),
+        'jeteta' : HistEFT("Events", [], hist.Cat("WP", "WP"), hist.Cat("Flav", "Flav"), hist.Bin("eta", "Jet eta", 25, -2.5, 2.5)),
+        'jetpteta' : HistEFT("Events", [], hist.Cat("WP", "WP"), hist.Cat("Flav", "Flav"), hist.Bin("pt",  "Jet p_{T} (GeV) ", [20, 30, 60, 120]), hist.Bin("abseta", "Jet eta", [0, 1, 1.8, 2.4])),
+        'jetptetaflav' : HistEFT("Events", [], hist.Cat("WP", "WP"), hist.Bin("pt",  "Jet p_{T} (GeV) ", [20, 30, 60, 120]), hist.Bin("abseta", "Jet eta", [0, 1, 1.8, 2.4]), hist.Bin("flav", "Flavor", [0, 4, 5]) ),
         })
 
     @property
@@ -114,27 +123,36 @@ class AnalysisProcessor(processor.ProcessorABC):
         normweights = weights.weight().flatten() 
         #hout['SumOfEFTweights'].fill(eftweights, sample=dataset, SumOfEFTweights=varnames['counts'], weight=normweights)
 
-        flavSelection = {'b': (np.abs(goodJets.hadronFlavour) == 5), 'c': (np.abs(goodJets.hadronFlavour) == 4), 'l': (np.abs(goodJets.hadronFlavour) <= 3) }
-
-        WP = {'all' : -999., 'loose': 0.0490, 'medium': 0.2783, 'tight': 0.7100}
-        btagSelection = {}
-        for wp, wpvals in WP.items():
-          btagSelection[wp] = (goodJets.btagDeepFlavB>wpvals) 
-
-        for jetype in ['b', 'c', 'l']:
-          for wp in WP.keys():
-            mask = (flavSelection[jetype])&(btagSelection[wp])
-            selectjets = goodJets[mask]
-            pts     = ak.flatten(selectjets.pt)
-            etas    = ak.flatten(selectjets.eta)
-            absetas = ak.flatten(np.abs(selectjets.eta))
-            flavarray = np.zeros_like(pts) if jetype == 'l' else (np.ones_like(pts)*(4 if jetype=='c' else 5))
-            weights =  np.ones_like(pts)
-            hout['jetpt'].fill(WP=wp, Flav=jetype,  pt=pts, weight=weights)
-            hout['jeteta'].fill(WP=wp, Flav=jetype,  eta=etas, weight=weights)
-            hout['jetpteta'].fill(WP=wp, Flav=jetype,  pt=pts, abseta=absetas, weight=weights)
-            hout['jetptetaflav'].fill(WP=wp, pt=pts, abseta=absetas, flav=flavarray, weight=weights)
-    
+        # Flavour code and WP bitmask of each jet
+        jets = ak.flatten(goodJets)
+        hadflav = np.abs(ak.to_numpy(jets.hadronFlavour))
+        flavcode = np.full(len(jets), -1)
+        flavcode[hadflav <= 3] = FLAV_LST.index('l')
+        flavcode[hadflav == 4] = FLAV_LST.index('c')
+        flavcode[hadflav == 5] = FLAV_LST.index('b')
+        btag = ak.to_numpy(jets.btagDeepFlavB)
+        wpmask = np.zeros(len(jets), dtype=np.uint8)
+        for i, wpval in enumerate(WP.values()):
+            wpmask |= (btag > wpval).astype(np.uint8) << i
+
+        # One entry for each WP that each jet (with a known flavour) passes
+        passes = ((wpmask[:, None] >> np.arange(len(WP_LST), dtype=np.uint8)) & 1).astype(bool)
+        jet_idx, wp_idx = np.nonzero(passes & (flavcode >= 0)[:, None])
+        flavwp_idx = flavcode[jet_idx]*len(WP_LST) + wp_idx
+        flavwp_keys = [{'Flav': jetype, 'WP': wp} for jetype in FLAV_LST for wp in WP_LST]
+        weights = np.ones(len(jet_idx))
+
+        pts     = ak.to_numpy(jets.pt)
+        etas    = ak.to_numpy(jets.eta)
+        absetas = np.abs(etas)
+        flavarray = np.where(flavcode >= 0, np.asarray(FLAV_HADRON)[flavcode], -1)
+
+        # Fill all of the flavours and WPs of each histogram in one go
+        hout['jetpt'].fill_batch(flavwp_keys, flavwp_idx, jet_idx, weight=weights, pt=pts)
+        hout['jeteta'].fill_batch(flavwp_keys, flavwp_idx, jet_idx, weight=weights, eta=etas)
+        hout['jetpteta'].fill_batch(flavwp_keys, flavwp_idx, jet_idx, weight=weights, pt=pts, abseta=absetas)
+        hout['jetptetaflav'].fill_batch([{'WP': wp} for wp in WP_LST], wp_idx, jet_idx, weight=weights, pt=pts, abseta=absetas, flav=flavarray)
+
         return hout
 
 
@@ -16,6 +16,8 @@ from coffea.nanoevents import NanoAODSchema
 
 import btagMCeff
 from topcoffea.modules import samples
+from topcoffea.modules.corrections import GetMCeffTable
+import topcoffea.modules.binary_lookup as binary_lookup
 
 if __name__ == '__main__':
   import argparse
@@ -84,6 +86,14 @@ if __name__ == '__main__':
   print('Saving output in %s...'%(outpath + outname + ".pkl.gz"))
   with gzip.open(outpath + outname + ".pkl.gz", "wb") as fout:
     cloudpickle.dump(output, fout)
+
+  # Save the efficiency map of each WP as a binary lookup table, this is what corrections.GetMCeffFunc reads (if it was made from the pkl file)
+  # Note: To use them, copy them to topcoffea/data/btagSF/UL as btagMCeff_<year>_<wp>.lookup, together with the pkl file as btagMCeff_<year>.pkl.gz
+  for wp in btagMCeff.WP_LST:
+    if wp == 'all': continue
+    values, edges = GetMCeffTable(output['jetptetaflav'], wp)
+    print('Saving the %s efficiencies in %s...'%(wp, outpath + outname + '_' + wp + binary_lookup.LOOKUP_EXT))
+    binary_lookup.dump_lookup(outpath + outname + '_' + wp + binary_lookup.LOOKUP_EXT, values, edges, source=outpath + outname + ".pkl.gz")
   print('Done!')
 
 
@@ -26,64 +26,69 @@ import topcoffea.modules.eft_helper as efth
 import topcoffea.modules.GetValuesFromJsons as getj
 
 
-class dataframe_accumulator(AccumulatorABC):
-
-    def __init__(self, value):
-        self._value = value
-
+# For each output: The columns to rank the events by (compared in order, largest first), the cut on the
+# first of them (None for no cut) and the number of top events to keep
+TOPK_CFG = {
+    "nleps"   : (["nleps", "njets"], 4,    1000),
+    "njets"   : (["njets", "nleps"], 10,   1000),
+    "ST"      : (["S_T"],            None, 30),
+    "HT"      : (["H_T"],            None, 30),
+    "invMass" : (["invMass"],        2000, 1000),
+    "pt_l"    : (["pt_l_0"],         500,  1000),
+    "pt_j"    : (["pt_j_0"],         1000, 1000),
+}
+
+# Number of leptons and jets whose pt is kept for each event
+NLEPS_PT = 4
+NJETS_PT = 12
+
+
+class topk_accumulator(AccumulatorABC):
+    '''
+        Keeps the k events with the largest values of the sort_by columns (compared in order), out of the
+        events where the first of them is >= min_value (if it is not None). The columns are numpy arrays
+        (strings are object arrays), so the size does not grow with the number of chunks that are added.
+    '''
+
+    def __init__(self, sort_by, k, min_value=None, columns=None):
+        self.sort_by = list(sort_by)
+        self.k = k
+        self.min_value = min_value
+        self._columns = {} if columns is None else columns
+
+    def __len__(self):
+        return len(self._columns[self.sort_by[0]]) if self._columns else 0
+
+    # The events as a dataframe, sorted from the top event down
     @property
     def value(self):
-        return self._value
+        return pd.DataFrame(self._columns)
+
+    @property
+    def columns(self):
+        return self._columns
 
     def identity(self):
-        return dataframe_accumulator(pd.DataFrame())
+        return topk_accumulator(self.sort_by, self.k, self.min_value)
 
+    # Add a topk_accumulator, a dict of columns or a dataframe
     def add(self, other):
-        if isinstance(other, pd.core.frame.DataFrame):
-            self._value = pd.concat([self._value, other])
+        if isinstance(other, topk_accumulator):
+            columns = other._columns
+        elif isinstance(other, pd.DataFrame):
+            columns = {name: other[name].to_numpy() for name in other.columns}
         else:
-            self._value = pd.concat([self._value, other._value])
-    
-    # The cutoff values are set manually 
-    # First sort the dataframe to get a sufficient amount of top events (e.g. get_ST)
-    # Then determine what values to focus on
-    def get_nleps(self):
-        self._value = self._value[self._value["nleps"] >= 4]
-
-    def get_njets(self):
-        self._value = self._value[self._value["njets"] >= 10]
-
-    def get_ST(self):
-        self._value.sort_values(by=["S_T"], ascending=False, inplace=True)[0:5]
-
-    def get_HT(self):
-        self._value.sort_values(by=["H_T"], ascending=False, inplace=True)[0:5]
-
-    def get_invMass(self):
-        self._value = self._value[self._value["invMass"] >= 2000]
-
-    def get_pt(self, key):
-        if key=="pt_l":
-            self._value = self._value[self._value[key+"_0"] >= 500]
-        elif key=="pt_j":
-            self._value = self._value[self._value[key+"_0"] >= 1000]
-        else:
-            raise Exception("key should be either 'pt_l' or 'pt_j'")
-
-    def sort(self, key):
-        if key=="nleps":
-            self._value.sort_values(by=["nleps", "njets"], ascending=False, inplace=True)
-        elif key=="njets":
-            self._value.sort_values(by=["njets", "nleps"], ascending=False, inplace=True)
-        elif key=="ST":
-            self._value = self._value.sort_values(by=["S_T"], ascending=False)[0:30]
-        elif key=="HT":
-            self._value = self._value.sort_values(by=["H_T"], ascending=False)[0:30]
-        elif key=="invMass":
-            self._value.sort_values(by=["invMass"], ascending=False, inplace=True)
-        elif key=="pt_l" or key=="pt_j":
-            self._value.sort_values(by=[key+"_0"], ascending=False, inplace=True)
-        self._value.reset_index(drop=True, inplace=True)
+            columns = other
+        if not columns:
+            return
+        if self.min_value is not None:
+            mask = (columns[self.sort_by[0]] >= self.min_value)
+            columns = {name: arr[mask] for name, arr in columns.items()}
+        if self._columns:
+            columns = {name: np.concatenate([self._columns[name], arr]) for name, arr in columns.items()}
+        # Note: lexsort sorts by the last key first and in increasing order (with the nans at the end)
+        order = np.lexsort([-columns[name] for name in reversed(self.sort_by)])[:self.k]
+        self._columns = {name: arr[order] for name, arr in columns.items()}
 
 
 class AnalysisProcessor(processor.ProcessorABC):
@@ -94,16 +99,10 @@ class AnalysisProcessor(processor.ProcessorABC):
         self._wc_names_lst = wc_names_lst
         self._dtype = dtype
 
-        # Create an accumulator of multiple dataframes
+        # Create an accumulator of the top events for each of the rankings
         self._accumulator = processor.dict_accumulator({
-                                "nleps": dataframe_accumulator(pd.DataFrame()), 
-                                "njets": dataframe_accumulator(pd.DataFrame()),
-                                "ST": dataframe_accumulator(pd.DataFrame()),
-                                "HT": dataframe_accumulator(pd.DataFrame()),
-                                "invMass": dataframe_accumulator(pd.DataFrame()),
-                                "pt_l": dataframe_accumulator(pd.DataFrame()),
-                                "pt_j": dataframe_accumulator(pd.DataFrame())
-                            })
+            key: topk_accumulator(sort_by, k, min_value) for key, (sort_by, min_value, k) in TOPK_CFG.items()
+        })
 
     @property
     def accumulator(self):
@@ -373,45 +372,31 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         # Now throw out all events that do not pass the selection cuts and collect events information
         # What we're left with now should <= len(number of events)
-        tight_event_info = {}
+        sr_event_mask = ak.to_numpy(sr_event_mask)
+        nsel = int(np.sum(sr_event_mask))
+        tight_event_info = {
+            "dataset": np.full(nsel, dataset, dtype=object),
+            "year": np.full(nsel, year, dtype=object),
+            "json_name": np.full(nsel, json_name, dtype=object),
+            "root_name": np.full(nsel, filename, dtype=object),
+        }
         info = ["run", "luminosityBlock", "event", "nleps", "njets", "invMass", "S_T", "H_T"]
         for label in info:
-            tight_event_info[label] = events[label][sr_event_mask]
-
-        # Put pt of leptons and jets of each event to two dataframes
-        # nleps_max and njets_max are predetermined and set as the loop ranges (number of columns)
-        pt_l_index = []
-        pt_j_index = []
-        for i in range(4):
-            pt_l_index.append("pt_l_"+str(i))
-        for i in range(12):
-            pt_j_index.append("pt_j_"+str(i))
-        df_pt_l = pd.DataFrame(ak.to_list(ak.pad_none(events["lep_pt"][sr_event_mask], 4)), columns=pt_l_index)
-        df_pt_j = pd.DataFrame(ak.to_list(ak.pad_none(events["jet_pt"][sr_event_mask], 12)), columns=pt_j_index)
-
-        # Create a dataframe as the output object and append pt
-        df = pd.DataFrame(tight_event_info, columns=info)
-        df = df.join(df_pt_l) if len(df.index)==len(df_pt_l.index) else None
-        df = df.join(df_pt_j) if len(df.index)==len(df_pt_j.index) else None
-
-        df.insert(0, "dataset", [dataset for x in range(len(df.index))])
-        df.insert(1, "year", [year for x in range(len(df.index))])
-        df.insert(2, "json_name", [json_name for x in range(len(df.index))])
-        df.insert(3, "root_name", [filename for x in range(len(df.index))])
-
-        # Put any quantities of interest into the output
-        self.accumulator["pt_j"].add(df)
-        self.accumulator["pt_j"].get_pt("pt_j")
+            tight_event_info[label] = ak.to_numpy(events[label][sr_event_mask])
 
-        self.accumulator["njets"].add(df)
-        self.accumulator["njets"].get_njets()
+        # Put pt of leptons and jets of each event into columns (nan when there is no such object)
+        # NLEPS_PT and NJETS_PT are predetermined and set the number of columns
+        for name, pts, nmax in [("pt_l", events["lep_pt"], NLEPS_PT), ("pt_j", events["jet_pt"], NJETS_PT)]:
+            pt_arr = ak.to_numpy(ak.fill_none(ak.pad_none(pts[sr_event_mask], nmax, clip=True), np.nan))
+            for i in range(nmax):
+                tight_event_info[f"{name}_{i}"] = pt_arr[:,i]
 
-        self.accumulator["nleps"].add(df)
-        self.accumulator["nleps"].get_nleps()
+        # Put any quantities of interest into the output, only the top events of each ranking are kept
+        hout = self.accumulator.identity()
+        for key in hout.keys():
+            hout[key].add(tight_event_info)
 
-        return self.accumulator
+        return hout
 
     def postprocess(self, accumulator):
-        for key, df_accum in accumulator.items():
-            if not df_accum.value.empty:
-                df_accum.sort(key) 
+        return accumulator
@@ -53,13 +53,14 @@ class AnalysisProcessor(processor.ProcessorABC):
         self._dtype = dtype
 
         # Create the histograms
+        # Note: A HistEFT without WCs is just a regular histogram, but it can fill all of the channels at once
         self._accumulator = processor.dict_accumulator({
-            "invmass" : hist.Hist("Events", hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("invmass", "$m_{\ell\ell}$ (GeV) ", 100, 50, 150)),
-            "njets"   : hist.Hist("Events", hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("njets", "njets", 8, 0, 8)),
-            "l0pt"    : hist.Hist("Events", hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("l0pt", "l0pt", 20, 0, 200)),
-            "l0eta"   : hist.Hist("Events", hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("l0eta", "l0eta", 20, -2.5, 2.5)),
-            "l1pt"    : hist.Hist("Events", hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("l1pt", "l1pt", 20, 0, 200)),
-            "l1eta"   : hist.Hist("Events", hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("l1eta", "l1eta", 20, -2.5, 2.5)),
+            "invmass" : HistEFT("Events", [], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("invmass", "$m_{\ell\ell}$ (GeV) ", 100, 50, 150)),
+            "njets"   : HistEFT("Events", [], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("njets", "njets", 8, 0, 8)),
+            "l0pt"    : HistEFT("Events", [], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("l0pt", "l0pt", 20, 0, 200)),
+            "l0eta"   : HistEFT("Events", [], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("l0eta", "l0eta", 20, -2.5, 2.5)),
+            "l1pt"    : HistEFT("Events", [], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("l1pt", "l1pt", 20, 0, 200)),
+            "l1eta"   : HistEFT("Events", [], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Bin("l1eta", "l1eta", 20, -2.5, 2.5)),
         })
 
     @property
@@ -276,27 +277,23 @@ class AnalysisProcessor(processor.ProcessorABC):
         #if not isData: chan_lst.append("sszTruthFlip2")
         #chan_lst = ["ss","os","ssz","osz","ssTruthFlip","osTruthNoFlip","sszTruthFlip","oszTruthNoFlip"]
 
-        # Loop over histograms to fill (just invmass, njets for now)
-        for dense_axis_name, dense_axis_vals in dense_var_dict.items():
-
-            # Loop over the lepton channels
-            for chan_name in chan_lst:
-
-                # Get the cut mask object
-                cuts_lst = ["2e"]
-                cuts_lst.append(chan_name)
-                if isData: cuts_lst.append("is_good_lumi")
-                cuts_mask = selections.all(*cuts_lst)
+        # The events (and the weights) that go into each of the channels, the same for all of the histograms
+        cuts_lst = ["2e"]
+        if isData: cuts_lst.append("is_good_lumi")
+        chan_evt_idx = [np.flatnonzero(selections.all(*cuts_lst, chan_name)) for chan_name in chan_lst]
+        key_idx = np.concatenate([np.full(len(evt_idx), i) for i, evt_idx in enumerate(chan_evt_idx)])
+        evt_idx = np.concatenate(chan_evt_idx)
+        weights = weights_object.weight()[evt_idx]
 
-                # Fill the histo
-                axes_fill_info_dict = {
-                    dense_axis_name  : dense_axis_vals[cuts_mask],
-                    "channel"        : chan_name,
-                    "sample"         : histAxisName,
-                    "weight"         : weights_object.weight()[cuts_mask],
-                }
-
-                hout[dense_axis_name].fill(**axes_fill_info_dict)
+        # Loop over histograms to fill (just invmass, njets for now), all of the channels are filled at once
+        for dense_axis_name, dense_axis_vals in dense_var_dict.items():
+            hout[dense_axis_name].fill_batch(
+                sparse_keys = [{"sample": histAxisName, "channel": chan_name} for chan_name in chan_lst],
+                key_idx     = key_idx,
+                event_idx   = evt_idx,
+                weight      = weights,
+                **{dense_axis_name: ak.to_numpy(ak.fill_none(dense_axis_vals, np.nan))},
+            )
 
         return hout
 
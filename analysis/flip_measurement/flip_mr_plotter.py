@@ -2,6 +2,7 @@
 #   - This script runs on the output of flip_mr_processor.py
 #   - It opens the pkl file, extracts the flip and no flip histos, calculates the flip prob, and saves that to a histo (also saves the 2d hists to png for reference)
 #   - The output histo is then placed in topcoffea/data so that corrections.py can read in the values using dense lookup 
+#   - The flip probs are also saved as binary lookup tables (see topcoffea/modules/binary_lookup.py), these are what corrections.py reads if they are up to date with the pkl files
 
 import os
 import copy
@@ -13,6 +14,7 @@ import uproot3
 from coffea import hist
 
 from topcoffea.modules.YieldTools import YieldTools
+import topcoffea.modules.binary_lookup as binary_lookup
 yt = YieldTools()
 
 import argparse
@@ -121,6 +123,10 @@ def main():
         with gzip.open(save_pkl_str, "wb") as fout:
             cloudpickle.dump(hist_ratio, fout)
 
+        # Save the flip rates as a binary lookup table too (this is what corrections.py reads, if it was made from the pkl file it is next to)
+        save_lookup_str = "flip_probs_topcoffea_" + year + binary_lookup.LOOKUP_EXT
+        binary_lookup.dump_lookup(save_lookup_str,hist_ratio.values()[()],[hist_ratio.axis("pt").edges(),hist_ratio.axis("eta").edges()],source=save_pkl_str)
+
 
 if __name__ == "__main__":
     main()
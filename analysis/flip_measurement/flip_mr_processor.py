@@ -7,6 +7,9 @@ import coffea
 from coffea import hist, processor
 
 import topcoffea.modules.objects as obj
+from topcoffea.modules.HistEFT import HistEFT
+
+FLIPSTATUS_LST = ["truthFlip", "truthNoFlip"]
 
 class AnalysisProcessor(processor.ProcessorABC):
 
@@ -17,8 +20,10 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         # Create the histograms
         self._accumulator = processor.dict_accumulator({
-            "ptabseta" : hist.Hist(
+            # Note: A HistEFT without WCs is just a regular histogram, but it can fill all of the flip statuses at once
+            "ptabseta" : HistEFT(
                 "Counts",
+                [],
                 hist.Cat("sample", "sample"),
                 hist.Cat("flipstatus", "flipstatus"), 
                 hist.Bin("pt", "pt", [0, 30.0, 45.0, 60.0, 100.0, 200.0]),
@@ -84,20 +89,20 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         hout = self.accumulator.identity()
 
-        # Loop over flip and noflip, and fill the histo
-        flipstatus_mask_dict = { "truthFlip" : truthFlip_mask, "truthNoFlip" : truthNoFlip_mask }
-        for flipstatus_mask_name, flipstatus_mask in flipstatus_mask_dict.items():
-
-            dense_objs_flat = ak.flatten(e_tight[flipstatus_mask])
-
-            axes_fill_info_dict = {
-                "pt"         : dense_objs_flat.pt,
-                "abseta"     : abs(dense_objs_flat.eta),
-                "flipstatus" : flipstatus_mask_name,
-                "sample"     : histAxisName,
-            }
-
-            hout["ptabseta"].fill(**axes_fill_info_dict)
+        # Fill flip and noflip in one pass, each electron goes into the bin of its flip status (if it has one)
+        e_flat = ak.flatten(e_tight)
+        flipstatus_idx = np.full(len(e_flat), -1)
+        flipstatus_idx[ak.to_numpy(ak.flatten(truthFlip_mask))] = FLIPSTATUS_LST.index("truthFlip")
+        flipstatus_idx[ak.to_numpy(ak.flatten(truthNoFlip_mask))] = FLIPSTATUS_LST.index("truthNoFlip")
+        e_idx = np.flatnonzero(flipstatus_idx >= 0)
+
+        hout["ptabseta"].fill_batch(
+            sparse_keys = [{"sample": histAxisName, "flipstatus": flipstatus} for flipstatus in FLIPSTATUS_LST],
+            key_idx     = flipstatus_idx[e_idx],
+            event_idx   = e_idx,
+            pt          = ak.to_numpy(e_flat.pt),
+            abseta      = np.abs(ak.to_numpy(e_flat.eta)),
+        )
 
         return hout
 
@@ -15,8 +15,8 @@ printf "\nRunning processor...\n"
 time python work_queue_run.py ../../topcoffea/cfg/check_yields_sample.cfg -o ${OUT_FILE_NAME}
 
 # Make the jsons
-printf "\nMaking yields json from pkl...\n"
-python get_yield_json.py -f histos/${OUT_FILE_NAME}.pkl.gz -n ${OUT_FILE_NAME} --quiet
+printf "\nMaking yields json from hist store...\n"
+python get_yield_json.py -f histos/${OUT_FILE_NAME}.hists.zip -n ${OUT_FILE_NAME} --quiet
 
 # If we want this to be the new ref json
 #cp ${OUT_FILE_NAME}.json tests/${REF_FILE_NAME}
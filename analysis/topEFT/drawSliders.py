@@ -16,16 +16,16 @@ from topcoffea.plotter.OutText import OutText
 from topcoffea.modules.HistEFT import HistEFT
 from topcoffea.modules.WCPoint import WCPoint
 from topcoffea.modules.WCFit import WCFit
+import topcoffea.modules.utils as utils
 from matplotlib.widgets import Slider, Button, RadioButtons
 
 
-path = 'histos/plotsTopEFT.pkl.gz'
+path = 'histos/plotsTopEFT.hists.zip' # Either a hist store or a pkl file
 hists = {}
-with gzip.open(path) as fin:
-  hin = pickle.load(fin)
-  for k in hin.keys():
-    if k in hists: hists[k]+=hin[k]
-    else:          hists[k]=hin[k]
+hin = utils.get_hist_from_pkl(path)
+for k in hin.keys():
+  if k in hists: hists[k]+=hin[k]
+  else:          hists[k]=hin[k]
 
 ch3l = ['eemSSonZ', 'eemSSoffZ', 'mmeSSonZ', 'mmeSSoffZ','eeeSSonZ', 'eeeSSoffZ', 'mmmSSonZ', 'mmmSSoffZ']
 
@@ -6,8 +6,8 @@ import topcoffea.modules.MakeLatexTable as mlt
 import topcoffea.modules.utils as utils
 
 # This script takes a pkl file, finds the yields in the analysis categories, saves the yields to a json
-#   - If you do not specify a pkl file path, will default to "hists/plotsTopEFT.pkl.gz"
-#   - Example usage: python get_yield_json.py -f histos/plotsTopEFT.pkl.gz
+#   - If you do not specify a pkl file path, will default to "histos/plotsTopEFT.hists.zip" (the default output of the processor)
+#   - Example usage: python get_yield_json.py -f histos/plotsTopEFT.hists.zip
 
 def main():
 
@@ -17,31 +17,40 @@ def main():
 
     # Set up the command line parser
     parser = argparse.ArgumentParser()
-    parser.add_argument("-f", "--pkl-file-path", default="histos/plotsTopEFT.pkl.gz", help = "The path to the pkl file")
+    parser.add_argument("-f", "--pkl-file-path", default="histos/plotsTopEFT.hists.zip", help = "The path to the pkl file (or hist store)")
     parser.add_argument("-y", "--year", default=None, help = "The year of the sample")
     parser.add_argument("-t", "--tag", default="Sample", help = "A string to describe the pkl file")
     parser.add_argument("-n", "--json-name", default="yields", help = "Name of the json file to save")
     parser.add_argument("-q", "--quiet", action="store_true", help = "Do not print out anything")
     parser.add_argument("-l", "--by-lep-flavor", action="store_true", help = "Do not sum over the lep flavor categories, cannot use unless input file is split by lep flavors")
     parser.add_argument("-j", "--by-njets", action="store_true", help = "Do not sum over the njets categories")
+    parser.add_argument("-w", "--wc-pts-json", default=None, help = "A json file of named WC points ({name: {wc: val}}) to get the yields at, the json will then have the yields for each point")
     args = parser.parse_args()
 
     # Get the histograms, check if split into lep flavors
-    hin_dict = utils.get_hist_from_pkl(args.pkl_file_path,allow_empty=False)
+    # Note: The yields are all taken from one hist, so that is the only one that needs to be loaded
+    hist_to_use = "lj0pt" if args.by_njets else "njets"
+    hin_dict = utils.get_hist_from_pkl(args.pkl_file_path,allow_empty=False,hist_lst=[hist_to_use])
     if not yt.is_split_by_lepflav(hin_dict) and args.by_lep_flavor:
         raise Exception("Cannot specify --by-lep-flavor option, the yields file is not split by lepton flavor")
 
-    # Put the yields into a dict
-    yld_dict = yt.get_yld_dict(hin_dict,args.year,njets=args.by_njets,lepflav=args.by_lep_flavor)
+    # Put the yields into a dict (for all of the WC points at once, if there are any)
+    wc_pts = None
+    if args.wc_pts_json is not None:
+        with open(args.wc_pts_json) as f:
+            wc_pts = json.load(f)
+    yld_dict = yt.get_yld_dict(hin_dict,args.year,njets=args.by_njets,lepflav=args.by_lep_flavor,wc_pts=wc_pts)
 
     # Print info about the file
     if not args.quiet:
         yt.print_hist_info(args.pkl_file_path)
-        yt.print_yld_dicts(yld_dict,args.tag)
-        if not args.by_lep_flavor and not args.by_njets:
-            mlt.print_latex_yield_table(yld_dict,key_order=yt.PROC_MAP.keys(),subkey_order=yt.CAT_LST,tag=args.tag,print_begin_info=True,print_end_info=True)
-        else:
-            mlt.print_latex_yield_table(yld_dict,tag=args.tag,print_begin_info=True,print_end_info=True,column_variable="keys")
+        yld_dict_per_pt = {"": yld_dict} if wc_pts is None else {f" ({pt_name})": d for pt_name,d in yld_dict.items()}
+        for pt_tag,pt_yld_dict in yld_dict_per_pt.items():
+            yt.print_yld_dicts(pt_yld_dict,args.tag+pt_tag)
+            if not args.by_lep_flavor and not args.by_njets:
+                mlt.print_latex_yield_table(pt_yld_dict,key_order=yt.PROC_MAP.keys(),subkey_order=yt.CAT_LST,tag=args.tag+pt_tag,print_begin_info=True,print_end_info=True)
+            else:
+                mlt.print_latex_yield_table(pt_yld_dict,tag=args.tag+pt_tag,print_begin_info=True,print_end_info=True,column_variable="keys")
 
     # Save to a json
     out_json_name = args.json_name
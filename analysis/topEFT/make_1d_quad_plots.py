@@ -50,16 +50,16 @@ def main():
 
     # Print where the fits cross 1.1 (i.e. scaling the SM up by 10%)
     # Not really useful right now, but at some point might need to do a variation of this for the equivalent of TOP-19-001's Table 1
+    # Note: The crossings for all of the WCs are found at once from the compiled fit
     threshold = 1.1
-    for wc_name in wc_names_lst:
-        quad_fit_1d = qft.get_1d_fit(wc_fit_dict,wc_name)
-        values_at_threshold = qft.find_where_fit_crosses_threshold(quad_fit_1d,threshold)
-        print(f"({wc_name} crosses {threshold} at: {values_at_threshold}")
+    quad_fit = qft.QuadFit.from_fit_dicts(wc_fit_dict)
+    values_at_threshold_arr = quad_fit.find_crossings(threshold)[0]
+    for wc_name,values_at_threshold in zip(quad_fit.wc_names,values_at_threshold_arr):
+        print(f"({wc_name} crosses {threshold} at: {list(values_at_threshold)}")
 
     # Make 1d quad plots for all the WCs
     yaxis_str = "$\sigma/\sigma_{SM}$"
-    for wc_name in wc_names_lst:
-        fit_coeffs_1d = qft.get_1d_fit(wc_fit_dict,wc_name)
+    for wc_name,fit_coeffs_1d in zip(quad_fit.wc_names,quad_fit.get_1d_fits()[0]):
         xaxis_lims = qft.ARXIV1901_LIMS.get(wc_name,qft.TOP19001_LIMS.get(wc_name,[-10,10])) # Use lim from 1901 theory paper if it exists, or TOP-19-001 if it exists, or -10,10 otherwise
         qft.make_1d_quad_plot(
             {wc_name: fit_coeffs_1d},
@@ -59,14 +59,48 @@ conda activate ${CONDA_DEFAULT_ENV}
 python make_cards.py ${INF} -d ${OUT_DIR} --var-lst ${VAR_LST} --ch-lst ${CH_LST} --use-selected "selectedWCs.txt" --do-nuisance ${OTHER}
 """
 
-def run_local(dc,km_dists,channels,selected_wcs, crop_negative_bins):
+# The DatacardMaker used by the local worker processes. It is set in the parent right before the pool
+#   is forked, so the workers all share (copy-on-write) the hists that were already read and prepared
+#   in the parent, instead of each one getting its own pickled copy or re-reading the input file
+_shared_dc = None
+
+def analyze_shared(task):
+    km_dist,ch,selected_wcs,crop_negative_bins = task
+    _shared_dc.analyze(km_dist,ch,selected_wcs,crop_negative_bins)
+    return km_dist,ch
+
+def run_local(dc,km_dists,channels,selected_wcs, crop_negative_bins, nworkers=1):
+    global _shared_dc
+    tasks = []
     for km_dist in km_dists:
         all_chs = dc.channels(km_dist)
         matched_chs = regex_match(all_chs,channels)
         if channels:
             print(f"Channels to process: {matched_chs}")
         for ch in matched_chs:
+            tasks.append((km_dist,ch,selected_wcs,crop_negative_bins))
+
+    if nworkers <= 1 or len(tasks) <= 1:
+        for km_dist,ch,selected_wcs,crop_negative_bins in tasks:
             r = dc.analyze(km_dist,ch,selected_wcs, crop_negative_bins)
+        return
+
+    import gc
+    import multiprocessing
+
+    print(f"Processing {len(tasks)} cards with {nworkers} workers")
+    _shared_dc = dc
+    # Move everything allocated so far out of the garbage collector's reach, so that the collections
+    #   in the workers don't touch (and therefore copy) the pages holding the shared hists
+    gc.freeze()
+    try:
+        with multiprocessing.get_context("fork").Pool(min(nworkers,len(tasks))) as pool:
+            for km_dist,ch in pool.imap_unordered(analyze_shared,tasks):
+                if dc.verbose:
+                    print(f"Finished {km_dist} in {ch}")
+    finally:
+        gc.unfreeze()
+        _shared_dc = None
 
 # VERY IMPORTANT:
 #   This setup assumes the output directory is mounted on the remote condor machines
@@ -165,6 +199,7 @@ def main():
     parser.add_argument("--use-selected",default="",help="Load selected process+WC combs from a file. Skips doing the normal selection step.")
     parser.add_argument("--condor","-C",action="store_true",help="Split up the channels into multiple condor jobs")
     parser.add_argument("--chunks","-n",default=1,help="The number of channels each condor job should process")
+    parser.add_argument("--nworkers","-j",default=1,help="Number of local worker processes to make the cards with (the hists are only read once and shared by all of them)")
     parser.add_argument("--keep-negative-bins",action="store_true",help="Don't crop negative bins")
 
     args = parser.parse_args()
@@ -189,6 +224,7 @@ def main():
 
     use_condor = args.condor
     chunks = int(args.chunks)
+    nworkers = int(args.nworkers)
 
     if isinstance(wcs,str):
         wcs = wcs.split(",")
@@ -281,7 +317,7 @@ def main():
     if use_condor:
         run_condor(dc,pkl_file,out_dir,dists,ch_lst,chunks)
     else:
-        run_local(dc,dists,ch_lst,selected_wcs, not args.keep_negative_bins)
+        run_local(dc,dists,ch_lst,selected_wcs, not args.keep_negative_bins, nworkers)
     dt = time.time() - tic
     print(f"Total Time: {dt:.2f} s")
     print("Finished!")
@@ -10,13 +10,16 @@ from coffea import hist
 from topcoffea.modules.HistEFT import HistEFT
 
 from topcoffea.modules.YieldTools import YieldTools
+from topcoffea.modules.hist_projection import HistProjection
 import topcoffea.modules.GetValuesFromJsons as getj
 from topcoffea.plotter.make_html import make_html
+import topcoffea.plotter.render as render
 import topcoffea.modules.utils as utils
 
 # This script takes an input pkl file that should have both data and background MC included.
 # Use the -y option to specify a year, if no year is specified, all years will be included.
 # There are various other options available from the command line.
+# The figures are rendered in a pool of local worker processes if a number of workers is given with -j.
 # For example, to make unit normalized plots for 2018, with the timestamp appended to the directory name, you would run:    
 #     python make_cr_plots.py -f histos/your.pkl.gz -o ~/www/somewhere/in/your/web/dir -n some_dir_name -y 2018 -t -u
 
@@ -183,7 +186,16 @@ def get_lumi_for_sample(sample_name):
         raise Exception(f"Error: Unknown year \"{year}\".")
     return lumi
 
-# Group bins in a hist, returns a new hist
+# Get the categories along an axis of a hist (EFT or regular coffea hist) or a HistProjection
+def get_cat_lables(histo,axis_name):
+    if isinstance(histo,HistProjection):
+        return histo.identifiers(axis_name)
+    if not isinstance(histo,HistEFT) and isinstance(histo,hist.Hist):
+        # E.g. the hists that are rebuilt from the render specs
+        return [identifier.name for identifier in histo.identifiers(axis_name)]
+    return yt.get_cat_lables(histo,axis_name)
+
+# Group bins in a hist (or a HistProjection), returns a new hist (or HistProjection)
 def group_bins(histo,bin_map,axis_name="sample",drop_unspecified=False):
 
     bin_map = copy.deepcopy(bin_map) # Don't want to edit the original
@@ -193,11 +205,13 @@ def group_bins(histo,bin_map,axis_name="sample",drop_unspecified=False):
     for grp_name,bins_in_grp in bin_map.items():
         bins_to_remap_lst.extend(bins_in_grp)
     if not drop_unspecified:
-        for bin_name in yt.get_cat_lables(histo,axis_name):
+        for bin_name in get_cat_lables(histo,axis_name):
             if bin_name not in bins_to_remap_lst:
                 bin_map[bin_name] = bin_name
 
     # Remap the bins
+    if isinstance(histo,HistProjection):
+        return histo.group(axis_name,bin_map)
     old_ax = histo.axis(axis_name)
     new_ax = hist.Cat(old_ax.name,old_ax.label)
     new_histo = histo.group(old_ax,new_ax,bin_map,overflow="over")
@@ -283,17 +297,23 @@ def get_rate_systs(sample_name,sample_group_map):
 
 
 # Wrapper for getting plus and minus rate arrs
+# The base_histo can be a hist or a HistProjection (with just the sample and systematic axes left)
 def get_rate_syst_arrs(base_histo,proc_group_map):
 
+    # Get the nominal arr of each sample (only once, they are the same for all of the rate systs)
+    nom_histo = base_histo.integrate("systematic","nominal")
+    nom_arr_dict = {}
+    for sample_name in get_cat_lables(base_histo,"sample"):
+        nom_arr_dict[sample_name] = nom_histo.integrate("sample",sample_name).values()[()]
+
     # Fill dictionary with the rate uncertainty arrays (with correlated ones organized together)
     rate_syst_arr_dict = {}
     for rate_sys_type in getj.get_syst_lst():
         rate_syst_arr_dict[rate_sys_type] = {}
-        for sample_name in yt.get_cat_lables(base_histo,"sample"):
+        for sample_name,thissample_nom_arr in nom_arr_dict.items():
 
             # Build the plus and minus arrays from the rate uncertainty number and the nominal arr
             rate_syst_dict = get_rate_systs(sample_name,proc_group_map)
-            thissample_nom_arr = base_histo.integrate("sample",sample_name).integrate("systematic","nominal").values()[()]
             p_arr = thissample_nom_arr*(rate_syst_dict[rate_sys_type][1]) - thissample_nom_arr # Difference between positive fluctuation and nominal
             m_arr = thissample_nom_arr*(rate_syst_dict[rate_sys_type][0]) - thissample_nom_arr # Difference between positive fluctuation and nominal
 
@@ -319,12 +339,13 @@ def get_rate_syst_arrs(base_histo,proc_group_map):
     return [sum(all_rates_m_sumw2_lst),sum(all_rates_p_sumw2_lst)]
 
 # Wrapper for getting plus and minus shape arrs
+# The base_histo can be a hist or a HistProjection (with just the sample and systematic axes left)
 def get_shape_syst_arrs(base_histo):
 
     # Get the list of systematic base names (i.e. without the up and down tags)
     # Assumes each syst has a "systnameUp" and a "systnameDown" category on the systematic axis
     syst_var_lst = []
-    all_syst_var_lst = yt.get_cat_lables(base_histo,"systematic")
+    all_syst_var_lst = get_cat_lables(base_histo,"systematic")
     for syst_var_name in all_syst_var_lst:
         if syst_var_name.endswith("Up"):
             syst_name_base = syst_var_name.replace("Up","")
@@ -335,7 +356,7 @@ def get_shape_syst_arrs(base_histo):
     p_arr_rel_lst = []
     m_arr_rel_lst = []
     for syst_name in syst_var_lst:
-        relevant_samples_lst = yt.get_cat_lables(base_histo.integrate("systematic",syst_name+"Up"), "sample") # The samples relevant to this syst
+        relevant_samples_lst = get_cat_lables(base_histo.integrate("systematic",syst_name+"Up"), "sample") # The samples relevant to this syst
         n_arr     = base_histo.integrate("sample",relevant_samples_lst).integrate("systematic","nominal").values()[()]        # Sum of all samples for nominal variation
         u_arr_sum = base_histo.integrate("sample",relevant_samples_lst).integrate("systematic",syst_name+"Up").values()[()]   # Sum of all samples for up variation
         d_arr_sum = base_histo.integrate("sample",relevant_samples_lst).integrate("systematic",syst_name+"Down").values()[()] # Sum of all samples for down variation
@@ -511,7 +532,7 @@ def make_single_fig_with_ratio(histo,axis_name,cat_ref,err_p=None,err_m=None,err
     )
 
     # Make the ratio plot
-    for cat_name in yt.get_cat_lables(histo,axis_name):
+    for cat_name in get_cat_lables(histo,axis_name):
         hist.plotratio(
             num = histo.integrate(axis_name,cat_name),
             denom = histo.integrate(axis_name,cat_ref),
@@ -543,13 +564,24 @@ def make_single_fig_with_ratio(histo,axis_name,cat_ref,err_p=None,err_m=None,err
 
     return fig
 
+# The plotting functions that the render specs can refer to (see topcoffea/plotter/render.py)
+render.register_renderer("cr_fig",make_cr_fig)
+render.register_renderer("single_fig",make_single_fig)
+render.register_renderer("single_fig_with_ratio",make_single_fig_with_ratio)
+
+# Render (in nworkers processes) and save the figures of the specs, then make the index.html files if saving to web area
+def render_and_save(specs,nworkers=1):
+    paths = render.render_specs(specs,nworkers)
+    for save_dir_path_tmp in render.get_dirs(paths):
+        if "www" in save_dir_path_tmp: make_html(save_dir_path_tmp)
+
 
 
 ###################### Wrapper function for example SR plots with systematics ######################
 # Wrapper function to loop over all SR categories and make plots for all variables
 # Right now this function will only plot the signal samples
 # By default, will make plots that show all systematics in the pkl file
-def make_all_sr_sys_plots(dict_of_hists,year,save_dir_path):
+def make_all_sr_sys_plots(dict_of_hists,year,save_dir_path,nworkers=1):
 
     # If selecting a year, append that year to the wight list
     sig_wl = ["private"]
@@ -571,7 +603,8 @@ def make_all_sr_sys_plots(dict_of_hists,year,save_dir_path):
     print("\nSig samples:",sig_sample_lst)
     print("\nAll systematics:",yt.get_cat_lables(dict_of_hists,"systematic",h_name=yt.get_hist_list(dict_of_hists)[0]))
 
-    # Loop over hists and make plots
+    # Loop over hists and make the plot specs
+    specs = []
     skip_lst = [] # Skip this hist
     for idx,var_name in enumerate(dict_of_hists.keys()):
         if yt.is_split_by_lepflav(dict_of_hists): raise Exception("Not set up to plot lep flav for SR, though could probably do it without too much work")
@@ -624,12 +657,17 @@ def make_all_sr_sys_plots(dict_of_hists,year,save_dir_path):
                 #hist_sig_grouped_tmp.set_wilson_coefficients(**WCPT_EXAMPLE)
 
                 # Make plots
-                fig = make_single_fig_with_ratio(hist_sig_grouped_tmp,"systematic","nominal")
                 title = proc_name+"_"+grouped_hist_cat+"_"+var_name
-                fig.savefig(os.path.join(save_dir_path_tmp,title))
+                specs.append(render.make_spec(
+                    "single_fig_with_ratio",
+                    os.path.join(save_dir_path_tmp,title),
+                    histo = render.hist_to_spec(hist_sig_grouped_tmp),
+                    axis_name = "systematic",
+                    cat_ref = "nominal",
+                ))
 
-            # Make an index.html file if saving to web area
-            if "www" in save_dir_path_tmp: make_html(save_dir_path_tmp)
+    # Render and save the figures
+    render_and_save(specs,nworkers)
 
 
 ###################### Wrapper function for simple plots ######################
@@ -685,7 +723,7 @@ def make_simple_plots(dict_of_hists,year,save_dir_path):
 
 ###################### Wrapper function for SR data and mc plots (unblind!) ######################
 # Wrapper function to loop over all SR categories and make plots for all variables
-def make_all_sr_data_mc_plots(dict_of_hists,year,save_dir_path):
+def make_all_sr_data_mc_plots(dict_of_hists,year,save_dir_path,nworkers=1):
 
     # Construct list of MC samples
     mc_wl = []
@@ -764,7 +802,8 @@ def make_all_sr_data_mc_plots(dict_of_hists,year,save_dir_path):
     analysis_bins['ptz'] = [0, 200, 300, 400, 500, dict_of_hists['ptz'].axis('ptz').edges()[-1]]
     analysis_bins['lj0pt'] = [0, 150, 250, 500, dict_of_hists['lj0pt'].axis('lj0pt').edges()[-1]]
 
-    # Loop over hists and make plots
+    # Loop over hists and make the plot specs
+    specs = []
     skip_lst = [] # Skip this hist
     #keep_lst = ["njets","lj0pt","ptz","nbtagsl","nbtagsm","l0pt","j0pt"] # Skip all but these hists
     for idx,var_name in enumerate(dict_of_hists.keys()):
@@ -818,14 +857,19 @@ def make_all_sr_data_mc_plots(dict_of_hists,year,save_dir_path):
                 print("Warning: empty data histo, continuing")
                 continue
 
-            fig = make_cr_fig(hist_mc, hist_data, unit_norm_bool=False)
             if year is not None: year_str = year
             else: year_str = "ULall"
             title = chan_name + "_" + var_name + "_" + year_str
-            fig.savefig(os.path.join(save_dir_path_tmp,title))
+            specs.append(render.make_spec(
+                "cr_fig",
+                os.path.join(save_dir_path_tmp,title),
+                h_mc = render.hist_to_spec(hist_mc),
+                h_data = render.hist_to_spec(hist_data),
+                unit_norm_bool = False,
+            ))
 
-            # Make an index.html file if saving to web area
-            if "www" in save_dir_path_tmp: make_html(save_dir_path_tmp)
+    # Render and save the figures
+    render_and_save(specs,nworkers)
 
 
 
@@ -835,7 +879,7 @@ def make_all_sr_data_mc_plots(dict_of_hists,year,save_dir_path):
 # Wrapper function to loop over all SR categories and make plots for all variables
 # Right now this function will only plot the signal samples
 # By default, will make two sets of plots: One with process overlay, one with channel overlay
-def make_all_sr_plots(dict_of_hists,year,unit_norm_bool,save_dir_path,split_by_chan=True,split_by_proc=True):
+def make_all_sr_plots(dict_of_hists,year,unit_norm_bool,save_dir_path,split_by_chan=True,split_by_proc=True,nworkers=1):
 
     # If selecting a year, append that year to the wight list
     sig_wl = ["private"]
@@ -857,7 +901,8 @@ def make_all_sr_plots(dict_of_hists,year,unit_norm_bool,save_dir_path,split_by_c
     print("\nSig samples:",sig_sample_lst)
 
 
-    # Loop over hists and make plots
+    # Loop over hists and make the plot specs
+    specs = []
     skip_lst = [] # Skip this hist
     for idx,var_name in enumerate(dict_of_hists.keys()):
         #if yt.is_split_by_lepflav(dict_of_hists): raise Exception("Not set up to plot lep flav for SR, though could probably do it without too much work")
@@ -896,13 +941,14 @@ def make_all_sr_plots(dict_of_hists,year,unit_norm_bool,save_dir_path,split_by_c
                 hist_sig_integrated_ch = hist_sig_integrated_ch.integrate("channel",sr_cat_dict[hist_cat])
 
                 # Make the plots
-                fig = make_single_fig(hist_sig_integrated_ch,unit_norm_bool)
                 title = hist_cat+"_"+var_name
                 if unit_norm_bool: title = title + "_unitnorm"
-                fig.savefig(os.path.join(save_dir_path_tmp,title))
-
-                # Make an index.html file if saving to web area
-                if "www" in save_dir_path_tmp: make_html(save_dir_path_tmp)
+                specs.append(render.make_spec(
+                    "single_fig",
+                    os.path.join(save_dir_path_tmp,title),
+                    histo = render.hist_to_spec(hist_sig_integrated_ch),
+                    unit_norm_bool = unit_norm_bool,
+                ))
 
 
         # Make plots for each process
@@ -926,20 +972,24 @@ def make_all_sr_plots(dict_of_hists,year,unit_norm_bool,save_dir_path,split_by_c
                     hist_sig_grouped_tmp = hist_sig_grouped_tmp.integrate("sample",proc_name)
 
                     # Make plots
-                    fig = make_single_fig(hist_sig_grouped_tmp[grouped_hist_cat],unit_norm_bool)
                     title = proc_name+"_"+grouped_hist_cat+"_"+var_name
                     if unit_norm_bool: title = title + "_unitnorm"
-                    fig.savefig(os.path.join(save_dir_path_tmp,title))
+                    specs.append(render.make_spec(
+                        "single_fig",
+                        os.path.join(save_dir_path_tmp,title),
+                        histo = render.hist_to_spec(hist_sig_grouped_tmp[grouped_hist_cat]),
+                        unit_norm_bool = unit_norm_bool,
+                    ))
 
-                # Make an index.html file if saving to web area
-                if "www" in save_dir_path_tmp: make_html(save_dir_path_tmp)
+    # Render and save the figures
+    render_and_save(specs,nworkers)
 
 
 
 ###################### Wrapper function for all CR plots ######################
 # Wrapper function to loop over all CR categories and make plots for all variables
 # The input hist should include both the data and MC
-def make_all_cr_plots(dict_of_hists,year,skip_syst_errs,unit_norm_bool,save_dir_path):
+def make_all_cr_plots(dict_of_hists,year,skip_syst_errs,unit_norm_bool,save_dir_path,nworkers=1):
 
     # Construct list of MC samples
     mc_wl = []
@@ -1009,7 +1059,8 @@ def make_all_cr_plots(dict_of_hists,year,skip_syst_errs,unit_norm_bool,save_dir_
         else:
             raise Exception(f"Error: Process name \"{proc_name}\" is not known.")
 
-    # Loop over hists and make plots
+    # Loop over hists and make the plot specs
+    specs = []
     skip_lst = [] # Skip these hists
     #skip_wlst = ["njets"] # Skip all but these hists
     for idx,var_name in enumerate(dict_of_hists.keys()):
@@ -1025,9 +1076,17 @@ def make_all_cr_plots(dict_of_hists,year,skip_syst_errs,unit_norm_bool,save_dir_
         print("\nVar name:",var_name)
         print("cr_cat_dict:",cr_cat_dict)
 
+        # Project the hist onto (sample, channel, systematic) once, only keeping the CR channels (and the SR bin of the appl axis, if there is one)
+        # Everything below (the plots and the syst bands) is made from this projection, instead of integrating (i.e. copying) the full hist again each time
+        cr_chan_set = set(chan_name for chan_lst in cr_cat_dict.values() for chan_name in chan_lst)
+        def is_in_cr(ids):
+            if ids["channel"] not in cr_chan_set: return False
+            return ("appl" not in ids) or (ids["appl"] == yt.get_appl_bin(ids["channel"]))
+        hist_proj = HistProjection(dict_of_hists[var_name],axes=("sample","channel","systematic"),select=is_in_cr)
+
         # Extract the MC and data hists
-        hist_mc = dict_of_hists[var_name].remove(samples_to_rm_from_mc_hist,"sample")
-        hist_data = dict_of_hists[var_name].remove(samples_to_rm_from_data_hist,"sample")
+        hist_mc = hist_proj.remove(samples_to_rm_from_mc_hist,"sample")
+        hist_data = hist_proj.remove(samples_to_rm_from_data_hist,"sample")
 
         # Normalize the MC hists
         sample_lumi_dict = {}
@@ -1047,10 +1106,8 @@ def make_all_cr_plots(dict_of_hists,year,skip_syst_errs,unit_norm_bool,save_dir_
                 os.mkdir(save_dir_path_tmp)
 
             # Integrate to get the categories we want
-            axes_to_integrate_dict = {}
-            axes_to_integrate_dict["channel"] = cr_cat_dict[hist_cat]
-            hist_mc_integrated   = yt.integrate_out_cats(yt.integrate_out_appl(hist_mc,hist_cat)   ,axes_to_integrate_dict)
-            hist_data_integrated = yt.integrate_out_cats(yt.integrate_out_appl(hist_data,hist_cat) ,axes_to_integrate_dict)
+            hist_mc_integrated   = hist_mc.integrate("channel",cr_cat_dict[hist_cat])
+            hist_data_integrated = hist_data.integrate("channel",cr_cat_dict[hist_cat])
 
             # Remove samples that are not relevant for the given category
             samples_to_rm = []
@@ -1100,42 +1157,45 @@ def make_all_cr_plots(dict_of_hists,year,skip_syst_errs,unit_norm_bool,save_dir_
             #print(f"Flip sf needed = (data - (pred - flips))/flips = {sf}")
             #exit()
 
-            # Create and save the figure
+            # Make the spec for the figure
             x_range = None
             if var_name == "ht": x_range = (0,250)
-            fig = make_cr_fig(
-                hist_mc_integrated,
-                hist_data_integrated,
-                unit_norm_bool,
+            title = hist_cat+"_"+var_name
+            if unit_norm_bool: title = title + "_unitnorm"
+            specs.append(render.make_spec(
+                "cr_fig",
+                os.path.join(save_dir_path_tmp,title),
+                h_mc = render.hist_to_spec(hist_mc_integrated.to_hist()),
+                h_data = render.hist_to_spec(hist_data_integrated.to_hist()),
+                unit_norm_bool = unit_norm_bool,
                 set_x_lim = x_range,
                 err_p = p_err_arr,
                 err_m = m_err_arr,
                 err_ratio_p = p_err_arr_ratio,
                 err_ratio_m = m_err_arr_ratio
-            )
-            title = hist_cat+"_"+var_name
-            if unit_norm_bool: title = title + "_unitnorm"
-            fig.savefig(os.path.join(save_dir_path_tmp,title))
+            ))
 
-            # Make an index.html file if saving to web area
-            if "www" in save_dir_path_tmp: make_html(save_dir_path_tmp)
+    # Render and save the figures
+    render_and_save(specs,nworkers)
 
 
 def main():
 
     # Set up the command line parser
     parser = argparse.ArgumentParser()
-    parser.add_argument("-f", "--pkl-file-path", default="histos/plotsTopEFT.pkl.gz", help = "The path to the pkl file")
+    parser.add_argument("-f", "--pkl-file-path", default="histos/plotsTopEFT.hists.zip", help = "The path to the pkl file (or hist store)")
     parser.add_argument("-o", "--output-path", default=".", help = "The path the output files should be saved to")
     parser.add_argument("-n", "--output-name", default="plots", help = "A name for the output directory")
     parser.add_argument("-t", "--include-timestamp-tag", action="store_true", help = "Append the timestamp to the out dir name")
     parser.add_argument("-y", "--year", default=None, help = "The year of the sample")
     parser.add_argument("-u", "--unit-norm", action="store_true", help = "Unit normalize the plots")
     parser.add_argument("-s", "--skip-syst", default=False, action="store_true", help = "Skip syst errs in plots, only relevant for CR plots right now")
+    parser.add_argument("-j", "--nworkers", default=1, help = "Number of local worker processes to render the figures with")
     args = parser.parse_args()
 
     # Whether or not to unit norm the plots
     unit_norm_bool = args.unit_norm
+    nworkers = int(args.nworkers)
 
     # Make a tmp output directory in curren dir a different dir is not specified
     timestamp_tag = datetime.datetime.now().strftime('%Y%m%d_%H%M')
@@ -1154,18 +1214,18 @@ def main():
     #exit()
 
     # Make the plots
-    make_all_cr_plots(hin_dict,args.year,args.skip_syst,unit_norm_bool,save_dir_path)
-    #make_all_sr_plots(hin_dict,args.year,unit_norm_bool,save_dir_path)
-    #make_all_sr_data_mc_plots(hin_dict,args.year,save_dir_path)
-    #make_all_sr_sys_plots(hin_dict,args.year,save_dir_path)
+    make_all_cr_plots(hin_dict,args.year,args.skip_syst,unit_norm_bool,save_dir_path,nworkers=nworkers)
+    #make_all_sr_plots(hin_dict,args.year,unit_norm_bool,save_dir_path,nworkers=nworkers)
+    #make_all_sr_data_mc_plots(hin_dict,args.year,save_dir_path,nworkers=nworkers)
+    #make_all_sr_sys_plots(hin_dict,args.year,save_dir_path,nworkers=nworkers)
     #make_simple_plots(hin_dict,args.year,save_dir_path)
 
     # Make unblinded SR data MC comparison plots by year
-    #make_all_sr_data_mc_plots(hin_dict,"2016",save_dir_path)
-    #make_all_sr_data_mc_plots(hin_dict,"2016APV",save_dir_path)
-    #make_all_sr_data_mc_plots(hin_dict,"2017",save_dir_path)
-    #make_all_sr_data_mc_plots(hin_dict,"2018",save_dir_path)
-    #make_all_sr_data_mc_plots(hin_dict,None,save_dir_path)
+    #make_all_sr_data_mc_plots(hin_dict,"2016",save_dir_path,nworkers=nworkers)
+    #make_all_sr_data_mc_plots(hin_dict,"2016APV",save_dir_path,nworkers=nworkers)
+    #make_all_sr_data_mc_plots(hin_dict,"2017",save_dir_path,nworkers=nworkers)
+    #make_all_sr_data_mc_plots(hin_dict,"2018",save_dir_path,nworkers=nworkers)
+    #make_all_sr_data_mc_plots(hin_dict,None,save_dir_path,nworkers=nworkers)
 
 if __name__ == "__main__":
     main()
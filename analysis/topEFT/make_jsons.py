@@ -10,6 +10,8 @@ from topcoffea.modules.samples import loadxsecdic
 from topcoffea.modules.combine_json_ext  import combine_json_ext
 from topcoffea.modules.combine_json_batch  import combine_json_batch
 import re
+from concurrent.futures import ThreadPoolExecutor
+from topcoffea.modules.createJSON import CreateJSON
 
 ########### The XSs from xsec.cfg ###########
 XSECDIC = loadxsecdic("../../topcoffea/cfg/xsec.cfg",True)
@@ -1679,53 +1681,60 @@ def replace_xsec_for_dict_of_samples(samples_dict,out_dir):
         print("\tPath to json:",path_to_json)
         replace_val_in_json(path_to_json,"xsec",new_xsec)
 
-# Wrapper for createJSON.py
-def make_json(sample_dir,sample_name,prefix,sample_yr,xsec_name,hist_axis_name,on_das=False):
-
-    # If the sample is on DAS, inclue the DAS flag in the createJSON.py arguments
-    das_flag = ""
-    if on_das: das_flag = "--DAS"
-
-    args = [
-        "python",
-        "../../topcoffea/modules/createJSON.py",
-        sample_dir,
-        das_flag,
-        "--sampleName"   , sample_name,
-        "--prefix"       , prefix,
-        "--xsec"         , "../../topcoffea/cfg/xsec.cfg",
-        "--year"         , sample_yr,
-        "--histAxisName" , hist_axis_name,
-    ]
-
-    if xsec_name:
-        args.extend(['--xsecName',xsec_name])
-
-    # Run createJSON.py
-    subprocess.run(args)
+# Wrapper for createJSON.py (runs it in this process, the files can be scanned concurrently by passing an executor)
+def make_json(sample_dir,sample_name,prefix,sample_yr,xsec_name,hist_axis_name,on_das=False,executor=None):
+    return CreateJSON(
+        path         = sample_dir,
+        prefix       = prefix,
+        sample       = sample_name,
+        xsec         = "../../topcoffea/cfg/xsec.cfg",
+        xsecName     = xsec_name if xsec_name else "",
+        year         = sample_yr,
+        histAxisName = hist_axis_name,
+        isDAS        = on_das,
+        executor     = executor,
+    )
 
 # Convenience function for running make_json() on all entries in a dictionary of samples, and moving the results to out_dir
-def make_jsons_for_dict_of_samples(samples_dict,prefix,year,out_dir,on_das=False):
+# Note: The jsons are all made concurrently first (with at most nworkers samples, and nworkers files, being scanned at a
+#       time), the moving/merging of the jsons is then done one sample at a time since the merging depends on the order
+def make_jsons_for_dict_of_samples(samples_dict,prefix,year,out_dir,on_das=False,nworkers=8):
     failed = []
+    sample_paths = {}
     for sample_name,sample_info in sorted(samples_dict.items()):
-        print(f"\n\nMaking JSON for {sample_name}...")
         path = sample_info["path"]
         if not on_das and "path_local" in sample_info:
             # The bkg samples are now at ND, but we wanted to leave the dataset names in the dictionaries as well (in case we want to access remotely)
             # So for these samples we have a "path" (i.e. dataset name to be used when on_das=True), as well as a "local_path" for acessing locally
             # Note, it would probably make more sense to call "path" something like "path_das" (and "path_local" just "path"), but did not want to change the existing names..
             path = sample_info["path_local"]
+        sample_paths[sample_name] = path
+
+    def make_one(sample_name):
+        print(f"\n\nMaking JSON for {sample_name}...")
+        sample_info = samples_dict[sample_name]
+        try:
+            make_json(
+                sample_dir = sample_paths[sample_name],
+                sample_name = sample_name,
+                prefix = prefix,
+                sample_yr = year,
+                xsec_name = sample_info["xsecName"],
+                hist_axis_name = sample_info["histAxisName"],
+                on_das = on_das,
+                executor = file_pool,
+            )
+        except Exception as e:
+            print(f"\nERROR: Making the JSON for {sample_name} failed: {e}")
+
+    # Separate pools for the samples and the files, so the sample jobs never wait on a slot held by themselves
+    with ThreadPoolExecutor(max_workers=nworkers) as file_pool, ThreadPoolExecutor(max_workers=nworkers) as sample_pool:
+        list(sample_pool.map(make_one,sample_paths.keys()))
+
+    for sample_name,path in sample_paths.items():
+        sample_info = samples_dict[sample_name]
         hist_axis_name = sample_info["histAxisName"]
         xsec_name = sample_info["xsecName"]
-        make_json(
-            sample_dir = path,
-            sample_name = sample_name,
-            prefix = prefix,
-            sample_yr = year,
-            xsec_name = xsec_name,
-            hist_axis_name = hist_axis_name,
-            on_das = on_das,
-        )
         out_name = sample_name+".json"
         if not os.path.exists(out_name):
             failed.append(sample_name)
@@ -11,7 +11,7 @@ time python run.py ../../topcoffea/json/test_samples/UL17_private_ttH_for_CI.jso
 
 # Make the JSON file of the yields
 printf "\nMaking the yields JSON file...\n"
-python get_yield_json.py -f histos/new_ref_histos.pkl.gz -n new_ref_yields
+python get_yield_json.py -f histos/new_ref_histos.hists.zip -n new_ref_yields
 
 # Replace the reference yields with the new reference yields
 printf "\nReplacing ref yields JSON with new file...\n"
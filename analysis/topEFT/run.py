@@ -17,7 +17,8 @@ from coffea.nanoevents import NanoAODSchema
 import topeft
 from topcoffea.modules import samples
 from topcoffea.modules import fileReader
-from topcoffea.modules.utils import dump_to_pkl, get_hist_from_pkl
+import topcoffea.modules.utils as utils
+import topcoffea.modules.hist_store as hist_store
 from topcoffea.modules.dataDrivenEstimation import DataDrivenProducer
 from topcoffea.modules.get_renormfact_envelope import get_renormfact_envelope
 
@@ -58,6 +59,7 @@ if __name__ == '__main__':
   parser.add_argument('--wc-list', action='extend', nargs='+', help = 'Specify a list of Wilson coefficients to use in filling histograms.')
   parser.add_argument('--hist-list', action='extend', nargs='+', help = 'Specify a list of histograms to fill.')
   parser.add_argument('--ecut', default=None  , help = 'Energy cut threshold i.e. throw out events above this (GeV)')
+  parser.add_argument('--pkl', action='store_true', help = 'Save the output as a single gzipped pkl file instead of a hist store (see topcoffea/modules/hist_store.py)')
 
   args = parser.parse_args()
   jsonFiles        = args.jsonFiles
@@ -77,6 +79,7 @@ if __name__ == '__main__':
   skip_cr          = args.skip_cr
   do_np            = args.do_np
   do_renormfact_envelope= args.do_renormfact_envelope
+  save_pkl         = args.pkl
   wc_lst = args.wc_list if args.wc_list is not None else []
 
   # Check if we have valid options
@@ -231,22 +234,23 @@ if __name__ == '__main__':
 
   # Save the output
   if not os.path.isdir(outpath): os.system("mkdir -p %s"%outpath)
-  out_pkl_file = os.path.join(outpath,outname+".pkl.gz")
-  print(f"\nSaving output in {out_pkl_file}...")
-  with gzip.open(out_pkl_file, "wb") as fout:
-    cloudpickle.dump(output, fout)
+  out_ext = ".pkl.gz" if save_pkl else hist_store.HIST_STORE_EXT
+  out_file = os.path.join(outpath,outname+out_ext)
+  print(f"\nSaving output in {out_file}...")
+  utils.dump_hists(out_file,output)
   print("Done!")
 
   # Run the data driven estimation, save the output
   if do_np:
     print("\nDoing the nonprompt estimation...")
-    out_pkl_file_name_np = os.path.join(outpath,outname+"_np.pkl.gz")
-    ddp = DataDrivenProducer(out_pkl_file,out_pkl_file_name_np)
-    print(f"Saving output in {out_pkl_file_name_np}...")
-    ddp.dumpToPickle()
-    print("Done!")
+    out_file_np = os.path.join(outpath,outname+"_np"+out_ext)
+    # Note: The output is already saved, so each hist of it is dropped once its np version is made (to not hold both in memory)
+    ddp = DataDrivenProducer(output,out_file_np,keepInput=False)
+    np_hists = ddp.getDataDrivenHistogram()
+    # Run the renorm fact envelope calculation (before saving, so the np hists only have to be written once)
     if do_renormfact_envelope:
       print("\nDoing the renorm. fact. envelope calculation...")
-      dict_of_histos = get_hist_from_pkl(out_pkl_file_name_np,allow_empty=False)
-      dict_of_histos_after_applying_envelope = get_renormfact_envelope(dict_of_histos)
-      dump_to_pkl(out_pkl_file_name_np,dict_of_histos_after_applying_envelope)
+      np_hists = get_renormfact_envelope({k:v for k,v in np_hists.items() if v.values() != {}})
+    print(f"Saving output in {out_file_np}...")
+    utils.dump_hists(out_file_np,np_hists)
+    print("Done!")
@@ -19,6 +19,7 @@ from topcoffea.modules.objects import *
 from topcoffea.modules.corrections import SFevaluator, GetBTagSF, ApplyJetCorrections, GetBtagEff, AttachMuonSF, AttachElectronSF, AttachPerLeptonFR, GetPUSF, ApplyRochesterCorrections, ApplyJetSystematics, AttachPSWeights, AttachPdfWeights, AttachScaleWeights, GetTriggerSF
 from topcoffea.modules.selection import *
 from topcoffea.modules.HistEFT import HistEFT
+from topcoffea.modules.weights import LayeredWeights
 from topcoffea.modules.paths import topcoffea_path
 import topcoffea.modules.eft_helper as efth
 
@@ -80,6 +81,10 @@ class AnalysisProcessor(processor.ProcessorABC):
             "lj0pt"   : HistEFT("Events", wc_names_lst, hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Cat("systematic", "Systematic Uncertainty"),hist.Cat("appl", "AR/SR"), hist.Bin("lj0pt",   "Leading pt of pair from l+j collection (GeV)", 12, 0, 600)),
         })
 
+        # Use the packed storage, so that accumulating the outputs of the chunks adds whole blocks of bins at once
+        for h in self._accumulator.values():
+            h.pack()
+
         # Set the list of hists to fill
         if hist_lst is None:
             # If the hist list is none, assume we want to fill all hists
@@ -288,9 +293,8 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         # These weights can go outside of the outside sys loop since they do not depend on pt of mu or jets
         # We only calculate these values if not isData
-        # Note: add() will generally modify up/down weights, so if these are needed for any reason after this point, we should instead pass copies to add()
         # Note: Here we will to the weights object the SFs that do not depend on any of the forthcoming loops
-        weights_obj_base = coffea.analysis_tools.Weights(len(events),storeIndividual=True)
+        weights_obj_base = LayeredWeights(len(events))
         if not isData:
 
             # If this is no an eft sample, get the genWeight
@@ -317,6 +321,173 @@ class AnalysisProcessor(processor.ProcessorABC):
             weights_obj_base.add('PU', GetPUSF((events.Pileup.nTrueInt), year), GetPUSF(events.Pileup.nTrueInt, year, 'up'), GetPUSF(events.Pileup.nTrueInt, year, 'down'))
 
 
+        ######### Everything that does not depend on the jet kinematics ###########
+
+        # The leptons, the lepton based selections and the lepton based weights are the same for all of the
+        # systematic variations that affect the jets, so compute them once here rather than in the loop below
+
+        # Jet cleaning, before any jet selection
+        #vetos_tocleanjets = ak.with_name( ak.concatenate([tau, l_fo], axis=1), "PtEtaPhiMCandidate")
+        vetos_tocleanjets = ak.with_name( l_fo, "PtEtaPhiMCandidate")
+        tmp = ak.cartesian([ak.local_index(jets.pt), vetos_tocleanjets.jetIdx], nested=True)
+        cleanedJets_nom = jets[~ak.any(tmp.slot0 == tmp.slot1, axis=-1)] # this line should go before *any selection*, otherwise lep.jetIdx is not aligned with the jet index
+
+        # Selecting jets and cleaning them
+        jetptname = "pt_nom" if hasattr(cleanedJets_nom, "pt_nom") else "pt"
+
+        # Jet energy corrections (the jet systematic variations are taken from these corrected jets in the loop)
+        if not isData:
+            cleanedJets_nom["pt_raw"] = (1 - cleanedJets_nom.rawFactor)*cleanedJets_nom.pt
+            cleanedJets_nom["mass_raw"] = (1 - cleanedJets_nom.rawFactor)*cleanedJets_nom.mass
+            cleanedJets_nom["pt_gen"] =ak.values_astype(ak.fill_none(cleanedJets_nom.matched_gen.pt, 0), np.float32)
+            cleanedJets_nom["rho"] = ak.broadcast_arrays(events.fixedGridRhoFastjetAll, cleanedJets_nom.pt)[0]
+            events_cache = events.caches[0]
+            cleanedJets_nom = ApplyJetCorrections(year, corr_type='jets').build(cleanedJets_nom, lazy_cache=events_cache)
+
+        # Put l_fo_conept_sorted into events
+        events["l_fo_conept_sorted"] = l_fo_conept_sorted
+
+        # The event selection
+        add2lMaskAndSFs(events, year, isData, sampleType)
+        add3lMaskAndSFs(events, year, isData, sampleType)
+        add4lMaskAndSFs(events, year, isData)
+        addLepCatMasks(events)
+
+        # Convenient to have l0, l1, l2 on hand
+        l_fo_conept_sorted_padded = ak.pad_none(l_fo_conept_sorted, 3)
+        l0 = l_fo_conept_sorted_padded[:,0]
+        l1 = l_fo_conept_sorted_padded[:,1]
+        l2 = l_fo_conept_sorted_padded[:,2]
+
+        # Trigger SFs
+        if not isData:
+            GetTriggerSF(year,events,l0,l1)
+
+        # The event weights that depend on the lep cat, as (name, nominal, up, down)
+        # Note: These are added to the weights objects of each of the jet systematic variations (LayeredWeights.add() does not modify the arrays)
+        lep_cat_wgts_dict = {}
+        for ch_name in ["2l", "2l_4t", "3l", "4l", "2l_CR", "2l_CRflip", "3l_CR", "2los_CRtt", "2los_CRZ"]:
+
+            # For both data and MC
+            lep_cat_wgts = []
+            if ch_name.startswith("2l"):
+                lep_cat_wgts.append(("FF", events.fakefactor_2l, events.fakefactor_2l_up, events.fakefactor_2l_down))
+                lep_cat_wgts.append(("FFpt",  events.nom, events.fakefactor_2l_pt1/events.fakefactor_2l, events.fakefactor_2l_pt2/events.fakefactor_2l))
+                lep_cat_wgts.append(("FFeta", events.nom, events.fakefactor_2l_be1/events.fakefactor_2l, events.fakefactor_2l_be2/events.fakefactor_2l))
+                lep_cat_wgts.append((f"FFcloseEl_{year}", events.nom, events.fakefactor_2l_elclosureup/events.fakefactor_2l, events.fakefactor_2l_elclosuredown/events.fakefactor_2l))
+                lep_cat_wgts.append((f"FFcloseMu_{year}", events.nom, events.fakefactor_2l_muclosureup/events.fakefactor_2l, events.fakefactor_2l_muclosuredown/events.fakefactor_2l))
+            elif ch_name.startswith("3l"):
+                lep_cat_wgts.append(("FF", events.fakefactor_3l, events.fakefactor_3l_up, events.fakefactor_3l_down))
+                lep_cat_wgts.append(("FFpt",  events.nom, events.fakefactor_3l_pt1/events.fakefactor_3l, events.fakefactor_3l_pt2/events.fakefactor_3l))
+                lep_cat_wgts.append(("FFeta", events.nom, events.fakefactor_3l_be1/events.fakefactor_3l, events.fakefactor_3l_be2/events.fakefactor_3l))
+                lep_cat_wgts.append((f"FFcloseEl_{year}", events.nom, events.fakefactor_3l_elclosureup/events.fakefactor_3l, events.fakefactor_3l_elclosuredown/events.fakefactor_3l))
+                lep_cat_wgts.append((f"FFcloseMu_{year}", events.nom, events.fakefactor_3l_muclosureup/events.fakefactor_3l, events.fakefactor_3l_muclosuredown/events.fakefactor_3l))
+
+            # For data only
+            if isData:
+                if ch_name in ["2l","2l_4t","2l_CR","2l_CRflip"]:
+                    lep_cat_wgts.append(("fliprate", events.flipfactor_2l, None, None))
+
+            # For MC only
+            if not isData:
+                if ch_name.startswith("2l"):
+                    lep_cat_wgts.append(("lepSF_muon", events.sf_2l_muon, events.sf_2l_hi_muon, events.sf_2l_lo_muon))
+                    lep_cat_wgts.append(("lepSF_elec", events.sf_2l_elec, events.sf_2l_hi_elec, events.sf_2l_lo_elec))
+                elif ch_name.startswith("3l"):
+                    lep_cat_wgts.append(("lepSF_muon", events.sf_3l_muon, events.sf_3l_hi_muon, events.sf_3l_lo_muon))
+                    lep_cat_wgts.append(("lepSF_elec", events.sf_3l_elec, events.sf_3l_hi_elec, events.sf_3l_lo_elec))
+                elif ch_name.startswith("4l"):
+                    lep_cat_wgts.append(("lepSF_muon", events.sf_4l_muon, events.sf_4l_hi_muon, events.sf_4l_lo_muon))
+                    lep_cat_wgts.append(("lepSF_elec", events.sf_4l_elec, events.sf_4l_hi_elec, events.sf_4l_lo_elec))
+                else:
+                    raise Exception(f"Unknown channel name: {ch_name}")
+
+            lep_cat_wgts_dict[ch_name] = lep_cat_wgts
+
+        # Get mask for events that have two sf os leps close to z peak
+        sfosz_3l_mask = get_Z_peak_mask(l_fo_conept_sorted_padded[:,0:3],pt_window=10.0)
+        sfosz_2l_mask = get_Z_peak_mask(l_fo_conept_sorted_padded[:,0:2],pt_window=10.0)
+        sfasz_2l_mask = get_Z_peak_mask(l_fo_conept_sorted_padded[:,0:2],pt_window=30.0,flavor="as") # Any sign (do not enforce ss or os here)
+
+        # Pass trigger mask
+        pass_trg = trgPassNoOverlap(events,isData,dataset,str(year))
+
+        # Charge masks
+        chargel0_p = ak.fill_none(((l0.charge)>0),False)
+        chargel0_m = ak.fill_none(((l0.charge)<0),False)
+        charge2l_0 = ak.fill_none(((l0.charge+l1.charge)==0),False)
+        charge2l_1 = ak.fill_none(((l0.charge+l1.charge)!=0),False)
+        charge3l_p = ak.fill_none(((l0.charge+l1.charge+l2.charge)>0),False)
+        charge3l_m = ak.fill_none(((l0.charge+l1.charge+l2.charge)<0),False)
+
+        # The lepton part of the selections that also have jet requirements (these are combined with the jet requirements in the loop)
+        lep_sel_masks = {
+            "2lss_p"    : (events.is2l & chargel0_p & pass_trg),
+            "2lss_m"    : (events.is2l & chargel0_m & pass_trg),
+            "2lss_CR"   : (events.is2l & (chargel0_p | chargel0_m) & pass_trg),
+            "2los_CRtt" : (events.is2l_nozeeveto & charge2l_0 & events.is_em & pass_trg),
+            "2los_CRZ"  : (events.is2l_nozeeveto & charge2l_0 & sfosz_2l_mask & pass_trg),
+            "3l_p_offZ" : (events.is3l & charge3l_p & ~sfosz_3l_mask & pass_trg),
+            "3l_m_offZ" : (events.is3l & charge3l_m & ~sfosz_3l_mask & pass_trg),
+            "3l_onZ"    : (events.is3l & sfosz_3l_mask & pass_trg),
+            "3l"        : (events.is3l & pass_trg),
+            "4l"        : (events.is4l & pass_trg),
+        }
+        lep_sel_masks = {k: ak.to_numpy(ak.fill_none(v,False)) for k,v in lep_sel_masks.items()}
+
+        # The selections that only depend on the leptons (the ones that depend on the jets are added to a copy of this in the loop)
+        lep_selections = PackedSelection(dtype='uint64')
+
+        # Lumi mask (for data)
+        lep_selections.add("is_good_lumi",lumi_mask)
+
+        # 2lss selection for the flip CR (no b jet requirement)
+        lep_selections.add("2lss_CRflip", (events.is2l_nozeeveto & events.is_ee & sfasz_2l_mask & pass_trg)) # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis, also note explicitly include the ee requirement here, so we don't have to rely on running with _split_by_lepton_flavor turned on to enforce this requirement
+
+        # Lep flavor selection
+        lep_selections.add("ee",  events.is_ee)
+        lep_selections.add("em",  events.is_em)
+        lep_selections.add("mm",  events.is_mm)
+        lep_selections.add("eee", events.is_eee)
+        lep_selections.add("eem", events.is_eem)
+        lep_selections.add("emm", events.is_emm)
+        lep_selections.add("mmm", events.is_mmm)
+        lep_selections.add("llll", (events.is_eeee | events.is_eeem | events.is_eemm | events.is_emmm | events.is_mmmm | events.is_gr4l)) # Not keepting track of these separately
+
+        # AR/SR categories
+        lep_selections.add("isSR_2lSS",    ( events.is2l_SR) & charge2l_1)
+        lep_selections.add("isAR_2lSS",    (~events.is2l_SR) & charge2l_1)
+        lep_selections.add("isAR_2lSS_OS", ( events.is2l_SR) & charge2l_0) # Sideband for the charge flip
+        lep_selections.add("isSR_2lOS",    ( events.is2l_SR) & charge2l_0)
+        lep_selections.add("isAR_2lOS",    (~events.is2l_SR) & charge2l_0)
+
+        lep_selections.add("isSR_3l",  events.is3l_SR)
+        lep_selections.add("isAR_3l", ~events.is3l_SR)
+        lep_selections.add("isSR_4l",  events.is4l_SR)
+
+        # Z pt (pt of the ll pair that form the Z for the onZ categories)
+        ptz = get_Z_pt(l_fo_conept_sorted_padded[:,0:3],10.0)
+
+        # Define invariant mass hists
+        mll_0_1 = (l0+l1).mass # Invmass for leading two leps
+
+        # Loose and medium DeepJet WPs
+        if year == "2017":
+            btagwpl = get_param("btag_wp_loose_UL17")
+            btagwpm = get_param("btag_wp_medium_UL17")
+        elif year == "2018":
+            btagwpl = get_param("btag_wp_loose_UL18")
+            btagwpm = get_param("btag_wp_medium_UL18")
+        elif year=="2016":
+            btagwpl = get_param("btag_wp_loose_UL16")
+            btagwpm = get_param("btag_wp_medium_UL16")
+        elif year=="2016APV":
+            btagwpl = get_param("btag_wp_loose_UL16APV")
+            btagwpm = get_param("btag_wp_medium_UL16APV")
+        else:
+            raise ValueError(f"Error: Unknown year \"{year}\".")
+
+
         ######### The rest of the processor is inside this loop over systs that affect object kinematics  ###########
 
         # If we're doing systematics and this isn't data, we will loop over the obj_correction_syst_lst list
@@ -325,35 +496,25 @@ class AnalysisProcessor(processor.ProcessorABC):
         else: syst_var_list = ['nominal']
 
         # Loop over the list of systematic variations we've constructed
+        # Only the jets (and the quantities that depend on them) change from one variation to the next
         met_raw=met
         for syst_var in syst_var_list:
-            # Make a copy of the base weights object, so that each time through the loop we do not double count systs
+            # Make a new layer on top of the base weights object, so that each time through the loop we do not double count systs
             # In this loop over systs that impact kinematics, we will add to the weights objects the SFs that depend on the object kinematics
-            weights_obj_base_for_kinematic_syst = copy.deepcopy(weights_obj_base)
+            weights_obj_base_for_kinematic_syst = weights_obj_base.layer()
 
             #################### Jets ####################
 
-            # Jet cleaning, before any jet selection
-            #vetos_tocleanjets = ak.with_name( ak.concatenate([tau, l_fo], axis=1), "PtEtaPhiMCandidate")
-            vetos_tocleanjets = ak.with_name( l_fo, "PtEtaPhiMCandidate")
-            tmp = ak.cartesian([ak.local_index(jets.pt), vetos_tocleanjets.jetIdx], nested=True)
-            cleanedJets = jets[~ak.any(tmp.slot0 == tmp.slot1, axis=-1)] # this line should go before *any selection*, otherwise lep.jetIdx is not aligned with the jet index
-
-            # Selecting jets and cleaning them
-            jetptname = "pt_nom" if hasattr(cleanedJets, "pt_nom") else "pt"
-
-            # Jet energy corrections
+            # The variation is taken from a shallow copy of the corrected jets, since ApplyJetSystematics sets fields on the jets it
+            # is given (the recombined JES_FlavorQCD pt). Setting a field on the copy only replaces the layout of the copy, so the
+            # jets shared by all of the variations are never modified by one of them (and no buffers are copied)
+            cleanedJets = copy.copy(cleanedJets_nom)
             if not isData:
-                cleanedJets["pt_raw"] = (1 - cleanedJets.rawFactor)*cleanedJets.pt
-                cleanedJets["mass_raw"] = (1 - cleanedJets.rawFactor)*cleanedJets.mass
-                cleanedJets["pt_gen"] =ak.values_astype(ak.fill_none(cleanedJets.matched_gen.pt, 0), np.float32)
-                cleanedJets["rho"] = ak.broadcast_arrays(events.fixedGridRhoFastjetAll, cleanedJets.pt)[0]
-                events_cache = events.caches[0]
-                cleanedJets = ApplyJetCorrections(year, corr_type='jets').build(cleanedJets, lazy_cache=events_cache)
                 # SYSTEMATICS
                 cleanedJets=ApplyJetSystematics(year,cleanedJets,syst_var)
                 met=ApplyJetCorrections(year, corr_type='met').build(met_raw, cleanedJets, lazy_cache=events_cache)
-            cleanedJets["isGood"] = isTightJet(getattr(cleanedJets, jetptname), cleanedJets.eta, cleanedJets.jetId, jetPtCut=30.) # temporary at 25 for synch, TODO: Do we want 30 or 25?
+            # Note: with_field adds isGood to a new array, so the jets the variation was taken from are left as they are
+            cleanedJets = ak.with_field(cleanedJets, isTightJet(getattr(cleanedJets, jetptname), cleanedJets.eta, cleanedJets.jetId, jetPtCut=30.), "isGood") # temporary at 25 for synch, TODO: Do we want 30 or 25?
             goodJets = cleanedJets[cleanedJets.isGood]
 
             # Count jets
@@ -362,31 +523,11 @@ class AnalysisProcessor(processor.ProcessorABC):
             j0 = goodJets[ak.argmax(goodJets.pt,axis=-1,keepdims=True)]
 
             # Loose DeepJet WP
-            if year == "2017":
-                btagwpl = get_param("btag_wp_loose_UL17")
-            elif year == "2018":
-                btagwpl = get_param("btag_wp_loose_UL18")
-            elif year=="2016":
-                btagwpl = get_param("btag_wp_loose_UL16")          
-            elif year=="2016APV":
-                btagwpl = get_param("btag_wp_loose_UL16APV")
-            else:
-                raise ValueError(f"Error: Unknown year \"{year}\".")
             isBtagJetsLoose = (goodJets.btagDeepFlavB > btagwpl)
             isNotBtagJetsLoose = np.invert(isBtagJetsLoose)
             nbtagsl = ak.num(goodJets[isBtagJetsLoose])
 
             # Medium DeepJet WP
-            if year == "2017": 
-                btagwpm = get_param("btag_wp_medium_UL17")
-            elif year == "2018":
-                btagwpm = get_param("btag_wp_medium_UL18")
-            elif year=="2016":
-                btagwpm = get_param("btag_wp_medium_UL16")
-            elif year=="2016APV":
-                btagwpm = get_param("btag_wp_medium_UL16APV")
-            else:
-                raise ValueError(f"Error: Unknown year \"{year}\".")
             isBtagJetsMedium = (goodJets.btagDeepFlavB > btagwpm)
             isNotBtagJetsMedium = np.invert(isBtagJetsMedium)
             nbtagsm = ak.num(goodJets[isBtagJetsMedium])
@@ -394,28 +535,15 @@ class AnalysisProcessor(processor.ProcessorABC):
 
             #################### Add variables into event object so that they persist ####################
 
-            # Put njets and l_fo_conept_sorted into events
+            # Put njets into events
             events["njets"] = njets
-            events["l_fo_conept_sorted"] = l_fo_conept_sorted
-
-            # The event selection
-            add2lMaskAndSFs(events, year, isData, sampleType)
-            add3lMaskAndSFs(events, year, isData, sampleType)
-            add4lMaskAndSFs(events, year, isData)
-            addLepCatMasks(events)
-
-            # Convenient to have l0, l1, l2 on hand
-            l_fo_conept_sorted_padded = ak.pad_none(l_fo_conept_sorted, 3)
-            l0 = l_fo_conept_sorted_padded[:,0]
-            l1 = l_fo_conept_sorted_padded[:,1]
-            l2 = l_fo_conept_sorted_padded[:,2]
 
 
             ######### Event weights that do not depend on the lep cat ##########
 
             if not isData:
 
-                # Btag SF following 1a) in https://twiki.cern.ch/twiki/bin/viewauth/CMS/BTagSFMethods    
+                # Btag SF following 1a) in https://twiki.cern.ch/twiki/bin/viewauth/CMS/BTagSFMethods
                 isBtagJetsLooseNotMedium = (isBtagJetsLoose & isNotBtagJetsMedium)
                 bJetSF   = [GetBTagSF(goodJets, year, 'LOOSE'),GetBTagSF(goodJets, year, 'MEDIUM')]
                 bJetEff  = [GetBtagEff(goodJets, year, 'loose'),GetBtagEff(goodJets, year, 'medium')]
@@ -427,132 +555,73 @@ class AnalysisProcessor(processor.ProcessorABC):
 
                 if self._do_systematics and syst_var=='nominal':
                     for b_syst in ["bc_corr","light_corr",f"bc_{year}",f"light_{year}"]:
-                        bJetSFUp = [GetBTagSF(goodJets, year, 'LOOSE', sys=b_syst)[0],GetBTagSF(goodJets, year, 'MEDIUM', sys=b_syst)[0]]
-                        bJetSFDo = [GetBTagSF(goodJets, year, 'LOOSE', sys=b_syst)[1],GetBTagSF(goodJets, year, 'MEDIUM', sys=b_syst)[1]]
+                        bJetSFUpDo = [GetBTagSF(goodJets, year, 'LOOSE', sys=b_syst),GetBTagSF(goodJets, year, 'MEDIUM', sys=b_syst)]
+                        bJetSFUp = [bJetSFUpDo[0][0],bJetSFUpDo[1][0]]
+                        bJetSFDo = [bJetSFUpDo[0][1],bJetSFUpDo[1][1]]
                         bJetEff_dataUp = [bJetEff[0]*bJetSFUp[0],bJetEff[1]*bJetSFUp[1]]
                         bJetEff_dataDo = [bJetEff[0]*bJetSFDo[0],bJetEff[1]*bJetSFDo[1]]
                         pDataUp = ak.prod(bJetEff_dataUp[1][isBtagJetsMedium], axis=-1) * ak.prod((bJetEff_dataUp[0][isBtagJetsLooseNotMedium] - bJetEff_dataUp[1][isBtagJetsLooseNotMedium]), axis=-1) * ak.prod((1-bJetEff_dataUp[0][isNotBtagJetsLoose]), axis=-1)
-                        pDataDo = ak.prod(bJetEff_dataDo[1][isBtagJetsMedium], axis=-1) * ak.prod((bJetEff_dataDo[0][isBtagJetsLooseNotMedium] - bJetEff_dataDo[1][isBtagJetsLooseNotMedium]), axis=-1) * ak.prod((1-bJetEff_dataDo[0][isNotBtagJetsLoose]), axis=-1)           
+                        pDataDo = ak.prod(bJetEff_dataDo[1][isBtagJetsMedium], axis=-1) * ak.prod((bJetEff_dataDo[0][isBtagJetsLooseNotMedium] - bJetEff_dataDo[1][isBtagJetsLooseNotMedium]), axis=-1) * ak.prod((1-bJetEff_dataDo[0][isNotBtagJetsLoose]), axis=-1)
                         weights_obj_base_for_kinematic_syst.add(f"btagSF{b_syst}", events.nom, (pDataUp/pMC)/(pData/pMC),(pDataDo/pMC)/(pData/pMC))
 
-                # Trigger SFs 
-                GetTriggerSF(year,events,l0,l1)                
-                weights_obj_base_for_kinematic_syst.add(f"triggerSF_{year}", events.trigger_sf, copy.deepcopy(events.trigger_sfUp), copy.deepcopy(events.trigger_sfDown))            # In principle does not have to be in the lep cat loop
+                # Trigger SFs (computed once above, but added here to keep the same order of the weights)
+                weights_obj_base_for_kinematic_syst.add(f"triggerSF_{year}", events.trigger_sf, events.trigger_sfUp, events.trigger_sfDown)            # In principle does not have to be in the lep cat loop
 
 
             ######### Event weights that do depend on the lep cat ###########
 
             # Loop over categories and fill the dict
             weights_dict = {}
-            for ch_name in ["2l", "2l_4t", "3l", "4l", "2l_CR", "2l_CRflip", "3l_CR", "2los_CRtt", "2los_CRZ"]:
-
-                # For both data and MC
-                weights_dict[ch_name] = copy.deepcopy(weights_obj_base_for_kinematic_syst)
-                if ch_name.startswith("2l"):
-                    weights_dict[ch_name].add("FF", events.fakefactor_2l, copy.deepcopy(events.fakefactor_2l_up), copy.deepcopy(events.fakefactor_2l_down))
-                    weights_dict[ch_name].add("FFpt",  events.nom, copy.deepcopy(events.fakefactor_2l_pt1/events.fakefactor_2l), copy.deepcopy(events.fakefactor_2l_pt2/events.fakefactor_2l))
-                    weights_dict[ch_name].add("FFeta", events.nom, copy.deepcopy(events.fakefactor_2l_be1/events.fakefactor_2l), copy.deepcopy(events.fakefactor_2l_be2/events.fakefactor_2l))
-                    weights_dict[ch_name].add(f"FFcloseEl_{year}", events.nom, copy.deepcopy(events.fakefactor_2l_elclosureup/events.fakefactor_2l), copy.deepcopy(events.fakefactor_2l_elclosuredown/events.fakefactor_2l))
-                    weights_dict[ch_name].add(f"FFcloseMu_{year}", events.nom, copy.deepcopy(events.fakefactor_2l_muclosureup/events.fakefactor_2l), copy.deepcopy(events.fakefactor_2l_muclosuredown/events.fakefactor_2l))
-                elif ch_name.startswith("3l"):
-                    weights_dict[ch_name].add("FF", events.fakefactor_3l, copy.deepcopy(events.fakefactor_3l_up), copy.deepcopy(events.fakefactor_3l_down))
-                    weights_dict[ch_name].add("FFpt",  events.nom, copy.deepcopy(events.fakefactor_3l_pt1/events.fakefactor_3l), copy.deepcopy(events.fakefactor_3l_pt2/events.fakefactor_3l))
-                    weights_dict[ch_name].add("FFeta", events.nom, copy.deepcopy(events.fakefactor_3l_be1/events.fakefactor_3l), copy.deepcopy(events.fakefactor_3l_be2/events.fakefactor_3l))
-                    weights_dict[ch_name].add(f"FFcloseEl_{year}", events.nom, copy.deepcopy(events.fakefactor_3l_elclosureup/events.fakefactor_3l), copy.deepcopy(events.fakefactor_3l_elclosuredown/events.fakefactor_3l))
-                    weights_dict[ch_name].add(f"FFcloseMu_{year}", events.nom, copy.deepcopy(events.fakefactor_3l_muclosureup/events.fakefactor_3l), copy.deepcopy(events.fakefactor_3l_muclosuredown/events.fakefactor_3l))
-
-                # For data only
-                if isData:
-                    if ch_name in ["2l","2l_4t","2l_CR","2l_CRflip"]:
-                        weights_dict[ch_name].add("fliprate", events.flipfactor_2l)
-
-                # For MC only
-                if not isData:
-                    if ch_name.startswith("2l"):
-                        weights_dict[ch_name].add("lepSF_muon", events.sf_2l_muon, copy.deepcopy(events.sf_2l_hi_muon), copy.deepcopy(events.sf_2l_lo_muon))
-                        weights_dict[ch_name].add("lepSF_elec", events.sf_2l_elec, copy.deepcopy(events.sf_2l_hi_elec), copy.deepcopy(events.sf_2l_lo_elec))
-                    elif ch_name.startswith("3l"):
-                        weights_dict[ch_name].add("lepSF_muon", events.sf_3l_muon, copy.deepcopy(events.sf_3l_hi_muon), copy.deepcopy(events.sf_3l_lo_muon))
-                        weights_dict[ch_name].add("lepSF_elec", events.sf_3l_elec, copy.deepcopy(events.sf_3l_hi_elec), copy.deepcopy(events.sf_3l_lo_elec))
-                    elif ch_name.startswith("4l"):
-                        weights_dict[ch_name].add("lepSF_muon", events.sf_4l_muon, copy.deepcopy(events.sf_4l_hi_muon), copy.deepcopy(events.sf_4l_lo_muon))
-                        weights_dict[ch_name].add("lepSF_elec", events.sf_4l_elec, copy.deepcopy(events.sf_4l_hi_elec), copy.deepcopy(events.sf_4l_lo_elec))
-                    else:
-                        raise Exception(f"Unknown channel name: {ch_name}")
+            for ch_name, lep_cat_wgts in lep_cat_wgts_dict.items():
+                # Each lep cat only stores its own weights on top of the ones shared by all of the lep cats
+                weights_dict[ch_name] = weights_obj_base_for_kinematic_syst.layer()
+                for wgt_name, wgt, wgt_up, wgt_down in lep_cat_wgts:
+                    weights_dict[ch_name].add(wgt_name, wgt, wgt_up, wgt_down)
 
 
             ######### Masks we need for the selection ##########
 
-            # Get mask for events that have two sf os leps close to z peak
-            sfosz_3l_mask = get_Z_peak_mask(l_fo_conept_sorted_padded[:,0:3],pt_window=10.0)
-            sfosz_2l_mask = get_Z_peak_mask(l_fo_conept_sorted_padded[:,0:2],pt_window=10.0)
-            sfasz_2l_mask = get_Z_peak_mask(l_fo_conept_sorted_padded[:,0:2],pt_window=30.0,flavor="as") # Any sign (do not enforce ss or os here)
-
-            # Pass trigger mask
-            pass_trg = trgPassNoOverlap(events,isData,dataset,str(year))
-
             # b jet masks
-            bmask_atleast1med_atleast2loose = ((nbtagsm>=1)&(nbtagsl>=2)) # Used for 2lss and 4l
-            bmask_exactly0med = (nbtagsm==0) # Used for 3l CR and 2los Z CR
-            bmask_exactly1med = (nbtagsm==1) # Used for 3l SR and 2lss CR
-            bmask_exactly2med = (nbtagsm==2) # Used for CRtt
-            bmask_atleast2med = (nbtagsm>=2) # Used for 3l SR
-            bmask_atmost2med  = (nbtagsm< 3) # Used to make 2lss mutually exclusive from tttt enriched
-            bmask_atleast3med = (nbtagsm>=3) # Used for tttt enriched
-
-            # Charge masks
-            chargel0_p = ak.fill_none(((l0.charge)>0),False)
-            chargel0_m = ak.fill_none(((l0.charge)<0),False)
-            charge2l_0 = ak.fill_none(((l0.charge+l1.charge)==0),False)
-            charge2l_1 = ak.fill_none(((l0.charge+l1.charge)!=0),False)
-            charge3l_p = ak.fill_none(((l0.charge+l1.charge+l2.charge)>0),False)
-            charge3l_m = ak.fill_none(((l0.charge+l1.charge+l2.charge)<0),False)
+            bmask_atleast1med_atleast2loose = ak.to_numpy((nbtagsm>=1)&(nbtagsl>=2)) # Used for 2lss and 4l
+            bmask_exactly0med = ak.to_numpy(nbtagsm==0) # Used for 3l CR and 2los Z CR
+            bmask_exactly1med = ak.to_numpy(nbtagsm==1) # Used for 3l SR and 2lss CR
+            bmask_exactly2med = ak.to_numpy(nbtagsm==2) # Used for CRtt
+            bmask_atleast2med = ak.to_numpy(nbtagsm>=2) # Used for 3l SR
+            bmask_atmost2med  = ak.to_numpy(nbtagsm< 3) # Used to make 2lss mutually exclusive from tttt enriched
+            bmask_atleast3med = ak.to_numpy(nbtagsm>=3) # Used for tttt enriched
 
 
             ######### Store boolean masks with PackedSelection ##########
 
-            selections = PackedSelection(dtype='uint64')
-
-            # Lumi mask (for data)
-            selections.add("is_good_lumi",lumi_mask)
+            # Start from the selections that only depend on the leptons, and add the ones that depend on the jets
+            selections = copy.deepcopy(lep_selections)
 
             # 2lss selection (drained of 4 top)
-            selections.add("2lss_p", (events.is2l & chargel0_p & bmask_atleast1med_atleast2loose & pass_trg & bmask_atmost2med))  # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis
-            selections.add("2lss_m", (events.is2l & chargel0_m & bmask_atleast1med_atleast2loose & pass_trg & bmask_atmost2med))  # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis
+            selections.add("2lss_p", (lep_sel_masks["2lss_p"] & bmask_atleast1med_atleast2loose & bmask_atmost2med))  # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis
+            selections.add("2lss_m", (lep_sel_masks["2lss_m"] & bmask_atleast1med_atleast2loose & bmask_atmost2med))  # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis
 
             # 2lss selection (enriched in 4 top)
-            selections.add("2lss_4t_p", (events.is2l & chargel0_p & bmask_atleast1med_atleast2loose & pass_trg & bmask_atleast3med))  # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis
-            selections.add("2lss_4t_m", (events.is2l & chargel0_m & bmask_atleast1med_atleast2loose & pass_trg & bmask_atleast3med))  # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis
-		
+            selections.add("2lss_4t_p", (lep_sel_masks["2lss_p"] & bmask_atleast1med_atleast2loose & bmask_atleast3med))  # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis
+            selections.add("2lss_4t_m", (lep_sel_masks["2lss_m"] & bmask_atleast1med_atleast2loose & bmask_atleast3med))  # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis
+
             # 2lss selection for CR
-            selections.add("2lss_CR", (events.is2l & (chargel0_p | chargel0_m) & bmask_exactly1med & pass_trg)) # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis
-            selections.add("2lss_CRflip", (events.is2l_nozeeveto & events.is_ee & sfasz_2l_mask & pass_trg)) # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis, also note explicitly include the ee requirement here, so we don't have to rely on running with _split_by_lepton_flavor turned on to enforce this requirement
+            selections.add("2lss_CR", (lep_sel_masks["2lss_CR"] & bmask_exactly1med)) # Note: The ss requirement has NOT yet been made at this point! We take care of it later with the appl axis
 
             # 2los selection
-            selections.add("2los_CRtt", (events.is2l_nozeeveto & charge2l_0 & events.is_em & bmask_exactly2med & pass_trg)) # Explicitly add the em requirement here, so we don't have to rely on running with _split_by_lepton_flavor turned on to enforce this requirement
-            selections.add("2los_CRZ", (events.is2l_nozeeveto & charge2l_0 & sfosz_2l_mask & bmask_exactly0med & pass_trg))
+            selections.add("2los_CRtt", (lep_sel_masks["2los_CRtt"] & bmask_exactly2med)) # Explicitly add the em requirement here, so we don't have to rely on running with _split_by_lepton_flavor turned on to enforce this requirement
+            selections.add("2los_CRZ", (lep_sel_masks["2los_CRZ"] & bmask_exactly0med))
 
             # 3l selection
-            selections.add("3l_p_offZ_1b", (events.is3l & charge3l_p & ~sfosz_3l_mask & bmask_exactly1med & pass_trg))
-            selections.add("3l_m_offZ_1b", (events.is3l & charge3l_m & ~sfosz_3l_mask & bmask_exactly1med & pass_trg))
-            selections.add("3l_p_offZ_2b", (events.is3l & charge3l_p & ~sfosz_3l_mask & bmask_atleast2med & pass_trg))
-            selections.add("3l_m_offZ_2b", (events.is3l & charge3l_m & ~sfosz_3l_mask & bmask_atleast2med & pass_trg))
-            selections.add("3l_onZ_1b", (events.is3l & sfosz_3l_mask & bmask_exactly1med & pass_trg))
-            selections.add("3l_onZ_2b", (events.is3l & sfosz_3l_mask & bmask_atleast2med & pass_trg))
-            selections.add("3l_CR", (events.is3l & bmask_exactly0med & pass_trg))
+            selections.add("3l_p_offZ_1b", (lep_sel_masks["3l_p_offZ"] & bmask_exactly1med))
+            selections.add("3l_m_offZ_1b", (lep_sel_masks["3l_m_offZ"] & bmask_exactly1med))
+            selections.add("3l_p_offZ_2b", (lep_sel_masks["3l_p_offZ"] & bmask_atleast2med))
+            selections.add("3l_m_offZ_2b", (lep_sel_masks["3l_m_offZ"] & bmask_atleast2med))
+            selections.add("3l_onZ_1b", (lep_sel_masks["3l_onZ"] & bmask_exactly1med))
+            selections.add("3l_onZ_2b", (lep_sel_masks["3l_onZ"] & bmask_atleast2med))
+            selections.add("3l_CR", (lep_sel_masks["3l"] & bmask_exactly0med))
 
             # 4l selection
-            selections.add("4l", (events.is4l & bmask_atleast1med_atleast2loose & pass_trg))
-
-            # Lep flavor selection
-            selections.add("ee",  events.is_ee)
-            selections.add("em",  events.is_em)
-            selections.add("mm",  events.is_mm)
-            selections.add("eee", events.is_eee)
-            selections.add("eem", events.is_eem)
-            selections.add("emm", events.is_emm)
-            selections.add("mmm", events.is_mmm)
-            selections.add("llll", (events.is_eeee | events.is_eeem | events.is_eemm | events.is_emmm | events.is_mmmm | events.is_gr4l)) # Not keepting track of these separately
+            selections.add("4l", (lep_sel_masks["4l"] & bmask_atleast1med_atleast2loose))
 
             # Njets selection
             selections.add("exactly_0j", (njets==0))
@@ -569,17 +638,6 @@ class AnalysisProcessor(processor.ProcessorABC):
             selections.add("atleast_0j", (njets>=0))
             selections.add("atmost_3j" , (njets<=3))
 
-            # AR/SR categories
-            selections.add("isSR_2lSS",    ( events.is2l_SR) & charge2l_1) 
-            selections.add("isAR_2lSS",    (~events.is2l_SR) & charge2l_1) 
-            selections.add("isAR_2lSS_OS", ( events.is2l_SR) & charge2l_0) # Sideband for the charge flip
-            selections.add("isSR_2lOS",    ( events.is2l_SR) & charge2l_0) 
-            selections.add("isAR_2lOS",    (~events.is2l_SR) & charge2l_0) 
-
-            selections.add("isSR_3l",  events.is3l_SR)
-            selections.add("isAR_3l", ~events.is3l_SR)
-            selections.add("isSR_4l",  events.is4l_SR)
-
 
             ######### Variables for the dense axes of the hists ##########
 
@@ -590,9 +648,6 @@ class AnalysisProcessor(processor.ProcessorABC):
             ptbl = (ptbl_bjet.nearest(ptbl_lep) + ptbl_bjet).pt
             ptbl = ak.values_astype(ak.fill_none(ptbl, -1), np.float32)
 
-            # Z pt (pt of the ll pair that form the Z for the onZ categories)
-            ptz = get_Z_pt(l_fo_conept_sorted_padded[:,0:3],10.0)
-
             # Leading (b+l) pair pt
             bjetsl = goodJets[isBtagJetsLoose][ak.argsort(goodJets[isBtagJetsLoose].pt, axis=-1, ascending=False)]
             bl_pairs = ak.cartesian({"b":bjetsl,"l":l_fo_conept_sorted})
@@ -611,9 +666,6 @@ class AnalysisProcessor(processor.ProcessorABC):
             l_j_pairs_mass = (l_j_pairs.o0 + l_j_pairs.o1).mass
             lj0pt = ak.max(l_j_pairs_pt,axis=-1)
 
-            # Define invariant mass hists
-            mll_0_1 = (l0+l1).mass # Invmass for leading two leps
-
             # ST (but "st" is too hard to search in the code, so call it ljptsum)
             ljptsum = ak.sum(l_j_collection.pt,axis=-1)
             if self._ecut_threshold is not None:
@@ -787,6 +839,69 @@ class AnalysisProcessor(processor.ProcessorABC):
 
 
 
+            # Find the events in each category once, rather than for every hist and every systematic
+            # For the njets hist we don't store njets in a sparse axis, so there the njet bins of each nlep cat are merged into one category
+            cat_lst = {False: [], True: []} # Keyed by whether or not the categories are for the njets hist
+            for nlep_cat in cat_dict.keys():
+
+                # Get a mask for events that pass any of the njet requiremens in this nlep cat
+                njets_any_mask = selections.any(*cat_dict[nlep_cat].keys())
+
+                # Loop over the njets list for each channel
+                for i_njet, njet_val in enumerate(cat_dict[nlep_cat].keys()):
+
+                    # Loop over the appropriate AR and SR for this channel
+                    for appl in cat_dict[nlep_cat][njet_val]["appl_lst"]:
+
+                        # Loop over the channels in each nlep cat (e.g. "3l_m_offZ_1b")
+                        for lep_chan in cat_dict[nlep_cat][njet_val]["lep_chan_lst"]:
+
+                            # Loop over the lep flavor list for each channel
+                            for lep_flav in cat_dict[nlep_cat][njet_val]["lep_flav_lst"]:
+
+                                for is_njets_cat in [False, True]:
+
+                                    # Only take the first njet bin for the njets hist (otherwise we'd fill the hist too many times)
+                                    if is_njets_cat and i_njet > 0: continue
+
+                                    # Construct the hist name
+                                    flav_ch = None
+                                    njet_ch = None
+                                    cuts_lst = [appl,lep_chan]
+                                    if isData:
+                                        cuts_lst.append("is_good_lumi")
+                                    if self._split_by_lepton_flavor:
+                                        flav_ch = lep_flav
+                                        cuts_lst.append(lep_flav)
+                                    if not is_njets_cat:
+                                        njet_ch = njet_val
+                                        cuts_lst.append(njet_val)
+                                    ch_name = construct_cat_name(lep_chan,njet_str=njet_ch,flav_str=flav_ch)
+
+                                    # Get the cuts mask for all selections
+                                    if is_njets_cat:
+                                        all_cuts_mask = (selections.all(*cuts_lst) & njets_any_mask)
+                                    else:
+                                        all_cuts_mask = selections.all(*cuts_lst)
+
+                                    # Apply the optional cut on energy of the event
+                                    if self._ecut_threshold is not None:
+                                        all_cuts_mask = (all_cuts_mask & ecut_mask)
+
+                                    cat_lst[is_njets_cat].append({
+                                        "nlep_cat" : nlep_cat,
+                                        "appl"     : appl,
+                                        "lep_chan" : lep_chan,
+                                        "ch_name"  : ch_name,
+                                        "events"   : np.flatnonzero(ak.to_numpy(all_cuts_mask)),
+                                    })
+
+                                # Do not loop over lep flavors if not self._split_by_lepton_flavor, it's a waste of time and also we'd fill the hists too many times
+                                if not self._split_by_lepton_flavor: break
+
+            # The weight for each nlep cat and each syst wgt variation, only calculated the first time it is needed
+            weights_cache = {}
+
             # Loop over the hists we want to fill
             for dense_axis_name, dense_axis_vals in varnames.items():
                 if dense_axis_name not in self._hist_lst:
@@ -808,109 +923,77 @@ class AnalysisProcessor(processor.ProcessorABC):
                         # This is data, so we want to loop over just up/down variations relevant for data (i.e. FF up and down)
                         wgt_var_lst = wgt_var_lst + data_syst_lst
 
+                # Collect the entries (i.e. the events and their weights) of every category and systematic for this hist, then fill them all at once
+                sparse_keys = []
+                key_idx_lst = []
+                event_idx_lst = []
+                weight_lst = []
+
                 # Loop over the systematics
                 for wgt_fluct in wgt_var_lst:
 
-                    # Loop over nlep categories "2l", "3l", "4l"
-                    for nlep_cat in cat_dict.keys():
+                    # Loop over the categories of all the nlep cats "2l", "3l", "4l"
+                    for cat in cat_lst[dense_axis_name == "njets"]:
+                        nlep_cat = cat["nlep_cat"]
+                        appl = cat["appl"]
+                        lep_chan = cat["lep_chan"]
+                        ch_name = cat["ch_name"]
 
                         # Get the appropriate Weights object for the nlep cat and get the weight to be used when filling the hist
-                        # Need to do this inside of nlep cat loop since some wgts depend on lep cat
-                        weights_object = weights_dict[nlep_cat]
-                        if (wgt_fluct == "nominal") or (wgt_fluct in obj_correction_syst_lst):
-                            # In the case of "nominal", or the jet energy systematics, no weight systematic variation is used
-                            weight = weights_object.weight(None)
-                        else:
-                            # Otherwise get the weight from the Weights object
-                            if wgt_fluct in weights_object.variations:
-                                weight = weights_object.weight(wgt_fluct)
+                        # Need to do this per nlep cat since some wgts depend on lep cat
+                        if (nlep_cat, wgt_fluct) not in weights_cache:
+                            weights_object = weights_dict[nlep_cat]
+                            if (wgt_fluct == "nominal") or (wgt_fluct in obj_correction_syst_lst):
+                                # In the case of "nominal", or the jet energy systematics, no weight systematic variation is used
+                                weights_cache[(nlep_cat, wgt_fluct)] = weights_object.weight(None)
+                            elif wgt_fluct in weights_object.variations:
+                                # Otherwise get the weight from the Weights object
+                                weights_cache[(nlep_cat, wgt_fluct)] = weights_object.weight(wgt_fluct)
                             else:
                                 # Note in this case there is no up/down fluct for this cateogry, so we don't want to fill a hist for it
-                                continue
-
-                        # This is a check ot make sure we guard against any unintentional variations being applied to data
-                        if self._do_systematics and isData:
-                            # Should not have any up/down variations for data in 4l (since we don't estimate the fake rate there)
-                            if nlep_cat == "4l":
-                                if weights_object.variations != set([]): raise Exception(f"Error: Unexpected wgt variations for data! Expected \"{[]}\" but have \"{weights_object.variations}\".")
-                            # In all other cases, the up/down variations should correspond to only the ones in the data list
-                            else:
-                                if weights_object.variations != set(data_syst_lst): raise Exception(f"Error: Unexpected wgt variations for data! Expected \"{set(data_syst_lst)}\" but have \"{weights_object.variations}\".")
-
-                        # Get a mask for events that pass any of the njet requiremens in this nlep cat
-                        # Useful in cases like njets hist where we don't store njets in a sparse axis
-                        njets_any_mask = selections.any(*cat_dict[nlep_cat].keys())
-
-                        # Loop over the njets list for each channel
-                        for njet_val in cat_dict[nlep_cat].keys():
-
-                            # Loop over the appropriate AR and SR for this channel
-                            for appl in cat_dict[nlep_cat][njet_val]["appl_lst"]:
-
-                                # We don't want or need to fill SR histos with the FF variations
-                                if appl.startswith("isSR") and wgt_fluct in data_syst_lst: continue
-
-                                # Loop over the channels in each nlep cat (e.g. "3l_m_offZ_1b")
-                                for lep_chan in cat_dict[nlep_cat][njet_val]["lep_chan_lst"]:
-
-                                    # Loop over the lep flavor list for each channel
-                                    for lep_flav in cat_dict[nlep_cat][njet_val]["lep_flav_lst"]:
-
-                                        # Construct the hist name
-                                        flav_ch = None
-                                        njet_ch = None
-                                        cuts_lst = [appl,lep_chan]
-                                        if isData:
-                                            cuts_lst.append("is_good_lumi")
-                                        if self._split_by_lepton_flavor:
-                                            flav_ch = lep_flav
-                                            cuts_lst.append(lep_flav)
-                                        if dense_axis_name != "njets":
-                                            njet_ch = njet_val
-                                            cuts_lst.append(njet_val)
-                                        ch_name = construct_cat_name(lep_chan,njet_str=njet_ch,flav_str=flav_ch)
-
-                                        # Get the cuts mask for all selections
-                                        if dense_axis_name == "njets":
-                                            all_cuts_mask = (selections.all(*cuts_lst) & njets_any_mask)
-                                        else:
-                                            all_cuts_mask = selections.all(*cuts_lst)
-
-                                        # Apply the optional cut on energy of the event
-                                        if self._ecut_threshold is not None:
-                                            all_cuts_mask = (all_cuts_mask & ecut_mask)
-
-                                        # Weights and eft coeffs
-                                        weights_flat = weight[all_cuts_mask]
-                                        eft_coeffs_cut = eft_coeffs[all_cuts_mask] if eft_coeffs is not None else None
-                                        eft_w2_coeffs_cut = eft_w2_coeffs[all_cuts_mask] if eft_w2_coeffs is not None else None
-
-
-                                        # Fill the histos
-                                        axes_fill_info_dict = {
-                                            dense_axis_name : dense_axis_vals[all_cuts_mask],
-                                            "channel"       : ch_name,
-                                            "appl"          : appl,
-                                            "sample"        : histAxisName,
-                                            "systematic"    : wgt_fluct,
-                                            "weight"        : weights_flat,
-                                            "eft_coeff"     : eft_coeffs_cut,
-                                            "eft_err_coeff" : eft_w2_coeffs_cut,
-                                        }
-
-                                        # Skip histos that are not defined (or not relevant) to given categories
-                                        if ((("j0" in dense_axis_name) and ("lj0pt" not in dense_axis_name)) & (("CRZ" in ch_name) or ("CRflip" in ch_name))): continue
-                                        if ((("j0" in dense_axis_name) and ("lj0pt" not in dense_axis_name)) & ("0j" in ch_name)): continue
-                                        if (("ptz" in dense_axis_name) & ("onZ" not in lep_chan)): continue
-                                        if ((dense_axis_name in ["o0pt","b0pt","bl0pt"]) & ("CR" in ch_name)): continue
-
-                                        hout[dense_axis_name].fill(**axes_fill_info_dict)
-
-                                        # Do not loop over lep flavors if not self._split_by_lepton_flavor, it's a waste of time and also we'd fill the hists too many times
-                                        if not self._split_by_lepton_flavor: break
-
-                            # Do not loop over njets if hist is njets (otherwise we'd fill the hist too many times)
-                            if dense_axis_name == "njets": break
+                                weights_cache[(nlep_cat, wgt_fluct)] = None
+
+                            # This is a check ot make sure we guard against any unintentional variations being applied to data
+                            if self._do_systematics and isData and weights_cache[(nlep_cat, wgt_fluct)] is not None:
+                                # Should not have any up/down variations for data in 4l (since we don't estimate the fake rate there)
+                                if nlep_cat == "4l":
+                                    if weights_object.variations != set([]): raise Exception(f"Error: Unexpected wgt variations for data! Expected \"{[]}\" but have \"{weights_object.variations}\".")
+                                # In all other cases, the up/down variations should correspond to only the ones in the data list
+                                else:
+                                    if weights_object.variations != set(data_syst_lst): raise Exception(f"Error: Unexpected wgt variations for data! Expected \"{set(data_syst_lst)}\" but have \"{weights_object.variations}\".")
+                        weight = weights_cache[(nlep_cat, wgt_fluct)]
+                        if weight is None: continue
+
+                        # We don't want or need to fill SR histos with the FF variations
+                        if appl.startswith("isSR") and wgt_fluct in data_syst_lst: continue
+
+                        # Skip histos that are not defined (or not relevant) to given categories
+                        if ((("j0" in dense_axis_name) and ("lj0pt" not in dense_axis_name)) & (("CRZ" in ch_name) or ("CRflip" in ch_name))): continue
+                        if ((("j0" in dense_axis_name) and ("lj0pt" not in dense_axis_name)) & ("0j" in ch_name)): continue
+                        if (("ptz" in dense_axis_name) & ("onZ" not in lep_chan)): continue
+                        if ((dense_axis_name in ["o0pt","b0pt","bl0pt"]) & ("CR" in ch_name)): continue
+
+                        key_idx_lst.append(np.full(len(cat["events"]), len(sparse_keys)))
+                        event_idx_lst.append(cat["events"])
+                        weight_lst.append(weight[cat["events"]])
+                        sparse_keys.append({
+                            "channel"    : ch_name,
+                            "appl"       : appl,
+                            "sample"     : histAxisName,
+                            "systematic" : wgt_fluct,
+                        })
+
+                # Fill the histos
+                if len(sparse_keys) == 0: continue
+                hout[dense_axis_name].fill_batch(
+                    sparse_keys,
+                    key_idx       = np.concatenate(key_idx_lst),
+                    event_idx     = np.concatenate(event_idx_lst),
+                    weight        = np.concatenate(weight_lst),
+                    eft_coeff     = eft_coeffs,
+                    eft_err_coeff = eft_w2_coeffs,
+                    **{dense_axis_name : dense_axis_vals},
+                )
 
         return hout
 
@@ -17,11 +17,13 @@ from coffea.nanoevents import NanoAODSchema
 
 import topeft
 import topcoffea.modules.utils as utils
+import topcoffea.modules.hist_store as hist_store
 from topcoffea.modules import samples
 from topcoffea.modules import fileReader
 from topcoffea.modules.dataDrivenEstimation import DataDrivenProducer
 from topcoffea.modules.get_renormfact_envelope import get_renormfact_envelope
 import topcoffea.modules.remote_environment as remote_environment
+from topcoffea.modules.spill_accumulator import SpillingWorkQueueExecutor
 
 WGT_VAR_LST = [
     "nSumOfWeights_ISRUp",
@@ -56,7 +58,12 @@ parser.add_argument('--do-renormfact-envelope', action='store_true', help = 'Per
 parser.add_argument('--wc-list', action='extend', nargs='+', help = 'Specify a list of Wilson coefficients to use in filling histograms.')
 parser.add_argument('--hist-list', action='extend', nargs='+', help = 'Specify a list of histograms to fill.')
 parser.add_argument('--ecut', default=None  , help = 'Energy cut threshold i.e. throw out events above this (GeV)')
+parser.add_argument('--pkl', action='store_true', help = 'Save the output as a single gzipped pkl file instead of a hist store (see topcoffea/modules/hist_store.py)')
 parser.add_argument('--port', default='9123-9130', help = 'Specify the Work Queue port. An integer PORT or an integer range PORT_MIN-PORT_MAX.')
+parser.add_argument('--treereduction', default=25, type=int, help = 'Number of results merged by each accumulation task on the workers')
+parser.add_argument('--compression', default=1, type=int, help = 'LZ4 level for the results sent back from the workers (levels above 2 are much slower and gain little for the hist arrays)')
+parser.add_argument('--max-manager-memory', default=None, type=int, help = 'Memory ceiling (in MB) for the output accumulated on the manager, partial sums above it are spilled to disk (no ceiling by default)')
+parser.add_argument('--spill-dir', default='.', help = 'Local dir for the partial sums spilled to disk (see --max-manager-memory)')
 
 args = parser.parse_args()
 jsonFiles  = args.jsonFiles
@@ -74,6 +81,7 @@ skip_sr    = args.skip_sr
 skip_cr    = args.skip_cr
 do_np      = args.do_np
 do_renormfact_envelope = args.do_renormfact_envelope
+save_pkl   = args.pkl
 wc_lst = args.wc_list if args.wc_list is not None else []
 
 # Check if we have valid options
@@ -235,10 +243,12 @@ executor_args = {
 
     'retries': 5,
 
-    # use mid-range compression for chunks results. 9 is the default for work
+    # use fast compression for chunks results. 9 is the default for work
     # queue in coffea. Valid values are 0 (minimum compression, less memory
-    # usage) to 16 (maximum compression, more memory usage).
-    'compression': 9,
+    # usage) to 16 (maximum compression, more memory usage). The results are
+    # mostly the (packed) float arrays of the hists, for which levels above 2
+    # (LZ4 HC) cost a lot of cpu time for little gain.
+    'compression': args.compression,
 
     # automatically find an adequate resource allocation for tasks.
     # tasks are first tried using the maximum resources seen of previously ran
@@ -264,10 +274,15 @@ executor_args = {
     # 'memory': 10000, #MB
 
     # control the size of accumulation tasks. Results are
-    # accumulated in groups of size chunks_per_accum, keeping at
-    # most chunks_per_accum at the same time in memory per task.
-    'chunks_per_accum': 25,
-    'chunks_accum_in_mem': 2,
+    # accumulated on the workers in a tree reduction, in groups of
+    # size treereduction.
+    'treereduction': args.treereduction,
+
+    # memory ceiling (in MB) for the final accumulation on the manager,
+    # the partial sums above it are spilled to spill_dir (see
+    # topcoffea/modules/spill_accumulator.py). None for no ceiling.
+    'max_manager_memory': args.max_manager_memory,
+    'spill_dir': args.spill_dir,
 
     # terminate workers on which tasks have been running longer than average.
     # This is useful for temporary conditions on worker nodes where a task will
@@ -293,7 +308,7 @@ executor_args = {
 # Run the processor and get the output
 tstart = time.time()
 
-executor = processor.WorkQueueExecutor(**executor_args)
+executor = SpillingWorkQueueExecutor(**executor_args)
 runner = processor.Runner(executor, schema=NanoAODSchema, chunksize=chunksize, maxchunks=nchunks, skipbadfiles=False, xrootdtimeout=180)
 output = runner(flist, treename, processor_instance)
 
@@ -307,23 +322,23 @@ print("Filled %.0f bins, nonzero bins: %1.1f %%" % (nbins, 100*nfilled/nbins,))
 
 # Save the output
 if not os.path.isdir(outpath): os.system("mkdir -p %s"%outpath)
-out_pkl_file = os.path.join(outpath,outname+".pkl.gz")
-print(f"\nSaving output in {out_pkl_file}...")
-with gzip.open(out_pkl_file, "wb") as fout:
-  cloudpickle.dump(output, fout)
+out_ext = ".pkl.gz" if save_pkl else hist_store.HIST_STORE_EXT
+out_file = os.path.join(outpath,outname+out_ext)
+print(f"\nSaving output in {out_file}...")
+utils.dump_hists(out_file,output)
 print("Done!")
 
 # Run the data driven estimation, save the output
 if do_np:
   print("\nDoing the nonprompt estimation...")
-  out_pkl_file_name_np = os.path.join(outpath,outname+"_np.pkl.gz")
-  ddp = DataDrivenProducer(out_pkl_file,out_pkl_file_name_np)
-  print(f"Saving output in {out_pkl_file_name_np}...")
-  ddp.dumpToPickle()
-  print("Done!")
-  # Run the renorm fact envelope calculation
+  out_file_np = os.path.join(outpath,outname+"_np"+out_ext)
+  # Note: The output is already saved, so each hist of it is dropped once its np version is made (to not hold both in memory)
+  ddp = DataDrivenProducer(output,out_file_np,keepInput=False)
+  np_hists = ddp.getDataDrivenHistogram()
+  # Run the renorm fact envelope calculation (before saving, so the np hists only have to be written once)
   if do_renormfact_envelope:
-      print("\nDoing the renorm. fact. envelope calculation...")
-      dict_of_histos = utils.get_hist_from_pkl(out_pkl_file_name_np,allow_empty=False)
-      dict_of_histos_after_applying_envelope = get_renormfact_envelope(dict_of_histos)
-      utils.dump_to_pkl(out_pkl_file_name_np,dict_of_histos_after_applying_envelope)
+    print("\nDoing the renorm. fact. envelope calculation...")
+    np_hists = get_renormfact_envelope({k:v for k,v in np_hists.items() if v.values() != {}})
+  print(f"Saving output in {out_file_np}...")
+  utils.dump_hists(out_file_np,np_hists)
+  print("Done!")
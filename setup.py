@@ -12,6 +12,7 @@ setuptools.setup(
             "json/*",
             "data/scaleFactors/*.root",
             "data/fliprates/*.pkl.gz",
+            "data/fliprates/*.lookup",
             "data/fromTTH/fakerate/*.root",
             "data/fromTTH/lepSF/*/*/*.root",
             "data/fromTTH/lepSF/*/*/*/*.root",
@@ -21,6 +22,7 @@ setuptools.setup(
             "data/JEC/*.txt",
             "data/JER/*.txt",
             "data/btagSF/UL/*.pkl.gz",
+            "data/btagSF/UL/*.lookup",
             "data/btagSF/UL/*.csv",
             "data/btagSF/*.csv",
             "data/pileup/*.root",
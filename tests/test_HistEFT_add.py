@@ -238,3 +238,75 @@ def test_split_by_terms():
     integral = a.sum('type').values()[()].sum()
     c = a.split_by_terms(['x'], 'type')
     assert integral == c.integrate('type', [k[0] for k in c.values() if 'eft' not in k[0]]).values()[()].sum()
+
+def test_packed_add():
+    for h1, h2 in [(a_w, b_w), (b_w, a_w), (a_e, b_e), (b_e, a_e)]:
+        unpacked = h1 + h2 + h1
+        packed = h1.copy().pack() + h2 + h1
+        assert packed.is_packed()
+        for key in ['eft', 'non-eft']:
+            assert np.all(np.abs(packed.integrate('type', key)._sumw[()] - unpacked.integrate('type', key)._sumw[()]) < 1e-10)
+            vals_p, errs_p = packed.integrate('type', key).values(sumw2=True)[()]
+            vals_u, errs_u = unpacked.integrate('type', key).values(sumw2=True)[()]
+            assert np.all(np.abs(vals_p - vals_u) < 1e-10)
+            assert np.all(np.abs(errs_p - errs_u) < 1e-10)
+
+def test_packed_add_promote_errors():
+    # A non-EFT bin with sumw2, added to an EFT bin (with the same key) that has the w**2 coefficients
+    sm_w = a_e.copy(content=False)
+    sm_w.fill(type='eft', x=np.full(nevts,0.5), weight=np.full(nevts,weight_val))
+    for h1, h2 in [(sm_w, a_e), (a_e, sm_w)]:
+        unpacked = h1 + h2
+        packed = h1.copy().pack() + h2
+        assert packed.is_packed()
+        assert np.all(np.abs(packed.integrate('type', 'eft')._sumw[()] - unpacked.integrate('type', 'eft')._sumw[()]) < 1e-10)
+        assert np.all(np.abs(packed.integrate('type', 'eft')._sumw2[()] - unpacked.integrate('type', 'eft')._sumw2[()]) < 1e-10)
+        vals_p, errs_p = packed.integrate('type', 'eft').values(sumw2=True)[()]
+        vals_u, errs_u = unpacked.integrate('type', 'eft').values(sumw2=True)[()]
+        assert np.all(np.abs(vals_p - vals_u) < 1e-10)
+        assert np.all(np.abs(errs_p - errs_u) < 1e-10)
+
+def test_packed_sum_group_rebin():
+    packed = (a_e + b_e).pack()
+    unpacked = a_e + b_e
+    assert packed.sum('type').values()[()].sum() == unpacked.sum('type').values()[()].sum()
+    c_p = packed.group('type', hist.Cat('all', 'all'), {'all': ['eft', 'non-eft'], 'sm': ['non-eft']})
+    c_u = unpacked.group('type', hist.Cat('all', 'all'), {'all': ['eft', 'non-eft'], 'sm': ['non-eft']})
+    assert c_p.is_packed()
+    assert c_p.values().keys() == c_u.values().keys()
+    for key in c_u.values():
+        assert np.all(np.abs(c_p.values()[key] - c_u.values()[key]) < 1e-10)
+    r_p = packed.rebin('x', hist.Bin('x', 'x', [0, 1]))
+    assert np.all(np.abs(r_p.integrate('type', 'eft')._sumw2[()][1] - (weight_val**2)*sums_w2) < 1e-10)
+
+def test_packed_pickle_and_fill():
+    import pickle
+    packed = a_w.copy().pack()
+    unpickled = pickle.loads(pickle.dumps(packed))
+    assert unpickled.is_packed()
+    assert np.all(unpickled.integrate('type', 'eft')._sumw[()] == packed.integrate('type', 'eft')._sumw[()])
+    # Filling a new sparse bin after packing still works, and the new bin is picked up by the next operation
+    unpickled.fill(type='non-eft', x=np.full(nevts,0.5), weight=np.full(nevts,weight_val))
+    assert abs(unpickled.integrate('type','non-eft')._sumw[()][1] - nevts*weight_val) < 1e-10
+    assert unpickled.integrate('type','non-eft').is_packed()
+
+def test_fill_batch():
+    # Fill the same events into two sparse bins (with different weights) in one go, and compare with fill()
+    weights = np.stack([np.full(nevts,weight_val), np.full(nevts,2*weight_val)])
+    for eft_coeff, eft_err_coeff in [(None, None), (eft_fit_coeffs, eft_w2_coeffs)]:
+        h_fill = a_e.copy(content=False)
+        h_batch = a_e.copy(content=False)
+        for i, name in enumerate(['w1', 'w2']):
+            h_fill.fill(type=name, x=np.full(nevts,0.5), weight=weights[i], eft_coeff=eft_coeff, eft_err_coeff=eft_err_coeff)
+        h_batch.fill_batch(
+            [{'type': 'w1'}, {'type': 'w2'}],
+            key_idx=np.repeat([0, 1], nevts),
+            event_idx=np.tile(np.arange(nevts), 2),
+            weight=weights.flatten(),
+            eft_coeff=eft_coeff,
+            eft_err_coeff=eft_err_coeff,
+            x=np.full(nevts,0.5),
+        )
+        for name in ['w1', 'w2']:
+            assert np.all(np.abs(h_batch.integrate('type',name)._sumw[()] - h_fill.integrate('type',name)._sumw[()]) < 1e-8)
+            assert np.all(np.abs(h_batch.integrate('type',name)._sumw2[()] - h_fill.integrate('type',name)._sumw2[()]) < 1e-8)
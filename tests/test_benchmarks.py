@@ -0,0 +1,25 @@
+import json
+import subprocess
+
+def test_bench_histeft(tmp_path):
+    outname = str(tmp_path / "bench.json")
+    args = [
+        "python",
+        "analysis/benchmarks/bench_histeft.py",
+        "-o", outname,
+        "-r", "1",
+        "-k", "histeft.add", "histeft.values", "calc_eft_weights",
+        "--n-wc", "2",
+        "--n-channels", "2",
+        "--n-systs", "2",
+        "--n-events", "100",
+    ]
+    subprocess.run(args,check=True)
+
+    with open(outname) as f:
+        out = json.load(f)
+    assert set(out["results"].keys()) == {"histeft.add","histeft.values_sm","histeft.values_wc","eft_helper.calc_eft_weights","eft_helper.calc_eft_weights_batch"}
+    for res in out["results"].values():
+        assert res["min_s"] <= res["median_s"]
+        assert res["peak_mem_mb"] >= 0
+    assert out["config"]["n_wc"] == 2
@@ -20,11 +20,11 @@ def test_topcoffea():
     # Run TopCoffea
     subprocess.run(args)
 
-    assert(exists('analysis/topEFT/histos/output_check_yields.pkl.gz'))
+    assert(exists('analysis/topEFT/histos/output_check_yields.hists.zip'))
 
 
 def test_nonprompt():
-    a=dataDrivenEstimation.DataDrivenProducer('analysis/topEFT/histos/output_check_yields.pkl.gz', 'analysis/topEFT/histos/output_check_yields_nonprompt')
+    a=dataDrivenEstimation.DataDrivenProducer('analysis/topEFT/histos/output_check_yields.hists.zip', 'analysis/topEFT/histos/output_check_yields_nonprompt')
     a.dumpToPickle() # Do we want to write this file when testing in CI? Maybe if we ever save the CI artifacts
 
     assert(exists('analysis/topEFT/histos/output_check_yields_nonprompt.pkl.gz'))
@@ -0,0 +1,90 @@
+import gzip
+import cloudpickle
+import numpy as np
+from coffea import hist
+from topcoffea.modules.HistEFT import HistEFT
+from topcoffea.modules.utils import get_hist_from_pkl
+import topcoffea.modules.hist_store as hist_store
+
+nevts = 100
+rng = np.random.default_rng()
+wc_names_lst = ["ctG","ctZ","ctW"]
+ncoeffs = 10
+
+samples = ["ttHUL17","ttllUL17","dataUL17"]
+channels = ["2lss_p_4j","3l_sfz_2j"]
+systs = ["nominal","ISRUp"]
+
+def make_hists():
+    h_eft = HistEFT("Events", wc_names_lst,
+                    hist.Cat("sample","sample"),
+                    hist.Cat("channel","channel"),
+                    hist.Cat("systematic","systematic"),
+                    hist.Bin("x","x",4,0,1))
+    h_eft.pack()
+    h_sm = hist.Hist("Events", hist.Cat("sample","sample"), hist.Bin("y","y",3,0,1))
+    for s in samples:
+        for ch in channels:
+            for syst in systs:
+                coeffs = None if s.startswith("data") else rng.normal(0.3,0.5,(nevts,ncoeffs))
+                h_eft.fill(sample=s, channel=ch, systematic=syst, x=rng.uniform(0,1,nevts), eft_coeff=coeffs, weight=np.ones(nevts))
+        h_sm.fill(sample=s, y=rng.uniform(0,1,nevts), weight=rng.uniform(0,1,nevts))
+    return {"x": h_eft, "y": h_sm, "empty": h_sm.copy(content=False), "other": {"a": 1}}
+
+def same_content(h1,h2):
+    v1 = h1.values(sumw2=True)
+    v2 = h2.values(sumw2=True)
+    if v1.keys() != v2.keys():
+        return False
+    for k in v1:
+        if not np.allclose(v1[k][0],v2[k][0]):
+            return False
+        if (v1[k][1] is None) != (v2[k][1] is None):
+            return False
+        if v1[k][1] is not None and not np.allclose(v1[k][1],v2[k][1]):
+            return False
+    return True
+
+def test_roundtrip(tmp_path):
+    hists = make_hists()
+    fpath = hist_store.dump_hists(str(tmp_path / "out"),hists)
+    assert fpath.endswith(hist_store.HIST_STORE_EXT)
+    assert hist_store.is_hist_store(fpath)
+
+    with hist_store.HistStoreReader(fpath) as reader:
+        assert set(reader.keys()) == set(hists.keys())
+        assert reader.identifiers("x","channel") == channels
+        for name in ["x","y","empty"]:
+            h = reader[name]
+            assert type(h) is type(hists[name])
+            assert same_content(h,hists[name])
+        assert reader["x"]._wcnames == wc_names_lst
+        assert reader["other"] == hists["other"]
+
+def test_slice(tmp_path):
+    hists = make_hists()
+    fpath = hist_store.dump_hists(str(tmp_path / "out"),hists)
+    with hist_store.HistStoreReader(fpath) as reader:
+        h = reader.get("x",channel="2lss_p_4j",systematic=["ISRUp"])
+        assert [x.name for x in h.identifiers("channel")] == ["2lss_p_4j"]
+        assert [x.name for x in h.identifiers("systematic")] == ["ISRUp"]
+        assert [x.name for x in h.identifiers("sample")] == sorted(samples)
+        assert same_content(h,hist_store.select_bins(hists["x"],channel="2lss_p_4j",systematic="ISRUp"))
+
+        # The histograms can still be used as usual
+        ref = hists["x"].integrate("channel","2lss_p_4j").integrate("systematic","ISRUp")
+        assert same_content(h.integrate("channel").integrate("systematic"),ref)
+
+def test_get_hist_from_pkl(tmp_path):
+    # Both the hist store and the legacy pkl files give the same dict of hists
+    hists = make_hists()
+    del hists["other"]
+    fpath = hist_store.dump_hists(str(tmp_path / "out"),hists)
+    pkl_path = str(tmp_path / "out.pkl.gz")
+    with gzip.open(pkl_path,"wb") as fout:
+        cloudpickle.dump(hists,fout)
+    for path in [fpath,pkl_path]:
+        h_dict = get_hist_from_pkl(path,allow_empty=False,hist_lst=["x","empty"],sample="ttHUL17")
+        assert list(h_dict.keys()) == ["x"]
+        assert [x.name for x in h_dict["x"].identifiers("sample")] == ["ttHUL17"]
+        assert same_content(h_dict["x"],hist_store.select_bins(hists["x"],sample="ttHUL17"))
@@ -1,9 +1,12 @@
+import pytest
 import numpy as np
 import awkward as ak
 from coffea import hist
 from topcoffea.modules.HistEFT import HistEFT
 from topcoffea.modules.WCPoint import WCPoint
 from topcoffea.modules.WCFit import WCFit
+import topcoffea.modules.eft_helper as efth
+from topcoffea.modules.datacard_tools import get_decomposition_matrices
 
 def fval(xvals = [], svals = []):
     # Ordering convention for the structure constants:
@@ -259,6 +262,53 @@ def test_stats():
     print(f'Passed Checks: {all_chks}/{units}')
     assert (all_chks == units)
 
+########################### eft_helper unit tests ###########################
+
+def test_eft_batch():
+    rng = np.random.default_rng(42)
+    n_wc = 3
+    q_coeffs = rng.normal(0.0, 1.0, (4, 2, efth.n_quad_terms(n_wc)))
+    w2_coeffs = efth.calc_w2_coeffs(q_coeffs)
+    wc_points = rng.normal(0.0, 2.0, (5, n_wc))
+
+    weights = efth.calc_eft_weights_batch(q_coeffs, wc_points)
+    w2 = efth.calc_eft_w2_batch(w2_coeffs, wc_points)
+    assert weights.shape == (5, 4, 2)
+    assert w2.shape == (5, 4, 2)
+    for i, pt in enumerate(wc_points):
+        assert np.allclose(weights[i], efth.calc_eft_weights(q_coeffs, pt))
+        assert np.allclose(w2[i], efth.calc_eft_w2(w2_coeffs, pt))
+
+    # A single (1D) WC point is treated as a batch of one point
+    assert np.allclose(efth.calc_eft_weights_batch(q_coeffs, wc_points[0])[0], weights[0])
+
+def test_decomposition_matrices():
+    rng = np.random.default_rng(42)
+    wcnames = ("ctG","ctZ","ctW","cpt")
+    n_wc = len(wcnames)
+    q_coeffs = rng.normal(0.0, 1.0, (3, efth.n_quad_terms(n_wc)))
+    w2_coeffs = efth.calc_w2_coeffs(q_coeffs)
+    names, w_mat, w2_mat = get_decomposition_matrices(wcnames, ("ctZ","ctG"))
+    assert names == ("sm", "lin_ctZ", "quad_ctZ", "quad_mixed_ctZ_ctG", "lin_ctG", "quad_ctG")
+
+    def at(**vals):
+        pt = np.array([vals.get(wc, 0.0) for wc in wcnames])
+        return efth.calc_eft_weights(q_coeffs, pt), efth.calc_eft_w2(w2_coeffs, pt)
+
+    expected = {
+        "sm": at(),
+        "lin_ctZ": at(ctZ=1.0),
+        "quad_ctZ": tuple(0.5*(a - 2*b + c) for a, b, c in zip(at(ctZ=2.0), at(ctZ=1.0), at())),
+        "quad_mixed_ctZ_ctG": at(ctZ=1.0, ctG=1.0),
+    }
+    for i, name in enumerate(names):
+        if name not in expected: continue
+        assert np.allclose(q_coeffs @ w_mat[i], expected[name][0])
+        assert np.allclose(w2_coeffs @ w2_mat[i], expected[name][1])
+
+    # The quad piece is exactly the ctZ*ctZ coefficient
+    assert np.array_equal(q_coeffs @ w_mat[2], q_coeffs[:, efth.quadratic_factors_to_term(np.array([2, 2]))])
+
 ########################### HistEFT unit tests ###########################
 
 def test_histeft():
@@ -498,3 +548,330 @@ def test_histeft():
 
     print(f'Passed Checks: {all_chks}/{units}')
     assert (all_chks == units)
+
+########################### Trigger selection unit tests ###########################
+
+def test_trg_masks():
+    from topcoffea.modules.selection import dataset_dict, exclude_dict, passesTrgInLst, trgPassNoOverlap
+
+    # Some fake events with random decisions for the 2017 triggers (leaving one of them out of the HLT branches)
+    rng = np.random.default_rng(123)
+    nevents = 1000
+    trg_names = sorted(set(sum(dataset_dict["2017"].values(),[])))
+    hlt = {trg_name: rng.random(nevents) < 0.1 for trg_name in trg_names[1:]}
+    events = ak.zip({"HLT": ak.zip(hlt)},depth_limit=1)
+
+    def passes_ref(trg_lst):
+        tpass = np.zeros(nevents,dtype=bool)
+        for trg_name in set(trg_lst) & set(hlt.keys()):
+            tpass = tpass | hlt[trg_name]
+        return tpass
+
+    assert np.array_equal(passesTrgInLst(events,dataset_dict["2017"]["MuonEG"]),passes_ref(dataset_dict["2017"]["MuonEG"]))
+    assert np.array_equal(trgPassNoOverlap(events,False,None,"2017"),passes_ref(sum(dataset_dict["2017"].values(),[])))
+    for dataset in dataset_dict["2017"].keys():
+        ref = passes_ref(dataset_dict["2017"][dataset]) & ~passes_ref(exclude_dict["2017"][dataset])
+        assert np.array_equal(trgPassNoOverlap(events,True,dataset,"2017"),ref)
+
+    with pytest.raises(Exception, match="No triggers"):
+        passesTrgInLst(events,["not_a_trigger"])
+
+########################### Renorm/fact envelope unit tests ###########################
+
+def test_renormfact_envelope():
+    from topcoffea.modules.get_renormfact_envelope import get_renormfact_envelope, RENORMFACT_VAR_LST
+
+    rng = np.random.default_rng(42)
+    h = HistEFT("Events", ["ctG"], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Cat("systematic", "systematic"), hist.Bin("x", "x", 5, 0, 1))
+    for syst in ["nominal"] + RENORMFACT_VAR_LST:
+        for ch in ["2lss", "3l"]:
+            h.fill(sample="ttH", channel=ch, systematic=syst, x=rng.random(100), eft_coeff=rng.random((100,3)))
+            h.fill(sample="ttW", channel=ch, systematic=syst, x=rng.random(100), weight=rng.random(100))
+
+    # The expected envelope, bin by bin (for EFT bins the variation is chosen from the SM part)
+    expected = {}
+    for sample in ["ttH", "ttW"]:
+        for ch in ["2lss", "3l"]:
+            arrs = np.stack([h._sumw[(hist.StringBin(sample), hist.StringBin(ch), hist.StringBin(syst))] for syst in RENORMFACT_VAR_LST])
+            sm = arrs[...,0] if arrs.ndim == 3 else arrs
+            bins = np.arange(arrs.shape[1])
+            expected[(sample, ch, "renormfactUp")] = arrs[np.argmax(sm, axis=0), bins]
+            expected[(sample, ch, "renormfactDown")] = arrs[np.argmin(sm, axis=0), bins]
+
+    out = get_renormfact_envelope({"x": h})["x"]
+    assert (set(out.identifiers("systematic")) == {hist.StringBin(s) for s in ["nominal", "renormfactUp", "renormfactDown"]})
+    for (sample, ch, syst), arr in expected.items():
+        assert np.array_equal(out._sumw[(hist.StringBin(sample), hist.StringBin(ch), hist.StringBin(syst))], arr)
+
+########################### Yield tools unit tests ###########################
+
+def test_get_yields():
+    from topcoffea.modules.YieldTools import YieldTools
+    yt = YieldTools()
+
+    rng = np.random.default_rng(7)
+    h = HistEFT("Events", ["ctG", "ctW"], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Cat("systematic", "systematic"), hist.Cat("appl", "appl"), hist.Bin("njets", "njets", 4, 0, 4))
+    for ch in ["3l_onZ_1b", "4l"]:
+        for syst in ["nominal", "btagUp"]:
+            for appl in ["isSR_3l", "isAR_3l"]:
+                x = rng.random(100)*6
+                h.fill(sample="ttH", channel=ch, systematic=syst, appl=appl, njets=x, eft_coeff=rng.random((100,6)), eft_err_coeff=rng.random((100,15)))
+                h.fill(sample="ttW", channel=ch, systematic=syst, appl=appl, njets=x, weight=rng.random(100))
+
+    cat_dict = {"3l": {"channel": "3l_onZ_1b", "appl": "isSR_3l"}, "3l_4l": {"channel": ["3l_onZ_1b", "4l"], "appl": "isSR_3l"}}
+    wc_pts = [{}, {"ctG": 1.2, "ctW": -0.4}]
+    ylds = yt.get_yields(h, cat_dict, wc_pts=wc_pts, overflow_str="over")
+
+    # Compare to integrating the hist for each category and point
+    for cat, cuts_dict in cat_dict.items():
+        h_cat = yt.integrate_out_cats(h, cuts_dict).integrate("systematic", "nominal")
+        for i, wc_pt in enumerate(wc_pts):
+            h_cat.set_wilson_coefficients(**wc_pt)
+            for sample in ["ttH", "ttW"]:
+                v, e = yt.get_yield(h_cat, sample, overflow_str="over")
+                assert np.isclose(ylds[sample][cat][0][i], v)
+                assert np.isclose(np.sqrt(ylds[sample][cat][1][i]), e)
+
+def test_wcfit_batch():
+    rng = np.random.default_rng(11)
+    wc_names = ["ctG", "ctW"]
+    pts = [WCPoint(dict(zip(wc_names, rng.normal(size=2))), wgt=rng.random()) for _ in range(20)]
+    chk_pts = [WCPoint(dict(zip(wc_names, rng.normal(size=2)))) for _ in range(4)]
+
+    # Fitting several sets of weights at once is the same as fitting them one by one
+    wgts = np.array([[pt.wgt, 3*pt.wgt - 1] for pt in pts])
+    fits = WCFit.FitMany(pts, wgts, tags=["a", "b"])
+    for i, fit in enumerate(fits):
+        fit_ref = WCFit([WCPoint(dict(pt.inputs), wgt=w) for pt, w in zip(pts, wgts[:,i])])
+        assert np.allclose(fit.GetCoefficients(), fit_ref.GetCoefficients())
+        assert np.allclose(fit.GetErrorCoefficients(), fit_ref.GetErrorCoefficients())
+
+        # Evaluating many points at once is the same as evaluating them one by one
+        assert np.allclose(fit.EvalPoints(chk_pts), [fit_ref.EvalPoint(pt) for pt in chk_pts])
+        assert np.allclose(fit.EvalPointsError(chk_pts), [fit_ref.EvalPointError(pt) for pt in chk_pts])
+
+    # The error scales linearly (i.e. the error coefficients scale with the square)
+    fit = fits[0]
+    err = fit.EvalPointError(chk_pts[0])
+    fit.Scale(2.5)
+    assert np.isclose(fit.EvalPointError(chk_pts[0]), 2.5*err)
+
+########################### Quad fit tools unit tests ###########################
+
+def test_quad_fit():
+    import topcoffea.modules.QuadFitTools as qft
+
+    rng = np.random.default_rng(5)
+    wc_lst = ["ctG", "ctW", "cpt"]
+    fit_dicts = {proc: dict(zip(qft.get_quad_keys(wc_lst), rng.random(10) + 0.1)) for proc in ["ttH", "ttW"]}
+    quad_fit = qft.QuadFit.from_fit_dicts(fit_dicts)
+
+    # Evaluating all of the points and fits at once is the same as evaluating them one by one
+    wc_pts = rng.normal(size=(6,3))
+    yields = quad_fit.eval(wc_pts)
+    for i, fit_dict in enumerate(fit_dicts.values()):
+        for j, wc_pt in enumerate(wc_pts):
+            assert np.isclose(yields[i,j], qft.eval_fit(fit_dict, dict(zip(wc_lst, wc_pt))))
+
+    # The crossings are where the 1d fits are equal to the threshold
+    threshold = 2.0
+    crossings = quad_fit.find_crossings(threshold)
+    params_1d = quad_fit.get_1d_fits()
+    assert crossings.shape == (2,3,2)
+    for i, fit_dict in enumerate(fit_dicts.values()):
+        for j, wc in enumerate(wc_lst):
+            assert np.allclose(params_1d[i,j], qft.get_1d_fit(fit_dict, wc))
+            assert np.allclose(qft.eval_1d_quad(params_1d[i,j], crossings[i,j]), threshold)
+
+########################### Data driven estimation unit tests ###########################
+
+def test_data_driven_producer():
+    from topcoffea.modules.dataDrivenEstimation import DataDrivenProducer
+    from topcoffea.modules.GetValuesFromJsons import get_lumi
+
+    rng = np.random.default_rng(3)
+    h = HistEFT("Events", ["ctG"], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Cat("systematic", "systematic"), hist.Cat("appl", "appl"), hist.Bin("x", "x", 4, 0, 1))
+    for syst in ["nominal", "FFUp", "btagUp"]:
+        for appl in ["isSR_2lSS", "isAR_2lSS", "isAR_2lSS_OS"]:
+            h.fill(sample="dataUL17", channel="2lss", systematic=syst, appl=appl, x=rng.random(50), weight=rng.random(50))
+            h.fill(sample="ttHJet_privateUL17", channel="2lss", systematic=syst, appl=appl, x=rng.random(50), eft_coeff=rng.random((50,3)))
+            h.fill(sample="ttbarUL17", channel="2lss", systematic=syst, appl=appl, x=rng.random(50), weight=rng.random(50))
+    h_in = {"x": h}
+    h_orig = h.copy()
+
+    out = DataDrivenProducer(h_in, "", keepInput=False).getDataDrivenHistogram()["x"]
+    assert h_in == {}
+    assert all(np.array_equal(h._sumw[k], h_orig._sumw[k]) for k in h._sumw)
+
+    def get(hst, sample, syst, appl=None):
+        key = (sample, "2lss", syst) + (() if appl is None else (appl,))
+        return hst._sumw.get(tuple(hist.StringBin(x) for x in key))
+
+    lumi = 1000.0*get_lumi("2017")
+    assert {x.name for x in out.identifiers("sample")} == {"dataUL17", "ttHJet_privateUL17", "ttbarUL17", "nonpromptUL17", "flipsUL17"}
+    for syst in ["nominal", "FFUp", "btagUp"]:
+        # The SR bins are kept as they are
+        for sample in ["dataUL17", "ttHJet_privateUL17", "ttbarUL17"]:
+            assert np.allclose(get(out, sample, syst), get(h, sample, syst, "isSR_2lSS"))
+        # Only the nominal and FF variations of the prompt MC are subtracted (at the SM)
+        np_expected = get(h, "dataUL17", syst, "isAR_2lSS")/lumi
+        if syst != "btagUp":
+            np_expected = np_expected - get(h, "ttHJet_privateUL17", syst, "isAR_2lSS")[:,0]
+        assert np.allclose(get(out, "nonpromptUL17", syst), np_expected)
+    # Only the nominal flips are kept
+    assert np.allclose(get(out, "flipsUL17", "nominal"), get(h, "dataUL17", "nominal", "isAR_2lSS_OS")/lumi)
+    assert get(out, "flipsUL17", "FFUp") is None
+
+def test_data_driven_producer_2d():
+    # Two dense axes, with EFT and non-EFT bins that end up in the same output bins
+    from topcoffea.modules.dataDrivenEstimation import DataDrivenProducer
+    from topcoffea.modules.GetValuesFromJsons import get_lumi
+
+    rng = np.random.default_rng(4)
+    h = HistEFT("Events", ["ctG"], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Cat("systematic", "systematic"), hist.Cat("appl", "appl"), hist.Bin("x", "x", 3, 0, 1), hist.Bin("y", "y", 2, 0, 1))
+    for syst in ["nominal", "FFUp", "btagUp"]:
+        for appl in ["isSR_2lSS", "isSR_3l", "isAR_2lSS", "isAR_2lSS_OS"]:
+            x, y = rng.random(50), rng.random(50)
+            h.fill(sample="dataUL17", channel="2lss", systematic=syst, appl=appl, x=x, y=y)
+            h.fill(sample="TTTo2L2Nu_centralUL17", channel="2lss", systematic=syst, appl=appl, x=x, y=y, weight=rng.random(50))
+            if appl == "isSR_3l":
+                h.fill(sample="ttHJet_privateUL17", channel="2lss", systematic=syst, appl=appl, x=x, y=y, weight=rng.random(50))
+            else:
+                h.fill(sample="ttHJet_privateUL17", channel="2lss", systematic=syst, appl=appl, x=x, y=y, eft_coeff=rng.random((50,3)), eft_err_coeff=rng.random((50,5)))
+
+    out = DataDrivenProducer({"x": h}, "").getDataDrivenHistogram()["x"]
+
+    def get(hst, sample, syst, appl=None, sumw2=False):
+        key = (sample, "2lss", syst) + (() if appl is None else (appl,))
+        return (hst._sumw2 if sumw2 else hst._sumw).get(tuple(hist.StringBin(x) for x in key))
+
+    lumi = 1000.0*get_lumi("2017")
+    for syst in ["nominal", "FFUp", "btagUp"]:
+        # The non-EFT bins of the SR are added into the SM coefficient of the EFT ones
+        sr = get(h, "ttHJet_privateUL17", syst, "isSR_2lSS").copy()
+        sr[...,0] += get(h, "ttHJet_privateUL17", syst, "isSR_3l")
+        assert np.allclose(get(out, "ttHJet_privateUL17", syst), sr)
+        sr2 = get(h, "ttHJet_privateUL17", syst, "isSR_2lSS", sumw2=True).copy()
+        sr2[...,0] += get(h, "ttHJet_privateUL17", syst, "isSR_3l", sumw2=True)
+        assert np.allclose(get(out, "ttHJet_privateUL17", syst, sumw2=True), sr2)
+        for sample in ["dataUL17", "TTTo2L2Nu_centralUL17"]:
+            assert np.allclose(get(out, sample, syst), get(h, sample, syst, "isSR_2lSS") + get(h, sample, syst, "isSR_3l"))
+        # Only the SM part of the EFT prompt MC is subtracted
+        np_expected = get(h, "dataUL17", syst, "isAR_2lSS")/lumi
+        if syst != "btagUp":
+            np_expected = np_expected - get(h, "ttHJet_privateUL17", syst, "isAR_2lSS")[...,0] - get(h, "TTTo2L2Nu_centralUL17", syst, "isAR_2lSS")
+        assert get(out, "nonpromptUL17", syst).shape == h._dense_shape
+        assert np.allclose(get(out, "nonpromptUL17", syst), np_expected)
+    assert np.allclose(get(out, "flipsUL17", "nominal"), get(h, "dataUL17", "nominal", "isAR_2lSS_OS")/lumi)
+
+########################### Spilling accumulator unit tests ###########################
+
+def test_spilling_accumulator(tmp_path):
+    from coffea import processor
+    from topcoffea.modules.spill_accumulator import SpillingAccumulator
+
+    rng = np.random.default_rng(5)
+    def make_output():
+        h = HistEFT("Events", ["ctG"], hist.Cat("sample", "sample"), hist.Bin("x", "x", 10, 0, 1))
+        h.fill(sample=str(rng.integers(3)), x=rng.random(20), eft_coeff=rng.random((20,3)))
+        return processor.dict_accumulator({"x": h, "n": processor.defaultdict_accumulator(int, {"a": 1})})
+    outputs = [make_output() for _ in range(10)]
+    expected = processor.accumulate([o.identity() for o in outputs[:1]] + [o for o in outputs])
+
+    # A tiny ceiling, so that every output gets spilled
+    accum = {"out": SpillingAccumulator(1e-4, str(tmp_path)), "processed": set()}
+    for i, o in enumerate(outputs):
+        accum = processor.accumulate([{"out": o, "processed": {i}}], accum)
+    assert accum["out"].nspills == len(outputs)
+    assert accum["processed"] == set(range(len(outputs)))
+
+    out = accum["out"].result()
+    assert list(tmp_path.iterdir()) == []
+    assert out["n"]["a"] == len(outputs)
+    assert set(out["x"]._sumw.keys()) == set(expected["x"]._sumw.keys())
+    for key, arr in expected["x"]._sumw.items():
+        assert np.allclose(out["x"]._sumw[key], arr)
+
+########################### Hist projection unit tests ###########################
+
+def test_hist_projection():
+    from topcoffea.modules.hist_projection import HistProjection
+
+    rng = np.random.default_rng(5)
+    h = HistEFT("Events", ["ctG"], hist.Cat("sample", "sample"), hist.Cat("channel", "channel"), hist.Cat("systematic", "systematic"), hist.Cat("appl", "appl"), hist.Bin("x", "x", 4, 0, 1))
+    for ch in ["2lss_p", "3l_onZ"]:
+        for syst in ["nominal", "btagUp"]:
+            for appl in ["isSR", "isAR"]:
+                h.fill(sample="ttH", channel=ch, systematic=syst, appl=appl, x=rng.random(50)*1.4-0.2, eft_coeff=rng.random((50,3)), eft_err_coeff=rng.random((50,5)))
+                h.fill(sample="ttW", channel=ch, systematic=syst, appl=appl, x=rng.random(50)*1.4-0.2, weight=rng.random(50))
+    h.fill(sample="data", channel="2lss_p", systematic="nominal", appl="isSR", x=rng.random(50))
+    h.set_wilson_coefficients(ctG=0.7)
+
+    proj = HistProjection(h, axes=("sample", "channel", "systematic"), select=lambda ids: ids["appl"] == "isSR")
+    h_sr = h.integrate("appl", "isSR")
+    assert proj.identifiers("sample") == ["data", "ttH", "ttW"]
+    assert proj.integrate("systematic", "btagUp").identifiers("sample") == ["ttH", "ttW"]
+
+    # Integrate, group and scale, the same as with the hist
+    scale = {"ttH": 2.0, "ttW": 0.5}
+    p = proj.remove(["data"], "sample")
+    p.scale(scale, axis="sample")
+    p = p.integrate("channel", ["2lss_p", "3l_onZ"]).group("sample", {"sig": ["ttH"], "bkg": "ttW", "none": []})
+    hh = h_sr.remove(["data"], "sample")
+    hh.scale(scale, axis="sample")
+    hh = hh.integrate("channel", ["2lss_p", "3l_onZ"]).group("sample", hist.Cat("sample", "sample"), {"sig": ["ttH"], "bkg": ["ttW"], "none": []})
+    for overflow in ["none", "all"]:
+        vals, vals_hist = p.values(sumw2=True, overflow=overflow), hh.values(sumw2=True, overflow=overflow)
+        assert vals.keys() == vals_hist.keys()
+        for k in vals:
+            assert np.allclose(vals[k][0], vals_hist[k][0]) and np.allclose(vals[k][1], vals_hist[k][1])
+    nom = p.integrate("systematic", "nominal").sum("sample").values()[()]
+    assert np.allclose(nom, hh.integrate("systematic", "nominal").sum("sample").values()[()])
+
+    # And back to a regular hist
+    h_out = p.integrate("systematic", "nominal").to_hist()
+    assert [ax.name for ax in h_out.axes()] == ["sample", "x"]
+    vals_out = h_out.values(sumw2=True, overflow="allnan")
+    vals_hist = hh.integrate("systematic", "nominal").values(sumw2=True, overflow="allnan")
+    assert vals_out.keys() == vals_hist.keys()
+    for k in vals_out:
+        assert np.allclose(vals_out[k][0], vals_hist[k][0]) and np.allclose(vals_out[k][1], vals_hist[k][1])
+
+########################### Render unit tests ###########################
+
+def test_render_specs(tmp_path):
+    import os
+    import matplotlib.pyplot as plt
+    import topcoffea.plotter.render as render
+
+    rng = np.random.default_rng(7)
+    h = HistEFT("Events", ["ctG"], hist.Cat("process", "process", sorting="identity"), hist.Bin("x", "x", 4, 0, 1))
+    for proc in ["ttW", "ttH", "data"]:
+        h.fill(process=proc, x=rng.random(50)*1.4-0.2, eft_coeff=rng.random((50,3)), eft_err_coeff=rng.random((50,5)))
+    h.set_wilson_coefficients(ctG=0.5)
+
+    # The hist is rebuilt from its arrays, with its identifiers in the same order
+    h_out = render.hist_from_spec(render.hist_to_spec(h))
+    assert [ax.name for ax in h_out.axes()] == ["process", "x"]
+    assert [str(i) for i in h_out.identifiers("process")] == ["ttW", "ttH", "data"]
+    assert np.array_equal(h_out.axis("x").edges(), h.axis("x").edges())
+    vals, vals_out = h.values(sumw2=True, overflow="allnan"), h_out.values(sumw2=True, overflow="allnan")
+    assert vals.keys() == vals_out.keys()
+    for k in vals:
+        assert np.allclose(vals[k][0], vals_out[k][0], equal_nan=True) and np.allclose(vals[k][1], vals_out[k][1], equal_nan=True)
+
+    # Render in the parent and in a pool, the figures are saved where the specs say
+    def draw(histo, title):
+        fig, ax = plt.subplots(1, 1)
+        hist.plot1d(histo, overlay="process", ax=ax)
+        ax.set_title(title)
+        return fig
+    render.register_renderer("test_fig", draw)
+    with pytest.raises(Exception):
+        render.make_spec("not_a_renderer", str(tmp_path/"x.png"))
+    for nworkers in [1, 2]:
+        specs = [render.make_spec("test_fig", str(tmp_path/f"{nworkers}_{i}.png"), rc_params={"font.size": 8}, histo=render.hist_to_spec(h), title=str(i)) for i in range(3)]
+        paths = render.render_specs(specs, nworkers)
+        assert paths == [str(tmp_path/f"{nworkers}_{i}.png") for i in range(3)]
+        assert all(os.path.getsize(p) > 0 for p in paths)
+        assert render.get_dirs(paths) == [str(tmp_path)]
@@ -1,8 +1,10 @@
 import os
 import subprocess
+import pytest
 
 from topcoffea.modules.paths import topcoffea_path
 from topcoffea.modules.utils import get_files
+import topcoffea.modules.GetValuesFromJsons as gv
 
 pjoin = os.path.join
 
@@ -109,3 +111,123 @@ def test_get_files():
 
 if __name__ == "__main__":
     test_get_files()
+
+def test_get_values_from_jsons():
+    gv.reload_jsons()
+    lumi = gv.get_lumi("2017")
+    assert (isinstance(lumi,float) and lumi > 0)
+
+    # The files are only read once, the same (read only) objects are returned afterwards
+    assert (gv.get_param("chargeflip_sf_dict") is gv.get_param("chargeflip_sf_dict"))
+    with pytest.raises(TypeError):
+        gv.get_param("chargeflip_sf_dict")["new_key"] = 1.0
+    with pytest.raises(AttributeError):
+        gv.get_param("conv_samples").append("new_sample")
+
+    # The parsed syst pairs are new lists, so changing one does not change the cache
+    down,up = gv.get_syst("lumi")
+    assert (down < 1 < up)
+    gv.get_syst("lumi").append(0)
+    assert (len(gv.get_syst("lumi")) == 2)
+
+    # Reloading drops the cached contents
+    old_params = gv.get_param("chargeflip_sf_dict")
+    gv.reload_jsons()
+    assert (gv.get_param("chargeflip_sf_dict") is not old_params)
+    assert (dict(gv.get_param("chargeflip_sf_dict")) == dict(old_params))
+
+    with pytest.raises(Exception):
+        gv.get_syst("not_a_syst")
+
+def test_lazy_sf_evaluator():
+    import numpy as np
+    from coffea import lookup_tools
+    from topcoffea.modules.corrections import LazyEvaluator, lepSFWeightSets
+
+    evaluator = LazyEvaluator(lepSFWeightSets)
+    assert ("MuonRecoSF_2018" in evaluator)
+    assert (len(evaluator._lookups) == 0)
+
+    # Only the weight sets from the same file are loaded, and they agree with an extractor reading everything
+    eta = np.array([0.3,1.5,2.2])
+    pt = np.array([20.,45.,100.])
+    sf = evaluator["MuonRecoSF_2018"](eta,pt)
+    assert (set(evaluator._lookups.keys()) == {"MuonRecoSF_2018","MuonRecoSF_2018_er"})
+    ext = lookup_tools.extractor()
+    ext.add_weight_sets([x for x in lepSFWeightSets if x.split()[0].startswith("MuonRecoSF_2018")])
+    ext.finalize()
+    assert np.array_equal(sf,ext.make_evaluator()["MuonRecoSF_2018"](eta,pt))
+
+    evaluator.clear()
+    assert (len(evaluator._lookups) == 0)
+    with pytest.raises(KeyError):
+        evaluator["not_a_weight_set"]
+
+def test_binary_lookup(tmp_path):
+    import gzip
+    import pickle
+    import numpy as np
+    from coffea import lookup_tools
+    import topcoffea.modules.binary_lookup as binary_lookup
+
+    # Round trip
+    values = np.arange(6.).reshape(2,3)
+    edges = [np.array([0.,1.,2.]), np.array([0.,0.5,1.,2.])]
+    fpath = binary_lookup.dump_lookup(str(tmp_path/("test"+binary_lookup.LOOKUP_EXT)),values,edges)
+    values_in, edges_in = binary_lookup.load_lookup(fpath)
+    assert np.array_equal(values_in,values)
+    assert all(np.array_equal(a,b) for a,b in zip(edges_in,edges))
+    with pytest.raises(ValueError):
+        binary_lookup.dump_lookup(fpath,values,edges[:1])
+
+    # The lookup file is only read if it was made from the current source file
+    from topcoffea.modules.corrections import LoadBinaryLookup
+    source = tmp_path/"test.pkl.gz"
+    source.write_bytes(b"some histogram")
+    assert not binary_lookup.is_up_to_date(fpath,str(source)) # No source digest stored
+    assert LoadBinaryLookup(fpath,str(source)) is None
+    binary_lookup.dump_lookup(fpath,values,edges,source=str(source))
+    assert binary_lookup.is_up_to_date(fpath,str(source))
+    assert np.array_equal(LoadBinaryLookup(fpath,str(source))._values,values)
+    source.write_bytes(b"some other histogram")
+    assert not binary_lookup.is_up_to_date(fpath,str(source))
+    assert LoadBinaryLookup(fpath,str(source)) is None
+    assert LoadBinaryLookup(str(tmp_path/"missing.lookup"),str(source)) is None
+
+    # The committed flip rate lookup files agree with the pkl files
+    for year in ["UL16APV","UL16","UL17","UL18"]:
+        pkl_path = topcoffea_path(f"data/fliprates/flip_probs_topcoffea_{year}.pkl.gz")
+        with gzip.open(pkl_path) as fin:
+            flip_hist = pickle.load(fin)
+        lookup_path = topcoffea_path(f"data/fliprates/flip_probs_topcoffea_{year}{binary_lookup.LOOKUP_EXT}")
+        assert binary_lookup.is_up_to_date(lookup_path,pkl_path)
+        values_in, edges_in = binary_lookup.load_lookup(lookup_path)
+        assert np.array_equal(values_in,flip_hist.values()[()])
+        assert np.array_equal(edges_in[0],flip_hist.axis("pt").edges())
+        assert np.array_equal(edges_in[1],flip_hist.axis("eta").edges())
+
+def test_btag_mceff_lookup():
+    import gzip
+    import pickle
+    import numpy as np
+    import topcoffea.modules.binary_lookup as binary_lookup
+    from topcoffea.modules.corrections import GetMCeffTable, GetMCeffFunc
+
+    # The committed btag MC efficiency lookup files agree with the pkl files
+    pt = np.array([25.,50.,100.,500.])
+    abseta = np.array([0.5,1.5,2.,2.3])
+    flav = np.array([5,5,5,5])
+    for year in ["2016APV","2016","2017","2018"]:
+        pkl_path = topcoffea_path(f"data/btagSF/UL/btagMCeff_{year}.pkl.gz")
+        with gzip.open(pkl_path) as fin:
+            h = pickle.load(fin)["jetptetaflav"]
+        for wp in ["loose","medium","tight"]:
+            values, edges = GetMCeffTable(h,wp)
+            lookup_path = topcoffea_path(f"data/btagSF/UL/btagMCeff_{year}_{wp}{binary_lookup.LOOKUP_EXT}")
+            assert binary_lookup.is_up_to_date(lookup_path,pkl_path)
+            values_in, edges_in = binary_lookup.load_lookup(lookup_path)
+            assert np.array_equal(values_in,values,equal_nan=True)
+            assert all(np.array_equal(a,b) for a,b in zip(edges_in,edges))
+            eff = GetMCeffFunc(year,wp)(pt,abseta,flav)
+            eff = eff[~np.isnan(eff)] # Bins without any jets
+            assert len(eff) and np.all((eff >= 0) & (eff <= 1))
@@ -0,0 +1,73 @@
+import copy
+import numpy as np
+import awkward as ak
+import pytest
+from coffea.analysis_tools import Weights
+
+from topcoffea.modules.weights import LayeredWeights
+
+def test_layered_weights():
+    rng = np.random.default_rng(42)
+    n = 1000
+    def rand():
+        w = rng.normal(1.0,0.2,n)
+        w[::50] = 0.0
+        return w
+
+    base_wgts = [("norm",rand(),None,None), ("PU",rand(),rand(),rand()), ("ISR",np.ones(n),rand(),rand())]
+    layer_wgts = [("btagSF",rand(),rand(),None)]
+    cat_wgts = {
+        "2l": [("FF",rand(),rand(),rand()), ("lepSF_muon",rand(),rand(),rand())],
+        "3l": [("FF",rand(),rand(),rand())],
+    }
+
+    # The reference: one coffea Weights object for each cat, built by deep copying
+    ref_base = Weights(n,storeIndividual=True)
+    layered_base = LayeredWeights(n)
+    for name,w,up,down in base_wgts:
+        ref_base.add(name,w,copy.deepcopy(up),copy.deepcopy(down))
+        layered_base.add(name,w,up,down)
+    ref_layer = copy.deepcopy(ref_base)
+    layered_layer = layered_base.layer()
+    for name,w,up,down in layer_wgts:
+        ref_layer.add(name,w,copy.deepcopy(up),copy.deepcopy(down))
+        layered_layer.add(name,w,up,down)
+
+    for cat,wgts in cat_wgts.items():
+        ref = copy.deepcopy(ref_layer)
+        layered = layered_layer.layer()
+        for name,w,up,down in wgts:
+            up_orig = None if up is None else up.copy()
+            ref.add(name,w,copy.deepcopy(up),copy.deepcopy(down))
+            layered.add(name,w,up,down)
+            # The arrays passed to add() are not modified
+            assert (up is None) or np.array_equal(up,up_orig)
+
+        assert layered.variations == ref.variations
+        assert np.array_equal(layered.weight(),ref.weight())
+        for var in ref.variations:
+            assert np.array_equal(layered.weight(var),ref.weight(var),equal_nan=True)
+        assert np.array_equal(layered.partial_weight(include=["PU","FF"]),ref.partial_weight(include=["PU","FF"]))
+        with pytest.raises(KeyError):
+            layered.weight("notAVariationUp")
+
+    # The base layers are not changed by the layers on top of them
+    assert layered_base.variations == ref_base.variations
+    assert np.array_equal(layered_base.weight(),ref_base.weight())
+
+    # Adding to a lower layer is seen by the layers on top of it
+    layered = layered_base.layer()
+    before = layered.weight()
+    layered_base.add("extra",np.full(n,2.0))
+    assert np.allclose(layered.weight(),2*before)
+
+def test_layered_weights_missing_values():
+    # Missing values in option type arrays are treated as a weight of 1, as for the coffea Weights
+    w = ak.Array([1.5,None,0.5])
+    ref = Weights(3)
+    ref.add("w",w)
+    layered = LayeredWeights(3)
+    layered.add("w",w)
+    assert np.array_equal(layered.weight(),ref.weight())
+    with pytest.raises(ValueError):
+        layered.add("wUp",np.ones(3))
@@ -36,4 +36,4 @@ def test_topcoffea_wq():
     with factory:
         subprocess.run(args, cwd="analysis/topEFT", timeout=400)
 
-    assert(exists('analysis/topEFT/histos/output_check_yields_wq.pkl.gz'))
+    assert(exists('analysis/topEFT/histos/output_check_yields_wq.hists.zip'))
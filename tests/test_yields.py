@@ -3,13 +3,13 @@ from os.path import exists
 from os import getcwd
 
 def test_make_yields_after_processor():
-    assert(exists('analysis/topEFT/histos/output_check_yields.pkl.gz')) # Make sure the input pkl file exists
+    assert(exists('analysis/topEFT/histos/output_check_yields.hists.zip')) # Make sure the input file exists
 
     args = [
         "python",
         "analysis/topEFT/get_yield_json.py",
         "-f",
-        "analysis/topEFT/histos/output_check_yields.pkl.gz",
+        "analysis/topEFT/histos/output_check_yields.hists.zip",
         "-n",
         "analysis/topEFT/output_check_yields"
     ]
@@ -1,84 +1,164 @@
 import json
+import types
 from topcoffea.modules.paths import topcoffea_path
 
+# The contents of the json files are loaded (and validated) once, the first time they are needed, and then
+# kept here as read only objects (dicts become mappingproxy objects and lists become tuples)
+# Note: Call reload_jsons() to pick up any changes made to the files after they were loaded
+_json_cache = {}
+
+
+######### Loading, validating and caching the json files #########
+
+def _is_number(x):
+    return isinstance(x,(int,float)) and not isinstance(x,bool)
+
+# Make a read only copy of the (nested) contents of a json
+def _freeze(obj):
+    if isinstance(obj,dict):
+        return types.MappingProxyType({k: _freeze(v) for k,v in obj.items()})
+    if isinstance(obj,list):
+        return tuple(_freeze(x) for x in obj)
+    return obj
+
+# Parse a rate syst, e.g. "0.88/1.13" or 1.05, into a pair of floats for down and up
+def _parse_syst(syst):
+    syst_str = str(syst)
+    syst_str_split = syst_str.split("/")
+    try:
+        if len(syst_str_split) == 2:
+            return (float(syst_str_split[0]),float(syst_str_split[1]))
+        elif len(syst_str_split) == 1:
+            return (1.0/float(syst_str_split[0]),float(syst_str_split[0]))
+    except (ValueError,ZeroDivisionError):
+        pass
+    raise Exception(f"Error: Syst string \"{syst_str}\" is of an unknown format.")
+
+def _check_dict(obj,what,fname):
+    if not isinstance(obj,dict):
+        raise Exception(f"Error: Expected {what} to be a dictionary in {fname}, got: {obj}")
+
+def _validate_lumi(jsn,fname):
+    _check_dict(jsn,"the lumi json",fname)
+    for year,lumi in jsn.items():
+        if not _is_number(lumi) or lumi <= 0:
+            raise Exception(f"Error: Invalid lumi \"{lumi}\" for year \"{year}\" in {fname}")
+    return _freeze(jsn)
+
+# The params are numbers, lists of sample names, or dictionaries of numbers
+def _validate_params(jsn,fname):
+    _check_dict(jsn,"the params json",fname)
+    for name,val in jsn.items():
+        is_valid = (
+            _is_number(val)
+            or (isinstance(val,list) and all(isinstance(x,str) for x in val))
+            or (isinstance(val,dict) and all(_is_number(x) for x in val.values()))
+        )
+        if not is_valid:
+            raise Exception(f"Error: Param \"{name}\" has an unexpected value in {fname}: {val}")
+    return _freeze(jsn)
+
+# Besides the (frozen) contents, also keeps the rate systs already parsed into (down,up) pairs
+def _validate_rate_systs(jsn,fname):
+    _check_dict(jsn,"the rate systs json",fname)
+    for key in ["rate_uncertainties","correlations","diboson_njets"]:
+        if key not in jsn:
+            raise Exception(f"Error: Missing \"{key}\" in {fname}")
+        _check_dict(jsn[key],f"\"{key}\"",fname)
+
+    pairs = {}
+    for syst_name,syst_obj in jsn["rate_uncertainties"].items():
+        if isinstance(syst_obj,dict):
+            pairs[syst_name] = {proc: _parse_syst(v) for proc,v in syst_obj.items()}
+        else:
+            pairs[syst_name] = _parse_syst(syst_obj)
+    for proc_name,corr in jsn["correlations"].items():
+        _check_dict(corr,f"the correlations for \"{proc_name}\"",fname)
+        if not all(isinstance(x,str) for x in corr.values()):
+            raise Exception(f"Error: The correlation tags for \"{proc_name}\" should be strings in {fname}: {corr}")
+    for proc_name,njets_dict in jsn["diboson_njets"].items():
+        _check_dict(njets_dict,f"the jet dependent systs for \"{proc_name}\"",fname)
+        if not all(_is_number(x) for x in njets_dict.values()):
+            raise Exception(f"Error: The jet dependent systs for \"{proc_name}\" should be numbers in {fname}: {njets_dict}")
+
+    out = dict(_freeze(jsn))
+    out["rate_uncertainty_pairs"] = _freeze(pairs)
+    return types.MappingProxyType(out)
+
+_validators = {
+    "json/lumi.json": _validate_lumi,
+    "json/params.json": _validate_params,
+    "json/rate_systs.json": _validate_rate_systs,
+}
+
+# Get the (cached) contents of one of the json files
+def load_json(fname):
+    if fname not in _json_cache:
+        with open(topcoffea_path(fname)) as f:
+            jsn = json.load(f)
+        _json_cache[fname] = _validators[fname](jsn,fname)
+    return _json_cache[fname]
+
+# Drop the cached contents, so the json files are read again the next time they are needed
+def reload_jsons():
+    _json_cache.clear()
+
+
+######### Getting values from the json files #########
+
 # Return the lumi from the json/lumi.json file for a given year
 def get_lumi(year):
-    lumi_json = topcoffea_path("json/lumi.json")
-    with open(lumi_json) as f_lumi:
-       lumi = json.load(f_lumi)
-       lumi = lumi[year]
-    return lumi
+    return load_json("json/lumi.json")[year]
 
 
 # Retrun the param value from params.json for a given param name
 def get_param(param_name):
-    param_json = topcoffea_path("json/params.json")
-    with open(param_json) as f_params:
-       params = json.load(f_params)
-       param_val = params[param_name]
-    return param_val
+    return load_json("json/params.json")[param_name]
 
 
 # Get the systematic value from the rate_systs json
 #   - If literal is True, return the literal string, e.g. "0.88/1.13"
 #   - If literal is False, return a pair of floats e.g. [0.88,1.13] for down and up
 def get_syst(syst_name,proc_name=None,literal=False):
-    syst_json = topcoffea_path("json/rate_systs.json")
-    with open(syst_json) as f_systs:
-        rate_systs_dict = json.load(f_systs)["rate_uncertainties"]
-
-        # Try to get the param from the dict
-        if syst_name in rate_systs_dict.keys():
-            syst_obj = rate_systs_dict[syst_name]
-            if syst_name == "lumi":
-                # Note we'll return this regardless of what proc name (if any) was passed
-                ret_obj = syst_obj
-            elif proc_name in rate_systs_dict[syst_name]:
-                ret_obj = rate_systs_dict[syst_name][proc_name]
-            else:
-                raise Exception(f"Error: Unknown proc name \"{proc_name}\", known processes for this syst \"{syst_name}\" are: {list(rate_systs_dict[syst_name].keys())}")
-        else:
-            raise Exception(f"Error: Unknown syst name \"{syst_name}\", known systs are: {list(rate_systs_dict.keys())}")
-
-        # Now get the output as a str and a pair of floats
-        ret_obj_str = str(ret_obj)
-        ret_obj_str_split = ret_obj_str.split("/")
-        if len(ret_obj_str_split) == 2:
-            ret_obj_pair = [float(ret_obj_str_split[0]),float(ret_obj_str_split[1])]
-        elif len(ret_obj_str_split) == 1:
-            ret_obj_pair = [1.0/float(ret_obj_str_split[0]),float(ret_obj_str_split[0])]
-        else:
-            raise Exception(f"Error: Syst string \"{ret_obj_str}\" is of an unknown format.")
+    rate_systs = load_json("json/rate_systs.json")
+    rate_systs_dict = rate_systs["rate_uncertainties"]
+    pairs_dict = rate_systs["rate_uncertainty_pairs"]
 
-        if literal:
-            return ret_obj_str
+    # Try to get the param from the dict
+    if syst_name in rate_systs_dict:
+        syst_obj = rate_systs_dict[syst_name]
+        if syst_name == "lumi":
+            # Note we'll return this regardless of what proc name (if any) was passed
+            ret_obj = syst_obj
+            ret_obj_pair = pairs_dict[syst_name]
+        elif proc_name in rate_systs_dict[syst_name]:
+            ret_obj = rate_systs_dict[syst_name][proc_name]
+            ret_obj_pair = pairs_dict[syst_name][proc_name]
         else:
-            return ret_obj_pair
+            raise Exception(f"Error: Unknown proc name \"{proc_name}\", known processes for this syst \"{syst_name}\" are: {list(rate_systs_dict[syst_name].keys())}")
+    else:
+        raise Exception(f"Error: Unknown syst name \"{syst_name}\", known systs are: {list(rate_systs_dict.keys())}")
+
+    if literal:
+        return str(ret_obj)
+    else:
+        return list(ret_obj_pair)
 
 
 # Just jet the list of rate syst keys included in the rate rate syst json
 def get_syst_lst():
-    syst_json = topcoffea_path("json/rate_systs.json")
-    with open(syst_json) as f_systs:
-        rate_systs_dict = json.load(f_systs)["rate_uncertainties"]
-        rate_syst_lst = list(rate_systs_dict.keys())
-        return rate_syst_lst
+    return list(load_json("json/rate_systs.json")["rate_uncertainties"].keys())
 
 
 # Get the correlation group a process belongs to for a given systematic type (pdf or qcd)
 def get_correlation_tag(syst_type,proc_name):
-    syst_json = topcoffea_path("json/rate_systs.json")
-    with open(syst_json) as f_systs:
-        corr_dict = json.load(f_systs)["correlations"]
-        if proc_name in corr_dict.keys():
-            if syst_type in corr_dict[proc_name].keys():
-                return corr_dict[proc_name][syst_type]
-            else: raise Exception(f"Error: Unknown syst type \"{syst_type}\", known systematics with correlations are: {list(corr_dict[proc_name].keys())}")
-        else: raise Exception(f"Error: Unknown proc name \"{proc_name}\", known processes are: {list(corr_dict.keys())}")
+    corr_dict = load_json("json/rate_systs.json")["correlations"]
+    if proc_name in corr_dict:
+        if syst_type in corr_dict[proc_name]:
+            return corr_dict[proc_name][syst_type]
+        else: raise Exception(f"Error: Unknown syst type \"{syst_type}\", known systematics with correlations are: {list(corr_dict[proc_name].keys())}")
+    else: raise Exception(f"Error: Unknown proc name \"{proc_name}\", known processes are: {list(corr_dict.keys())}")
 
 # Get the dict of jet-dependent scaling factors
 def get_jet_dependent_syst_dict(process="Diboson"):
-    syst_json = topcoffea_path("json/rate_systs.json")
-    with open(syst_json) as f_systs:
-        diboson_njets_dict = json.load(f_systs)["diboson_njets"]
-        return(diboson_njets_dict[process])
+    return load_json("json/rate_systs.json")["diboson_njets"][process]
@@ -7,6 +7,12 @@
  Example of initizalization: 
   HistEFT("Events", ['c1', 'c2', 'c3'], hist.Cat("sample", "sample"), hist.Cat("cut", "cut"), hist.Bin("met", "MET (GeV)", 40, 0, 400))
 
+ Storage: by default each sparse bin is stored as its own numpy array in the _sumw/_sumw2 dicts. After
+ calling pack(), all of the EFT bins (and separately all of the non-EFT bins) are instead kept in one
+ contiguous array whose first axis runs over the sparse keys, and the dicts only hold views into those
+ arrays. In this mode add(), sum(), group(), rebin(), __getitem__ and values() act on whole blocks at
+ once, and pickling stores the blocks rather than one array per sparse bin.
+
  TODO: check the group and rebin functions... in particular, the part of grouping/rebinning the coefficients
  TODO: add sum of weights for normalization? 
 """
@@ -18,13 +24,70 @@ import copy
 import awkward as ak
 import numbers
 
-from coffea.hist.hist_tools import DenseAxis
+from coffea.hist.hist_tools import DenseAxis, assemble_blocks, overflow_behavior
 from topcoffea.modules.utils import regex_match
 
 import topcoffea.modules.eft_helper as efth
 
+class SparseBlock(object):
+  """ Contiguous storage for all of the sparse bins of one kind (EFT or non-EFT) of a packed HistEFT
+      Row i of the arrays holds the dense bins of the sparse key keys[i]
+        sumw      : Shape (nrows, *dense_shape) for non-EFT bins, (nrows, *dense_shape, ncoeffs) for EFT bins
+        sumw2     : Same layout as sumw (nerrcoeffs instead of ncoeffs for EFT bins), None if no row has sumw2
+        has_sumw2 : Boolean mask of the rows that have sumw2 (i.e. are not None in the _sumw2 dict), None
+                    if the histogram does not keep track of sumw2 at all. Rows without sumw2 are always zero.
+  """
+
+  def __init__(self, keys, sumw, sumw2=None, has_sumw2=None):
+    self.keys = list(keys)
+    self.sumw = sumw
+    self.sumw2 = sumw2
+    self.has_sumw2 = has_sumw2
+    self.index = {k: i for i, k in enumerate(self.keys)}
+    # Views into the rows of sumw/sumw2, these are what the HistEFT puts in its _sumw/_sumw2 dicts
+    self._views = None
+    self._views2 = None
+
+  def __len__(self):
+    return len(self.keys)
+
+  def __getstate__(self):
+    # The views and the index are rebuilt after unpickling, no need to store them
+    state = self.__dict__.copy()
+    state['_views'] = None
+    state['_views2'] = None
+    del state['index']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.index = {k: i for i, k in enumerate(self.keys)}
+
+  def copy(self):
+    return SparseBlock(
+      self.keys,
+      self.sumw.copy(),
+      None if self.sumw2 is None else self.sumw2.copy(),
+      None if self.has_sumw2 is None else self.has_sumw2.copy()
+    )
+
+  def take(self, rows, keys=None):
+    """ Return a new block with a copy of the selected rows, optionally relabeling them with new keys """
+    rows = np.asarray(rows, dtype=np.intp)
+    if keys is None: keys = [self.keys[i] for i in rows]
+    return SparseBlock(
+      keys,
+      self.sumw[rows],
+      None if self.sumw2 is None else self.sumw2[rows],
+      None if self.has_sumw2 is None else self.has_sumw2[rows]
+    )
+
 class HistEFT(coffea.hist.Hist):
 
+  # The packed storage (see pack()), None when the histogram uses the usual dict of arrays. Defined at the
+  # class level so that histograms pickled before the packed storage existed can still be loaded.
+  _blocks = None
+
   def __init__(self, label, wcnames, *axes, **kwargs):
     """ Initialize """
     if isinstance(wcnames, str) and ',' in wcnames: wcnames = wcnames.replace(' ', '').split(',')
@@ -174,14 +237,413 @@ class HistEFT(coffea.hist.Hist):
     new_h = new_h.remove([GROUP_NAME],axis_name)
     return new_h
 
+  ######### Packed (block) storage #########
+
+  def pack(self):
+    """ Switch this histogram (in-place) to the packed storage, where the contents of all the sparse bins
+        of the same kind live in one contiguous array. The _sumw/_sumw2 dicts are kept, but filled with
+        views into those arrays. Histograms produced from a packed histogram (e.g. by copy(), sum(),
+        group(), etc.) are packed as well.
+    """
+    if self.dense_dim() == 0:
+      raise RuntimeError("Packed storage not implemented for histograms without a dense axis")
+    self._bind_blocks(self._stack_blocks(), list(self._sumw.keys()))
+    return self
+
+  def unpack(self):
+    """ Switch this histogram (in-place) back to storing an independent array for each sparse bin """
+    if self._blocks is not None:
+      self._sumw = {k: v.copy() for k, v in self._sumw.items()}
+      if self._sumw2 is not None:
+        self._sumw2 = {k: (None if v is None else v.copy()) for k, v in self._sumw2.items()}
+      self._blocks = None
+    return self
+
+  def is_packed(self):
+    return self._blocks is not None
+
+  def _block_shape(self, is_eft, sumw2=False):
+    """ Shape of one row of the block that stores the sumw (or sumw2) of the EFT (or non-EFT) bins """
+    if not is_eft:
+      return self._dense_shape
+    return (*self._dense_shape, self._nerrcoeffs if sumw2 else self._ncoeffs)
+
+  def _stack_blocks(self):
+    """ Build the blocks from the contents of the _sumw/_sumw2 dicts (the arrays are copied, the dicts are not modified) """
+    keys = {True: [], False: []}
+    for key, arr in self._sumw.items():
+      keys[arr.shape != self._dense_shape].append(key)
+
+    blocks = {}
+    for is_eft, block_keys in keys.items():
+      nrows = len(block_keys)
+      sumw = np.zeros((nrows, *self._block_shape(is_eft)), dtype=self._dtype)
+      for i, key in enumerate(block_keys):
+        sumw[i] = self._sumw[key]
+      sumw2 = None
+      has_sumw2 = None
+      if self._sumw2 is not None:
+        # Note: An EFT bin can end up with a non-EFT shaped sumw2 when it was summed with a non-EFT bin,
+        #       since that sumw2 can't be used to calculate the EFT errors anyway, it is treated as None
+        w2_shape = self._block_shape(is_eft, sumw2=True)
+        w2 = [self._sumw2.get(key) for key in block_keys]
+        has_sumw2 = np.array([(v is not None) and (v.shape == w2_shape) for v in w2], dtype=bool)
+        if has_sumw2.any():
+          sumw2 = np.zeros((nrows, *w2_shape), dtype=self._dtype)
+          for i in np.flatnonzero(has_sumw2):
+            sumw2[i] = w2[i]
+      blocks[is_eft] = SparseBlock(block_keys, sumw, sumw2, has_sumw2)
+    return blocks
+
+  def _bind_blocks(self, blocks, order=None):
+    """ Make blocks the storage of this histogram, refilling the _sumw/_sumw2 dicts with views into their rows
+        The order argument gives the order of the keys in the dicts (defaults to the order of the rows)
+    """
+    keep_sumw2 = any(b.has_sumw2 is not None for b in blocks.values())
+    location = {}
+    for block in blocks.values():
+      block._views = list(block.sumw)
+      if keep_sumw2:
+        if block.has_sumw2 is None:
+          block.has_sumw2 = np.zeros(len(block), dtype=bool)
+        if block.sumw2 is None:
+          block._views2 = [None]*len(block)
+        else:
+          block._views2 = [v if has else None for v, has in zip(block.sumw2, block.has_sumw2)]
+      for i, key in enumerate(block.keys):
+        location[key] = (block, i)
+    if order is None:
+      order = location.keys()
+
+    self._sumw = {}
+    self._sumw2 = {} if keep_sumw2 else None
+    for key in order:
+      block, i = location[key]
+      self._sumw[key] = block._views[i]
+      if keep_sumw2:
+        self._sumw2[key] = block._views2[i]
+    self._blocks = blocks
+
+  def _blocks_in_sync(self):
+    """ Check that the _sumw/_sumw2 dicts still only hold the views into the blocks, i.e. that nothing
+        (e.g. fill() creating a new sparse bin or _init_sumw2()) replaced or added entries since they were bound
+    """
+    nrows = sum(len(b) for b in self._blocks.values())
+    if len(self._sumw) != nrows:
+      return False
+    if (self._sumw2 is not None) and (len(self._sumw2) != nrows):
+      return False
+    for block in self._blocks.values():
+      if (block.has_sumw2 is None) != (self._sumw2 is None) or block._views is None:
+        return False
+      for key, view in zip(block.keys, block._views):
+        if self._sumw.get(key) is not view:
+          return False
+      if self._sumw2 is not None:
+        for key, view in zip(block.keys, block._views2):
+          if key not in self._sumw2 or self._sumw2[key] is not view:
+            return False
+    return True
+
+  def _packed_blocks(self):
+    """ Get the blocks with the contents of this histogram. For a packed histogram these are its own blocks
+        (rebuilt first if the dicts were modified), otherwise they are stacked copies of the dict contents.
+    """
+    if self._blocks is None:
+      return self._stack_blocks()
+    if not self._blocks_in_sync():
+      self.pack()
+    return self._blocks
+
+  def _concat_blocks(self, is_eft, parts):
+    """ Concatenate the rows of several blocks of the same kind into a new block """
+    if len(parts) == 0:
+      return SparseBlock([], np.zeros((0, *self._block_shape(is_eft)), dtype=self._dtype))
+    keys = [k for part in parts for k in part.keys]
+    sumw = np.concatenate([part.sumw for part in parts]).astype(self._dtype, copy=False)
+    has_sumw2 = None
+    sumw2 = None
+    if any(part.has_sumw2 is not None for part in parts):
+      has_sumw2 = np.concatenate([
+        part.has_sumw2 if part.has_sumw2 is not None else np.zeros(len(part), dtype=bool) for part in parts
+      ])
+      if any(part.sumw2 is not None for part in parts):
+        w2_shape = self._block_shape(is_eft, sumw2=True)
+        sumw2 = np.concatenate([
+          part.sumw2 if part.sumw2 is not None else np.zeros((len(part), *w2_shape), dtype=self._dtype) for part in parts
+        ]).astype(self._dtype, copy=False)
+    return SparseBlock(keys, sumw, sumw2, has_sumw2)
+
+  def _promote_block(self, block, eft_has_sumw2):
+    """ Convert a block of non-EFT bins into EFT bins, with the non-EFT contents going into the SM (0th) coefficient
+        The sumw2 are only carried over if the EFT bins they will be combined with store the w**2 coefficients,
+        otherwise the promoted bins have no sumw2
+    """
+    sumw = np.zeros((len(block), *self._block_shape(True)), dtype=self._dtype)
+    sumw[..., 0] = block.sumw
+    sumw2 = None
+    has_sumw2 = None
+    if block.has_sumw2 is not None:
+      has_sumw2 = block.has_sumw2.copy() if eft_has_sumw2 else np.zeros(len(block), dtype=bool)
+      if has_sumw2.any():
+        sumw2 = np.zeros((len(block), *self._block_shape(True, sumw2=True)), dtype=self._dtype)
+        sumw2[..., 0] = block.sumw2
+    return SparseBlock(block.keys, sumw, sumw2, has_sumw2)
+
+  @staticmethod
+  def _segment_sum(block, inv, dense_op, new_keys):
+    """ Apply dense_op to all rows of block, then sum together the rows that have the same value in inv
+        Returns the (sorted) unique values of inv and a block with one row for each of them, labeled by
+        new_keys[value]. Just like in sum(), the sumw2 of a summed row is None (i.e. has_sumw2 is False)
+        if it is None for any of the rows that went into it.
+    """
+    if len(block) == 0:
+      return np.zeros(0, dtype=np.intp), SparseBlock(
+        [],
+        dense_op(block.sumw).copy(),
+        None,
+        None if block.has_sumw2 is None else block.has_sumw2.copy()
+      )
+    order = np.argsort(inv, kind='stable')
+    sorted_inv = inv[order]
+    starts = np.flatnonzero(np.r_[True, sorted_inv[1:] != sorted_inv[:-1]])
+    is_sorted = np.array_equal(order, np.arange(len(inv)))
+
+    def segment_op(arr):
+      arr = dense_op(arr if is_sorted else arr[order])
+      return np.add.reduceat(arr, starts, axis=0)
+
+    sumw = segment_op(block.sumw)
+    sumw2 = None
+    has_sumw2 = None
+    if block.has_sumw2 is not None:
+      has_sumw2 = np.logical_and.reduceat(block.has_sumw2 if is_sorted else block.has_sumw2[order], starts)
+      if block.sumw2 is not None and has_sumw2.any():
+        sumw2 = segment_op(block.sumw2)
+        sumw2[~has_sumw2] = 0
+    idx = sorted_inv[starts]
+    return idx, SparseBlock([new_keys[i] for i in idx], sumw, sumw2, has_sumw2)
+
+  def _add_packed(self, other):
+    """ Block version of add(), called when this histogram is packed """
+    blocks = self._packed_blocks()
+    oblocks = other._packed_blocks()
+
+    # Get the sumw2 of both histograms on the same footing, following the same rules as the dict version:
+    #   - If only other has sumw2, this histogram gets sumw2=sumw for its non-EFT bins and None for its EFT bins
+    #   - If only this histogram has sumw2, the non-EFT bins of other contribute sumw2=sumw, its EFT bins None
+    #   - A None sumw2 is added as if it were zero (but the result is only None if both are None)
+    if (self._sumw2 is None) and (other._sumw2 is not None):
+      for is_eft, block in blocks.items():
+        block.has_sumw2 = np.full(len(block), not is_eft)
+        block.sumw2 = None if is_eft else block.sumw.copy()
+    if (self._sumw2 is not None) and (other._sumw2 is None):
+      oblocks = {
+        is_eft: SparseBlock(block.keys, block.sumw, None if is_eft else block.sumw, np.full(len(block), not is_eft))
+        for is_eft, block in oblocks.items()
+      }
+
+    # The keys of other, in terms of the identifiers of this histogram (any missing identifiers get created)
+    raxes = other.sparse_axes()
+    laxes = [self.axis(rax) for rax in raxes]
+    lkeys = {}
+    for rkey in other._sumw.keys():
+      lkeys[rkey] = tuple(lax.index(rax[ridx]) for lax, rax, ridx in zip(laxes, raxes, rkey))
+
+    # Bins that are EFT bins in one histogram but not in the other get promoted to EFT bins
+    # Their sumw2 is kept if the EFT bins of either histogram store the w**2 coefficients (as in the dict version,
+    # where a non-EFT bin added to an EFT bin with sumw2 takes its sumw2 along into the SM coefficient)
+    eft_has_sumw2 = (blocks[True].sumw2 is not None) or (oblocks[True].sumw2 is not None)
+    to_promote = [i for i, k in enumerate(oblocks[True].keys) if lkeys[k] in blocks[False].index]
+    if len(to_promote):
+      rows = [blocks[False].index[lkeys[oblocks[True].keys[i]]] for i in to_promote]
+      keep = np.setdiff1d(np.arange(len(blocks[False])), rows)
+      promoted = self._promote_block(blocks[False].take(rows), eft_has_sumw2)
+      blocks[True] = self._concat_blocks(True, [blocks[True], promoted])
+      blocks[False] = blocks[False].take(keep)
+    to_promote = [i for i, k in enumerate(oblocks[False].keys) if lkeys[k] in blocks[True].index]
+    if len(to_promote):
+      keep = np.setdiff1d(np.arange(len(oblocks[False])), to_promote)
+      promoted = self._promote_block(oblocks[False].take(to_promote), eft_has_sumw2)
+      oblocks = {
+        True: self._concat_blocks(True, [oblocks[True], promoted]),
+        False: oblocks[False].take(keep),
+      }
+
+    # Now add the rows of each kind, appending the rows for the keys that this histogram does not have yet
+    new_keys = []
+    for is_eft, oblock in oblocks.items():
+      block = blocks[is_eft]
+      lrows, rrows, new_rows = [], [], []
+      for r, rkey in enumerate(oblock.keys):
+        i = block.index.get(lkeys[rkey])
+        if i is None:
+          new_rows.append(r)
+        else:
+          lrows.append(i)
+          rrows.append(r)
+      if len(lrows):
+        block.sumw[lrows] += oblock.sumw[rrows]
+        if (oblock.sumw2 is not None) and oblock.has_sumw2[rrows].any():
+          if block.sumw2 is None:
+            block.sumw2 = np.zeros((len(block), *self._block_shape(is_eft, sumw2=True)), dtype=self._dtype)
+          block.sumw2[lrows] += oblock.sumw2[rrows]
+        if block.has_sumw2 is not None:
+          block.has_sumw2[lrows] |= oblock.has_sumw2[rrows]
+      if len(new_rows):
+        appended = oblock.take(new_rows, keys=[lkeys[oblock.keys[r]] for r in new_rows])
+        blocks[is_eft] = self._concat_blocks(is_eft, [block, appended])
+        new_keys += [oblock.keys[r] for r in new_rows]
+
+    # New keys go at the end of the dicts, in the order they had in other
+    other_order = {k: i for i, k in enumerate(other._sumw.keys())}
+    new_keys.sort(key=lambda k: other_order[k])
+    self._bind_blocks(blocks, list(self._sumw.keys()) + [lkeys[k] for k in new_keys])
+    return self
+
+  def _sum_packed(self, out, sparse_drop, dense_slice, dense_sum_dim):
+    """ Block version of sum(), called when this histogram is packed """
+    blocks = self._packed_blocks()
+    block_slice = (slice(None),) + dense_slice
+    block_sum_dim = tuple(d+1 for d in dense_sum_dim)
+
+    def dense_op(array):
+      if len(block_sum_dim) > 0:
+        return np.sum(array[block_slice], axis=block_sum_dim)
+      return array
+
+    # Find the output key of every row, numbering the output keys in order of first appearance
+    new_keys = {}
+    inv = {is_eft: np.empty(len(block), dtype=np.intp) for is_eft, block in blocks.items()}
+    location = self._block_locations(blocks)
+    for key in self._sumw.keys():
+      is_eft, i = location[key]
+      new_key = tuple(k for j, k in enumerate(key) if j not in sparse_drop)
+      inv[is_eft][i] = new_keys.setdefault(new_key, len(new_keys))
+    new_keys = list(new_keys)
+
+    eft_idx, eft_block = self._segment_sum(blocks[True], inv[True], dense_op, new_keys)
+    sm_idx, sm_block = self._segment_sum(blocks[False], inv[False], dense_op, new_keys)
+
+    # Output keys that get both EFT and non-EFT contributions are EFT bins, the non-EFT part goes into the SM coefficient
+    both, ieft, ism = np.intersect1d(eft_idx, sm_idx, assume_unique=True, return_indices=True)
+    if len(both):
+      eft_block.sumw[ieft, ..., 0] += sm_block.sumw[ism]
+      if eft_block.has_sumw2 is not None:
+        has_both = eft_block.has_sumw2[ieft] & sm_block.has_sumw2[ism]
+        eft_block.has_sumw2[ieft] = has_both
+        if eft_block.sumw2 is not None:
+          if sm_block.sumw2 is not None:
+            eft_block.sumw2[ieft, ..., 0] += sm_block.sumw2[ism]
+          eft_block.sumw2[ieft[~has_both]] = 0
+      sm_block = sm_block.take(np.setdiff1d(np.arange(len(sm_block)), ism))
+
+    out._bind_blocks({True: eft_block, False: sm_block}, new_keys)
+    if out.dense_dim() == 0:
+      # Rows of a block without dense axes are scalars rather than views, so go back to the dict storage
+      out.unpack()
+    return out
+
+  def _getitem_packed(self, out, sparse_idx, dense_idx):
+    """ Block version of __getitem__(), called when this histogram is packed """
+    blocks = self._packed_blocks()
+    sparse_idx = [set(idx) for idx in sparse_idx]
+
+    def selected(key):
+      return all(k in idx for k, idx in zip(key, sparse_idx))
+
+    new_blocks = {}
+    for is_eft, block in blocks.items():
+      # Slice the dense axes of all the rows at once (the extra slices are for the rows and the EFT coefficients)
+      block_idx = (slice(None),) + dense_idx + ((slice(None),) if is_eft else ())
+
+      def dense_op(array):
+        return np.block(assemble_blocks(array, block_idx))
+
+      sub = block.take([i for i, key in enumerate(block.keys) if selected(key)])
+      new_blocks[is_eft] = SparseBlock(
+        sub.keys,
+        dense_op(sub.sumw),
+        None if sub.sumw2 is None else dense_op(sub.sumw2),
+        sub.has_sumw2
+      )
+    out._bind_blocks(new_blocks, [key for key in self._sumw.keys() if selected(key)])
+    return out
+
+  def _values_packed(self, sumw2, overflow):
+    """ Block version of values(), called when this histogram is packed """
+    blocks = self._packed_blocks()
+    view = (slice(None),) + tuple(overflow_behavior(overflow) for _ in range(self.dense_dim()))
+
+    evaluated = {}
+    for is_eft, block in blocks.items():
+      if len(block) == 0:
+        continue
+      if is_eft:
+        _sumw = efth.calc_eft_weights_batch(block.sumw, self._wcs)[0]
+      else:
+        _sumw = block.sumw
+      _sumw2 = None
+      if sumw2:
+        if is_eft:
+          # Set really tiny error bars (e.g. one one-millionth the size of the average bin) for the bins without w**2 coefficients
+          _sumw2 = np.ones_like(_sumw)*(1e-30*np.mean(_sumw, axis=tuple(range(1, _sumw.ndim)), keepdims=True))
+          if block.sumw2 is not None:
+            _sumw2[block.has_sumw2] = efth.calc_eft_w2_batch(block.sumw2[block.has_sumw2], self._wcs)[0]
+        elif block.sumw2 is None:
+          _sumw2 = _sumw
+        elif block.has_sumw2.all():
+          _sumw2 = block.sumw2
+        else:
+          has = block.has_sumw2.reshape((-1,) + (1,)*self.dense_dim())
+          _sumw2 = np.where(has, block.sumw2, _sumw)
+        _sumw2 = _sumw2[view]
+      evaluated[is_eft] = (_sumw[view], _sumw2)
+
+    out = {}
+    sparse_axes = self.sparse_axes()
+    location = self._block_locations(blocks)
+    for key in self._sumw.keys():
+      is_eft, i = location[key]
+      id_key = tuple(ax[k] for ax, k in zip(sparse_axes, key))
+      _sumw, _sumw2 = evaluated[is_eft]
+      out[id_key] = (_sumw[i], _sumw2[i]) if sumw2 else _sumw[i]
+    return out
+
+  @staticmethod
+  def _block_locations(blocks):
+    """ Map each sparse key to the kind of block it is stored in and its row """
+    return {key: (is_eft, i) for is_eft, block in blocks.items() for i, key in enumerate(block.keys)}
+
+  def __getstate__(self):
+    if self._blocks is None:
+      return self.__dict__.copy()
+    # Only the blocks (and the order of the keys) get stored, the dicts of views are rebuilt when unpickling
+    blocks = self._packed_blocks()
+    state = self.__dict__.copy()
+    state['_blocks'] = blocks
+    state['_sumw'] = list(self._sumw.keys())
+    state['_sumw2'] = None
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    if self._blocks is not None:
+      self._bind_blocks(self._blocks, self._sumw)
+
   def copy(self, content=True):
     """ Copy """
     out = HistEFT(self._label, self._wcnames, *self._axes, dtype=self._dtype)
     if self._sumw2 is not None: out._sumw2 = {}
     out._wcs = copy.deepcopy(self._wcs)
-    if content:
+    if content and self._blocks is not None:
+      blocks = self._packed_blocks()
+      out._bind_blocks({is_eft: block.copy() for is_eft, block in blocks.items()}, list(self._sumw.keys()))
+    elif content:
         out._sumw = copy.deepcopy(self._sumw)
         out._sumw2 = copy.deepcopy(self._sumw2)
+    elif self._blocks is not None:
+      out.pack()
     return out
 
   def copy_sm(self):
@@ -354,11 +816,132 @@ class HistEFT(coffea.hist.Hist):
       if eft_err_coeff is not None:
         self._sumw2[sparse_key] += np.sum(eft_err_coeff,axis=0)
 
+  def fill_batch(self, sparse_keys, key_idx, event_idx, weight=None, eft_coeff=None, eft_err_coeff=None, **dense_values):
+    """ Fill many sparse bins at once
+        Gives the same result as calling fill() once for each of the sparse bins, but the dense bins of all the
+        events are only looked up once, and all of the sparse bins are summed together with a single bincount.
+    Parameters
+    ----------
+        sparse_keys : list
+            One dict for each sparse bin to fill, mapping the name of each sparse axis to its identifier
+        key_idx : array
+            For each entry, the index in sparse_keys of the bin it goes into
+        event_idx : array
+            For each entry, the index of its event in the dense values and eft_coeff/eft_err_coeff arrays. The same
+            event can enter several sparse bins (e.g. one for each weight variation), with a different weight in each.
+        weight : array
+            The weight of each entry (not of each event)
+        eft_coeff, eft_err_coeff : array
+            The EFT (and w**2) coefficients of each event
+        **dense_values
+            The values for the dense axes, for each event
+    """
+    if self.dense_dim() == 0:
+      raise RuntimeError("Batch filling not implemented for histograms without a dense axis")
+    if sorted(dense_values) != sorted(d.name for d in self.dense_axes()):
+      raise ValueError(
+        "Need the values of exactly the dense axes of %r, got: %s" % (self, ", ".join(dense_values))
+      )
+    key_idx = np.asarray(key_idx, dtype=np.intp)
+    event_idx = np.asarray(event_idx, dtype=np.intp)
+    if weight is not None:
+      weight = np.asarray(weight)
+
+    keys = [tuple(d.index(sparse_key[d.name]) for d in self.sparse_axes()) for sparse_key in sparse_keys]
+
+    # Flat index (sparse bin, dense bin) of every entry, only looking up the dense bins of the events that are used
+    nbins = int(np.prod(self._dense_shape))
+    events, inv = np.unique(event_idx, return_inverse=True)
+    if len(events):
+      dense_indices = tuple(d.index(dense_values[d.name][events]) for d in self.dense_axes())
+      dense_bin = np.atleast_1d(np.ravel_multi_index(dense_indices, self._dense_shape))[inv]
+    else:
+      dense_bin = np.zeros(0, dtype=np.intp)
+    flat = key_idx*nbins + dense_bin
+    nflat = len(keys)*nbins
+
+    if eft_coeff is None:
+      for key in keys:
+        if key in self._sumw and self._sumw[key].shape != self._dense_shape:
+          raise ValueError("Attempt to fill an EFT bin with non-EFT events.")
+      if weight is not None and self._sumw2 is None:
+        self._init_sumw2()
+      sumw = np.bincount(flat, weights=weight, minlength=nflat).reshape((len(keys), *self._dense_shape))
+      sumw2 = None
+      if self._sumw2 is not None:
+        sumw2 = sumw if weight is None else np.bincount(flat, weights=weight**2, minlength=nflat).reshape(sumw.shape)
+      for i, key in enumerate(keys):
+        if key not in self._sumw:
+          self._sumw[key] = np.zeros(shape=self._dense_shape, dtype=self._dtype)
+          if self._sumw2 is not None:
+            self._sumw2[key] = np.zeros(shape=self._dense_shape, dtype=self._dtype)
+        self._sumw[key] += sumw[i]
+        if sumw2 is not None:
+          self._sumw2[key] += sumw2[i]
+      return
+
+    eft_coeff = np.asarray(eft_coeff)
+    if self._ncoeffs != eft_coeff.shape[1]:
+      raise ValueError(
+        "Wrong number of EFT coefficients.  "+
+        "Expecting {}, received {}".format(self._ncoeffs, eft_coeff.shape[1])
+      )
+    if eft_err_coeff is not None:
+      eft_err_coeff = np.asarray(eft_err_coeff)
+      if self._nerrcoeffs != eft_err_coeff.shape[1]:
+        raise ValueError(
+          "Wrong number of EFT w*w coefficients.  "+
+          "Expecting {}, received {}".format(self._nerrcoeffs, eft_err_coeff.shape[1])
+        )
+
+    sumw = self._bincount_coeffs(flat, event_idx, eft_coeff, weight, nflat)
+    sumw = sumw.reshape((len(keys), *self._dense_shape, self._ncoeffs))
+    sumw2 = None
+    if eft_err_coeff is not None:
+      sumw2 = self._bincount_coeffs(flat, event_idx, eft_err_coeff, None if weight is None else weight**2, nflat)
+      sumw2 = sumw2.reshape((len(keys), *self._dense_shape, self._nerrcoeffs))
+    for i, key in enumerate(keys):
+      if key not in self._sumw:
+        self._sumw[key] = np.zeros(shape=(*self._dense_shape,self._ncoeffs), dtype=self._dtype)
+        if eft_err_coeff is not None:
+          if self._sumw2 is None:
+            self._init_sumw2()
+          self._sumw2[key] = np.zeros(shape=(*self._dense_shape,self._nerrcoeffs), dtype=self._dtype)
+        elif self._sumw2 is not None:
+          self._sumw2[key] = None
+      self._sumw[key] += sumw[i]
+      if sumw2 is not None:
+        self._sumw2[key] += sumw2[i]
+
+  @staticmethod
+  def _bincount_coeffs(flat, event_idx, coeffs, weight, nflat):
+    """ Sum the (weighted) coefficients of the event of each entry into the flat bins of the entries
+        The entries are processed in slices, so that the temporary array of coefficients stays small
+    """
+    out = np.zeros((nflat, coeffs.shape[1]))
+    order = np.argsort(flat, kind='stable')
+    flat = flat[order]
+    event_idx = event_idx[order]
+    if weight is not None:
+      weight = weight[order]
+    step = max(1, 2**22 // coeffs.shape[1])
+    for start in range(0, len(flat), step):
+      stop = start + step
+      rows = coeffs[event_idx[start:stop]]
+      if weight is not None:
+        rows = rows*weight[start:stop, np.newaxis]
+      f = flat[start:stop]
+      starts = np.flatnonzero(np.r_[True, f[1:] != f[:-1]])
+      out[f[starts]] += np.add.reduceat(rows, starts, axis=0)
+    return out
+
   def add(self, other):
     """ Add another histogram into this one, in-place """
 
     if not self.compatible(other):
       raise ValueError("Cannot add this histogram with histogram %r of dissimilar dimensions" % other)
+    if self._blocks is not None:
+      return self._add_packed(other)
     raxes = other.sparse_axes()
 
     # Adds right to left
@@ -459,6 +1042,8 @@ class HistEFT(coffea.hist.Hist):
     out = HistEFT(self._label, self._wcnames, *new_dims, dtype=self._dtype)
     out._wcs = copy.deepcopy(self._wcs)
     if self._sumw2 is not None: out._init_sumw2()
+    if self._blocks is not None:
+      return self._getitem_packed(out, sparse_idx, dense_idx)
     for sparse_key in self._sumw:
       if not all(k in idx for k, idx in zip(sparse_key, sparse_idx)):
         continue
@@ -527,6 +1112,8 @@ class HistEFT(coffea.hist.Hist):
         sparse_drop.append(isparse)
     dense_slice = tuple(dense_slice)
     dense_sum_dim = tuple(dense_sum_dim)
+    if self._blocks is not None:
+      return self._sum_packed(out, sparse_drop, dense_slice, dense_sum_dim)
 
     def dense_op(array):
       if len(dense_sum_dim) > 0:
@@ -616,6 +1203,8 @@ class HistEFT(coffea.hist.Hist):
     out = HistEFT(self._label, self._wcnames, *new_dims, dtype=self._dtype)
     out._wcs = copy.deepcopy(self._wcs)
     if self._sumw2 is not None: out._init_sumw2()
+    packed_parts = {True: [], False: []}
+    packed_order = []
     for new_cat in mapping.keys():
       the_slice = mapping[new_cat]
       if not isinstance(the_slice, tuple): the_slice = (the_slice,)
@@ -626,6 +1215,12 @@ class HistEFT(coffea.hist.Hist):
       full_slice = tuple(full_slice)
       reduced_hist = self[full_slice].sum(*tuple(ax.name for ax in old_axes), overflow=overflow)  # slice may change old axis binning
       new_idx = new_axis.index(new_cat)
+      if self._blocks is not None:
+        # The reduced hist is packed too, so just relabel its blocks and stack them all together at the end
+        for is_eft, block in reduced_hist._packed_blocks().items():
+          packed_parts[is_eft].append(block.take(np.arange(len(block)), keys=[(new_idx,) + key for key in block.keys]))
+        packed_order += [(new_idx,) + key for key in reduced_hist._sumw]
+        continue
       for key in reduced_hist._sumw:
         new_key = (new_idx,) + key
         out._sumw[new_key] = reduced_hist._sumw[key]
@@ -635,6 +1230,9 @@ class HistEFT(coffea.hist.Hist):
           else:
             out._sumw2[new_key] = None
 
+    if self._blocks is not None:
+      out._bind_blocks({is_eft: out._concat_blocks(is_eft, parts) for is_eft, parts in packed_parts.items()}, packed_order)
+      if out._sumw2 is None and self._sumw2 is not None: out._sumw2 = {}
     return out
 
   def rebin(self, old_axis, new_axis):
@@ -665,6 +1263,24 @@ class HistEFT(coffea.hist.Hist):
         anew[view_ax(inew)] += array[view_ax(iold)]
       return anew
 
+    if self._blocks is not None:
+      # Same as dense_op, but for all of the rows of a block at once
+      def block_op(array):
+        anew = np.zeros(shape=(array.shape[0], *out._dense_shape, *array.shape[1+self.dense_dim():]), dtype=out._dtype)
+        for iold, inew in enumerate(binmap):
+          anew[(slice(None),) + view_ax(inew)] += array[(slice(None),) + view_ax(iold)]
+        return anew
+      blocks = {}
+      for is_eft, block in self._packed_blocks().items():
+        blocks[is_eft] = SparseBlock(
+          block.keys,
+          block_op(block.sumw),
+          None if block.sumw2 is None else block_op(block.sumw2),
+          None if block.has_sumw2 is None else block.has_sumw2.copy()
+        )
+      out._bind_blocks(blocks, list(self._sumw.keys()))
+      return out
+
     for key in self._sumw:
       out._sumw[key] = dense_op(self._sumw[key])
       if self._sumw2 is not None:
@@ -698,6 +1314,9 @@ class HistEFT(coffea.hist.Hist):
           tuple(coffea.hist.hist_tools.overflow_behavior(overflow) for _ in range(self.dense_dim()))
         ]
 
+    if self._blocks is not None:
+      return self._values_packed(sumw2, overflow)
+
     out = {}
     for sparse_key in self._sumw.keys():
       id_key = tuple(ax[k] for ax, k in zip(self.sparse_axes(), sparse_key))
@@ -710,7 +1329,7 @@ class HistEFT(coffea.hist.Hist):
         is_eft_bin = isinstance(self._sumw[sparse_key],np.ndarray)
 
       if is_eft_bin:
-        _sumw = efth.calc_eft_weights(self._sumw[sparse_key],self._wcs)
+        _sumw = efth.calc_eft_weights_batch(self._sumw[sparse_key],self._wcs)[0]
       else:
         _sumw = self._sumw[sparse_key]
 
@@ -718,7 +1337,7 @@ class HistEFT(coffea.hist.Hist):
         if self._sumw2 is not None:
             if is_eft_bin:
               if self._sumw2[sparse_key] is not None:
-                _sumw2 = efth.calc_eft_w2(self._sumw2[sparse_key],self._wcs)
+                _sumw2 = efth.calc_eft_w2_batch(self._sumw2[sparse_key],self._wcs)[0]
               else:
                 # Set really tiny error bars (e.g. one one-millionth the size of the average bin)
                 _sumw2 = np.full_like(_sumw,1e-30*np.mean(_sumw))
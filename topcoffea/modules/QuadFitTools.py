@@ -1,4 +1,5 @@
 import os
+import functools
 from coffea.nanoevents import NanoEventsFactory
 import awkward as ak
 
@@ -110,6 +111,103 @@ def get_quad_keys(wc_lst):
     return quad_terms_lst
 
 
+# Parse the key strings of a quad fit dict (e.g. "ctG*sm") into the names of the two WCs of each term
+# Cached since the same keys are used over and over (e.g. when scanning many points)
+@functools.lru_cache(maxsize=None)
+def parse_quad_keys(quad_keys):
+    return tuple(tuple(k.split("*")) for k in quad_keys)
+
+
+########## Compiled quad fits ##########
+
+class QuadFit:
+    '''
+        One or more quad fits (e.g. for several processes or systematic variations) compiled into arrays
+          - The term names are parsed once into the indices of their WCs, so the fits can be evaluated at many WC points at once
+          - The coeffs array has shape (n fits, n terms), with the terms in the order of get_quad_keys(wc_names)
+    '''
+
+    def __init__(self,wc_names,coeffs,labels=None):
+        self.wc_names = [wc for wc in wc_names if wc != "sm"]
+        self.coeffs = np.atleast_2d(np.asarray(coeffs,dtype=float))
+        self.labels = list(range(len(self.coeffs))) if labels is None else list(labels)
+        if self.coeffs.shape[-1] != len(get_quad_keys(self.wc_names)):
+            raise Exception(f"Error: Expected {len(get_quad_keys(self.wc_names))} quad terms for {len(self.wc_names)} WCs, received {self.coeffs.shape[-1]}.")
+        if len(self.labels) != len(self.coeffs):
+            raise Exception(f"Error: Got {len(self.labels)} labels for {len(self.coeffs)} fits.")
+
+        # The index (in ["sm"]+wc_names) of the two WCs of each term, and where the 1d fit terms of each WC are
+        idx_map = {wc: i for i,wc in enumerate(["sm"]+self.wc_names)}
+        self.term_idx = np.array([[idx_map[wc1],idx_map[wc2]] for wc1,wc2 in parse_quad_keys(tuple(get_quad_keys(self.wc_names)))],dtype=int)
+        self._term_lookup = {tuple(pair): i for i,pair in enumerate(self.term_idx.tolist())}
+
+    # Make a QuadFit from a fit dict {"sm*sm": val, "ctG*sm": val, ...} or a dict of fit dicts {label: fit_dict}
+    # Terms that are missing from a fit dict are taken to be 0
+    @classmethod
+    def from_fit_dicts(cls,fit_dicts):
+        if len(fit_dicts) and not isinstance(next(iter(fit_dicts.values())),dict):
+            fit_dicts = {0: fit_dicts}
+        wc_names = []
+        for fit_dict in fit_dicts.values():
+            for wc1,wc2 in parse_quad_keys(tuple(fit_dict.keys())):
+                for wc in [wc1,wc2]:
+                    if wc != "sm" and wc not in wc_names: wc_names.append(wc)
+        quad_fit = cls(wc_names,np.zeros((len(fit_dicts),len(get_quad_keys(wc_names)))),labels=list(fit_dicts.keys()))
+        idx_map = {wc: i for i,wc in enumerate(["sm"]+wc_names)}
+        for row,fit_dict in enumerate(fit_dicts.values()):
+            for (wc1,wc2),val in zip(parse_quad_keys(tuple(fit_dict.keys())),fit_dict.values()):
+                i,j = idx_map[wc1],idx_map[wc2]
+                quad_fit.coeffs[row,quad_fit._term_lookup[(max(i,j),min(i,j))]] = val
+        return quad_fit
+
+    # Get the fits back as a dict of fit dicts {label: fit_dict}
+    def to_fit_dicts(self):
+        quad_keys = get_quad_keys(self.wc_names)
+        return {label: dict(zip(quad_keys,row)) for label,row in zip(self.labels,self.coeffs)}
+
+    # Get the WC points as an array of shape (n points, n WCs)
+    #   - Either an array that is already in that shape (with the WCs in the order of wc_names)
+    #   - Or a dictionary {wc name: array of values}, WCs that are not specified are set to 0
+    def get_wc_arr(self,wc_pts):
+        if isinstance(wc_pts,dict):
+            for wc in wc_pts.keys():
+                if wc not in self.wc_names: raise Exception(f"Error: Unknown WC \"{wc}\".")
+            npts = max([np.size(v) for v in wc_pts.values()],default=1)
+            return np.stack([np.broadcast_to(np.asarray(wc_pts.get(wc,0.0),dtype=float),(npts,)) for wc in self.wc_names],axis=-1).reshape(npts,len(self.wc_names))
+        wc_arr = np.atleast_2d(np.asarray(wc_pts,dtype=float))
+        if wc_arr.shape[-1] != len(self.wc_names):
+            raise Exception(f"Error: Expected {len(self.wc_names)} WC values per point, received {wc_arr.shape[-1]}.")
+        return wc_arr
+
+    # Evaluate all of the fits at all of the WC points, returns an array of shape (n fits, n points)
+    def eval(self,wc_pts):
+        wc_arr = self.get_wc_arr(wc_pts)
+        x = np.hstack((np.ones((len(wc_arr),1)),wc_arr))
+        terms = x[:,self.term_idx[:,0]]*x[:,self.term_idx[:,1]]
+        return self.coeffs @ terms.T
+
+    # Get the constant, linear, quadratic terms for a list of WCs (defaults to all), returns an array of shape (n fits, n WCs, 3)
+    def get_1d_fits(self,wc_lst=None):
+        if wc_lst is None: wc_lst = self.wc_names
+        idx = []
+        for wc in wc_lst:
+            i = self.wc_names.index(wc) + 1
+            idx.append([self._term_lookup[(0,0)],self._term_lookup[(i,0)],self._term_lookup[(i,i)]])
+        return self.coeffs[:,np.array(idx,dtype=int).reshape(len(wc_lst),3)]
+
+    # Find where the 1d fits cross a threshold, for all of the fits and WCs at once, returns an array of shape (n fits, n WCs, 2)
+    def find_crossings(self,threshold,wc_lst=None):
+        return find_where_fits_cross_threshold(self.get_1d_fits(wc_lst),threshold)
+
+    # Scan the 1d fits over a range for each WC (all other WCs at 0), returns x of shape (n WCs, n points) and y of shape (n fits, n WCs, n points)
+    def scan_1d(self,wc_ranges,npoints=1000,wc_lst=None):
+        if wc_lst is None: wc_lst = self.wc_names
+        x = np.array([np.linspace(*wc_ranges.get(wc,[-10,10]),npoints) for wc in wc_lst]).reshape(len(wc_lst),npoints)
+        params = self.get_1d_fits(wc_lst)
+        y = params[...,0,None] + params[...,1,None]*x + params[...,2,None]*x*x
+        return x, y
+
+
 ########## Plotting tools ##########
 
 # Takes two arrays and returnes a shifted differences
@@ -138,28 +236,18 @@ def make_1d_quad_plot(quad_params_dict,xaxis_name,yaxis_name,title,xaxis_range=[
     ax.set_ylabel(yaxis_name)
     ax.set_title(title)
 
-    # Get x and y arr from quad params
-    ymax = 0
-    ymin = 99999999
-    quad_arr_dict = {}
-    for key_name, quad_params in quad_params_dict.items():
-
-        # Get the quad fit params from the list
+    # Get x and y arr from quad params (for all of the fits at once)
+    for quad_params in quad_params_dict.values():
         if len(quad_params) != 3:
             raise Exception(f"Error: Wrong number of parameters specified for 1d quadratic. Require 3, received {len(quad_params)}.")
-        s0 = quad_params[0] 
-        s1 = quad_params[1]
-        s2 = quad_params[2]
+    x_arr = np.linspace(xaxis_range[0], xaxis_range[1], 1000)
+    params_arr = np.array(list(quad_params_dict.values()),dtype=float).reshape(-1,3)
+    y_arrs = eval_1d_quad(params_arr,x_arr[:,None]).T
+    quad_arr_dict = {key_name: [x_arr,y_arr] for key_name,y_arr in zip(quad_params_dict.keys(),y_arrs)}
 
-        # Find x and y points
-        x_arr = np.linspace(xaxis_range[0], xaxis_range[1], 1000)
-        y_arr = s0 + s1*x_arr + s2*x_arr*x_arr
-
-        # Keep track of overall max y
-        ymax = max(ymax,max(y_arr))
-        ymin = min(ymin,min(y_arr))
-
-        quad_arr_dict[key_name] = [x_arr,y_arr]
+    # Keep track of overall max y
+    ymax = max(0,np.max(y_arrs,initial=0))
+    ymin = min(99999999,np.min(y_arrs,initial=99999999))
 
     # Loop over arr dict and make plots
     for key_name, quad_arr in quad_arr_dict.items():
@@ -260,49 +348,57 @@ def scale_to_sm(fit_dict):
     return scale_fit_dict(fit_dict,1.0/fit_dict["sm*sm"])
 
 # Evalueate a fit dictionary at some point in the wc phase space
+# Note: To evaluate many points (or many fits), compile the fits into a QuadFit instead
 def eval_fit(fit_dict,wcpt_dict):
-    xsec = 0
-    for wc_str, coeff_val in fit_dict.items():
-        wc1,wc2 = wc_str.split("*")
-        if wc1 not in wcpt_dict:
-            if wc1 == "sm":
-                wc1_val = 1.0
+    wc_vals = {"sm": 1.0}
+    for wc_pair in parse_quad_keys(tuple(fit_dict.keys())):
+        for wc in wc_pair:
+            if wc in wc_vals: continue
+            if wc in wcpt_dict:
+                wc_vals[wc] = wcpt_dict[wc]
             else:
-                print(f"WARNING: No value specified for WC {wc1}. Setting it to 0.")
-                wc1_val = 0.0
-        else:
-            wc1_val = wcpt_dict[wc1]
-        if wc2 not in wcpt_dict.keys():
-            if wc2 == "sm":
-                wc2_val = 1.0
-            else:
-                print(f"WARNING: No value specified for WC {wc2}. Setting it to 0.")
-                wc2_val = 0.0
-        else:
-            wc2_val = wcpt_dict[wc2]
-        xsec = xsec + wc1_val*wc2_val*coeff_val
+                print(f"WARNING: No value specified for WC {wc}. Setting it to 0.")
+                wc_vals[wc] = 0.0
+    xsec = 0
+    for (wc1,wc2),coeff_val in zip(parse_quad_keys(tuple(fit_dict.keys())),fit_dict.values()):
+        xsec = xsec + wc_vals[wc1]*wc_vals[wc2]*coeff_val
     return xsec
 
 
 # Evaluate a 1d quadratic at a given point
+#   - Also works for arrays, with the 3 params along the last axis of quad_params_1d
 def eval_1d_quad( quad_params_1d,x):
-    if len(quad_params_1d) != 3:
-        raise Exception(f"Error: Wrong number of parameters specified for 1d quadratic. Require 3, received {len(quad_params)}.")
-    y = quad_params_1d[0] + quad_params_1d[1]*x + quad_params_1d[2]*x*x
+    quad_params_1d = np.asarray(quad_params_1d)
+    if quad_params_1d.shape[-1] != 3:
+        raise Exception(f"Error: Wrong number of parameters specified for 1d quadratic. Require 3, received {quad_params_1d.shape[-1]}.")
+    y = quad_params_1d[...,0] + quad_params_1d[...,1]*x + quad_params_1d[...,2]*x*x
     return y
 
 
 # Takes as input 1d quadratic fit params, and returns the x value where y crosses some threshold
 def find_where_fit_crosses_threshold(quad_params_1d,threshold):
-
-    # Get the individual params
     if len(quad_params_1d) != 3:
-        raise Exception(f"Error: Wrong number of parameters specified for 1d quadratic. Require 3, received {len(quad_params)}.")
-    s0 = quad_params_1d[0]
-    s1 = quad_params_1d[1]
-    s2 = quad_params_1d[2]
-
-    x_p = (-s1 + np.sqrt(s1*s1 - 4.0*s2*(s0-threshold)) )/(2.0*s2)
-    x_m = (-s1 - np.sqrt(s1*s1 - 4.0*s2*(s0-threshold)) )/(2.0*s2)
-
-    return [x_m,x_p]
+        raise Exception(f"Error: Wrong number of parameters specified for 1d quadratic. Require 3, received {len(quad_params_1d)}.")
+    return list(find_where_fits_cross_threshold(quad_params_1d,threshold))
+
+
+# Same as find_where_fit_crosses_threshold, but for any number of fits at once
+#   - The 3 params are along the last axis of quad_params_arr, returns an array with [x_m,x_p] along the last axis
+#   - If there is no crossing the values are nan, if the fit is linear both values are the one crossing
+def find_where_fits_cross_threshold(quad_params_arr,threshold):
+    quad_params_arr = np.asarray(quad_params_arr,dtype=float)
+    if quad_params_arr.shape[-1] != 3:
+        raise Exception(f"Error: Wrong number of parameters specified for 1d quadratic. Require 3, received {quad_params_arr.shape[-1]}.")
+    s0 = quad_params_arr[...,0]
+    s1 = quad_params_arr[...,1]
+    s2 = quad_params_arr[...,2]
+
+    with np.errstate(divide="ignore",invalid="ignore"):
+        sqrt_disc = np.sqrt(s1*s1 - 4.0*s2*(s0-threshold))
+        x_p = (-s1 + sqrt_disc)/(2.0*s2)
+        x_m = (-s1 - sqrt_disc)/(2.0*s2)
+        x_lin = (threshold-s0)/s1
+    x_p = np.where(s2 == 0, x_lin, x_p)
+    x_m = np.where(s2 == 0, x_lin, x_m)
+
+    return np.stack([x_m,x_p],axis=-1)
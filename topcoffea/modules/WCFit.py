@@ -3,6 +3,8 @@
  This is basically a python copy of the c++ WCFit class
    (see: https://github.com/TopEFT/EFTGenReader)
  Per-event fits of WC points are done with numpy.lstsq
+ The coefficients are stored in numpy arrays, so a fit can be evaluated at many WC points at once (see EvalPoints),
+ and many fits (e.g. for different bins or processes) to the same WC points can be done with one solve (see FitMany)
 """
 
 import numpy as np
@@ -11,6 +13,10 @@ from topcoffea.modules.WCPoint import WCPoint
 
 kSMstr = 'sm' # For global use
 
+def GetWCArray(pts, wc_names):
+  """ Get the strengths of the WCs (in the order of wc_names) for a list of WC points, as an array of shape (n points, n WCs) """
+  return np.array([pt.GetStrengths(wc_names) for pt in pts], dtype=float).reshape(len(pts), len(wc_names))
+
 class WCFit:
 
   def SetTag(self, tag):
@@ -107,21 +113,39 @@ class WCFit:
     """ Checks to see if the fit includes the specified WC """
     return wc_name in self.names
 
+  def _GetWCValues(self, pts):
+    """ Get an array of shape (n points, 1 + n WCs) with the values of the fit names (the 'sm' column is always 1) """
+    if isinstance(pts, WCPoint): pts = [pts]
+    if isinstance(pts, (list, tuple)) and (len(pts) == 0 or isinstance(pts[0], WCPoint)):
+      wcs = GetWCArray(pts, self.names[1:])
+    else:
+      wcs = np.atleast_2d(np.asarray(pts, dtype=float))
+      if wcs.shape[-1] != self.GetDim():
+        raise Exception(f"Error: Expected {self.GetDim()} WC values per point (for {self.names[1:]}), got {wcs.shape[-1]}")
+    return np.hstack((np.ones((len(wcs),1)), wcs))
+
+  def _GetTerms(self, pts):
+    """ Get an array of shape (n points, Size()) with the value multiplying each coefficient at each point """
+    x = self._GetWCValues(pts)
+    return x[:,self._pair_idx[:,0]]*x[:,self._pair_idx[:,1]]
+
+  def EvalPoints(self, pts):
+    """ Evaluate the fit at many WC points at once
+        The points can be a list of WCPoints, or an array of shape (n points, n WCs) with the WCs in the order of GetNames()[1:] """
+    return self._GetTerms(pts) @ self.coeffs
+
+  def EvalPointsError(self, pts):
+    """ Evaluate the error fit at many WC points at once (the points are the same as for EvalPoints) """
+    terms = self._GetTerms(pts)
+    return sqrt((terms[:,self._err_idx[:,0]]*terms[:,self._err_idx[:,1]]) @ self.err_coeffs)
+
   def EvalPoint(self, pt, val=0.0):
     """ Evaluate the fit at a particular WC phase space point """
     if not isinstance(pt, WCPoint):
       wc_name = pt
       pt = WCPoint()
       pt.SetStrength(wc_name, val)
-    v = 0
-    for i in range(self.Size()):
-      c = self.coeffs[i]
-      n1 = self.names[(self.pairs[i])[0]]
-      n2 = self.names[(self.pairs[i])[1]]
-      x1 = 1 if n1 == kSMstr else pt.GetStrength(n1)
-      x2 = 1 if n2 == kSMstr else pt.GetStrength(n2)
-      v += x1*x2*c;
-    return v;
+    return self.EvalPoints([pt])[0] if self.Size() else 0
 
   def EvalPointError(self, pt, val = 0.0):
     """ Evaluate the error fit at a particular WC phase space point """
@@ -129,21 +153,7 @@ class WCFit:
       wc_name = pt
       pt = WCPoint()
       pt.SetStrength(wc_name, val)
-    i = 0
-    v,x1,x2,x3,x4,c = 0., 0., 0., 0., 0., 0.
-    n1,n2,n3,n4 = '', '', '', ''
-    err_pair,idx_pair = (0.,0.),(0.,0.)
-    for i in range(self.ErrSize()):
-      c = self.err_coeffs[i]
-      err_pair = self.err_pairs[i]
-      idx_pair = self.pairs[err_pair[0]]; n1 = self.names[idx_pair[0]]; n2 = self.names[idx_pair[1]]
-      idx_pair = self.pairs[err_pair[1]]; n3 = self.names[idx_pair[0]]; n4 = self.names[idx_pair[1]]
-      x1 = 1.0 if n1 == kSMstr else pt.GetStrength(n1)
-      x2 = 1.0 if n2 == kSMstr else pt.GetStrength(n2)
-      x3 = 1.0 if n3 == kSMstr else pt.GetStrength(n3)
-      x4 = 1.0 if n4 == kSMstr else pt.GetStrength(n4)
-      v += x1*x2*x3*x4*c;
-    return sqrt(v);
+    return self.EvalPointsError([pt])[0] if self.ErrSize() else 0.
 
   def AddFit(self, added_fit):
     """ Add fit """
@@ -155,6 +165,8 @@ class WCFit:
       self.coeffs     = added_fit.GetCoefficients().copy()
       self.err_pairs  = added_fit.GetErrorPairs().copy()
       self.err_coeffs = added_fit.GetErrorCoefficients().copy()
+      self._pair_idx  = np.array(self.pairs, dtype=int).reshape(-1,2)
+      self._err_idx   = np.array(self.err_pairs, dtype=int).reshape(-1,2)
       if len(self.tag) == 0: self.tag = added_fit.GetTag()
       return;
 
@@ -165,22 +177,30 @@ class WCFit:
       print("[ERROR] WCFit mismatch in error pairs! (addFit)")
       return
 
-    for i in range(self.ErrSize()):
-      if i < self.Size(): self.coeffs[i] += added_fit.GetCoefficient(i)
-      # It is *very* important that we keep track of the err fit coeffs separately, since Sum(f^2) != (Sum(f))^2
-      self.err_coeffs[i] += added_fit.GetErrorCoefficient(i)
+    self.coeffs += added_fit.GetCoefficients()
+    # It is *very* important that we keep track of the err fit coeffs separately, since Sum(f^2) != (Sum(f))^2
+    self.err_coeffs += added_fit.GetErrorCoefficients()
 
   def Scale(self, val):
-    """ Scaling fit """
-    for i in range(self.Size()):    self.coeffs[i]     *= val
-    for i in range(self.ErrSize()): self.err_coeffs[i] += val*val
+    """ Scaling fit (the error fit is quadratic in the weights, so it scales with the square) """
+    self.coeffs     *= val
+    self.err_coeffs *= val*val
 
   def Clear(self):
-    self.names.clear()
-    self.pairs.clear()
-    self.coeffs.clear()
-    self.err_pairs.clear()
-    self.err_coeffs.clear()
+    self.names = []
+    self.pairs = []
+    self.coeffs = np.zeros(0)
+    self.err_pairs = []
+    self.err_coeffs = np.zeros(0)
+    self._pair_idx = np.zeros((0,2), dtype=int)
+    self._err_idx = np.zeros((0,2), dtype=int)
+
+  def _CalcErrorCoefficients(self, coefficients):
+    """ The error fit structure constants when each fitted point is a single weight (i.e. the products of the fit structure constants) """
+    c = np.asarray(coefficients, dtype=float)
+    c1 = c[...,self._err_idx[:,0]]
+    c2 = c[...,self._err_idx[:,1]]
+    return np.where(self._err_idx[:,0] == self._err_idx[:,1], 1., 2.)*c1*c2
 
   def Serialize(self):
     """ Serialize WCFit {coeffs: numbers} and {err_coeffs: numbers} to JSON """
@@ -203,8 +223,8 @@ class WCFit:
       derr.setdefault(key, []).append(self.err_coeffs[i])
     '''
     lnames = [(i,j) for i in self.names for j in self.names]
-    dcoeff = [[p, self.coeffs[self.pairs.index(p)]] for p in self.pairs]
-    derr = [[p, self.err_coeffs[self.err_pairs.index(p)]] for p in self.err_pairs]
+    dcoeff = [[p, float(self.coeffs[self.pairs.index(p)])] for p in self.pairs]
+    derr = [[p, float(self.err_coeffs[self.err_pairs.index(p)])] for p in self.err_pairs]
     #f = open('serial.json','a')
     #f.write(self.GetTag()+'\n')
     d = {'tag': self.GetTag(),\
@@ -315,80 +335,98 @@ class WCFit:
 
     self.names.append(newName)
     new_idx1 = len(self.names)-1
-    # Extend the pairs and coeffs vectors
+    # Extend the pairs and err_pairs vectors
     for i in range(new_idx1+1):
       idx_pair1 = (new_idx1, i)
       self.pairs.append(idx_pair1)
-      self.coeffs.append(0.0) # Extending makes no assumptions about the fit coefficients
-      # Extend the err_pairs and err_coeffs vectors
       new_idx2 = len(self.pairs)-1
       for j in range(new_idx2+1):
         idx_pair2 = (new_idx2,j)
         self.err_pairs.append(idx_pair2)
-        self.err_coeffs.append(0.0)
+    # Extending makes no assumptions about the fit coefficients
+    self.coeffs = np.append(self.coeffs, np.zeros(len(self.pairs) - len(self.coeffs)))
+    self.err_coeffs = np.append(self.err_coeffs, np.zeros(len(self.err_pairs) - len(self.err_coeffs)))
+    self._pair_idx = np.array(self.pairs, dtype=int)
+    self._err_idx = np.array(self.err_pairs, dtype=int)
 
   def FitPoints(self,pts):
     """ Extract a n-Dim quadratic fit from a collection of WC phase space points """
     self.Clear()
     if len(pts) == 0: return
 
-    self.Extend(kSMstr) # The SM term is always first
-
     # This assumes that all WCPoints have exact same list of WC names
-    for kv in pts[0].inputs.keys(): 
-      self.Extend(kv)
-
-    nCols = self.Size() # Should be equal to 1 + 2*N + N*(N - 1)/2
-    nRows = len(pts)
-
-    A = []; b = []
-    for rid in range(nRows):
-      A.append([])
-      for cid in range(nCols):
-        idx_pair = self.pairs[cid]
-        n1 = self.names[idx_pair[0]]
-        n2 = self.names[idx_pair[1]]
-        x1 = 1. if n1 == kSMstr else pts[rid].inputs[n1]
-        x2 = 1. if n2 == kSMstr else pts[rid].inputs[n2]
-        A[rid].append(x1*x2)
-      b.append(pts[rid].wgt)
-    A = np.array(A)
-    b = np.array(b)
+    self.SetNames(list(pts[0].inputs.keys()))
+
+    A = self._GetTerms(pts) # Should have 1 + 2*N + N*(N - 1)/2 columns
+    b = np.array([pt.wgt for pt in pts])
 
     c_x, _, _, _ = np.linalg.lstsq(A,b, rcond=None) # Solve for the fit parameters
-    for i in range(self.ErrSize()):
-      if i < self.Size(): self.coeffs[i] = c_x[i]
-      idx_pair = self.err_pairs[i]
-      self.err_coeffs[i] = c_x[idx_pair[0]]*c_x[idx_pair[1]] if idx_pair[0] == idx_pair[1] else 2*c_x[idx_pair[0]]*c_x[idx_pair[1]]
+    self.coeffs = c_x
+    self.err_coeffs = self._CalcErrorCoefficients(c_x)
+
+  @classmethod
+  def FitMany(cls, pts, wgts, tags=None):
+    """ Extract the fits for many sets of weights (e.g. for different bins or processes) at the same WC points, with one lstsq solve
+          pts  : The WC points (either a list of WCPoints, or a dict {wc name: array of the strengths at each point})
+          wgts : Array of shape (n points, n fits), column i holds the weights to fit for fit i
+        Returns a list of n fits WCFit objects """
+    if isinstance(pts, dict):
+      names = list(pts.keys())
+      wcs = np.stack([np.asarray(pts[n], dtype=float) for n in names], axis=-1) if names else np.zeros((len(wgts),0))
+    else:
+      names = list(pts[0].inputs.keys()) if len(pts) else []
+      wcs = GetWCArray(pts, names)
+    wgts = np.asarray(wgts, dtype=float)
+    if wgts.ndim == 1: wgts = wgts[:,None]
+    if len(wgts) != len(wcs):
+      raise Exception(f"Error: Got {len(wcs)} WC points but {len(wgts)} rows of weights")
+    if tags is None: tags = ['']*wgts.shape[1]
+
+    base = cls()
+    base.SetNames(names)
+    c_x, _, _, _ = np.linalg.lstsq(base._GetTerms(wcs), wgts, rcond=None) # Solve for the fit parameters of all of the fits at once
+    err_x = base._CalcErrorCoefficients(c_x.T)
+
+    fits = []
+    for i in range(wgts.shape[1]):
+      fit = cls(tag=tags[i])
+      fit.SetNames(names)
+      fit.coeffs = c_x[:,i].copy()
+      fit.err_coeffs = err_x[i].copy()
+      fits.append(fit)
+    return fits
+
+  def SetNames(self, names):
+    """ Reset the fit to the given WC names (plus 'sm', which is always first), with all coefficients 0 """
+    self.Clear()
+    self.Extend(kSMstr) # The SM term is always first
+    for name in names: self.Extend(name)
 
   def SetNamesAndCoefficients(self, names, coefficients, errors=[]):
     self.Clear()
     if len(names) == 0: return
-    self.Extend(kSMstr)
+    self.SetNames(names)
 
-    for name in names: self.Extend(name)
     if self.Size() != len(coefficients):
       print('ERROR : %i coefficients are needed but %i are given'%(self.Size(), len(coefficients)))
       return
- 
-    for i in range(self.Size()):
-      self.coeffs[i] = coefficients[i]
 
-    if len(errors) == self.ErrSize():
-      for i in range(self.ErrSize()):
-        self.err_coeffs[i] = errors[i]
+    self.coeffs = np.array(coefficients, dtype=float)
+
+    if errors is not None and len(errors) == self.ErrSize():
+      self.err_coeffs = np.array(errors, dtype=float)
     else:
-      for i in range(self.ErrSize()):
-        idx_pair = self.err_pairs[i]
-        self.err_coeffs[i] = coefficients[idx_pair[0]]*coefficients[idx_pair[1]] if idx_pair[0] == idx_pair[1] else 2*coefficients[idx_pair[0]]*coefficients[idx_pair[1]]
+      self.err_coeffs = self._CalcErrorCoefficients(self.coeffs)
 
   def __init__(self, wcpoints=None, tag='', names=None, coeffs=None, errors=None):
     """ Constructor """
     self.names = [] # Includes 'sm'
     self.pairs = [] # pair doublets of the 'names' list
-    self.coeffs = [] # fit structure constants
+    self.coeffs = np.zeros(0) # fit structure constants
     self.err_pairs = [] # pair doubles, indices of the 'pairs' list
-    self.err_coeffs = [] # The error fit structure constants
+    self.err_coeffs = np.zeros(0) # The error fit structure constants
+    self._pair_idx = np.zeros((0,2), dtype=int) # The pairs and err_pairs as arrays, for evaluating many points at once
+    self._err_idx = np.zeros((0,2), dtype=int)
     self.tag = ''
     self.tag = tag
     if wcpoints != None:
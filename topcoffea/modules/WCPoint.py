@@ -30,13 +30,17 @@ class WCPoint:
 
   def SetSMPoint(self):
     """ Sets all WCs to SM value (i.e. 0.) """
-    for i in range(len(self.inputs)): 
-      self.inputs[i] = 0.0
+    for k in self.inputs.keys():
+      self.inputs[k] = 0.0
 
   def GetStrength(self, wcName):
     """ Get strength for a particular WC """
     return self.inputs[wcName] if wcName in self.inputs else 0.0
 
+  def GetStrengths(self, wc_names):
+    """ Get the strengths for a list of WCs (0 for the ones the point does not have) """
+    return [self.GetStrength(n) for n in wc_names]
+
   def GetEuclideanDistance(self, pt=None):
     """ Calculates the distance from the origin (SM point) using euclidean metric """
     if pt == None:
@@ -7,6 +7,9 @@ from topcoffea.modules.HistEFT import HistEFT
 from topcoffea.modules.paths import topcoffea_path
 from topcoffea.modules.GetValuesFromJsons import get_lumi
 import topcoffea.modules.utils as utils
+import topcoffea.modules.hist_store as hist_store
+import topcoffea.modules.eft_helper as efth
+from coffea.hist.hist_tools import overflow_behavior
 
 class YieldTools():
 
@@ -335,6 +338,11 @@ class YieldTools():
     # Find the list of hists in a pkl file
     def get_hist_list(self,path,allow_empty=True):
 
+        # For a hist store, the list can be read from the index without loading any of the hists
+        if type(path) is str and hist_store.is_hist_store(path):
+            with hist_store.HistStoreReader(path) as reader:
+                return [k for k in reader.keys() if allow_empty or not reader.is_empty(k)]
+
         # Get the dict
         if type(path) is str: hin_dict = utils.get_hist_from_pkl(path,allow_empty)
         else: hin_dict = path
@@ -443,20 +451,25 @@ class YieldTools():
 
 
 
+    # Get the SR bin of the appl axis for a category (or channel) name
+    def get_appl_bin(self,lep_cat):
+        if "2lss" in lep_cat:
+            return self.APPL_DICT["2lss"]
+        elif "2los" in lep_cat:
+            return self.APPL_DICT["2los"]
+        elif "3l" in lep_cat:
+            return self.APPL_DICT["3l"]
+        elif "4l" in lep_cat:
+            return self.APPL_DICT["4l"]
+        else:
+            raise Exception(f"Error: Category \"{lep_cat}\" is not known.")
+
+
     # Integrate appl axis if present, keeping only SR
     def integrate_out_appl(self,histo,lep_cat):
         histo_integrated = copy.deepcopy(histo)
         if ("appl" in self.get_axis_list(histo)):
-            if "2lss" in lep_cat:
-                sr_bin = self.APPL_DICT["2lss"]
-            elif "2los" in lep_cat:
-                sr_bin = self.APPL_DICT["2los"]
-            elif "3l" in lep_cat:
-                sr_bin = self.APPL_DICT["3l"]
-            elif "4l" in lep_cat:
-                sr_bin = self.APPL_DICT["4l"]
-            else:
-                raise Exception(f"Error: Category \"{lep_cat}\" is not known.")
+            sr_bin = self.get_appl_bin(lep_cat)
             histo_integrated = histo.integrate("appl",sr_bin)
         else:
             print("Already integrated out the appl axis. Continuing...")
@@ -596,7 +609,7 @@ class YieldTools():
 
         # Reweight the hist
         if rwgt_pt is not None:
-            hist.set_wilson_coefficients(**wc_vals)
+            h.set_wilson_coefficients(**rwgt_pt)
         else:
             h.set_sm()
 
@@ -608,11 +621,99 @@ class YieldTools():
         return self.get_yield(h,proc,overflow_str)
 
 
+    # Get the yields for all of the samples and categories of a hist at once, without integrating (or copying) the hist
+    #   - The cat_dict maps each category name to the cuts defining it, e.g. {"2lss_p": {"channel":"2lss_p","appl":"isSR_2lSS"}}
+    #   - Only the nominal is used (if there is a systematic axis), any other sparse axes are summed over
+    #   - The wc_pts is a list of dicts of WC values (WCs that are not specified are 0), defaults to just the SM
+    #   - Returns {sample: {cat: (sumw,sumw2)}}, where sumw and sumw2 are arrays with one element per WC point
+    #   - Note: For EFT bins without w**2 coefficients, the sumw2 is taken to be 0
+    def get_yields(self,h,cat_dict,wc_pts=None,overflow_str="none"):
+
+        # Get the WC points as a 2d array, in the order of the WCs of the hist
+        if wc_pts is None: wc_pts = [{}]
+        wc_names = list(getattr(h,"_wcnames",[]))
+        wc_arr = np.zeros((len(wc_pts),len(wc_names)))
+        for i,wc_pt in enumerate(wc_pts):
+            for wc_name,wc_val in wc_pt.items():
+                if wc_name not in wc_names:
+                    raise Exception(f"Error: Unknown WC \"{wc_name}\", the WCs in the hist are: {wc_names}")
+                wc_arr[i,wc_names.index(wc_name)] = wc_val
+
+        # Precompute which categories the values along the cut axes belong to
+        sparse_axis_names = [ax.name for ax in h.sparse_axes()]
+        cut_axis_names = sorted(set(axis_name for cuts_dict in cat_dict.values() for axis_name in cuts_dict.keys()))
+        cut_axis_idx = [sparse_axis_names.index(axis_name) for axis_name in cut_axis_names]
+        sample_idx = sparse_axis_names.index("sample")
+        syst_idx = sparse_axis_names.index("systematic") if "systematic" in sparse_axis_names else None
+        def passes(cuts,axis_name,val):
+            if axis_name not in cuts: return True
+            cut = cuts[axis_name]
+            return (val == cut) if isinstance(cut,str) else (val in cut)
+        cat_map = {}
+        def get_cats(cut_vals):
+            if cut_vals not in cat_map:
+                cat_map[cut_vals] = [cat for cat,cuts in cat_dict.items() if all(passes(cuts,n,v) for n,v in zip(cut_axis_names,cut_vals))]
+            return cat_map[cut_vals]
+
+        # Sum the dense bins of each sparse bin, and add them up for each (sample,cat)
+        # The EFT bins are summed as coefficients, and only evaluated at the WC points at the end
+        view = tuple(overflow_behavior(overflow_str) for _ in range(h.dense_dim()))
+        dense_axes = tuple(range(h.dense_dim()))
+        sums = {}
+        for key,sumw in h._sumw.items():
+            if (syst_idx is not None) and (key[syst_idx].name != "nominal"): continue
+            cat_lst = get_cats(tuple(key[i].name for i in cut_axis_idx))
+            if len(cat_lst) == 0: continue
+            is_eft = (sumw.shape != h._dense_shape)
+            sumw2 = None if h._sumw2 is None else h._sumw2.get(key)
+            if is_eft:
+                has_w2 = (sumw2 is not None) and (sumw2.shape == (*h._dense_shape,h._nerrcoeffs))
+            else:
+                # Without sumw2, the sumw is used as the sumw2 (i.e. the same as what values() does)
+                has_w2 = True
+                if sumw2 is None: sumw2 = sumw
+            sumw_tot = sumw[view].sum(axis=dense_axes)
+            sumw2_tot = sumw2[view].sum(axis=dense_axes) if has_w2 else None
+            for cat in cat_lst:
+                sum_key = (key[sample_idx].name,cat,is_eft)
+                if sum_key not in sums:
+                    sums[sum_key] = [sumw_tot,sumw2_tot]
+                else:
+                    sums[sum_key][0] = sums[sum_key][0] + sumw_tot
+                    if sumw2_tot is not None:
+                        sums[sum_key][1] = sumw2_tot if sums[sum_key][1] is None else sums[sum_key][1] + sumw2_tot
+
+        # Evaluate the sums at the WC points, for all of the EFT sums at once
+        out = {}
+        eft_keys = [k for k in sums.keys() if k[2]]
+        if len(eft_keys) > 0:
+            eft_sumw = efth.calc_eft_weights_batch(np.stack([sums[k][0] for k in eft_keys]),wc_arr)
+            eft_w2_keys = [k for k in eft_keys if sums[k][1] is not None]
+            eft_sumw2 = np.zeros_like(eft_sumw)
+            if len(eft_w2_keys) > 0:
+                w2_idx = [eft_keys.index(k) for k in eft_w2_keys]
+                eft_sumw2[:,w2_idx] = efth.calc_eft_w2_batch(np.stack([sums[k][1] for k in eft_w2_keys]),wc_arr)
+        for sum_key,(sumw_tot,sumw2_tot) in sums.items():
+            sample,cat,is_eft = sum_key
+            if is_eft:
+                i = eft_keys.index(sum_key)
+                vals = (eft_sumw[:,i],eft_sumw2[:,i])
+            else:
+                vals = (np.full(len(wc_pts),sumw_tot),np.full(len(wc_pts),sumw2_tot))
+            if cat in out.setdefault(sample,{}):
+                vals = (out[sample][cat][0]+vals[0],out[sample][cat][1]+vals[1])
+            out[sample][cat] = vals
+
+        return out
+
+
     # This function:
     #   - Takes as input a hist dict (i.e. what the processor outptus)
     #   - Returns a dictionary of yields for the categories in the "channel" axis
     #   - Optionally sums over njets or lep flavs
-    def get_yld_dict(self,hin_dict,year=None,njets=False,lepflav=False):
+    #   - Optionally takes a dict of named WC points ({name: {wc: val}}), in which case a dict of yield dicts (one per point) is returned
+    #     Note: All of the points are evaluated in the same pass over the hist
+    def get_yld_dict(self,hin_dict,year=None,njets=False,lepflav=False,wc_pts=None):
 
         # Check for options that do not make sense
         if lepflav and not self.is_split_by_lepflav(hin_dict):
@@ -631,8 +732,12 @@ class YieldTools():
                 cat_dict[ch]["appl"] = self.APPL_DICT[nlep_str]
             cat_dict[ch]["channel"] = ch
 
-        # Find the yields
-        yld_dict = {}
+        # Find the yields (at all of the WC points), keep overflow since it's important
+        pt_names = [None] if wc_pts is None else list(wc_pts.keys())
+        ylds = self.get_yields(hin_dict[hist_to_use],cat_dict,wc_pts=(None if wc_pts is None else list(wc_pts.values())),overflow_str="over")
+
+        # Put the yields into a yield dict for each WC point
+        yld_dict_per_pt = {pt_name: {} for pt_name in pt_names}
         proc_lst = self.get_cat_lables(hin_dict,"sample")
         #if "flipsUL17" not in proc_lst: proc_lst = proc_lst + ["flipsUL16","flipsUL16APV","flipsUL17","flipsUL18"] # Very bad workaround for _many_ reasons.. leaving it in since it's useful for getting yields of the full pkl file (but we don't need it for e.g. the CI, so leave it commented), note this entire class is a mess and should be totally rewritten before the next analysis
         print("proc_lst",proc_lst)
@@ -643,22 +748,29 @@ class YieldTools():
         for proc in proc_lst:
             if year is not None:
                 if not proc.endswith(year): continue
-            lumi_factor = self.get_lumi_for_sample(proc)
+            # Scale the mc by lumi
+            lumi_factor = 1.0 if "data" in proc else self.get_lumi_for_sample(proc)
             proc_name_short = self.get_short_name(proc)
-            if proc_name_short not in yld_dict:
-                yld_dict[proc_name_short] = {}
-                for cat,cuts_dict in cat_dict.items():
-                    yld_dict[proc_name_short][cat] = self.get_normalized_yield(hin_dict,lumi_factor,proc,cuts_dict,overflow_str="over",h_name=hist_to_use) # Important to keep overflow
-            else:
-                for cat,cuts_dict in cat_dict.items():
-                    yld_dict[proc_name_short][cat][0] += self.get_normalized_yield(hin_dict,lumi_factor,proc,cuts_dict,overflow_str="over",h_name=hist_to_use)[0] # Important to keep overflow
-                    yld_dict[proc_name_short][cat][1] = None # Ok, let's just forget the sumw2...
+            for i,pt_name in enumerate(pt_names):
+                yld_dict = yld_dict_per_pt[pt_name]
+                for cat in cat_dict.keys():
+                    sumw, sumw2 = ylds.get(proc,{}).get(cat,([0.0]*len(pt_names),[0.0]*len(pt_names)))
+                    yld = [sumw[i]*lumi_factor, np.sqrt(sumw2[i])*lumi_factor]
+                    if proc_name_short not in yld_dict:
+                        yld_dict[proc_name_short] = {}
+                    if cat not in yld_dict[proc_name_short]:
+                        yld_dict[proc_name_short][cat] = yld
+                    else:
+                        yld_dict[proc_name_short][cat][0] += yld[0]
+                        yld_dict[proc_name_short][cat][1] = None # Ok, let's just forget the sumw2...
 
         # If the file is split by lepton flav, but we don't want that, sum over lep flavors:
         if self.is_split_by_lepflav(hin_dict) and not lepflav:
-            yld_dict = self.sum_over_lepcats(yld_dict)
+            yld_dict_per_pt = {pt_name: self.sum_over_lepcats(yld_dict) for pt_name,yld_dict in yld_dict_per_pt.items()}
 
-        return yld_dict
+        if wc_pts is None:
+            return yld_dict_per_pt[None]
+        return yld_dict_per_pt
 
 
 
@@ -834,12 +946,12 @@ class YieldTools():
     # Print out all the info about all the axes in a hist
     def print_hist_info(self,path,h_name="njets",verbose=False):
 
-        # Get the dict
-        if type(path) is str: hin_dict = utils.get_hist_from_pkl(path)
+        # Get the dict (from a hist store only the hists that get printed need to be loaded)
+        if type(path) is str: hin_dict = utils.get_hist_from_pkl(path,hist_lst=(None if verbose else [h_name]))
         else: hin_dict = path
 
         # Print info about all keys
-        print("\nThe keys of the dict are:",list(hin_dict.keys()))
+        print("\nThe keys of the dict are:",self.get_hist_list(path))
         if verbose:
             for k in hin_dict.keys():
                 print(f"\n{k}: {hin_dict[k].values()}")
@@ -0,0 +1,100 @@
+'''
+    Compact, versioned binary format for the binned lookup tables of the corrections (e.g. the flip rates)
+
+    Layout of a lookup file (little endian):
+        - Header: the magic bytes (8 bytes), the format version (uint32) and the number of axes ndim (uint32)
+        - The sha256 digest of the file the table was made from (32 bytes, all zeros if not given), from version 2 on
+        - The number of bins of each axis (ndim uint64)
+        - The bin edges of each axis, one after the other (float64, nbins+1 of them for each axis)
+        - The values of the table (float64, in C order)
+
+    Everything is 8 byte aligned, so when the file is read it is just memory mapped and the arrays are views
+    into it (no unpickling, and the pages are shared between the processes on the same node).
+
+    The digest of the source file (e.g. the pkl file with the histogram of the flip rates) is used to check that
+    the lookup file is up to date with it (see is_up_to_date), so the source file stays the reference.
+
+    Example:
+        dump_lookup("flip_probs_topcoffea_UL17.lookup",ratio_arr,[pt_edges,abseta_edges],source="flip_probs_topcoffea_UL17.pkl.gz")
+        values, edges = load_lookup("flip_probs_topcoffea_UL17.lookup")
+'''
+
+import hashlib
+import struct
+import numpy as np
+
+LOOKUP_EXT = ".lookup"
+LOOKUP_MAGIC = b"TCLOOKUP"
+LOOKUP_VERSION = 2
+HEADER = struct.Struct("<8sII")
+SOURCE_DIGEST = struct.Struct("<32s")
+NO_SOURCE_DIGEST = bytes(SOURCE_DIGEST.size)
+
+# Get the sha256 digest of the contents of a file
+def get_file_digest(fpath):
+    h = hashlib.sha256()
+    with open(fpath,"rb") as f:
+        for block in iter(lambda: f.read(1<<20),b""):
+            h.update(block)
+    return h.digest()
+
+# Write a table of values with the bin edges of each of its axes to a lookup file
+#   - source: The path of the file the table was made from (its digest is stored in the lookup file)
+def dump_lookup(fpath,values,edges,source=None):
+    values = np.ascontiguousarray(values,dtype="<f8")
+    edges = [np.ascontiguousarray(e,dtype="<f8") for e in edges]
+    if len(edges) != values.ndim:
+        raise ValueError(f"Got {len(edges)} axes of edges for a table with {values.ndim} dimensions")
+    for i,(e,nbins) in enumerate(zip(edges,values.shape)):
+        if e.shape != (nbins+1,):
+            raise ValueError(f"Axis {i} has {len(e)} edges, expected {nbins+1}")
+    source_digest = NO_SOURCE_DIGEST if source is None else get_file_digest(source)
+    with open(fpath,"wb") as f:
+        f.write(HEADER.pack(LOOKUP_MAGIC,LOOKUP_VERSION,values.ndim))
+        f.write(SOURCE_DIGEST.pack(source_digest))
+        f.write(np.asarray(values.shape,dtype="<u8").tobytes())
+        for e in edges:
+            f.write(e.tobytes())
+        f.write(values.tobytes())
+    return fpath
+
+# Read the header of a lookup file, returns the number of axes, the digest of the source file (None if not stored) and the offset of the data
+def _read_header(buf,fpath):
+    if len(buf) < HEADER.size:
+        raise RuntimeError(f"Not a lookup file (too short): {fpath}")
+    magic,version,ndim = HEADER.unpack_from(buf,0)
+    if magic != LOOKUP_MAGIC:
+        raise RuntimeError(f"Not a lookup file (bad magic bytes): {fpath}")
+    if version > LOOKUP_VERSION:
+        raise RuntimeError(f"Unsupported lookup file version {version} in {fpath}")
+    offset = HEADER.size
+    source_digest = None
+    if version >= 2:
+        source_digest, = SOURCE_DIGEST.unpack_from(buf,offset)
+        offset += SOURCE_DIGEST.size
+        if source_digest == NO_SOURCE_DIGEST:
+            source_digest = None
+    return ndim,source_digest,offset
+
+# Get the digest of the source file stored in a lookup file (None if it was not stored)
+def get_source_digest(fpath):
+    return _read_header(np.memmap(fpath,dtype=np.uint8,mode="r"),fpath)[1]
+
+# Check that a lookup file was made from the current contents of the source file
+# Note: A lookup file without the digest of its source (e.g. of version 1) can not be checked, so it is never up to date
+def is_up_to_date(fpath,source):
+    source_digest = get_source_digest(fpath)
+    return (source_digest is not None) and (source_digest == get_file_digest(source))
+
+# Read a lookup file, returns the table of values and the list of the bin edges (read only views of the mapped file)
+def load_lookup(fpath):
+    buf = np.memmap(fpath,dtype=np.uint8,mode="r")
+    ndim,_,offset = _read_header(buf,fpath)
+    shape = tuple(int(n) for n in np.frombuffer(buf,dtype="<u8",count=ndim,offset=offset))
+    offset += 8*ndim
+    edges = []
+    for nbins in shape:
+        edges.append(np.frombuffer(buf,dtype="<f8",count=nbins+1,offset=offset))
+        offset += 8*(nbins+1)
+    values = np.frombuffer(buf,dtype="<f8",count=int(np.prod(shape)),offset=offset).reshape(shape)
+    return values,edges
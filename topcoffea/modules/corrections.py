@@ -16,120 +16,204 @@ from coffea.jetmet_tools import FactorizedJetCorrector, JetCorrectionUncertainty
 from coffea.jetmet_tools import JECStack, CorrectedJetsFactory, CorrectedMETFactory
 from coffea.btag_tools.btagscalefactor import BTagScaleFactor
 from topcoffea.modules.GetValuesFromJsons import get_param
+import topcoffea.modules.binary_lookup as binary_lookup
 from coffea.lookup_tools import txt_converters, rochester_lookup
 
 basepathFromTTH = 'data/fromTTH/'
 
+###### Cache for the correction inputs
+################################################################
+# The inputs of the corrections (pickled histograms, csv and text files) do not change during a run, so the
+# lookup objects built from them are kept for the lifetime of the process (i.e. of each worker), keyed
+# by (year, file, variant), instead of being rebuilt for every chunk and every systematic
+
+correctionCache = {}
+
+def GetCachedCorrection(year, fpath, variant, builder):
+  ''' Return builder() for the given (year, file, variant), only calling builder the first time this key is seen '''
+  key = (str(year), fpath, variant)
+  if key not in correctionCache:
+    correctionCache[key] = builder()
+  return correctionCache[key]
+
+def ClearCorrectionCache():
+  ''' Drop all of the cached lookup objects, e.g. if the input files were changed '''
+  correctionCache.clear()
+  SFevaluator.clear()
+
 ###### Lepton scale factors
 ################################################################
-extLepSF = lookup_tools.extractor()
-
-# New UL Lepton SFs
-# Muon: reco
-extLepSF.add_weight_sets(["MuonRecoSF_2018 NUM_TrackerMuons_DEN_genTracks/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2018_UL_trackerMuon.json')])
-extLepSF.add_weight_sets(["MuonRecoSF_2018_er NUM_TrackerMuons_DEN_genTracks/abseta_pt_error %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2018_UL_trackerMuon.json')])
-extLepSF.add_weight_sets(["MuonRecoSF_2017 NUM_TrackerMuons_DEN_genTracks/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2017_UL_trackerMuon.json')])
-extLepSF.add_weight_sets(["MuonRecoSF_2017_er NUM_TrackerMuons_DEN_genTracks/abseta_pt_error %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2017_UL_trackerMuon.json')])
-extLepSF.add_weight_sets(["MuonRecoSF_2016 NUM_TrackerMuons_DEN_genTracks/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2016postVFP_UL_trackerMuon.json')])
-extLepSF.add_weight_sets(["MuonRecoSF_2016_er NUM_TrackerMuons_DEN_genTracks/abseta_pt_error %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2016postVFP_UL_trackerMuon.json')])
-extLepSF.add_weight_sets(["MuonRecoSF_2016APV NUM_TrackerMuons_DEN_genTracks/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2016preVFP_UL_trackerMuon.json')])
-extLepSF.add_weight_sets(["MuonRecoSF_2016APV_er NUM_TrackerMuons_DEN_genTracks/abseta_pt_error %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2016preVFP_UL_trackerMuon.json')])
-# Muon: loose POG
-extLepSF.add_weight_sets(["MuonLooseSF_2018 NUM_LooseID_DEN_TrackerMuons/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2018_UL_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2018_stat NUM_LooseID_DEN_TrackerMuons/abseta_pt_stat %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2018_UL_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2018_syst NUM_LooseID_DEN_TrackerMuons/abseta_pt_syst %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2018_UL_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2017 NUM_LooseID_DEN_TrackerMuons/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2017_UL_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2017_stat NUM_LooseID_DEN_TrackerMuons/abseta_pt_stat %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2017_UL_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2017_syst NUM_LooseID_DEN_TrackerMuons/abseta_pt_syst %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2017_UL_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2016 NUM_LooseID_DEN_TrackerMuons/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2016_stat NUM_LooseID_DEN_TrackerMuons/abseta_pt_stat %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2016_syst NUM_LooseID_DEN_TrackerMuons/abseta_pt_syst %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2016APV NUM_LooseID_DEN_TrackerMuons/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_HIPM_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2016APV_stat NUM_LooseID_DEN_TrackerMuons/abseta_pt_stat %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_HIPM_ID.json')])
-extLepSF.add_weight_sets(["MuonLooseSF_2016APV_syst NUM_LooseID_DEN_TrackerMuons/abseta_pt_syst %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_HIPM_ID.json')])
-# Muon: ISO + IP (Barbara)
-extLepSF.add_weight_sets(["MuonIsoSF_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2018_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonIsoSF_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2018_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonIsoSF_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2017_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonIsoSF_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2017_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonIsoSF_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonIsoSF_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonIsoSF_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016APV_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonIsoSF_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016APV_iso_EGM2D.root')])
-# Muon: looseMVA&tight (Barbara)
-extLepSF.add_weight_sets(["MuonSF_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2018_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonSF_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2018_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonSF_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2017_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonSF_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2017_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonSF_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonSF_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonSF_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016APV_EGM2D.root')])
-extLepSF.add_weight_sets(["MuonSF_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016APV_EGM2D.root')])
-# Elec: reco
-extLepSF.add_weight_sets(["ElecRecoSFAb_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_ptAbove20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFAb_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_ptAbove20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFBe_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_ptBelow20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFBe_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_ptBelow20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFAb_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_ptAbove20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFAb_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_ptAbove20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFBe_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_ptBelow20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFBe_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_ptBelow20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFAb_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_ptAbove20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFAb_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_ptAbove20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFBe_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_ptBelow20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFBe_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_ptBelow20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFAb_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_ptAbove20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFAb_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_ptAbove20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFBe_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_ptBelow20_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecRecoSFBe_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_ptBelow20_EGM2D.root')])
-# Elec: loose (Barbara)
-extLepSF.add_weight_sets(["ElecLooseSF_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_recoToloose_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecLooseSF_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_recoToloose_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecLooseSF_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_recoToloose_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecLooseSF_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_recoToloose_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecLooseSF_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_recoToloose_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecLooseSF_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_recoToloose_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecLooseSF_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_recoToloose_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecLooseSF_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_recoToloose_EGM2D.root')])
-# Elec: ISO + IP (Barbara)
-extLepSF.add_weight_sets(["ElecIsoSF_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecIsoSF_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecIsoSF_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecIsoSF_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecIsoSF_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecIsoSF_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecIsoSF_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_iso_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecIsoSF_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_iso_EGM2D.root')])
-# Elec: looseMVA&tight (Barbara)
-extLepSF.add_weight_sets(["ElecSF_2018_2lss EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_2lss_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2018_2lss_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_2lss_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2018_3l EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_3l_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2018_3l_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_3l_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2017_2lss EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_2lss_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2017_2lss_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_2lss_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2017_3l EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_3l_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2017_3l_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_3l_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2016_2lss EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_2lss_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2016_2lss_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_2lss_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2016_3l EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_3l_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2016_3l_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_3l_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2016APV_2lss EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_2lss_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2016APV_2lss_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_2lss_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2016APV_3l EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_3l_EGM2D.root')])
-extLepSF.add_weight_sets(["ElecSF_2016APV_3l_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_3l_EGM2D.root')])
+# The weight sets, as "<name> <histogram> <file>" (i.e. the input of coffea's extractor.add_weight_sets())
+# Note: These are not read when this module is imported, see LazyEvaluator below
+lepSFWeightSets = [
+  # New UL Lepton SFs
+  # Muon: reco
+  "MuonRecoSF_2018 NUM_TrackerMuons_DEN_genTracks/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2018_UL_trackerMuon.json'),
+  "MuonRecoSF_2018_er NUM_TrackerMuons_DEN_genTracks/abseta_pt_error %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2018_UL_trackerMuon.json'),
+  "MuonRecoSF_2017 NUM_TrackerMuons_DEN_genTracks/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2017_UL_trackerMuon.json'),
+  "MuonRecoSF_2017_er NUM_TrackerMuons_DEN_genTracks/abseta_pt_error %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2017_UL_trackerMuon.json'),
+  "MuonRecoSF_2016 NUM_TrackerMuons_DEN_genTracks/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2016postVFP_UL_trackerMuon.json'),
+  "MuonRecoSF_2016_er NUM_TrackerMuons_DEN_genTracks/abseta_pt_error %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2016postVFP_UL_trackerMuon.json'),
+  "MuonRecoSF_2016APV NUM_TrackerMuons_DEN_genTracks/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2016preVFP_UL_trackerMuon.json'),
+  "MuonRecoSF_2016APV_er NUM_TrackerMuons_DEN_genTracks/abseta_pt_error %s"%topcoffea_path('data/leptonSF/muon/Efficiency_muon_generalTracks_Run2016preVFP_UL_trackerMuon.json'),
+  # Muon: loose POG
+  "MuonLooseSF_2018 NUM_LooseID_DEN_TrackerMuons/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2018_UL_ID.json'),
+  "MuonLooseSF_2018_stat NUM_LooseID_DEN_TrackerMuons/abseta_pt_stat %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2018_UL_ID.json'),
+  "MuonLooseSF_2018_syst NUM_LooseID_DEN_TrackerMuons/abseta_pt_syst %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2018_UL_ID.json'),
+  "MuonLooseSF_2017 NUM_LooseID_DEN_TrackerMuons/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2017_UL_ID.json'),
+  "MuonLooseSF_2017_stat NUM_LooseID_DEN_TrackerMuons/abseta_pt_stat %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2017_UL_ID.json'),
+  "MuonLooseSF_2017_syst NUM_LooseID_DEN_TrackerMuons/abseta_pt_syst %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2017_UL_ID.json'),
+  "MuonLooseSF_2016 NUM_LooseID_DEN_TrackerMuons/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_ID.json'),
+  "MuonLooseSF_2016_stat NUM_LooseID_DEN_TrackerMuons/abseta_pt_stat %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_ID.json'),
+  "MuonLooseSF_2016_syst NUM_LooseID_DEN_TrackerMuons/abseta_pt_syst %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_ID.json'),
+  "MuonLooseSF_2016APV NUM_LooseID_DEN_TrackerMuons/abseta_pt_value %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_HIPM_ID.json'),
+  "MuonLooseSF_2016APV_stat NUM_LooseID_DEN_TrackerMuons/abseta_pt_stat %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_HIPM_ID.json'),
+  "MuonLooseSF_2016APV_syst NUM_LooseID_DEN_TrackerMuons/abseta_pt_syst %s"%topcoffea_path('data/leptonSF/muon/Efficiencies_muon_generalTracks_Z_Run2016_UL_HIPM_ID.json'),
+  # Muon: ISO + IP (Barbara)
+  "MuonIsoSF_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2018_iso_EGM2D.root'),
+  "MuonIsoSF_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2018_iso_EGM2D.root'),
+  "MuonIsoSF_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2017_iso_EGM2D.root'),
+  "MuonIsoSF_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2017_iso_EGM2D.root'),
+  "MuonIsoSF_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016_iso_EGM2D.root'),
+  "MuonIsoSF_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016_iso_EGM2D.root'),
+  "MuonIsoSF_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016APV_iso_EGM2D.root'),
+  "MuonIsoSF_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016APV_iso_EGM2D.root'),
+  # Muon: looseMVA&tight (Barbara)
+  "MuonSF_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2018_EGM2D.root'),
+  "MuonSF_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2018_EGM2D.root'),
+  "MuonSF_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2017_EGM2D.root'),
+  "MuonSF_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2017_EGM2D.root'),
+  "MuonSF_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016_EGM2D.root'),
+  "MuonSF_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016_EGM2D.root'),
+  "MuonSF_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016APV_EGM2D.root'),
+  "MuonSF_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/muon/egammaEffi2016APV_EGM2D.root'),
+  # Elec: reco
+  "ElecRecoSFAb_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_ptAbove20_EGM2D.root'),
+  "ElecRecoSFAb_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_ptAbove20_EGM2D.root'),
+  "ElecRecoSFBe_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_ptBelow20_EGM2D.root'),
+  "ElecRecoSFBe_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_ptBelow20_EGM2D.root'),
+  "ElecRecoSFAb_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_ptAbove20_EGM2D.root'),
+  "ElecRecoSFAb_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_ptAbove20_EGM2D.root'),
+  "ElecRecoSFBe_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_ptBelow20_EGM2D.root'),
+  "ElecRecoSFBe_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_ptBelow20_EGM2D.root'),
+  "ElecRecoSFAb_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_ptAbove20_EGM2D.root'),
+  "ElecRecoSFAb_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_ptAbove20_EGM2D.root'),
+  "ElecRecoSFBe_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_ptBelow20_EGM2D.root'),
+  "ElecRecoSFBe_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_ptBelow20_EGM2D.root'),
+  "ElecRecoSFAb_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_ptAbove20_EGM2D.root'),
+  "ElecRecoSFAb_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_ptAbove20_EGM2D.root'),
+  "ElecRecoSFBe_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_ptBelow20_EGM2D.root'),
+  "ElecRecoSFBe_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_ptBelow20_EGM2D.root'),
+  # Elec: loose (Barbara)
+  "ElecLooseSF_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_recoToloose_EGM2D.root'),
+  "ElecLooseSF_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_recoToloose_EGM2D.root'),
+  "ElecLooseSF_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_recoToloose_EGM2D.root'),
+  "ElecLooseSF_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_recoToloose_EGM2D.root'),
+  "ElecLooseSF_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_recoToloose_EGM2D.root'),
+  "ElecLooseSF_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_recoToloose_EGM2D.root'),
+  "ElecLooseSF_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_recoToloose_EGM2D.root'),
+  "ElecLooseSF_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_recoToloose_EGM2D.root'),
+  # Elec: ISO + IP (Barbara)
+  "ElecIsoSF_2018 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_iso_EGM2D.root'),
+  "ElecIsoSF_2018_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_iso_EGM2D.root'),
+  "ElecIsoSF_2017_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_iso_EGM2D.root'),
+  "ElecIsoSF_2017 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_iso_EGM2D.root'),
+  "ElecIsoSF_2016_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_iso_EGM2D.root'),
+  "ElecIsoSF_2016 EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_iso_EGM2D.root'),
+  "ElecIsoSF_2016APV_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_iso_EGM2D.root'),
+  "ElecIsoSF_2016APV EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_iso_EGM2D.root'),
+  # Elec: looseMVA&tight (Barbara)
+  "ElecSF_2018_2lss EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_2lss_EGM2D.root'),
+  "ElecSF_2018_2lss_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_2lss_EGM2D.root'),
+  "ElecSF_2018_3l EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_3l_EGM2D.root'),
+  "ElecSF_2018_3l_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2018_3l_EGM2D.root'),
+  "ElecSF_2017_2lss EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_2lss_EGM2D.root'),
+  "ElecSF_2017_2lss_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_2lss_EGM2D.root'),
+  "ElecSF_2017_3l EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_3l_EGM2D.root'),
+  "ElecSF_2017_3l_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2017_3l_EGM2D.root'),
+  "ElecSF_2016_2lss EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_2lss_EGM2D.root'),
+  "ElecSF_2016_2lss_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_2lss_EGM2D.root'),
+  "ElecSF_2016_3l EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_3l_EGM2D.root'),
+  "ElecSF_2016_3l_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016_3l_EGM2D.root'),
+  "ElecSF_2016APV_2lss EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_2lss_EGM2D.root'),
+  "ElecSF_2016APV_2lss_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_2lss_EGM2D.root'),
+  "ElecSF_2016APV_3l EGamma_SF2D %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_3l_EGM2D.root'),
+  "ElecSF_2016APV_3l_er EGamma_SF2D_error %s"%topcoffea_path('data/leptonSF/elec/egammaEffi2016APV_3l_EGM2D.root'),
+]
 
 # Fake rate 
 for year in ['2016APV_2016', 2017, 2018]:
   for syst in ['','_up','_down','_be1','_be2','_pt1','_pt2']:
-    extLepSF.add_weight_sets([("MuonFR_{year}{syst} FR_mva085_mu_data_comb_recorrected{syst} %s"%topcoffea_path(basepathFromTTH+'fakerate/fr_{year}_recorrected.root')).format(year=year,syst=syst)])
-    extLepSF.add_weight_sets([("ElecFR_{year}{syst} FR_mva090_el_data_comb_NC_recorrected{syst} %s"%topcoffea_path(basepathFromTTH+'fakerate/fr_{year}_recorrected.root')).format(year=year,syst=syst)])
-
+    lepSFWeightSets.append(("MuonFR_{year}{syst} FR_mva085_mu_data_comb_recorrected{syst} %s"%topcoffea_path(basepathFromTTH+'fakerate/fr_{year}_recorrected.root')).format(year=year,syst=syst))
+    lepSFWeightSets.append(("ElecFR_{year}{syst} FR_mva090_el_data_comb_NC_recorrected{syst} %s"%topcoffea_path(basepathFromTTH+'fakerate/fr_{year}_recorrected.root')).format(year=year,syst=syst))
 
-extLepSF.finalize()
-SFevaluator = extLepSF.make_evaluator()
+class LazyEvaluator:
+  '''
+    Drop-in replacement for the evaluator of a coffea lookup_tools.extractor: a weight set is only read
+    the first time it is looked up (along with the other weight sets from the same file, since the files
+    are per year and per lepton flavor), so only the inputs for the years and flavors that are actually
+    processed are ever loaded
+  '''
+  def __init__(self, weight_sets):
+    self._weight_sets = {} # File -> list of weight sets from that file
+    self._files = {}       # Weight set name -> file
+    for weight_set in weight_sets:
+      name, _, fpath = weight_set.split()
+      self._weight_sets.setdefault(fpath,[]).append(weight_set)
+      self._files[name] = fpath
+    self._lookups = {}
+
+  def _load(self, fpath):
+    ext = lookup_tools.extractor()
+    ext.add_weight_sets(self._weight_sets[fpath])
+    ext.finalize()
+    evaluator = ext.make_evaluator()
+    for name in evaluator.keys():
+      self._lookups[name] = evaluator[name]
+
+  def __getitem__(self, name):
+    if name not in self._lookups:
+      if name not in self._files:
+        raise KeyError(f"Unknown weight set \"{name}\"")
+      self._load(self._files[name])
+    return self._lookups[name]
+
+  def __contains__(self, name):
+    return name in self._files
+
+  def keys(self):
+    return self._files.keys()
+
+  def clear(self):
+    ''' Drop the loaded lookups, they are read again the next time they are needed '''
+    self._lookups.clear()
+
+SFevaluator = LazyEvaluator(lepSFWeightSets)
 
 
 ffSysts=['','_up','_down','_be1','_be2','_pt1','_pt2']
+
+# Get the dense_lookup of a binary lookup file (memory mapped, see binary_lookup.py)
+# Returns None if there is no lookup file, or if it was not made from the current contents of its source file
+# (the source file is the reference, so in both cases the caller should read the source file instead)
+def LoadBinaryLookup(lookup_path, source_path):
+  if not os.path.exists(lookup_path): return None
+  if not binary_lookup.is_up_to_date(lookup_path, source_path):
+    print(f"[W]: {lookup_path} was not made from the current {source_path}, reading the latter instead (remake the lookup file)")
+    return None
+  values, edges = binary_lookup.load_lookup(lookup_path)
+  return lookup_tools.dense_lookup.dense_lookup(values, edges)
+
+def LoadFlipLookup(flip_year_name):
+  # The flip rates are read from the binary lookup file if it is up to date with the pickled histogram
+  pkl_path = topcoffea_path(f"data/fliprates/flip_probs_topcoffea_{flip_year_name}.pkl.gz")
+  flip_lookup = LoadBinaryLookup(topcoffea_path(f"data/fliprates/flip_probs_topcoffea_{flip_year_name}{binary_lookup.LOOKUP_EXT}"), pkl_path)
+  if flip_lookup is not None: return flip_lookup
+  # Otherwise from the pickled histogram
+  with gzip.open(pkl_path) as fin:
+    flip_hist = pickle.load(fin)
+    return lookup_tools.dense_lookup.dense_lookup(flip_hist.values()[()],[flip_hist.axis("pt").edges(),flip_hist.axis("eta").edges()])
+
 def AttachPerLeptonFR(leps, flavor, year):
 
   # Get the flip rates lookup object
@@ -138,9 +222,7 @@ def AttachPerLeptonFR(leps, flavor, year):
   elif year == "2017": flip_year_name = "UL17"
   elif year == "2018": flip_year_name = "UL18"
   else: raise Exception(f"Not a known year: {year}")
-  with gzip.open(topcoffea_path(f"data/fliprates/flip_probs_topcoffea_{flip_year_name}.pkl.gz")) as fin:
-    flip_hist = pickle.load(fin)
-    flip_lookup = lookup_tools.dense_lookup.dense_lookup(flip_hist.values()[()],[flip_hist.axis("pt").edges(),flip_hist.axis("eta").edges()])
+  flip_lookup = GetCachedCorrection(year, f"data/fliprates/flip_probs_topcoffea_{flip_year_name}", "flip_lookup", lambda: LoadFlipLookup(flip_year_name))
 
   # Get the fliprate scaling factor for the given year
   chargeflip_sf = get_param("chargeflip_sf_dict")[flip_year_name]
@@ -270,43 +352,56 @@ def AttachElectronSF(electrons, year):
 # Hard-coded to DeepJet algorithm, loose and medium WPs
 
 # MC efficiencies
+BTAG_MCEFF_PATH = 'data/btagSF/UL/btagMCeff_%s'
+
 def GetMCeffFunc(year, wp='medium', flav='b'):
   if year not in ['2016','2016APV','2017','2018']: raise Exception(f"Error: Unknown year \"{year}\".")
+  return GetCachedCorrection(year, BTAG_MCEFF_PATH%year, wp, lambda: LoadMCeffFunc(year, wp))
 
-  pathToBtagMCeff = topcoffea_path('data/btagSF/UL/btagMCeff_%s.pkl.gz'%year)
-  hists = {}
-  with gzip.open(pathToBtagMCeff) as fin:
-    hin = pickle.load(fin)
-    for k in hin.keys():
-      if k in hists: hists[k]+=hin[k]
-      else:          hists[k]=hin[k]
-  h = hists['jetptetaflav']
+# Get the MC btag efficiency table of a WP from the jetptetaflav histogram of analysis/btagMCeff/btagMCeff.py
+# Returns the efficiencies (including the overflow bins, in pt, abseta and flav) and the bin edges (inf for the overflow bins)
+def GetMCeffTable(h, wp='medium'):
   hnum = h.integrate('WP', wp)
   hden = h.integrate('WP', 'all')
-  getnum = lookup_tools.dense_lookup.dense_lookup(hnum.values(overflow='over')[()], [hnum.axis('pt').edges(), hnum.axis('abseta').edges(), hnum.axis('flav').edges()])
-  getden = lookup_tools.dense_lookup.dense_lookup(hden.values(overflow='over')[()], [hden.axis('pt').edges(), hnum.axis('abseta').edges(), hden.axis('flav').edges()])
-  values = hnum.values(overflow='over')[()]
-  edges = [hnum.axis('pt').edges(), hnum.axis('abseta').edges(), hnum.axis('flav').edges()]
-  fun = lambda pt, abseta, flav : getnum(pt,abseta,flav)/getden(pt,abseta,flav)
-  return fun
+  with np.errstate(divide='ignore', invalid='ignore'):
+    values = hnum.values(overflow='over')[()]/hden.values(overflow='over')[()]
+  edges = [np.append(hnum.axis(ax).edges(), np.inf) for ax in ['pt', 'abseta', 'flav']]
+  return values, edges
+
+def LoadMCeffFunc(year, wp='medium'):
+  # The efficiencies are read from the binary lookup file of the WP if it is up to date with the pickled histograms
+  pathToBtagMCeff = topcoffea_path(f"{BTAG_MCEFF_PATH%year}.pkl.gz")
+  mceff_lookup = LoadBinaryLookup(topcoffea_path(f"{BTAG_MCEFF_PATH%year}_{wp}{binary_lookup.LOOKUP_EXT}"), pathToBtagMCeff)
+  if mceff_lookup is not None: return mceff_lookup
+  # Otherwise from the pickled histograms
+  with gzip.open(pathToBtagMCeff) as fin:
+    hin = pickle.load(fin)
+  values, edges = GetMCeffTable(hin['jetptetaflav'], wp)
+  return lookup_tools.dense_lookup.dense_lookup(values, edges)
 
 def GetBtagEff(jets, year, wp='medium'):
   if year not in ['2016','2016APV','2017','2018']: raise Exception(f"Error: Unknown year \"{year}\".")
   return GetMCeffFunc(year,wp)(jets.pt, np.abs(jets.eta), jets.hadronFlavour)
 
+BTagSFfile = {
+  '2016'    : "data/btagSF/UL/DeepJet_106XUL16postVFPSF_v2.csv",
+  '2016APV' : "data/btagSF/UL/wp_deepJet_106XUL16preVFP_v2.csv",
+  '2017'    : "data/btagSF/UL/wp_deepJet_106XUL17_v3.csv",
+  '2018'    : "data/btagSF/UL/wp_deepJet_106XUL18_v2.csv",
+}
+def GetBTagSFEvaluator(year, wp='MEDIUM'):
+  if year not in BTagSFfile: raise Exception(f"Error: Unknown year \"{year}\".")
+  return GetCachedCorrection(year, BTagSFfile[year], wp, lambda: BTagScaleFactor(topcoffea_path(BTagSFfile[year]),wp))
+
 def GetBTagSF(jets, year, wp='MEDIUM', sys='central'):
-  if   year == '2016': SFevaluatorBtag = BTagScaleFactor(topcoffea_path("data/btagSF/UL/DeepJet_106XUL16postVFPSF_v2.csv"),wp) 
-  elif year == '2016APV': SFevaluatorBtag = BTagScaleFactor(topcoffea_path("data/btagSF/UL/wp_deepJet_106XUL16preVFP_v2.csv"),wp) 
-  elif year == '2017': SFevaluatorBtag = BTagScaleFactor(topcoffea_path("data/btagSF/UL/wp_deepJet_106XUL17_v3.csv"),wp)
-  elif year == '2018': SFevaluatorBtag = BTagScaleFactor(topcoffea_path("data/btagSF/UL/wp_deepJet_106XUL18_v2.csv"),wp)
-  else: raise Exception(f"Error: Unknown year \"{year}\".")
+  SFevaluatorBtag = GetBTagSFEvaluator(year, wp)
 
   pt = jets.pt; abseta = np.abs(jets.eta); flavor = jets.hadronFlavour
   SF=SFevaluatorBtag.eval('central',jets.hadronFlavour,np.abs(jets.eta),jets.pt)
 
   # Workaround: For UL16, use the SFs from the UL16APV for light flavor jets
-  SFevaluatorBtag_UL16APV = BTagScaleFactor(topcoffea_path("data/btagSF/UL/wp_deepJet_106XUL16preVFP_v2.csv"),wp)
   if year == "2016":
+      SFevaluatorBtag_UL16APV = GetBTagSFEvaluator("2016APV", wp)
       had_flavor = jets.hadronFlavour
       SF_UL16APV = SFevaluatorBtag_UL16APV.eval('central',jets.hadronFlavour,np.abs(jets.eta),jets.pt)
       SF = ak.where(had_flavor==0,SF_UL16APV,SF)
@@ -378,29 +473,31 @@ def GetMCPUname(year):
   ''' Returns the name of the file to read pu MC profile '''
   return MCPUfile[str(year)]
 
-PUfunc = {}
 ### Load histograms and get lookup tables (extractors are not working here...)
-for year in ['2016', '2016APV', '2017', '2018']:
-  PUfunc[year] = {}
+def LoadPUfunc(year):
+  ''' Returns the lookups for the MC and data (nominal, up, down) pileup profiles of a year '''
+  PUfunc = {}
   with uproot.open(pudirpath+GetMCPUname(year)) as fMC:
     hMC = fMC['pileup']
-    PUfunc[year]['MC'] = lookup_tools.dense_lookup.dense_lookup(hMC.values() / np.sum( hMC.values()), hMC.axis(0).edges())
+    PUfunc['MC'] = lookup_tools.dense_lookup.dense_lookup(hMC.values() / np.sum( hMC.values()), hMC.axis(0).edges())
   with uproot.open(pudirpath+GetDataPUname(year,  'nominal')) as fData:
     hD   = fData  ['pileup']
-    PUfunc[year]['Data'  ] = lookup_tools.dense_lookup.dense_lookup(hD.values() / np.sum(hD.values()), hD.axis(0).edges())
+    PUfunc['Data'  ] = lookup_tools.dense_lookup.dense_lookup(hD.values() / np.sum(hD.values()), hD.axis(0).edges())
   with uproot.open(pudirpath+GetDataPUname(year,  'up')) as fDataUp:
     hDUp = fDataUp['pileup']
-    PUfunc[year]['DataUp'] = lookup_tools.dense_lookup.dense_lookup(hDUp.values() / np.sum(hDUp.values()), hD.axis(0).edges())
+    PUfunc['DataUp'] = lookup_tools.dense_lookup.dense_lookup(hDUp.values() / np.sum(hDUp.values()), hD.axis(0).edges())
   with uproot.open(pudirpath+GetDataPUname(year, 'down')) as fDataDo:
     hDDo = fDataDo['pileup']
-    PUfunc[year]['DataDo'] = lookup_tools.dense_lookup.dense_lookup(hDDo.values() / np.sum(hDDo.values()), hD.axis(0).edges())
+    PUfunc['DataDo'] = lookup_tools.dense_lookup.dense_lookup(hDDo.values() / np.sum(hDDo.values()), hD.axis(0).edges())
+  return PUfunc
 
 
 def GetPUSF(nTrueInt, year, var='nominal'):
   year = str(year)
   if year not in ['2016','2016APV','2017','2018']: raise Exception(f"Error: Unknown year \"{year}\".")
-  nMC  =PUfunc[year]['MC'](nTrueInt+1)
-  nData=PUfunc[year]['DataUp' if var == 'up' else ('DataDo' if var == 'down' else 'Data')](nTrueInt)
+  PUfunc = GetCachedCorrection(year, pudirpath, "PUfunc", lambda: LoadPUfunc(year))
+  nMC  =PUfunc['MC'](nTrueInt+1)
+  nData=PUfunc['DataUp' if var == 'up' else ('DataDo' if var == 'down' else 'Data')](nTrueInt)
   weights = np.divide(nData,nMC)
   return weights
 
@@ -488,6 +585,9 @@ def ApplyJetCorrections(year, corr_type):
   elif year=='2017': jec_tag='17_V5'; jer_tag='Summer19UL17_JRV2'
   elif year=='2018': jec_tag='18_V5'; jer_tag='Summer19UL18_JRV2'
   else: raise Exception(f"Error: Unknown year \"{year}\".")
+  return GetCachedCorrection(year, f"data/JEC/{jec_tag}+data/JER/{jer_tag}", corr_type, lambda: LoadJetCorrections(jec_tag, jer_tag, corr_type))
+
+def LoadJetCorrections(jec_tag, jer_tag, corr_type):
   extJEC = lookup_tools.extractor()
   extJEC.add_weight_sets(["* * "+topcoffea_path('data/JER/%s_MC_SF_AK4PFchs.jersf.txt'%jer_tag),"* * "+topcoffea_path('data/JER/%s_MC_PtResolution_AK4PFchs.jr.txt'%jer_tag),"* * "+topcoffea_path('data/JEC/Summer19UL%s_MC_L1FastJet_AK4PFchs.txt'%jec_tag),"* * "+topcoffea_path('data/JEC/Summer19UL%s_MC_L2Relative_AK4PFchs.txt'%jec_tag),"* * "+topcoffea_path('data/JEC/Quad_Summer19UL%s_MC_UncertaintySources_AK4PFchs.junc.txt'%jec_tag)])
   jec_types = ['FlavorQCD', 'FlavorPureBottom', 'FlavorPureQuark', 'FlavorPureGluon', 'FlavorPureCharm', 'BBEC1', 'Absolute', 'RelativeBal', 'RelativeSample']
@@ -558,12 +658,19 @@ def ApplyJetSystematics(year,cleanedJets,syst_var):
 # https://gitlab.cern.ch/akhukhun/roccor
 # https://github.com/CoffeaTeam/coffea/blob/master/coffea/lookup_tools/rochester_lookup.py
 
+RochesterFile = {
+    '2016'    : "data/MuonScale/RoccoR2016bUL.txt",
+    '2016APV' : "data/MuonScale/RoccoR2016aUL.txt",
+    '2017'    : "data/MuonScale/RoccoR2017UL.txt",
+    '2018'    : "data/MuonScale/RoccoR2018UL.txt",
+}
+def LoadRochester(year):
+    rochester_data = txt_converters.convert_rochester_file(topcoffea_path(RochesterFile[year]), loaduncs=True)
+    return rochester_lookup.rochester_lookup(rochester_data)
+
 def ApplyRochesterCorrections(year, mu, is_data):
-    if year=='2016': rochester_data = txt_converters.convert_rochester_file(topcoffea_path("data/MuonScale/RoccoR2016bUL.txt"), loaduncs=True)
-    elif year=='2016APV': rochester_data = txt_converters.convert_rochester_file(topcoffea_path("data/MuonScale/RoccoR2016aUL.txt"), loaduncs=True)
-    elif year=='2017': rochester_data = txt_converters.convert_rochester_file(topcoffea_path("data/MuonScale/RoccoR2017UL.txt"), loaduncs=True)
-    elif year=='2018': rochester_data = txt_converters.convert_rochester_file(topcoffea_path("data/MuonScale/RoccoR2018UL.txt"), loaduncs=True)
-    rochester = rochester_lookup.rochester_lookup(rochester_data)
+    if year not in RochesterFile: raise Exception(f"Error: Unknown year \"{year}\".")
+    rochester = GetCachedCorrection(year, RochesterFile[year], 'rochester', lambda: LoadRochester(year))
     if not is_data:
         hasgen = ~np.isnan(ak.fill_none(mu.matched_gen.pt, np.nan))
         mc_rand = np.random.rand(*ak.to_numpy(ak.flatten(mu.pt)).shape)
@@ -632,6 +739,9 @@ def GetRatioAssymetricUncertainties(num, numDo, numUp, den, denDo, denUp):
 ######  Scale Factors
 
 def LoadTriggerSF(year, ch='2l', flav='em'):
+  return GetCachedCorrection(year, 'data/triggerSF/triggerSF_%s.pkl.gz'%year, (ch, flav), lambda: BuildTriggerSF(year, ch, flav))
+
+def BuildTriggerSF(year, ch='2l', flav='em'):
   pathToTriggerSF = topcoffea_path('data/triggerSF/triggerSF_%s.pkl.gz'%year)
   with gzip.open(pathToTriggerSF) as fin: hin = pickle.load(fin)
   if ch=='2l': axisY='l1pt'
@@ -68,20 +68,25 @@ def main():
   parser.add_argument('--verbose','-v'    , action='store_true'  , help = 'Activate the verbosing')
 
   args, unknown = parser.parse_known_args()
-  #cfgfile     = args.cfgfile
-  path         = args.path
-  prefix       = args.prefix
-  sample       = args.sampleName
-  xsec         = args.xsec
-  xsecName     = args.xsecName
-  year         = args.year
-  options      = args.options
-  treeName     = args.treename
-  histAxisName = args.histAxisName
-  outname      = args.outname
-  isDAS        = args.DAS
-  nFiles       = int(args.nFiles) if not args.nFiles is None else None
-  verbose      = args.verbose
+  CreateJSON(
+    path         = args.path,
+    prefix       = args.prefix,
+    sample       = args.sampleName,
+    xsec         = args.xsec,
+    xsecName     = args.xsecName,
+    year         = args.year,
+    treeName     = args.treename,
+    histAxisName = args.histAxisName,
+    isDAS        = args.DAS,
+    nFiles       = int(args.nFiles) if not args.nFiles is None else None,
+    outname      = args.outname,
+    options      = args.options,
+    verbose      = args.verbose,
+  )
+
+def CreateJSON(path, prefix='', sample='', xsec=1, xsecName='', year=-1, treeName='Events', histAxisName='', isDAS=False, nFiles=None, outname='', options='', verbose=False, executor=None):
+  ''' Find the files of a sample, get their metadata and write it all to a json file (returns the name of the json)
+      An executor from concurrent.futures can be passed to scan the files concurrently '''
 
   # Get the xsec for the dataset
   if xsecName == '': xsecName = sample
@@ -141,7 +146,7 @@ def main():
     # For data this this should all be the same
     nEvents,nGenEvents,nSumOfWeights = output,output,output
   else:
-    nEvents, nGenEvents, nSumOfWeights, isData = GetAllInfoFromFile(filesWithPrefix, treeName)
+    nEvents, nGenEvents, nSumOfWeights, isData = GetAllInfoFromFile(filesWithPrefix, treeName, executor)
 
   # Any samples coming from DAS won't have EFT weights/WCs, saves having to actually access remote files
   if isDAS:
@@ -163,6 +168,7 @@ def main():
   with open(outname, 'w') as outfile:
     json.dump(sampdic, outfile, indent=2)
     print('>> New json file: %s'%outname)
+  return outname
 
 if __name__ == '__main__':
   main()
@@ -1,155 +1,211 @@
 import argparse
-from coffea import hist, processor
+import copy
+import numpy as np
+from coffea import hist
 from topcoffea.modules.YieldTools import YieldTools
 from topcoffea.modules.GetValuesFromJsons import get_lumi, get_param
+import topcoffea.modules.hist_store as hist_store
 import topcoffea.modules.utils as utils
 import cloudpickle
-from collections import defaultdict 
 import re, gzip
 
+SAMPLE_NAME_PATTERN = re.compile('(?P<sample>.*)UL(?P<year>.*)')
+YEARS = ['16APV','16','17','18']
+
+# The kinds of application region bins (anything that is not an AR is taken as it is)
+SR, FAKES_AR, FLIPS_AR = 0, 1, 2
+FLIPS_AR_NAME = "isAR_2lSS_OS"
+
+# Split a sample name into the process name and the year, e.g. "ttHJet_privateUL16APV" -> ("ttHJet_private","16APV")
+def parse_sample_name(name):
+    match = SAMPLE_NAME_PATTERN.search(name)
+    if not match:
+        raise RuntimeError(f"Sample {name} does not match the naming convention.")
+    year = match.group('year')
+    if year not in YEARS:
+        raise RuntimeError(f"Sample {name} does not match the naming convention, year \"{year}\" is unknown.")
+    return match.group('sample'), year
+
+# Add the right array into the left dict, following the same conventions as HistEFT.add()
+#   - The arrays of the non-EFT bins have the dense shape of the histogram, the EFT ones have an extra (last) axis for the coefficients
+#   - A non-EFT array added to an EFT one goes into the SM (0th) coefficient
+#   - A None sumw2 is ignored (the result is None only if all of the values are None)
+# Note: The right array is not copied, so it should not be used anywhere else
+def _add_to(left, key, right, dense_shape):
+    if key not in left or left[key] is None:
+        left[key] = right
+    elif right is None:
+        pass
+    elif left[key].shape == right.shape:
+        left[key] += right
+    elif right.shape == dense_shape:
+        left[key][...,0] += right
+    elif left[key].shape == dense_shape:
+        right[...,0] += left[key]
+        left[key] = right
+    else:
+        raise ValueError("Cannot sum these histograms, the values are not an expected shape.")
+
 class DataDrivenProducer: 
-    def __init__(self, inputHist, outputName):
+    '''
+        Builds the nonprompt and flips estimations from the application region (AR) bins of the histograms
+          - The data in the fakes ARs (minus the prompt contribution from MC) becomes "nonpromptUL<year>"
+          - The data in the flips AR becomes "flipsUL<year>"
+          - The signal region bins are kept as they are, and the appl axis is integrated out
+        If keepInput is False, each input histogram is dropped as soon as its output is made (so the input and
+        the output are never in memory at the same time). This is always the case when the input is read from
+        a file, in which case hist stores are also read one histogram at a time.
+    '''
+    def __init__(self, inputHist, outputName, keepInput=True):
         yt=YieldTools()
-        if type(inputHist) == str and inputHist.endswith('.pkl.gz'): # we are plugging a pickle file
-            self.inhist=utils.get_hist_from_pkl(inputHist)
+        self.inputPath=None
+        if type(inputHist) == str: # we are plugging a pickle file (or a hist store)
+            if hist_store.is_hist_store(inputHist):
+                self.inputPath=inputHist
+                self.inhist=None
+            else:
+                self.inhist=utils.get_hist_from_pkl(inputHist)
+            keepInput=False
         else: # we already have the histogram
             self.inhist=inputHist
         self.outputName=outputName
+        self.keepInput=keepInput
         self.verbose=False
         self.dataName='data'
         self.outHist=None
         self.promptSubtractionSamples=get_param('prompt_subtraction_samples')
         self.DDFakes()
 
+    # Iterate over the input (name,histogram) pairs, dropping the inputs that have been used if we can
+    def _iterInputs(self):
+        if self.inputPath is not None:
+            with hist_store.HistStoreReader(self.inputPath) as reader:
+                for key in reader.keys():
+                    yield key, reader[key]
+            self.inputPath=None
+            return
+        for key in list(self.inhist.keys()):
+            yield key, self.inhist[key]
+            if not self.keepInput:
+                del self.inhist[key]
+
+    # Get the (output sample name, kind of bin, lumi, is data) for each (sample, appl) pair of a histogram
+    # Note: The output name is None for the bins that do not go into the output
+    def _classifySamples(self, histo):
+        samples={}
+        for sample in histo.identifiers('sample'):
+            sampleName, year = parse_sample_name(sample.name)
+            isData = self.dataName == sampleName
+            lumi = 1000.0*get_lumi('20'+year)
+            samples[sample.name] = (sampleName, year, isData, lumi)
+
+        classes={}
+        skipped=set()
+        for appl in histo.identifiers('appl'):
+            if 'isAR' not in appl.name:
+                kind = SR
+            elif appl.name == FLIPS_AR_NAME:
+                kind = FLIPS_AR
+            else:
+                kind = FAKES_AR
+            for name,(sampleName,year,isData,lumi) in samples.items():
+                outName = name
+                if kind == FLIPS_AR:
+                    outName = 'flipsUL%s'%year if isData else None
+                elif kind == FAKES_AR:
+                    if isData or sampleName in self.promptSubtractionSamples:
+                        outName = 'nonpromptUL%s'%year
+                    else:
+                        outName = None
+                        skipped.add(sampleName)
+                classes[(name,appl.name)] = (outName, kind, lumi, isData)
+        for sampleName in sorted(skipped):
+            print(f"We won't consider {sampleName} for the prompt subtraction in the appl. region")
+        return classes
+
+    # Make the data driven histogram from a histogram with an appl axis, without modifying the input
+    def getDataDrivenHist(self, histo):
+        sparse_names = [ax.name for ax in histo.sparse_axes()]
+        isample = sparse_names.index('sample')
+        iappl = sparse_names.index('appl')
+        isyst = sparse_names.index('systematic')
+        classes = self._classifySamples(histo)
+
+        # The output has a new sample axis (so the new names are not added to the axis of the input)
+        old_sample_axis = histo.axis('sample')
+        sample_axis = hist.Cat(old_sample_axis.name, old_sample_axis.label)
+        out_axes = [sample_axis if ax is old_sample_axis else ax for ax in histo.axes() if ax.name != 'appl']
+        out = histo.__class__(histo._label, histo._wcnames, *out_axes, dtype=histo._dtype)
+        out._wcs = copy.deepcopy(histo._wcs)
+        out._sumw2 = {}
+
+        # The MC is scaled to the lumi here, and everything but data is scaled back by 1/lumi at the end
+        # Note: The prompt subtraction is summed on its own, and subtracted once everything else is summed
+        sumw, sumw2 = out._sumw, out._sumw2
+        dense_shape = histo._dense_shape
+        sub_sumw, sub_sumw2 = {}, {}
+        out_lumi = {}
+        for key,values in histo._sumw.items():
+            outName, kind, lumi, isData = classes[(key[isample].name, key[iappl].name)]
+            if outName is None:
+                continue
+            syst = key[isyst].name
+            isPromptSub = (kind == FAKES_AR) and not isData
+            if kind == FLIPS_AR and syst != "nominal":
+                continue # We don't use the up/down FF variations for the flips
+            if isPromptSub and (syst != "nominal") and not syst.startswith("FF"):
+                continue # But we keep FFUp and FFDown for the nonprompt, as these are its up and down variations
+
+            # Same as scale() would do, the sumw2 of the non-EFT bins is sumw if there is no sumw2
+            is_eft = values.shape != histo._dense_shape
+            if histo._sumw2 is not None:
+                values2 = histo._sumw2.get(key)
+            else:
+                values2 = None if is_eft else values
+
+            new_key = tuple(sample_axis.index(outName) if i == isample else k for i,k in enumerate(key) if i != iappl)
+            factor = 1.0 if isData else lumi
+            if isPromptSub:
+                # Only the SM part (without uncertainties) is subtracted
+                values = values[...,0] if is_eft else values
+                _add_to(sub_sumw, new_key, values*factor, dense_shape)
+                _add_to(sub_sumw2, new_key, np.zeros_like(values), dense_shape)
+            else:
+                _add_to(sumw, new_key, values*factor, dense_shape)
+                _add_to(sumw2, new_key, None if values2 is None else values2*factor**2, dense_shape)
+            out_lumi[new_key] = 1.0 if (isData and kind == SR) else lumi
+
+        for new_key in sub_sumw.keys():
+            _add_to(sumw, new_key, -sub_sumw[new_key], dense_shape)
+            _add_to(sumw2, new_key, sub_sumw2[new_key], dense_shape)
+
+        # Scale back by 1/lumi all processes but data so they can be used transparently downstream
+        for new_key in sumw.keys():
+            lumi = out_lumi[new_key]
+            if lumi != 1.0:
+                sumw[new_key] *= 1.0/lumi
+                if sumw2[new_key] is not None:
+                    sumw2[new_key] *= (1.0/lumi)**2
+        return out
+
     def DDFakes(self):
         if self.outHist!=None:  # already some processing has been done, so using what is available
             self.inhist=self.outHist
+            self.inputPath=None
 
         self.outHist={}
 
-        for key,histo in self.inhist.items():
+        for key,histo in self._iterInputs():
+            if not isinstance(histo, hist.Hist): # not a histogram, nothing to do
+                self.outHist[key]=histo
+                continue
 
             if not len(histo.values()): # histo is empty, so we just integrate over appl and keep an empty histo
                 print(f'[W]: Histogram {key} is empty, returning an empty histo')
                 self.outHist[key]=histo.integrate('appl')
                 continue
 
-            # First we are gonna scale all MC processes in  by the luminosity
-            name_regex='(?P<sample>.*)UL(?P<year>.*)'
-            pattern=re.compile(name_regex)
-
-            scale_dict={}
-            for sample in histo.identifiers('sample'):
-                match = pattern.search(sample.name)
-                sampleName=match.group('sample')
-                year=match.group('year')
-                if not match: 
-                    raise RuntimeError(f"Sample {sample} does not match the naming convention.")
-                if year not in ['16APV','16','17','18']:
-                    raise RuntimeError(f"Sample {sample} does not match the naming convention, year \"{year}\" is unknown.")
-
-                if self.dataName == sampleName:
-                    continue # We do not scale data
-                scale_dict[(sample, )] = 1000.0*get_lumi('20'+year)
-
-            prescale=histo.values().copy()
-            histo.scale( scale_dict, axis=('sample',))
-            postscale=histo.values()
-
-            # now for each year we actually perform the subtraction and integrate out the application regions
-            newhist=None
-            for ident in histo.identifiers('appl'):
-                hAR=histo.integrate('appl', ident)
-
-                if 'isAR' not in ident.name:
-                    # if we are in the signal region, we just take the 
-                    # whole histogram integrating out the application region axis
-                    if newhist==None:
-                        newhist=hAR
-                    else:
-                        newhist.add(hAR)
-                else:
-                    if "isAR_2lSS_OS"==ident.name:
-                        # we are in the flips application region and theres no "prompt" subtraction, so we just have to rename data to flips, put it in the right axis and we are done
-                        newNameDictData=defaultdict(list)
-                        for sample in hAR.identifiers('sample'):
-                            match = pattern.search(sample.name)
-                            sampleName=match.group('sample')
-                            year=match.group('year')
-                            nonPromptName='flipsUL%s'%year
-                            if self.dataName==sampleName:
-                                newNameDictData[nonPromptName].append(sample.name)
-                        hFlips=hAR.group('sample',  hist.Cat('sample','sample'), newNameDictData)
-
-                        # remove any up/down FF variations from the flip histo since we don't use that info
-                        syst_var_idet_rm_lst = []
-                        syst_var_idet_lst = hFlips.identifiers("systematic")
-                        for syst_var_idet in syst_var_idet_lst:
-                            if (syst_var_idet.name != "nominal"):
-                                syst_var_idet_rm_lst.append(syst_var_idet)
-                        hFlips = hFlips.remove(syst_var_idet_rm_lst,"systematic")
-                        
-                        # now adding them to the list of processes: 
-                        if newhist==None:
-                            newhist=hFlips
-                        else:
-                            newhist.add( hFlips ) 
-                            
-
-                    else:
-                        # if we are in the nonprompt application region, we also integrate the application region axis
-                        # and construct the new sample 'nonprompt'
-                        
-                        # we look at data only, and rename it to fakes
-                        newNameDictData=defaultdict(list); newNameDictNoData=defaultdict(list)
-                        for sample in hAR.identifiers('sample'):
-                            match = pattern.search(sample.name)
-                            sampleName=match.group('sample')
-                            year=match.group('year')
-                            nonPromptName='nonpromptUL%s'%year
-                            if self.dataName==sampleName:
-                                newNameDictData[nonPromptName].append(sample.name)
-                            elif sampleName in self.promptSubtractionSamples: 
-                                newNameDictNoData[nonPromptName].append(sample.name)
-                            else:
-                                print(f"We won't consider {sampleName} for the prompt subtraction in the appl. region")
-                        
-                        hFakes=hAR.group('sample',  hist.Cat('sample','sample'), newNameDictData)
-                        # now we take all the stuff that is not data in the AR to make the prompt subtraction and assign them to nonprompt.
-                        hPromptSub=hAR.group('sample', hist.Cat('sample','sample'), newNameDictNoData )
-
-                        # remove the up/down variations (if any) from the prompt subtraction histo
-                        # but keep FFUp and FFDown, as these are the nonprompt up and down variations 
-                        syst_var_idet_rm_lst = []
-                        syst_var_idet_lst = hPromptSub.identifiers("systematic")
-                        for syst_var_idet in syst_var_idet_lst:
-                            if (syst_var_idet.name != "nominal") and (not syst_var_idet.name.startswith("FF")):
-                                syst_var_idet_rm_lst.append(syst_var_idet)
-                        hPromptSub = hPromptSub.remove(syst_var_idet_rm_lst,"systematic")
-                        hPromptSub = hPromptSub.copy_sm()
-
-                        # now we actually make the subtraction
-                        hPromptSub.scale(-1)
-                        hFakes.add(hPromptSub)
-                        # now adding them to the list of processes: 
-                        if newhist==None:
-                            newhist=hFakes
-                        else:
-                            newhist.add(hFakes)
-            # Scale back by 1/lumi all processes but data so they can be used transparently downstream
-            # Mind that we scaled all mcs already above
-            scaleDict={}
-            for sample in newhist.identifiers('sample'):
-                match = pattern.search(sample.name)
-                sampleName=match.group('sample')
-                if self.dataName == sampleName:
-                    continue
-                year=match.group('year')
-                scaleDict[sample]=1.0/(1000.0*get_lumi('20'+year))
-            newhist.scale( scaleDict, axis='sample')
-
-
-            self.outHist[key]=newhist
+            self.outHist[key]=self.getDataDrivenHist(histo)
 
     def dumpToPickle(self):
         if not self.outputName.endswith(".pkl.gz"):
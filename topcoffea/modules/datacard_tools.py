@@ -9,10 +9,13 @@ import os
 import re
 import json
 import time
+import functools
 
 from coffea.hist import StringBin, Cat, Bin
+from coffea.hist.hist_tools import overflow_behavior
 
 from topcoffea.modules.paths import topcoffea_path
+import topcoffea.modules.utils as utils
 import topcoffea.modules.eft_helper as efth
 
 PRECISION = 6   # Decimal point precision in the text datacard output
@@ -397,13 +400,17 @@ class DatacardMaker():
 
     def read(self,fpath):
         """
-            Input should be a file path to a pkl file containing histograms produced by the topeft.py
+            Input should be a file path to a pkl file (or hist store) containing histograms produced by the topeft.py
             processor. The histograms are extracted and then pre-processed to remove / group / scale
             various sparse axes categories.
         """
         print(f"Opening: {fpath}")
         tic = time.time()
-        self.hists = pickle.load(gzip.open(fpath))
+        # Note: For a hist store, only the requested hists (and only the nominal parts of them, if the
+        #       nuisances are not needed) get decompressed
+        hist_lst = self.var_lst if self.var_lst else None
+        selection = {} if self.do_nuisance else {"systematic": "nominal"}
+        self.hists = utils.get_hist_from_pkl(fpath,hist_lst=hist_lst,**selection)
         dt = time.time() - tic
         print(f"Pkl Open Time: {dt:.2f} s")
 
@@ -1005,48 +1012,109 @@ class DatacardMaker():
             lin piece:   set(c1=1.0)
             mixed piece: set(c1=1.0,c2=1.0)
             quad piece:  0.5*[set(c1=2.0) - 2*set(c1=1.0) + set(sm)]
+
+            Note: Instead of evaluating the hist at each of these WC points, the pieces are built in one
+                go from the stored coefficients, see get_decomposition_matrices()
         """
         tic = time.time()
-        h.set_sm()
-        sm = h.values(sumw2=True, overflow='all')
+        names,w_mat,w2_mat = get_decomposition_matrices(tuple(h._wcnames),tuple(wcs))
+        view = tuple(overflow_behavior("all") for _ in range(h.dense_dim()))
+        # Rows that are not EFT bins are the same at every WC point, so only the sum of the weights given
+        #   to the WC points in each piece matters (i.e. 1 for all pieces except quad, where it is 0)
+        row_sums = w_mat[:,0]
+
+        # Collect the arrays of all the sparse bins, split by kind, so each kind is done in one pass
+        eft_keys,eft_w,eft_w2,has_w2 = [],[],[],[]
+        non_eft_keys,non_eft_w,non_eft_w2 = [],[],[]
+        for sparse_key,arr in h._sumw.items():
+            tup = tuple(x.name for x in sparse_key)
+            arr2 = None if h._sumw2 is None else h._sumw2.get(sparse_key)
+            if arr.shape != h._dense_shape:
+                eft_keys.append(tup)
+                eft_w.append(arr)
+                has_w2.append(arr2 is not None and arr2.shape[-1] == w2_mat.shape[-1])
+                eft_w2.append(arr2 if has_w2[-1] else None)
+            else:
+                non_eft_keys.append(tup)
+                non_eft_w.append(arr)
+                non_eft_w2.append(arr if arr2 is None else arr2)
+
         # Note: The keys of this dictionary are a pretty contrived, but are useful later on
-        r = {}
-        r["sm"] = sm
-        terms = 1
-        for n1,wc1 in enumerate(wcs):
-            h.set_wilson_coefficients(**{wc1: 1.0})
-            tmp_lin_1 = h.values(overflow='all', sumw2=True)
-            h.set_wilson_coefficients(**{wc1: 2.0})
-            tmp_lin_2 = h.values(overflow='all',sumw2=True)
-
-            lin_name = f"lin_{wc1}"
-            quad_name = f"quad_{wc1}"
-
-            terms += 2
-
-            r[lin_name] = tmp_lin_1
-            r[quad_name] = {}
-            for sparse_key in h._sumw.keys():
-                tup = tuple(x.name for x in sparse_key)
-                r[quad_name][tup]=[]
-                for i in range(2):
-                    r[quad_name][tup].append( 0.5*(tmp_lin_2[tup][i] - 2*tmp_lin_1[tup][i] + sm[tup][i]) ) 
-                    
-            for n2,wc2 in enumerate(wcs):
-                if n1 >= n2: continue
-                mixed_name = f"quad_mixed_{wc1}_{wc2}"
-                h.set_wilson_coefficients(**{wc1:1.0,wc2:1.0})
-                r[mixed_name] = h.values(overflow='all',sumw2=True)
-                terms += 1
+        r = {name: {} for name in names}
+        if eft_keys:
+            # Shape: (n_pieces, n_sparse_bins, *dense_shape)
+            sumw = np.tensordot(w_mat,np.stack(eft_w),axes=([1],[-1]))
+            # Set really tiny error bars for the bins without w**2 coefficients (as values() does)
+            dense_axes = tuple(range(2,sumw.ndim))
+            sumw2 = np.ones_like(sumw)*(1e-30*np.mean(sumw,axis=dense_axes,keepdims=True))
+            if any(has_w2):
+                idx = np.flatnonzero(has_w2)
+                sumw2[:,idx] = np.tensordot(w2_mat,np.stack([eft_w2[i] for i in idx]),axes=([1],[-1]))
+            for i,name in enumerate(names):
+                for j,tup in enumerate(eft_keys):
+                    r[name][tup] = [sumw[i,j][view],sumw2[i,j][view]]
+        if non_eft_keys:
+            stacked_w = np.stack(non_eft_w)
+            stacked_w2 = np.stack(non_eft_w2)
+            for i,name in enumerate(names):
+                for j,tup in enumerate(non_eft_keys):
+                    r[name][tup] = [row_sums[i]*stacked_w[j][view],row_sums[i]*stacked_w2[j][view]]
 
         toc = time.time()
         dt = toc - tic
         if self.verbose:
             print(f"\tDecompose Time: {dt:.2f} s")
-            print(f"\tTotal terms: {terms}")
+            print(f"\tTotal terms: {len(names)}")
 
         return r
 
+@functools.lru_cache(maxsize=None)
+def get_decomposition_matrices(wcnames,wcs):
+    """
+        Build the linear maps from the quadratic (and quartic) EFT coefficients of a bin to the sm, lin,
+        quad and mixed pieces of DatacardMaker.decompose() for the selected wcs. Returns the names of the
+        pieces (in the order decompose() has always produced them) and the two matrices, of shape
+        (n_pieces, n_quad_terms) and (n_pieces, n_quartic_terms).
+
+        Each piece is a combination of the hist evaluated at a few WC points, which is linear in the
+        coefficients. So the matrices are just the monomials at those points combined the same way. For
+        the quadratic coefficients this boils down to picking out single terms, e.g. the quad piece of
+        c1 is exactly its c1*c1 coefficient.
+    """
+    n_wc = len(wcnames)
+    pts = {}
+    def pt(**vals):
+        key = tuple(sorted(vals.items()))
+        if key not in pts:
+            arr = np.zeros(n_wc)
+            for wc,v in vals.items():
+                arr[wcnames.index(wc)] = v
+            pts[key] = (len(pts),arr)
+        return pts[key][0]
+
+    # Each piece is a list of (factor, WC point) pairs
+    pieces = {"sm": [(1.0,pt())]}
+    for n1,wc1 in enumerate(wcs):
+        pieces[f"lin_{wc1}"] = [(1.0,pt(**{wc1: 1.0}))]
+        pieces[f"quad_{wc1}"] = [(0.5,pt(**{wc1: 2.0})),(-1.0,pt(**{wc1: 1.0})),(0.5,pt())]
+        for n2,wc2 in enumerate(wcs):
+            if n1 >= n2: continue
+            pieces[f"quad_mixed_{wc1}_{wc2}"] = [(1.0,pt(**{wc1: 1.0, wc2: 1.0}))]
+
+    points = np.zeros((len(pts),n_wc))
+    for i,arr in pts.values():
+        points[i] = arr
+    combs = np.zeros((len(pieces),len(points)))
+    for i,terms in enumerate(pieces.values()):
+        for factor,j in terms:
+            combs[i,j] += factor
+
+    w_mat = combs @ efth.calc_monomials(points,efth.quad_monomial_table(n_wc))
+    w2_mat = combs @ efth.calc_monomials(points,efth.quartic_monomial_table(n_wc))
+    w_mat.setflags(write=False)
+    w2_mat.setflags(write=False)
+    return tuple(pieces.keys()),w_mat,w2_mat
+
 if __name__ == '__main__':
     fpath = topcoffea_path("../analysis/topEFT/histos/may18_fullRun2_withSys_anatest08_np.pkl.gz")
 
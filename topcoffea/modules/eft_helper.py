@@ -5,6 +5,7 @@ import numpy as np
 import numba
 from numba.typed import List
 import math
+import functools
 
 @numba.njit
 def calc_eft_weights(q_coeffs,wc_values):
@@ -205,6 +206,85 @@ def calc_eft_w2(quartic_coeffs_unique, wc_values):
 
     return out
 
+@functools.lru_cache(maxsize=None)
+def quad_monomial_table(n_wc):
+    """Index table for the quadratic parameterization of n_wc Wilson coefficients.
+
+    Returns an integer array of shape (n_quad_terms(n_wc), 2), where row i holds the two
+    factors that multiply the i-th quadratic coefficient.  Factor 0 is the constant "1",
+    factor k>0 is the (k-1)-th WC.  The table is computed once per number of WCs and cached,
+    so treat it as read only.
+    """
+    table = np.zeros((n_quad_terms(n_wc),2),np.int64)
+    for i_term in range(len(table)):
+        quadratic_term_to_factors(i_term,table[i_term])
+    table.setflags(write=False)
+    return table
+
+@functools.lru_cache(maxsize=None)
+def quartic_monomial_table(n_wc):
+    """Index table for the quartic (w**2) parameterization of n_wc Wilson coefficients.
+
+    Same as quad_monomial_table(), but with the 4 factors of each of the n_quartic_terms(n_wc)
+    terms (i.e. what quartic_term_to_factors() gives for each term).
+    """
+    # Note: Use the same int32 factors array as calc_eft_w2(), the mapping is only validated for that type
+    factors = np.zeros(4,np.int32)
+    table = np.zeros((n_quartic_terms(n_wc),4),np.int64)
+    for i_term in range(len(table)):
+        quartic_term_to_factors(i_term,factors)
+        table[i_term] = factors
+    table.setflags(write=False)
+    return table
+
+def calc_monomials(wc_points, table):
+    """Evaluate the monomials of a quadratic (or quartic) parameterization at a set of WC points.
+
+    Args:
+        wc_points: A 2D array of shape (n_points, n_wc), each row is one set of WC values
+        table: The index table from quad_monomial_table() or quartic_monomial_table()
+
+    Returns:
+        An array of shape (n_points, n_terms) with the value multiplying each coefficient at each point
+    """
+    wc_points = np.atleast_2d(np.asarray(wc_points,dtype=np.float64))
+    # Prepend "1" to the start of each WC point to account for the constant and linear terms
+    wcs = np.hstack((np.ones((len(wc_points),1)),wc_points))
+    return np.prod(wcs[:,table],axis=-1)
+
+def calc_eft_weights_batch(q_coeffs, wc_points):
+    """Calculate the weights for many sets of WC values at once.
+
+    Args:
+        q_coeffs: Array specifying a set of quadric coefficients parameterizing the weights.
+                  The last dimension should specify the coefficients, while any earlier dimensions
+                  might be for different histogram bins, events, etc.
+        wc_points: A 2D array of shape (n_points, n_wc), each row is one set of WC values
+
+    Returns:
+        An array of shape (n_points, *q_coeffs.shape[:-1]), where out[i] is the same as
+        calc_eft_weights(q_coeffs, wc_points[i])
+    """
+    wc_points = np.atleast_2d(wc_points)
+    monomials = calc_monomials(wc_points, quad_monomial_table(wc_points.shape[-1]))
+    return np.tensordot(monomials,q_coeffs,axes=([1],[-1]))
+
+def calc_eft_w2_batch(quartic_coeffs_unique, wc_points):
+    """Calculate the w**2 values for many sets of WC values at once.
+
+    Args:
+        quartic_coeffs_unique: Array specifying a set of quartic coefficients parameterizing the
+                    w**2 values (see calc_eft_w2).
+        wc_points: A 2D array of shape (n_points, n_wc), each row is one set of WC values
+
+    Returns:
+        An array of shape (n_points, *quartic_coeffs_unique.shape[:-1]), where out[i] is the same
+        as calc_eft_w2(quartic_coeffs_unique, wc_points[i])
+    """
+    wc_points = np.atleast_2d(wc_points)
+    monomials = calc_monomials(wc_points, quartic_monomial_table(wc_points.shape[-1]))
+    return np.tensordot(monomials,quartic_coeffs_unique,axes=([1],[-1]))
+
 def remap_coeffs(current_list, target_list, coeffs):
     """Remaps the quadratic fit coefficients to the appropriate order desired for filling a HistEFT.
     
@@ -1,4 +1,5 @@
 import os, sys, argparse, uproot
+import numpy as np
 import subprocess
 
 def isdigit(a):
@@ -193,48 +194,38 @@ def getDicFiles(inFolder):
   groupFilesInDic(listOfFiles,files)
   return listOfFiles
   
-def GetAllInfoFromFile(fname, treeName = 'Events'):
-  ''' Returns a list with all the info of a file ''' 
+def GetAllInfoFromFile(fname, treeName = 'Events', executor = None):
+  ''' Returns a list with all the info of a file (or the summed info of a list of files)
+      For a list of files, an executor from concurrent.futures can be passed to scan the files concurrently '''
   if isinstance(fname, list):
     nEvents = 0
     nGenEvents = 0
     nSumOfWeights = 0
     isData = False
-    for f in fname: 
-      iE, iG, iS, isData = GetAllInfoFromFile(f, treeName)
+    results = executor.map(GetAllInfoFromFile, fname, [treeName]*len(fname)) if executor is not None else (GetAllInfoFromFile(f, treeName) for f in fname)
+    for iE, iG, iS, isData in results:
       nEvents += iE
       nGenEvents += iG
       nSumOfWeights += iS
     return [nEvents, nGenEvents, nSumOfWeights, isData]
   elif isinstance(fname, str):
     print('Opening with uproot: ', fname)
-    f = uproot.open(fname)
-    t = f[treeName]
-    isData = not 'genWeight' in t#.keys()
-    nEvents = int(t.num_entries)
-    ## Method 1: from histograms
-    if 'Count' in f and False:
-      hc = f['Count']
-      nGenEvents = hc.values[0] #hc.GetBinContent(1) if isinstance(hc,TH1F) else 1
-      nSumOfWeights = 0
-      keys = [str(k) for k in f.keys()]
-      for k in keys:
-        if 'SumWeights' in str(k):
-          hs = f['SumWeights']
-          nSumOfWeights = hs.values[0]
-      if nSumOfWeights == 0: 
-        nSumOfWeights = nGenEvents
-    # Method 2: from 'Runs' tree
-    elif (('Runs' in f) & (not isData)):
-      r = f['Runs']
-      genEventSumw  = 'genEventSumw'  if 'genEventSumw'  in r else 'genEventSumw_'
-      genEventCount = 'genEventCount' if 'genEventCount' in r else 'genEventCount_'
-      nGenEvents    = sum(r[genEventCount] .array())
-      nSumOfWeights = sum(r[genEventSumw].array())
-    # Method 3: from unskimmed file
-    else:
-      nGenEvents = nEvents
-      nSumOfWeights = sum(t['genWeight']) if not isData else nEvents
+    with uproot.open(fname) as f:
+      t = f[treeName]
+      isData = not 'genWeight' in t#.keys()
+      nEvents = int(t.num_entries)
+      # Method 1: from 'Runs' tree (only the two branches needed are read, and summed with numpy)
+      if (('Runs' in f) & (not isData)):
+        r = f['Runs']
+        genEventSumw  = 'genEventSumw'  if 'genEventSumw'  in r else 'genEventSumw_'
+        genEventCount = 'genEventCount' if 'genEventCount' in r else 'genEventCount_'
+        arrs = r.arrays([genEventCount, genEventSumw], library='np')
+        nGenEvents    = int(np.sum(arrs[genEventCount]))
+        nSumOfWeights = float(np.sum(arrs[genEventSumw]))
+      # Method 2: from unskimmed file
+      else:
+        nGenEvents = nEvents
+        nSumOfWeights = float(np.sum(t['genWeight'].array(library='np'))) if not isData else nEvents
     return [nEvents, nGenEvents, nSumOfWeights, isData]
   else: print('[ERROR] [GetAllInfoFromFile]: wrong input')
 
@@ -1,8 +1,6 @@
 import numpy as np
 import argparse
 
-from coffea.hist import StringBin
-
 import topcoffea.modules.utils as utils
 from topcoffea.modules.YieldTools import YieldTools
 yt = YieldTools()
@@ -35,6 +33,83 @@ NO_RENORMFACT_LST = [
 ]
 
 
+# Max number of elements to stack at once when finding the envelope (i.e. how many sparse bins are done together)
+MAX_STACK_SIZE = 2**24
+
+
+# Group the sparse keys of a histo that have renorm/fact variations by everything except the systematic
+#   - Returns a dict: key without the systematic -> list of the keys for nominal followed by the 6 variations
+def get_renormfact_key_groups(histo):
+    sparse_axis_names = [ax.name for ax in histo.sparse_axes()]
+    sample_idx = sparse_axis_names.index("sample")
+    syst_idx = sparse_axis_names.index("systematic")
+    syst_lst = ["nominal"] + RENORMFACT_VAR_LST
+
+    groups = {}
+    for key in histo._sumw.keys():
+        if key[sample_idx].name in NO_RENORMFACT_LST: continue
+        syst_name = key[syst_idx].name
+        if syst_name not in syst_lst: continue
+        group_key = key[:syst_idx] + key[syst_idx+1:]
+        groups.setdefault(group_key,{})[syst_name] = key
+
+    out = {}
+    for group_key,syst_dict in groups.items():
+        missing_lst = [syst_name for syst_name in syst_lst if syst_name not in syst_dict]
+        if len(missing_lst) > 0:
+            raise Exception(f"Error: Missing the {missing_lst} variations for the bin {tuple(k.name for k in group_key)}.")
+        out[group_key] = [syst_dict[syst_name] for syst_name in syst_lst]
+    return out
+
+
+# Find the envelope of the renorm/fact variations for a list of groups of keys (as returned by get_renormfact_key_groups) that all have the same shape
+#   - The variations of all of the groups are stacked along a new axis, so the most extreme variation is found for all of the bins at once
+#   - The choice of the most extreme variation is based on the SM part of EFT bins, the whole EFT coefficient array is then taken from that variation
+#   - Returns the sumw for up and down (arrays of shape (n groups, *shape)), and the same for sumw2 (None for the groups where they do not all exist)
+def get_envelope_for_groups(histo,key_groups,is_eft):
+    sumw = np.stack([[histo._sumw[key] for key in keys] for keys in key_groups])
+    sm = sumw[...,0] if is_eft else sumw
+
+    # Get the indices (of the list of the renorm/fact variations) of the most extreme variation with respect to nominal, for each bin
+    diff_wrt_nom = sm[:,1:] - sm[:,:1]
+    max_var_idx = np.expand_dims(np.argmax(diff_wrt_nom,axis=1),1)
+    min_var_idx = np.expand_dims(np.argmin(diff_wrt_nom,axis=1),1)
+    if is_eft:
+        max_var_idx = max_var_idx[...,None]
+        min_var_idx = min_var_idx[...,None]
+    sumw_up = np.take_along_axis(sumw[:,1:],max_var_idx,axis=1)[:,0]
+    sumw_do = np.take_along_axis(sumw[:,1:],min_var_idx,axis=1)[:,0]
+
+    # Also might as well get the sumw2 (though we don't really use this right now)
+    # Only meaningful if the sumw2 exists for all of the variations we took the bins from (otherwise just leave it as None)
+    sumw2_up = [None]*len(key_groups)
+    sumw2_do = [None]*len(key_groups)
+    if histo._sumw2 is not None:
+        sumw2_shape = (*histo._dense_shape, histo._nerrcoeffs) if is_eft else histo._dense_shape
+        sumw2 = np.zeros((len(key_groups),len(RENORMFACT_VAR_LST),*sumw2_shape))
+        has_sumw2 = np.zeros((len(key_groups),len(RENORMFACT_VAR_LST)),dtype=bool)
+        for i,keys in enumerate(key_groups):
+            for j,key in enumerate(keys[1:]):
+                arr = histo._sumw2.get(key)
+                if (arr is not None) and (arr.shape == sumw2_shape):
+                    sumw2[i,j] = arr
+                    has_sumw2[i,j] = True
+        if has_sumw2.any():
+            sm_idx_up = max_var_idx[...,0] if is_eft else max_var_idx
+            sm_idx_do = min_var_idx[...,0] if is_eft else min_var_idx
+            has_sumw2_bins = np.broadcast_to(has_sumw2.reshape(*has_sumw2.shape,*[1]*len(histo._dense_shape)),sm[:,1:].shape)
+            all_sumw2_exists = (
+                np.take_along_axis(has_sumw2_bins,sm_idx_up,axis=1) & np.take_along_axis(has_sumw2_bins,sm_idx_do,axis=1)
+            ).reshape(len(key_groups),-1).all(axis=1)
+            sumw2_up_arr = np.take_along_axis(sumw2,max_var_idx,axis=1)[:,0]
+            sumw2_do_arr = np.take_along_axis(sumw2,min_var_idx,axis=1)[:,0]
+            for i in np.flatnonzero(all_sumw2_exists):
+                sumw2_up[i] = sumw2_up_arr[i]
+                sumw2_do[i] = sumw2_do_arr[i]
+
+    return sumw_up, sumw_do, sumw2_up, sumw2_do
+
+
 # Get the most extreme renorm fact variations
 def get_renormfact_envelope(dict_of_hists):
 
@@ -51,81 +126,33 @@ def get_renormfact_envelope(dict_of_hists):
 
         # Get the histo for this variable from the input dict
         histo = dict_of_hists[var_name]
-        sample_lst = yt.get_cat_lables(histo,"sample")
-        cat_lst = yt.get_cat_lables(histo,"channel")
-
-        # Loop over samples and channels and find the bins with the most extreme rf variations
-        out_dict = {}
-        for sample_name in sample_lst:
-            if sample_name in NO_RENORMFACT_LST: continue
-            for cat_name in cat_lst:
-                print("\t\t",sample_name,cat_name)
-
-                # Get the nominal arr
-                # Use sumw not values() since it's way faster
-                key_tup_nom = (StringBin(sample_name), StringBin(cat_name), StringBin("nominal"))
-                dense_arr_nom = histo._sumw[key_tup_nom]
-                if dense_arr_nom.ndim == 2:
-                    # If this is an EFT bin, just take SM part
-                    dense_arr_nom = dense_arr_nom[:,0]
-
-                # Get the 6 renorm/fact variation arrs, and find difference with respect to nominal, appending resulting arrays to a list
-                diff_wrt_nom_arr_lst = []
-                for rf_variation in RENORMFACT_VAR_LST:
-                    key_tup = (StringBin(sample_name), StringBin(cat_name), StringBin(rf_variation))
-                    dense_arr_var = histo._sumw[key_tup]
-                    if dense_arr_var.ndim == 2:
-                        # If this is an EFT bin, just take SM part
-                        dense_arr_var = dense_arr_var[:,0]
-                    dense_arr_diffwrtnom = dense_arr_var - dense_arr_nom
-                    diff_wrt_nom_arr_lst.append(dense_arr_diffwrtnom)
-
-                # Get the indices (of the list of the renomr/fact strings) corresponding to the most extreme variation with respect to nominal
-                max_var_idx = np.argmax(diff_wrt_nom_arr_lst,axis=0)
-                min_var_idx = np.argmin(diff_wrt_nom_arr_lst,axis=0)
-
-                # Get the renorm/fact variation string corresponding to the most extreme variation
-                rf_vars_extreme_max = np.take(RENORMFACT_VAR_LST,max_var_idx)
-                rf_vars_extreme_min = np.take(RENORMFACT_VAR_LST,min_var_idx)
-
-                # Now loop over the dense bins (probably a way to do this without a loop)
-                # For each dense bin, get the values corresponding to the most extreme variation, and append those to a list (whihc we'll later turn into an array)
-                extreme_sumw_up_lst = []
-                extreme_sumw_do_lst = []
-                extreme_sumw2_up_lst = []
-                extreme_sumw2_do_lst = []
-                all_sumw2_exists = True # Keep track if all sumw2 arrays are meaningful (otherwise just leave leave sumw2 as None)
-                for bin_idx in range(len(rf_vars_extreme_max)):
-                    # Get the key tuple for the bin for this category
-                    key_tup_extreme_up = (StringBin(sample_name), StringBin(cat_name), StringBin(rf_vars_extreme_max[bin_idx]))
-                    key_tup_extreme_do = (StringBin(sample_name), StringBin(cat_name), StringBin(rf_vars_extreme_min[bin_idx]))
-                    # Append the sum2 for each bin to the list
-                    extreme_sumw_up_lst.append(histo._sumw[key_tup_extreme_up][bin_idx])
-                    extreme_sumw_do_lst.append(histo._sumw[key_tup_extreme_do][bin_idx])
-                    # Also might as well get the sumw2 for the bin (though we don't really use this right now)
-                    extreme_sumw2_up = histo._sumw2[key_tup_extreme_up]
-                    extreme_sumw2_do = histo._sumw2[key_tup_extreme_do]
-                    if (extreme_sumw2_up is not None) and (extreme_sumw2_do is not None):
-                        extreme_sumw2_up_lst.append(extreme_sumw2_up[bin_idx])
-                        extreme_sumw2_do_lst.append(extreme_sumw2_do[bin_idx])
-                    else:
-                        all_sumw2_exists = False
+
+        # Split the groups of keys by the shape of their arrays (i.e. EFT or not), since only arrays of the same shape can be stacked
+        key_groups_by_shape = {}
+        for group_key,keys in get_renormfact_key_groups(histo).items():
+            shape = histo._sumw[keys[0]].shape
+            key_groups_by_shape.setdefault(shape,[]).append((group_key,keys))
+
+        for shape,key_groups in key_groups_by_shape.items():
+            is_eft = (shape != histo._dense_shape)
+            n_per_batch = max(1,MAX_STACK_SIZE//(len(RENORMFACT_VAR_LST)*int(np.prod(shape))))
+            for batch_start in range(0,len(key_groups),n_per_batch):
+                batch = key_groups[batch_start:batch_start+n_per_batch]
+                sumw_up, sumw_do, sumw2_up, sumw2_do = get_envelope_for_groups(histo,[keys for _,keys in batch],is_eft)
 
                 # This is a bit of a hack, probably not the best way to do this :(
                 # Since it's apparently very hard to add categories to a coffea hist, let's just overwrite the sumw values of an exisitng category
                 # We won't need renorm or fact or renormfact once we've found the evelope, so just overwrite renormfact
                 # At the end we'll remove the renorm and fact categories
                 # So what we'll be left with is a renormfact category, whose values are now the evelope of the renorm, fact, and renormfact systeamtics
-                key_tup_rf_env_up = (StringBin(sample_name), StringBin(cat_name), StringBin("renormfactUp"))
-                key_tup_rf_env_do = (StringBin(sample_name), StringBin(cat_name), StringBin("renormfactDown"))
-                histo._sumw[key_tup_rf_env_up] = np.array(extreme_sumw_up_lst)
-                histo._sumw[key_tup_rf_env_do] = np.array(extreme_sumw_do_lst)
-                if all_sumw2_exists:
-                    histo._sumw2[key_tup_rf_env_up] = np.array(extreme_sumw2_up_lst)
-                    histo._sumw2[key_tup_rf_env_do] = np.array(extreme_sumw2_do_lst)
-                else:
-                    histo._sumw2[key_tup_rf_env_up] = None
-                    histo._sumw2[key_tup_rf_env_do] = None
+                for i,(_,keys) in enumerate(batch):
+                    key_rf_env_up = keys[1+RENORMFACT_VAR_LST.index("renormfactUp")]
+                    key_rf_env_do = keys[1+RENORMFACT_VAR_LST.index("renormfactDown")]
+                    histo._sumw[key_rf_env_up] = sumw_up[i]
+                    histo._sumw[key_rf_env_do] = sumw_do[i]
+                    if histo._sumw2 is not None:
+                        histo._sumw2[key_rf_env_up] = sumw2_up[i]
+                        histo._sumw2[key_rf_env_do] = sumw2_do[i]
 
         # Remove the left over renorm/fact variations, and put the histo into the output dictionary
         histo = histo.remove(["factUp","factDown","renormUp","renormDown"],"systematic")
@@ -141,13 +168,13 @@ def main():
     # Set up the command line parser
     parser = argparse.ArgumentParser()
     parser.add_argument("pkl_file_path", help = "The path to the pkl file")
-    parser.add_argument("-n", "--output-name", default="histos_dict", help = "A name for the output file")
+    parser.add_argument("-n", "--output-name", default="histos_dict", help = "A name for the output file (saved as a pkl file if it ends in .pkl.gz, as a hist store otherwise)")
     args = parser.parse_args()
 
     # Get the envelope and write to an out pkl
     hin_dict = utils.get_hist_from_pkl(args.pkl_file_path,allow_empty=False)
     hout_dict = get_renormfact_envelope(hin_dict)
-    utils.dump_to_pkl(args.output_name,hout_dict)
+    utils.dump_hists(args.output_name,hout_dict)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,178 @@
+'''
+    Projection of a histogram onto a few of its sparse axes, stored as dense numpy arrays
+
+    The histogram is evaluated (at its current WC point, for a HistEFT) and reduced in a single pass over
+    its sparse bins to arrays of shape (n_cats_axis_0, ..., n_cats_axis_N, *dense_shape), with all of the
+    other sparse axes summed over. The usual operations (integrate, remove, group, scale, values) then
+    act on these arrays directly, so they do not copy the histogram (or re-evaluate its EFT bins) each
+    time. The dense arrays keep all of the flow bins, so to_hist() gives back a regular coffea histogram
+    (e.g. for plotting) that is the same as what the equivalent operations on the histogram would give.
+
+    Example:
+        proj = HistProjection(h,axes=("sample","channel","systematic"))
+        nom_arr = proj.integrate("sample",["ttHJet_privateUL17"]).integrate("systematic","nominal").integrate("channel").values()[()]
+'''
+
+import numbers
+import numpy as np
+
+from coffea import hist
+from coffea.hist.hist_tools import overflow_behavior
+
+class HistProjection:
+    '''
+        Projection of the histogram h onto the sparse axes listed in axes
+          - select: Optional function taking a dict of the sparse identifiers of a bin ({axis name: identifier}, for
+            all of the sparse axes of h) that returns whether the bin should be included in the projection
+    '''
+    def __init__(self,h,axes=("sample","channel","systematic"),select=None):
+        sparse_axis_names = [ax.name for ax in h.sparse_axes()]
+        for axis_name in axes:
+            if axis_name not in sparse_axis_names:
+                raise ValueError(f"The hist has no sparse axis \"{axis_name}\", its sparse axes are: {sparse_axis_names}")
+        pos = [sparse_axis_names.index(axis_name) for axis_name in axes]
+
+        self.label = h.label
+        self.axes = list(axes)
+        self.axis_labels = {axis_name: h.axis(axis_name).label for axis_name in axes}
+        self.dense_axes = list(h.dense_axes())
+
+        # Evaluate all of the sparse bins at once, and only keep the ones that are selected
+        vals = h.values(sumw2=True,overflow="allnan")
+        keys = [key for key in vals.keys() if (select is None) or select(dict(zip(sparse_axis_names,key)))]
+        self.cats = {axis_name: sorted(set(key[i] for key in keys)) for axis_name,i in zip(axes,pos)}
+
+        # Add the bins into the arrays
+        shape = tuple(len(self.cats[axis_name]) for axis_name in axes)
+        dense_shape = h._dense_shape if h.dense_dim() > 0 else ()
+        self.sumw = np.zeros(shape+tuple(dense_shape))
+        self.sumw2 = np.zeros(shape+tuple(dense_shape))
+        self.filled = np.zeros(shape,dtype=bool)
+        if len(keys) > 0:
+            cat_idx = [{cat: j for j,cat in enumerate(self.cats[axis_name])} for axis_name in axes]
+            idx = tuple(np.array([cat_idx[n][key[i]] for key in keys],dtype=np.intp) for n,i in enumerate(pos))
+            np.add.at(self.sumw,idx,np.stack([vals[key][0] for key in keys]))
+            np.add.at(self.sumw2,idx,np.stack([vals[key][1] for key in keys]))
+            self.filled[idx] = True
+
+    # Make a projection from arrays (the arrays are not copied)
+    @classmethod
+    def _from_arrays(cls,other,axes,cats,sumw,sumw2,filled):
+        out = cls.__new__(cls)
+        out.label = other.label
+        out.axes = list(axes)
+        out.axis_labels = {axis_name: other.axis_labels[axis_name] for axis_name in axes}
+        out.dense_axes = other.dense_axes
+        out.cats = cats
+        out.sumw = sumw
+        out.sumw2 = sumw2
+        out.filled = filled
+        return out
+
+    def copy(self):
+        return self._from_arrays(self,self.axes,dict(self.cats),self.sumw.copy(),self.sumw2.copy(),self.filled.copy())
+
+    # Get the position of an axis, and the (sorted, unique) indices of the given categories along it
+    # The categories can be a single name or a list of names (names that are not in the projection are skipped), None for all of them
+    def _get_idx(self,axis_name,cats=None):
+        if axis_name not in self.axes:
+            raise ValueError(f"The projection has no axis \"{axis_name}\", its axes are: {self.axes}")
+        if cats is None:
+            cats = self.cats[axis_name]
+        elif isinstance(cats,str):
+            cats = [cats]
+        cat_set = set(cats)
+        idx = [j for j,cat in enumerate(self.cats[axis_name]) if cat in cat_set]
+        return self.axes.index(axis_name), np.array(idx,dtype=np.intp)
+
+    # The indices of the filled bins (as tuples of indices along the axes)
+    def _filled_idx(self):
+        if len(self.axes) == 0:
+            return [()] if self.filled else []
+        return list(zip(*np.nonzero(self.filled)))
+
+    # The categories along an axis that have any filled bins
+    def identifiers(self,axis_name):
+        ax = self.axes.index(axis_name)
+        other_axes = tuple(i for i in range(len(self.axes)) if i != ax)
+        is_filled = self.filled.any(axis=other_axes) if len(other_axes) else self.filled
+        return [cat for cat,f in zip(self.cats[axis_name],is_filled) if f]
+
+    # Sum over the given categories of an axis (all of them if None), and drop the axis
+    def integrate(self,axis_name,cats=None):
+        ax,idx = self._get_idx(axis_name,cats)
+        axes = [a for a in self.axes if a != axis_name]
+        cats = {a: self.cats[a] for a in axes}
+        return self._from_arrays(
+            self, axes, cats,
+            np.take(self.sumw,idx,axis=ax).sum(axis=ax),
+            np.take(self.sumw2,idx,axis=ax).sum(axis=ax),
+            np.take(self.filled,idx,axis=ax).any(axis=ax),
+        )
+
+    # Sum over all of the categories of the given axes
+    def sum(self,*axis_names):
+        out = self
+        for axis_name in axis_names:
+            out = out.integrate(axis_name)
+        return out
+
+    # Drop the given categories of an axis
+    def remove(self,cats,axis_name):
+        ax,idx = self._get_idx(axis_name,cats)
+        keep = np.setdiff1d(np.arange(len(self.cats[axis_name])),idx)
+        cats = dict(self.cats)
+        cats[axis_name] = [self.cats[axis_name][j] for j in keep]
+        return self._from_arrays(
+            self, self.axes, cats,
+            np.take(self.sumw,keep,axis=ax),
+            np.take(self.sumw2,keep,axis=ax),
+            np.take(self.filled,keep,axis=ax),
+        )
+
+    # Group the categories of an axis, the mapping is {new category: [old categories]}
+    def group(self,axis_name,mapping):
+        ax = self.axes.index(axis_name)
+        new_cats = list(mapping.keys())
+        new_idx = [self._get_idx(axis_name,mapping[new_cat])[1] for new_cat in new_cats]
+        def group_arr(arr,op):
+            return np.stack([op(np.take(arr,idx,axis=ax),axis=ax) for idx in new_idx],axis=ax)
+        cats = dict(self.cats)
+        cats[axis_name] = new_cats
+        return self._from_arrays(self, self.axes, cats, group_arr(self.sumw,np.sum), group_arr(self.sumw2,np.sum), group_arr(self.filled,np.any))
+
+    # Scale in place by a number, or by a {category: factor} dict along an axis (categories that are not in the dict are not scaled)
+    def scale(self,factor,axis=None):
+        if isinstance(factor,numbers.Number) and axis is None:
+            self.sumw *= factor
+            self.sumw2 *= factor**2
+        elif isinstance(factor,dict):
+            ax = self.axes.index(axis)
+            factor_arr = np.array([factor.get(cat,1.0) for cat in self.cats[axis]])
+            factor_arr = factor_arr.reshape((-1,)+(1,)*(self.sumw.ndim-ax-1))
+            self.sumw *= factor_arr
+            self.sumw2 *= factor_arr**2
+        else:
+            raise TypeError("Could not interpret scale factor")
+
+    # Same as the values() of a hist, i.e. {(identifier,...): sumw} (or (sumw,sumw2) if sumw2) for all of the filled bins
+    def values(self,sumw2=False,overflow="none"):
+        view = tuple(overflow_behavior(overflow) for _ in self.dense_axes)
+        out = {}
+        for idx in self._filled_idx():
+            key = tuple(self.cats[axis_name][j] for axis_name,j in zip(self.axes,idx))
+            if sumw2:
+                out[key] = (self.sumw[idx][view],self.sumw2[idx][view])
+            else:
+                out[key] = self.sumw[idx][view]
+        return out
+
+    # Make a regular coffea hist from the projection (e.g. for plotting)
+    def to_hist(self):
+        out = hist.Hist(self.label,*[hist.Cat(axis_name,self.axis_labels[axis_name]) for axis_name in self.axes],*self.dense_axes)
+        out._sumw2 = {}
+        for idx in self._filled_idx():
+            key = tuple(out.axis(axis_name).index(self.cats[axis_name][j]) for axis_name,j in zip(self.axes,idx))
+            out._sumw[key] = self.sumw[idx].copy()
+            out._sumw2[key] = self.sumw2[idx].copy()
+        return out
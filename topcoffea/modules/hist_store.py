@@ -0,0 +1,216 @@
+'''
+    Chunked, indexed on-disk format for the dictionaries of histograms produced by the processors
+
+    A hist store is a zip archive (each member compressed on its own) holding:
+        - index.json: The names of the histograms, their sparse axes and, for every chunk, the list
+          of sparse bins (as identifier names) it contains
+        - For each histogram, a "meta" member with an empty copy of the histogram (axes, WC names, etc.)
+        - For each histogram, one member per chunk with the sumw/sumw2 arrays of the sparse bins in it.
+          By default the bins are chunked by their (sample, channel) identifiers.
+        - Any non-histogram object of the output dict is pickled whole in its own member
+
+    Since the index can be read without touching the rest of the archive, a single histogram, or just
+    a sample/channel/systematic slice of it, can be loaded by only decompressing the members needed.
+
+    Example:
+        dump_hists("histos/out.hists.zip",output)
+        reader = HistStoreReader("histos/out.hists.zip")
+        h = reader.get("lj0pt",channel="2lss_p_4j",systematic=["nominal","ISRUp"])
+'''
+
+import json
+import pickle
+import zipfile
+import cloudpickle
+
+from coffea import hist
+
+HIST_STORE_EXT = ".hists.zip"
+HIST_STORE_VERSION = 1
+INDEX_NAME = "index.json"
+
+# The sparse axes used to split a histogram into chunks (only the ones a histogram actually has are used)
+CHUNK_AXES = ("sample","channel")
+
+# Check if a file is a hist store (as opposed to e.g. a gzipped pkl file)
+def is_hist_store(fpath):
+    if not zipfile.is_zipfile(fpath):
+        return False
+    with zipfile.ZipFile(fpath) as zf:
+        return INDEX_NAME in zf.namelist()
+
+# Get the names of the sparse axes to chunk a histogram by
+def get_chunk_axes(h,chunk_axes=CHUNK_AXES):
+    sparse_names = [ax.name for ax in h.sparse_axes()]
+    chunk_names = [x for x in chunk_axes if x in sparse_names]
+    if not chunk_names and sparse_names:
+        chunk_names = sparse_names[:1]
+    return chunk_names
+
+# Write a dictionary of histograms (e.g. the output of a processor) to a hist store
+def dump_hists(out_name,hists,chunk_axes=CHUNK_AXES,compresslevel=6):
+    if not out_name.endswith(HIST_STORE_EXT):
+        out_name = out_name + HIST_STORE_EXT
+    index = {"version": HIST_STORE_VERSION, "hists": {}, "objects": {}}
+    with zipfile.ZipFile(out_name,"w",compression=zipfile.ZIP_DEFLATED,compresslevel=compresslevel,allowZip64=True) as zf:
+        for i,(name,h) in enumerate(hists.items()):
+            prefix = f"{i}"
+            if not isinstance(h,hist.Hist):
+                member = f"{prefix}/object.pkl"
+                zf.writestr(member,cloudpickle.dumps(h))
+                index["objects"][name] = member
+                continue
+            sparse_axes = h.sparse_axes()
+            chunk_names = get_chunk_axes(h,chunk_axes)
+            chunk_pos = [h._isparse(x) for x in chunk_names]
+
+            meta_member = f"{prefix}/meta.pkl"
+            zf.writestr(meta_member,cloudpickle.dumps(h.copy(content=False)))
+
+            # Group the sparse bins by the identifiers of the chunk axes
+            chunk_keys = {}
+            for key in h._sumw.keys():
+                chunk_keys.setdefault(tuple(key[p] for p in chunk_pos),[]).append(key)
+
+            chunks = []
+            for j,(chunk_id,keys) in enumerate(chunk_keys.items()):
+                member = f"{prefix}/{j}.pkl"
+                # Note: The bins are keyed by the names of their identifiers, since the indices of the
+                #       sparse bins are only meaningful for the axes of this particular histogram
+                names = [tuple(x.name for x in k) for k in keys]
+                payload = {
+                    "sumw": {n: h._sumw[k] for n,k in zip(names,keys)},
+                    "sumw2": None if h._sumw2 is None else {n: h._sumw2.get(k) for n,k in zip(names,keys)},
+                }
+                zf.writestr(member,pickle.dumps(payload,protocol=pickle.HIGHEST_PROTOCOL))
+                chunks.append({
+                    "member": member,
+                    "id": [x.name for x in chunk_id],
+                    "keys": names,
+                })
+            index["hists"][name] = {
+                "meta": meta_member,
+                "sparse_axes": [ax.name for ax in sparse_axes],
+                "chunk_axes": chunk_names,
+                "chunks": chunks,
+            }
+        # The index is written last, so a partially written file is never mistaken for a complete one
+        zf.writestr(INDEX_NAME,json.dumps(index))
+    return out_name
+
+# Get a copy of a histogram with only the sparse bins that pass the selection, i.e. what a HistStoreReader
+# would load for the same histogram and selection (useful for histograms that are already in memory)
+# Note: As for HistStoreReader.load(), a selection on an axis that the histogram does not have is ignored
+def select_bins(h,**selection):
+    sparse_names = [ax.name for ax in h.sparse_axes()]
+    sel = {sparse_names.index(axis): ({ids} if isinstance(ids,str) else set(ids)) for axis,ids in selection.items() if axis in sparse_names}
+    out = h.copy(content=False)
+    for key,sumw in h._sumw.items():
+        if not all(key[pos].name in ids for pos,ids in sel.items()):
+            continue
+        out._sumw[key] = sumw.copy()
+        if h._sumw2 is not None:
+            out._sumw2[key] = None if h._sumw2.get(key) is None else h._sumw2[key].copy()
+    return out
+
+class HistStoreReader:
+    '''
+        Lazy reader for a hist store. Only the index is read when the file is opened, histograms are
+        loaded (fully or in part) on demand. The selection keyword arguments of the loading methods map
+        a sparse axis name to an identifier name (or a list of them), e.g. get("njets",sample="data")
+    '''
+    def __init__(self,fpath):
+        self.fpath = fpath
+        self._zf = zipfile.ZipFile(fpath)
+        try:
+            self.index = json.loads(self._zf.read(INDEX_NAME))
+        except KeyError:
+            self._zf.close()
+            raise RuntimeError(f"Not a hist store (no {INDEX_NAME}): {fpath}")
+        if self.index["version"] > HIST_STORE_VERSION:
+            self._zf.close()
+            raise RuntimeError(f"Unsupported hist store version {self.index['version']} in {fpath}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def close(self):
+        self._zf.close()
+
+    def keys(self):
+        return list(self.index["hists"].keys()) + list(self.index["objects"].keys())
+
+    def __contains__(self,name):
+        return name in self.index["hists"] or name in self.index["objects"]
+
+    def __getitem__(self,name):
+        return self.get(name)
+
+    # Check if a histogram has no sparse bins (without loading it)
+    def is_empty(self,name):
+        return len(self.index["hists"][name]["chunks"]) == 0
+
+    # Get the identifier names of a sparse axis that have content, without loading the histogram
+    def identifiers(self,name,axis):
+        info = self.index["hists"][name]
+        pos = info["sparse_axes"].index(axis)
+        seen = {}
+        for chunk in info["chunks"]:
+            for k in chunk["keys"]:
+                seen[k[pos]] = None
+        return list(seen.keys())
+
+    # Load a histogram, keeping only the sparse bins that pass the selection
+    def get(self,name,**selection):
+        if name in self.index["objects"]:
+            if selection:
+                raise ValueError(f"Cannot select a slice of '{name}', it is not a histogram")
+            return pickle.loads(self._zf.read(self.index["objects"][name]))
+        if name not in self.index["hists"]:
+            raise KeyError(name)
+        info = self.index["hists"][name]
+        sel = {}
+        for axis,ids in selection.items():
+            if axis not in info["sparse_axes"]:
+                raise ValueError(f"Histogram '{name}' has no sparse axis '{axis}'")
+            sel[info["sparse_axes"].index(axis)] = {ids} if isinstance(ids,str) else set(ids)
+
+        def passes(key_names):
+            return all(key_names[pos] in ids for pos,ids in sel.items())
+
+        h = pickle.loads(self._zf.read(info["meta"]))
+        sparse_axes = h.sparse_axes()
+        for chunk in info["chunks"]:
+            # Chunks without any selected bin are never decompressed
+            if not any(passes(k) for k in chunk["keys"]):
+                continue
+            payload = pickle.loads(self._zf.read(chunk["member"]))
+            for key_names,sumw in payload["sumw"].items():
+                if not passes(key_names):
+                    continue
+                key = tuple(ax.index(x) for ax,x in zip(sparse_axes,key_names))
+                h._sumw[key] = sumw
+                if payload["sumw2"] is not None:
+                    if h._sumw2 is None:
+                        h._sumw2 = {}
+                    h._sumw2[key] = payload["sumw2"][key_names]
+        return h
+
+    # Load a dictionary of histograms (all of them if hist_lst is not given)
+    # Note: Here a selection on an axis that a histogram does not have is ignored for that histogram
+    def load(self,hist_lst=None,**selection):
+        if hist_lst is None:
+            hist_lst = self.keys()
+        out = {}
+        # Note: Names of hists that are not in the file are skipped, same as for a dict of hists
+        hist_lst = [name for name in hist_lst if name in self]
+        for name in hist_lst:
+            if name in self.index["objects"]:
+                out[name] = self.get(name)
+                continue
+            axes = self.index["hists"][name]["sparse_axes"]
+            out[name] = self.get(name,**{k: v for k,v in selection.items() if k in axes})
+        return out
@@ -145,54 +145,91 @@ exclude_dict = {
 }
 
 
-# This is a helper function called by trgPassNoOverlap
+# The trigger masks are precompiled once per year: each trigger used by the analysis gets a bit, and a list of
+# triggers becomes the integer with the bits of its triggers set, so checking a list of triggers is just a
+# bitwise and against the bits packed for the events (see packTrgBits)
+def _build_trg_masks(year):
+    trg_bits = {}
+    for trg_lst in dataset_dict[year].values():
+        for trg_name in trg_lst:
+            if trg_name not in trg_bits:
+                trg_bits[trg_name] = len(trg_bits)
+    if len(trg_bits) > 64:
+        raise Exception(f"Error: Too many triggers ({len(trg_bits)}) to pack into 64 bits for year \"{year}\".")
+    def to_mask(trg_lst):
+        mask = 0
+        for trg_name in trg_lst:
+            mask |= 1 << trg_bits[trg_name]
+        return mask
+    return {
+        "bits"    : trg_bits,
+        "all"     : to_mask(trg_bits.keys()),
+        "dataset" : {dataset: to_mask(trg_lst) for dataset,trg_lst in dataset_dict[year].items()},
+        "exclude" : {dataset: to_mask(trg_lst) for dataset,trg_lst in exclude_dict[year].items()},
+    }
+
+trg_masks_dict = {year: _build_trg_masks(year) for year in dataset_dict.keys()}
+
+# Pack the trigger decisions of the events into an array of integers (one per event)
+#   - Only the HLT branches for the bits set in the mask are read
+#   - Returns the packed bits and the mask of the bits for the triggers that are present in the events
+def packTrgBits(events,trg_bits,mask):
+    packed = np.zeros(len(events), dtype=np.uint64)
+    present = 0
+    hlt_fields = set(events.HLT.fields)
+    for trg_name,bit in trg_bits.items():
+        if not (mask >> bit) & 1 or trg_name not in hlt_fields:
+            continue
+        packed |= ak.to_numpy(events.HLT[trg_name]).astype(np.uint64) << np.uint64(bit)
+        present |= 1 << bit
+    return packed, present
+
+# Returns an array the same length as the packed bits, elements are true if any of the bits in the mask are set
+def passesTrgMask(packed,mask):
+    return (packed & np.uint64(mask)) != 0
+
+# This is a helper function for checking a list of triggers by name
 #   - Takes events objects, and a lits of triggers
 #   - Returns an array the same length as events, elements are true if the event passed at least one of the triggers and false otherwise
 def passesTrgInLst(events,trg_name_lst):
-    tpass = np.zeros_like(np.array(events.MET.pt), dtype=np.bool)
-    trg_info_dict = events.HLT
-
-    # "fields" should be list of all triggers in the dataset
-    common_triggers = set(trg_info_dict.fields) & set(trg_name_lst)
+    trg_bits = {trg_name: i for i,trg_name in enumerate(dict.fromkeys(trg_name_lst))}
+    mask = (1 << len(trg_bits)) - 1
+    packed, present = packTrgBits(events,trg_bits,mask)
 
     # Check to make sure that at least one of our specified triggers is present in the dataset
-    if len(common_triggers) == 0 and len(trg_name_lst):
+    if present == 0 and len(trg_name_lst):
         raise Exception("No triggers from the sample matched to the ones used in the analysis.")
 
-    for trg_name in common_triggers:
-        tpass = tpass | trg_info_dict[trg_name]
-    return tpass
+    return passesTrgMask(packed,mask)
 
 # This is what we call from the processor
 #   - Returns an array the len of events
 #   - Elements are false if they do not pass any of the triggers defined in dataset_dict
 #   - In the case of data, events are also false if they overlap with another dataset
 def trgPassNoOverlap(events,is_data,dataset,year):
-    
+
     # The trigger for 2016 and 2016APV are the same
     if year == "2016APV":
         year = "2016"
+    trg_masks = trg_masks_dict[year]
 
-    # Initialize ararys and lists, get trg pass info from events
-    trg_passes    = np.zeros_like(np.array(events.MET.pt), dtype=np.bool) # Array of False the len of events
-    trg_overlaps  = np.zeros_like(np.array(events.MET.pt), dtype=np.bool) # Array of False the len of events
-    trg_info_dict = events.HLT
-    full_trg_lst  = []
-
-    # Get the full list of triggers in all datasets
-    for dataset_name in dataset_dict[year].keys():
-        full_trg_lst = full_trg_lst + dataset_dict[year][dataset_name]
-
-    # Check if events pass any of the triggers
-    trg_passes = passesTrgInLst(events,full_trg_lst)
-
-    # In case of data, check if events overlap with other datasets
+    # For MC, check if events pass any of the triggers in any of the datasets
+    # In case of data, check if events pass the triggers of the dataset and do not overlap with the other datasets
     if is_data:
-        trg_passes = passesTrgInLst(events,dataset_dict[year][dataset])
-        trg_overlaps = passesTrgInLst(events, exclude_dict[year][dataset])
+        pass_mask = trg_masks["dataset"][dataset]
+        overlap_mask = trg_masks["exclude"][dataset]
+    else:
+        pass_mask = trg_masks["all"]
+        overlap_mask = 0
+    packed, present = packTrgBits(events,trg_masks["bits"],pass_mask|overlap_mask)
+
+    # Check to make sure that at least one of our specified triggers is present in the dataset
+    for mask in [pass_mask,overlap_mask]:
+        if mask and not (present & mask):
+            raise Exception("No triggers from the sample matched to the ones used in the analysis.")
 
     # Return true if passes trg and does not overlap
-    return (trg_passes & ~trg_overlaps)
+    return passesTrgMask(packed,pass_mask) & ~passesTrgMask(packed,overlap_mask)
 
 
 # 2l selection (we do not make the ss requirement here)
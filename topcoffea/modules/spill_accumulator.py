@@ -0,0 +1,172 @@
+'''
+    Accumulation of processor outputs with a ceiling on the memory that is used
+
+    The outputs (dicts of accumulators, e.g. of histograms) are summed in place as they come in. Whenever
+    the running sum goes above the memory ceiling, it is spilled to local disk (one file per entry of the
+    dict, e.g. per histogram) and the sum starts over. At the end, the spilled partial sums are merged
+    back one entry at a time, so at most one spilled piece is loaded on top of what is already merged.
+
+    The spill files use a fast codec: pickle protocol 5 (HistEFTs are packed first, so each one is stored
+    as a few big contiguous arrays) compressed with lz4 at its fastest level.
+
+    SpillingWorkQueueExecutor is a WorkQueueExecutor that does the final accumulation on the manager (i.e.
+    of the results of the accumulation tasks that run on the workers) this way.
+
+    Example:
+        executor = SpillingWorkQueueExecutor(max_manager_memory=8000,**executor_args)
+'''
+
+import os
+import pickle
+import shutil
+import tempfile
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import lz4.frame as lz4f
+from coffea import hist, processor
+
+from topcoffea.modules.HistEFT import HistEFT
+
+LZ4_LEVEL = lz4f.COMPRESSIONLEVEL_MIN
+SPILL_EXT = ".p.lz4"
+
+# Serialize an object with the fast codec
+def dumps(obj,level=LZ4_LEVEL):
+    if isinstance(obj,HistEFT) and not obj.is_packed():
+        obj.pack()
+    return lz4f.compress(pickle.dumps(obj,protocol=pickle.HIGHEST_PROTOCOL),compression_level=level)
+
+# Deserialize an object written by dumps()
+def loads(data):
+    return pickle.loads(lz4f.decompress(data))
+
+# Get the (rough) number of bytes held by an accumulator, only counting the arrays in it
+# Note: Works for histograms, numpy arrays, column accumulators and (nested) dicts of them
+def get_size(obj):
+    if isinstance(obj,hist.Hist):
+        size = sum(arr.nbytes for arr in obj._sumw.values())
+        if obj._sumw2 is not None:
+            size += sum(arr.nbytes for arr in obj._sumw2.values() if arr is not None)
+        return size
+    if isinstance(obj,np.ndarray):
+        return obj.nbytes
+    if isinstance(obj,processor.column_accumulator):
+        return obj.value.nbytes
+    if isinstance(obj,Mapping):
+        return sum(get_size(v) for v in obj.values())
+    return 0
+
+class SpillingAccumulator:
+    '''
+        Sums a stream of outputs (dicts of accumulators), keeping at most max_mem_mb (in MB) of the sum in
+        memory. The partial sums above that are spilled to a temporary dir made in spill_dir. Since it is
+        Addable, coffea's accumulate() adds the outputs to it in place.
+    '''
+    def __init__(self,max_mem_mb,spill_dir="."):
+        self.max_mem = max_mem_mb*1024**2
+        self.spill_dir = spill_dir
+        self.nspills = 0
+        self._accum = None
+        self._accum_type = None
+        self._keys = {}
+        self._spills = []
+        self._tmp_dir = None
+
+    def __iadd__(self,other):
+        if self._accum_type is None:
+            self._accum_type = type(other)
+        for key in other.keys():
+            self._keys[key] = None
+        if self._accum is None:
+            self._accum = other
+        else:
+            self._accum = processor.accumulate([other],self._accum)
+        if get_size(self._accum) > self.max_mem:
+            self.spill()
+        return self
+
+    # Adding to the accumulator is always done in place
+    def __add__(self,other):
+        return self.__iadd__(other)
+
+    def __len__(self):
+        return len(self._keys)
+
+    # Write the running sum to disk, one file per entry
+    def spill(self):
+        if self._accum is None:
+            return
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix="spill-",dir=self.spill_dir)
+        paths = {}
+        for i,(key,value) in enumerate(self._accum.items()):
+            path = os.path.join(self._tmp_dir,f"{self.nspills}_{i}{SPILL_EXT}")
+            with open(path,"wb") as f:
+                f.write(dumps(value))
+            paths[key] = path
+        self._spills.append(paths)
+        self.nspills += 1
+        self._accum = None
+
+    # Iterate over the (key, sum) pairs, merging the spilled pieces of one key at a time
+    # Note: This empties the accumulator (and removes the spill files) as it goes
+    def items(self):
+        try:
+            for key in list(self._keys):
+                total = None
+                if self._accum is not None and key in self._accum:
+                    total = self._accum.pop(key)
+                for paths in self._spills:
+                    if key not in paths:
+                        continue
+                    path = paths.pop(key)
+                    with open(path,"rb") as f:
+                        piece = loads(f.read())
+                    os.remove(path)
+                    total = piece if total is None else processor.accumulate([piece],total)
+                del self._keys[key]
+                yield key,total
+        finally:
+            self.cleanup()
+
+    # Get the full sum (of the same type as the outputs), None if nothing was added
+    def result(self):
+        if self._accum_type is None:
+            return None
+        out = self._accum_type()
+        for key,value in self.items():
+            out[key] = value
+        return out
+
+    # Remove the spill files
+    def cleanup(self):
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir,ignore_errors=True)
+        self._tmp_dir = None
+        self._spills = []
+
+@dataclass
+class SpillingWorkQueueExecutor(processor.WorkQueueExecutor):
+    '''
+        WorkQueueExecutor that does the final accumulation on the manager with a SpillingAccumulator
+          - max_manager_memory: Memory ceiling (in MB) for the accumulated output, no ceiling if None
+          - spill_dir: Where the spill files go (the filepath of the executor if None)
+    '''
+    max_manager_memory: Optional[int] = None
+    spill_dir: Optional[str] = None
+
+    def __call__(self,items,function,accumulator):
+        if (self.max_manager_memory is None) or (self.desc == "Preprocessing") or (accumulator is not None):
+            return super().__call__(items,function,accumulator)
+        spill_accum = SpillingAccumulator(self.max_manager_memory,self.spill_dir or self.filepath)
+        # The results of the runner are wrapped as {"out": output, "processed": set of work items}
+        wrapped_out,e = super().__call__(items,function,{"out": spill_accum, "processed": set()})
+        if len(spill_accum) == 0:
+            return None,e
+        if spill_accum.nspills:
+            print(f"Spilled the output to disk {spill_accum.nspills} time(s) to stay under {self.max_manager_memory} MB")
+        wrapped_out["out"] = spill_accum.result()
+        return wrapped_out,e
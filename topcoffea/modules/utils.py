@@ -5,6 +5,10 @@ import gzip
 import pickle
 import cloudpickle
 
+from coffea import hist
+
+import topcoffea.modules.hist_store as hist_store
+
 pjoin = os.path.join
 
 # Match strings using one or more regular expressions
@@ -156,9 +160,29 @@ def dump_to_pkl(out_name,out_file):
         cloudpickle.dump(out_file, fout)
     print("Done.\n")
 
+# Save a dictionary of hists, as a gzipped pkl file if the name ends in .pkl.gz and as a hist store otherwise
+def dump_hists(out_name,hists):
+    if out_name.endswith(".pkl.gz"):
+        with gzip.open(out_name, "wb") as fout:
+            cloudpickle.dump(hists, fout)
+    else:
+        out_name = hist_store.dump_hists(out_name,hists)
+    return out_name
+
 # Get the dictionary of hists from the pkl file (e.g. that a processor outputs)
-def get_hist_from_pkl(path_to_pkl,allow_empty=True):
-    h = pickle.load( gzip.open(path_to_pkl) )
+# Note: The file can also be a hist store (see hist_store.py), in which case only the hists in hist_lst
+#       are loaded (all of them if it is None), keeping only the sparse bins passing the selection
+#       (e.g. channel="2lss_p_4j"), while a pkl file always has to be read in full before selecting
+def get_hist_from_pkl(path_to_pkl,allow_empty=True,hist_lst=None,**selection):
+    if hist_store.is_hist_store(path_to_pkl):
+        with hist_store.HistStoreReader(path_to_pkl) as reader:
+            h = reader.load(hist_lst,**selection)
+    else:
+        h = pickle.load( gzip.open(path_to_pkl) )
+        if hist_lst is not None:
+            h = {k:v for k,v in h.items() if k in hist_lst}
+        if selection:
+            h = {k:(hist_store.select_bins(v,**selection) if isinstance(v,hist.Hist) else v) for k,v in h.items()}
     if not allow_empty:
         h = {k:v for k,v in h.items() if v.values() != {}}
     return h
@@ -0,0 +1,156 @@
+'''
+    Layered container for event weights and their systematic variations
+
+    Works like coffea.analysis_tools.Weights (same add() and weight() interface, and the same results),
+    but a new layer can be stacked on top of an existing weights object instead of deep copying it:
+
+        weights_base = LayeredWeights(len(events))
+        weights_base.add("norm",norm)
+        weights_2l = weights_base.layer()
+        weights_2l.add("lepSF",sf,sf_up,sf_down)
+
+    A layer only stores the weights added to it, and refers to the layers below it for the rest. The
+    total weight of a layer is only computed when it is first asked for (and then kept until something is
+    added to it or to a layer below it). Note that this means that a weight added to a layer after other
+    layers have been stacked on top of it is seen by those layers too (as opposed to a deep copy).
+'''
+
+import numpy as np
+import awkward as ak
+
+
+# Get a flat numpy array from an awkward or numpy array, replacing any missing values with fill_value
+def _to_numpy(arr,fill_value=1.0):
+    arr = ak.to_numpy(arr,allow_missing=True)
+    if isinstance(arr,np.ma.MaskedArray):
+        arr = arr.filled(fill_value)
+    return arr
+
+class LayeredWeights:
+    '''
+        Event weights and associated systematic shifts, stored as a stack of layers
+
+        Parameters
+        ----------
+            size : int
+                Number of events (only needed for the bottom layer, the other layers get it from their base)
+            base : LayeredWeights, optional
+                The layer to stack this one on top of, use layer() rather than passing this directly
+    '''
+    def __init__(self, size=None, base=None):
+        if base is None and size is None:
+            raise ValueError("Either the size or the base layer must be given")
+        self._base = base
+        self._size = base._size if base is not None else size
+        self._weights = []   # The (name, nominal weight) pairs added to this layer, in the order they were added
+        self._modifiers = {} # The up/down variations of this layer, as ratios wrt the nominal weight
+        self._version = 0    # Incremented whenever a weight is added, to know when the cached total is out of date
+        self._weight = None
+        self._weight_versions = None
+
+    # Make a new (empty) layer on top of this one, this is what replaces a deep copy
+    def layer(self):
+        return LayeredWeights(base=self)
+
+    def add(self, name, weight, weightUp=None, weightDown=None, shift=False):
+        '''
+            Add a named correction to the event weight, and optionally its up/down variations
+            Same as coffea.analysis_tools.Weights.add(), except the arrays passed are never modified
+        '''
+        if name.endswith("Up") or name.endswith("Down"):
+            raise ValueError("Avoid using 'Up' and 'Down' in weight names, instead pass appropriate shifts to add() call")
+        weight = _to_numpy(weight)
+        if len(weight) != self._size:
+            raise ValueError(f"Weight '{name}' has {len(weight)} entries, expected {self._size}")
+        self._weights.append((name,weight))
+        nonzero = weight != 0.0
+        if weightUp is not None:
+            weightUp = np.array(_to_numpy(weightUp),copy=True)
+            if shift:
+                weightUp += weight
+            weightUp[nonzero] /= weight[nonzero]
+            self._modifiers[name + "Up"] = weightUp
+        if weightDown is not None:
+            weightDown = np.array(_to_numpy(weightDown),copy=True)
+            if shift:
+                weightDown = weight - weightDown
+            weightDown[nonzero] /= weight[nonzero]
+            self._modifiers[name + "Down"] = weightDown
+        self._version += 1
+
+    # The layers from the bottom one to this one
+    def _layers(self):
+        layers = []
+        layer = self
+        while layer is not None:
+            layers.append(layer)
+            layer = layer._base
+        return layers[::-1]
+
+    # Find a modifier in this layer or in the ones below it (the closest one wins, as if the layers were one object)
+    def _find_modifier(self, modifier):
+        layer = self
+        while layer is not None:
+            if modifier in layer._modifiers:
+                return layer._modifiers[modifier]
+            layer = layer._base
+        return None
+
+    def weight(self, modifier=None):
+        '''
+            The event weight vector, or the weight for a particular systematic variation if the modifier
+            (of the form name+"Up" or name+"Down") is given
+        '''
+        layers = self._layers()
+        versions = tuple(layer._version for layer in layers)
+        if self._weight is None or self._weight_versions != versions:
+            # Note: Multiply in the same order as the weights were added, to get the same result as one coffea Weights object
+            if self._base is not None:
+                total = self._base.weight()
+            else:
+                total = np.ones(self._size)
+            for _,w in self._weights:
+                total = total * w
+            self._weight = total
+            self._weight_versions = versions
+        if modifier is None:
+            return self._weight
+        ratio = self._find_modifier(modifier)
+        if ratio is None and "Down" in modifier:
+            up = self._find_modifier(modifier.replace("Down","Up"))
+            if up is not None:
+                return self._weight / up
+        if ratio is None:
+            raise KeyError(modifier)
+        return self._weight * ratio
+
+    def partial_weight(self, include=[], exclude=[]):
+        '''
+            Product of a subset of the nominal weights (of all of the layers), specified either by the names
+            to include or the names to exclude
+        '''
+        if (include and exclude) or not (include or exclude):
+            raise ValueError("Need to specify exactly one of the 'exclude' or 'include' arguments.")
+        weights = {}
+        for layer in self._layers():
+            weights.update(dict(layer._weights))
+        names = set(weights.keys())
+        if include:
+            names = names & set(include)
+        if exclude:
+            names = names - set(exclude)
+        w = np.ones(self._size)
+        for name in names:
+            w *= weights[name]
+        return w
+
+    @property
+    def variations(self):
+        '''Set of the available modifiers (of all of the layers)'''
+        keys = set()
+        for layer in self._layers():
+            keys.update(layer._modifiers.keys())
+        # Add any missing 'Down' variation
+        for k in list(keys):
+            keys.add(k.replace("Up", "Down"))
+        return keys
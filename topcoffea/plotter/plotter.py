@@ -11,6 +11,73 @@ from coffea import hist, processor
 from coffea.hist import plot
 from cycler import cycler
 from topcoffea.plotter.OutText import OutText
+import topcoffea.plotter.render as render
+import topcoffea.modules.utils as utils
+
+def DrawStack(h, hData=None, colors=[], doRatio=True, doStack=True, doLegend=True, doLogY=False, invertStack=False,
+              fill_opts=None, error_opts=None, data_err_opts=None, xRange=None, yRange=None, ratioRange=[0.5, 1.5], yRatioTit='Data / Pred.',
+              lumi=59.7, lumiunit='fb$^{-1}$', sqrts='13 TeV', region=None):
+  ''' Draws the stack of the (scaled) background histogram h, with the data on top if hData is given; returns the figure '''
+  density = False; binwnorm = None
+
+  if hData is not None and doRatio:
+    fig, (ax, rax) = plt.subplots(2, 1, figsize=(7,7), gridspec_kw={"height_ratios": (3, 1)}, sharex=True)
+    fig.subplots_adjust(hspace=.07)
+  else:
+    fig, ax = plt.subplots(1, 1, figsize=(7,7))#, gridspec_kw={"height_ratios": (3, 1)}, sharex=True)
+
+  # Colors
+  if invertStack: 
+    _n = len(h.identifiers("process"))-1
+    colors = colors[_n::-1]
+    h.axis("process")._sorted.reverse()
+  ax.set_prop_cycle(cycler(color=colors))
+
+  if not doStack:
+    error_opts = None
+    fill_opts  = None
+
+  hist.plot1d(h, overlay="process", ax=ax, clear=False, stack=doStack, density=density, line_opts=None, fill_opts=fill_opts, error_opts=error_opts, binwnorm=binwnorm)
+
+  if hData is not None:
+    hist.plot1d(hData, ax=ax, clear=False, error_opts=data_err_opts, binwnorm=binwnorm)
+
+  ax.autoscale(axis='x', tight=True)
+  ax.set_ylim(0, None)
+  ax.set_xlabel(None)
+
+  if doLegend:
+    leg_anchor=(1., 1.)
+    leg_loc='upper left'
+    handles, labels = ax.get_legend_handles_labels()
+    if hData is not None:
+      handles = handles[-1:]+handles[:-1]
+      labels = ['Data']+labels[:-1]            
+    ax.legend(handles, labels)#,bbox_to_anchor=leg_anchor,loc=leg_loc)
+  
+  if hData is not None and doRatio:
+    hist.plotratio(hData, h.sum("process"), clear=False,ax=rax, error_opts=data_err_opts, denom_fill_opts={}, guide_opts={}, unc='num')
+    rax.set_ylabel(yRatioTit)
+    rax.set_ylim(ratioRange[0], ratioRange[1])
+
+  if doLogY:
+    ax.set_yscale("log")
+    ax.set_ylim(1,ax.get_ylim()[1]*5)        
+
+  if not xRange is None: ax.set_xlim(xRange[0],xRange[1])
+  if not yRange is None: ax.set_ylim(yRange[0],yRange[1])
+
+  # Labels
+  CMS  = plt.text(0., 1., r"$\bf{CMS}$ Preliminary", fontsize=16, horizontalalignment='left', verticalalignment='bottom', transform=ax.transAxes)
+  lumi = plt.text(1., 1., r"%1.1f %s (%s)"%(lumi, lumiunit, sqrts), fontsize=20, horizontalalignment='right', verticalalignment='bottom', transform=ax.transAxes)
+
+  if not region is None:
+    lab = plt.text(0.03, .98, region, fontsize=16, horizontalalignment='left', verticalalignment='top', transform=ax.transAxes)
+    ax.set_ylim(0,ax.get_ylim()[1]*1.1)
+
+  return fig
+
+render.register_renderer('stack', DrawStack)
 
 class plotter:
   def __init__(self, path, prDic={}, colors={}, bkgList=[], dataName='data', outpath='./temp/', output=None, lumi=59.7, sigList=[]):
@@ -40,6 +107,7 @@ class plotter:
     self.SetRange()
     self.SetRatioRange()
     self.yRatioTit = 'Data / Pred.'
+    self.SetWorkers()
 
   def SetPath(self, path):
     ''' Set path to sample '''
@@ -51,11 +119,11 @@ class plotter:
     self.hists = {}
     listpath = self.path if isinstance(self.path, list) else [self.path]
     for path in listpath:
-      with gzip.open(path) as fin:
-        hin = pickle.load(fin)
-        for k in hin.keys():
-          if k in self.hists: self.hists[k]+=hin[k]
-          else:               self.hists[k]=hin[k]
+      # Either a hist store or a pkl file (see topcoffea/modules/hist_store.py)
+      hin = utils.get_hist_from_pkl(path)
+      for k in hin.keys():
+        if k in self.hists: self.hists[k]+=hin[k]
+        else:               self.hists[k]=hin[k]
     self.GroupProcesses()
 
   def SetProcessDic(self, prdic, sampleLabel='sample', processLabel='process'):
@@ -149,6 +217,10 @@ class plotter:
   def SetRatioRange(self, ymin=0.5, ymax=1.5):
     self.ratioRange = [ymin, ymax]
 
+  def SetWorkers(self, nworkers=1):
+    ''' Set the number of local processes the plots are rendered with '''
+    self.nworkers = nworkers
+
   def SetRegion(self, ref=None):
     self.region = ref
 
@@ -211,88 +283,37 @@ class plotter:
 
   def Stack(self, hname={}, xtit='', ytit=''):
     ''' prName can be a list of histograms or a dictionary 'histoName : xtit' '''
+    render.render_specs(self.GetStackSpecs(hname, xtit, ytit), self.nworkers)
+
+  def GetStackSpecs(self, hname={}, xtit='', ytit=''):
+    ''' Returns the render specs of the stack plots: the histograms are computed here, and drawn and saved by render.render_specs '''
     if isinstance(hname, dict):
-      for k in hname: self.Stack(k, hname[k], ytit)
-      return
+      return [spec for k in hname for spec in self.GetStackSpecs(k, hname[k], ytit)]
     if isinstance(hname, list):
-      for k in hname: self.Stack(k, xtit, ytit)
-      return
-     
-    density = False; binwnorm = None
-    plt.rcParams.update(self.textParams)
-
-    if self.doData(hname) and self.doRatio:
-      fig, (ax, rax) = plt.subplots(2, 1, figsize=(7,7), gridspec_kw={"height_ratios": (3, 1)}, sharex=True)
-      fig.subplots_adjust(hspace=.07)
-    else:
-      fig, ax = plt.subplots(1, 1, figsize=(7,7))#, gridspec_kw={"height_ratios": (3, 1)}, sharex=True)
-
-    # Colors
-    from cycler import cycler
-    colors = self.GetColors(self.bkglist)
-    if self.invertStack: 
-      _n = len(h.identifiers(overlay))-1
-      colors = colors[_n::-1]
-    ax.set_prop_cycle(cycler(color=colors))
+      return [spec for k in hname for spec in self.GetStackSpecs(k, xtit, ytit)]
 
-    fill_opts  = self.fill_opts
-    error_opts = self.error_opts
-    data_err_opts = self.data_err_opts
-    if not self.doStack:
-      error_opts = None
-      fill_opts  = None
-
-    if self.invertStack and type(h._axes[0])==hist.hist_tools.Cat:  h._axes[0]._sorted.reverse() 
     h = self.GetHistogram(hname, self.bkglist)
     h.scale(1000.*self.lumi)
     y = h.integrate("process").values(overflow='all')
-    if y == {}: return #process not found
-    hist.plot1d(h, overlay="process", ax=ax, clear=False, stack=self.doStack, density=density, line_opts=None, fill_opts=fill_opts, error_opts=error_opts, binwnorm=binwnorm)
-
-    if self.doData(hname):
-      hData = self.GetHistogram(hname, self.dataName)
-      hist.plot1d(hData, ax=ax, clear=False, error_opts=data_err_opts, binwnorm=binwnorm)
-      ydata = hData.values(overflow='all')
-
-    ax.autoscale(axis='x', tight=True)
-    ax.set_ylim(0, None)
-    ax.set_xlabel(None)
-
-    if self.doLegend:
-      leg_anchor=(1., 1.)
-      leg_loc='upper left'
-      handles, labels = ax.get_legend_handles_labels()
-      if self.doData(hname):
-        handles = handles[-1:]+handles[:-1]
-        labels = ['Data']+labels[:-1]            
-      ax.legend(handles, labels)#,bbox_to_anchor=leg_anchor,loc=leg_loc)
-    
-    if self.doData(hname) and self.doRatio:
-      hist.plotratio(hData, h.sum("process"), clear=False,ax=rax, error_opts=data_err_opts, denom_fill_opts={}, guide_opts={}, unc='num')
-      rax.set_ylabel(self.yRatioTit)
-      rax.set_ylim(self.ratioRange[0], self.ratioRange[1])
-
-    if self.doLogY:
-      ax.set_yscale("log")
-      ax.set_ylim(1,ax.get_ylim()[1]*5)        
+    if y == {}: return [] #process not found
+    hData = self.GetHistogram(hname, self.dataName) if self.doData(hname) else None
 
-    if not self.xRange is None: ax.set_xlim(xRange[0],xRange[1])
-    if not self.yRange is None: ax.set_ylim(yRange[0],yRange[1])
-
-    # Labels
-    CMS  = plt.text(0., 1., r"$\bf{CMS}$ Preliminary", fontsize=16, horizontalalignment='left', verticalalignment='bottom', transform=ax.transAxes)
-    lumi = plt.text(1., 1., r"%1.1f %s (%s)"%(self.lumi, self.lumiunit, self.sqrts), fontsize=20, horizontalalignment='right', verticalalignment='bottom', transform=ax.transAxes)
-
-    if not self.region is None:
-      lab = plt.text(0.03, .98, self.region, fontsize=16, horizontalalignment='left', verticalalignment='top', transform=ax.transAxes)
-      ax.set_ylim(0,ax.get_ylim()[1]*1.1)
-    
-    # Save
+    # Output name
     os.system('mkdir -p %s'%self.outpath)
     if self.output is None: 
       self.output = hname
-      fig.savefig(os.path.join(self.outpath, self.output+'.png'))
-    else: fig.savefig(os.path.join(self.outpath, hname+'_'+'_'.join(self.region.split())+'.png'))
+      path = os.path.join(self.outpath, self.output+'.png')
+    else: path = os.path.join(self.outpath, hname+'_'+'_'.join(self.region.split())+'.png')
+
+    return [render.make_spec('stack', path, rc_params=self.textParams,
+      h = render.hist_to_spec(h),
+      hData = None if hData is None else render.hist_to_spec(hData),
+      colors = self.GetColors(self.bkglist),
+      doRatio = self.doRatio, doStack = self.doStack, doLegend = self.doLegend, doLogY = self.doLogY, invertStack = self.invertStack,
+      fill_opts = self.fill_opts, error_opts = self.error_opts, data_err_opts = self.data_err_opts,
+      xRange = self.xRange, yRange = self.yRange, ratioRange = self.ratioRange, yRatioTit = self.yRatioTit,
+      lumi = self.lumi, lumiunit = self.lumiunit, sqrts = self.sqrts, region = self.region,
+    )]
 
   def GetYields(self, var='counts'):
     sumy = 0
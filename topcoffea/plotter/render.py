@@ -0,0 +1,126 @@
+'''
+    Render figures from pure-data plot specs, optionally in a local process pool
+
+    Making the figures is split in two steps:
+        - In the parent process, everything that is plotted is computed (i.e. the hists are integrated,
+          grouped, scaled, and the error bands are calculated), and put into a plot spec. A plot spec is a
+          dict holding only plain data (strings, numbers, lists/dicts and numpy arrays): the name of the
+          render function, the path(s) to save the figure to and the arguments of the render function.
+          Small hists are stored in the specs as their arrays (see hist_to_spec), and are turned back
+          into coffea hists by the worker.
+        - The specs are rendered (drawn with matplotlib and saved), one at a time in a loop, or in
+          parallel with a pool of forked worker processes.
+
+    The output file names are set in the spec by the parent, so they do not depend on which worker
+    renders which figure, or on the order they finish in.
+
+    The render functions take the arguments of the spec and return a matplotlib figure, they have to
+    be registered (with register_renderer) before the pool is forked.
+
+    Example:
+        register_renderer("cr_fig",make_cr_fig)
+        specs = [make_spec("cr_fig","plots/cr_3l/cr_3l_ht",h_mc=hist_to_spec(h_mc),h_data=hist_to_spec(h_data),unit_norm_bool=False)]
+        render_specs(specs,nworkers=8)
+'''
+
+import os
+import numpy as np
+import matplotlib.pyplot as plt
+
+from coffea import hist
+
+HIST_SPEC_TYPE = "hist"
+
+# The registered render functions, by name
+RENDERERS = {}
+
+# Register a function (taking the arguments of a spec, returning a figure) to render the specs with the given name
+def register_renderer(name,func):
+    RENDERERS[name] = func
+    return func
+
+# Make a plot spec
+#   - renderer: The name of a registered render function
+#   - paths: The path (or list of paths) to save the figure to, these are passed to savefig as they are
+#   - rc_params: The matplotlib rcParams to use while rendering
+#   - **args: The arguments of the render function
+def make_spec(renderer,paths,rc_params=None,**args):
+    if renderer not in RENDERERS:
+        raise Exception(f"Error: Unknown renderer \"{renderer}\", the known ones are: {list(RENDERERS.keys())}")
+    if isinstance(paths,str):
+        paths = [paths]
+    return {"renderer": renderer, "paths": list(paths), "rc_params": dict(rc_params or {}), "args": args}
+
+######### Hists in the specs #########
+
+# Get the arrays of a (coffea or EFT) hist as plain data, EFT hists are evaluated at their current WC point
+def hist_to_spec(h):
+    # The identifiers are kept in the order of the axis, since it sets the order they are plotted in (e.g. in a stack)
+    sparse_axes = [[ax.name,ax.label,ax._sorting,[[b.name,b.label] for b in ax.identifiers()]] for ax in h.sparse_axes()]
+    dense_axes = [[ax.name,ax.label,np.asarray(ax.edges())] for ax in h.dense_axes()]
+    vals = h.values(sumw2=True,overflow="allnan")
+    return {
+        "type": HIST_SPEC_TYPE,
+        "label": h.label,
+        "sparse_axes": sparse_axes,
+        "dense_axes": dense_axes,
+        "keys": list(vals.keys()),
+        "sumw": [sumw for sumw,_ in vals.values()],
+        "sumw2": [sumw2 for _,sumw2 in vals.values()],
+    }
+
+def is_hist_spec(obj):
+    return isinstance(obj,dict) and obj.get("type") == HIST_SPEC_TYPE
+
+# Get the coffea hist back from its plain data
+def hist_from_spec(spec):
+    sparse_axes = []
+    for name,label,sorting,identifiers in spec["sparse_axes"]:
+        ax = hist.Cat(name,label,sorting=sorting)
+        for id_name,id_label in identifiers:
+            ax.index(hist.StringBin(id_name,id_label))
+        sparse_axes.append(ax)
+    dense_axes = [hist.Bin(name,label,edges) for name,label,edges in spec["dense_axes"]]
+    h = hist.Hist(spec["label"],*sparse_axes,*dense_axes)
+    h._sumw2 = {}
+    for key,sumw,sumw2 in zip(spec["keys"],spec["sumw"],spec["sumw2"]):
+        sparse_key = tuple(ax.index(k) for ax,k in zip(sparse_axes,key))
+        h._sumw[sparse_key] = np.array(sumw,dtype=float)
+        h._sumw2[sparse_key] = np.array(sumw2,dtype=float)
+    return h
+
+######### Rendering #########
+
+# Render a spec and save the figure, returns the paths it was saved to
+def render_spec(spec):
+    args = {k: (hist_from_spec(v) if is_hist_spec(v) else v) for k,v in spec["args"].items()}
+    with plt.rc_context(spec["rc_params"]):
+        fig = RENDERERS[spec["renderer"]](**args)
+        if fig is None:
+            return []
+        for path in spec["paths"]:
+            fig.savefig(path)
+    plt.close(fig)
+    return spec["paths"]
+
+# Render all of the specs, in a pool of nworkers forked processes if nworkers > 1
+# Returns the list of the paths of the saved figures (in the order of the specs)
+def render_specs(specs,nworkers=1):
+    if nworkers <= 1 or len(specs) <= 1:
+        return [path for spec in specs for path in render_spec(spec)]
+
+    import multiprocessing
+
+    print(f"Rendering {len(specs)} figures with {nworkers} workers")
+    with multiprocessing.get_context("fork").Pool(min(nworkers,len(specs))) as pool:
+        paths_per_spec = pool.map(render_spec,specs,chunksize=max(1,len(specs)//(4*nworkers)))
+    return [path for paths in paths_per_spec for path in paths]
+
+# Get the dirs of the saved figures (e.g. to make the index.html files once all of the figures are there)
+def get_dirs(paths):
+    dirs = []
+    for path in paths:
+        d = os.path.dirname(path)
+        if d not in dirs:
+            dirs.append(d)
+    return dirs